@@ -1,12 +1,11 @@
 import json
 import logging
 import sys
-from threading import Lock, Thread
-import urllib2
 import time
 from autobahn.twisted.websocket import WebSocketServerProtocol, WebSocketServerFactory, listenWS
-from twisted.web.client import Agent
-from twisted.internet import reactor
+from twisted.web.client import Agent, readBody
+from twisted.web.http_headers import Headers
+from twisted.internet import defer, reactor
 from twisted.python import log
 from twisted.web.server import Site
 from twisted.web.static import File
@@ -17,26 +16,76 @@ POLL_INTERVAL = 5
 MAX_POLL_INTERVAL = 30
 POLL_INTERVAL_STEP = 5
 MAX_ERRORS = 5
-updateLock = Lock()
+MAX_CONCURRENT_FETCHES = 10
+MAX_PATCH_OPERATIONS = 100
 
 #Server Messages
 KRT_JSON_DATA = "krtJSONData"
 KRT_URL_DROPPED = "krtURLDropped"
 KRT_REGISTER_URL = "krtRegisterURL"
 KRT_PUSH_DATA = "krtPushData"
+KRT_JSON_PATCH = "krtJSONPatch"
 
-agent = Agent(reactor)
+agent = Agent(reactor, connectTimeout=MAX_POLL_INTERVAL)
+# limits how many URLs are downloaded from the masters at the same time
+fetchSemaphore = defer.DeferredSemaphore(MAX_CONCURRENT_FETCHES)
 
 
-def dict_compare(d1, d2):
-    d1_keys = set(d1.keys())
-    d2_keys = set(d2.keys())
-    intersect_keys = d1_keys.intersection(d2_keys)
-    added = d1_keys - d2_keys
-    removed = d2_keys - d1_keys
-    modified = {o : (d1[o], d2[o]) for o in intersect_keys if d1[o] != d2[o]}
-    same = set(o for o in intersect_keys if d1[o] == d2[o])
-    return added, removed, modified, same
+def fetchJSON(url):
+    """
+    Downloads and decodes the JSON found on a URL without blocking the reactor
+    """
+    d = agent.request('GET', str(url), Headers({'User-Agent': ['katana-autobahn']}))
+    timeout = reactor.callLater(MAX_POLL_INTERVAL, d.cancel)
+
+    def readResponse(response):
+        if response.code != 200:
+            raise IOError("HTTP {0} while fetching {1}".format(response.code, url))
+        return readBody(response)
+
+    def cancelTimeout(result):
+        if timeout.active():
+            timeout.cancel()
+        return result
+
+    d.addCallback(readResponse)
+    d.addBoth(cancelTimeout)
+    d.addCallback(json.loads)
+    return d
+
+
+def escapeJSONPointer(key):
+    return unicode(key).replace(u"~", u"~0").replace(u"/", u"~1")
+
+
+def json_patch(old, new, path=u""):
+    """
+    Returns the list of JSON-patch (RFC 6902) operations that turn old into new,
+    an empty list means the documents are equal
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        operations = []
+        for key in old:
+            if key not in new:
+                operations.append({"op": "remove", "path": path + u"/" + escapeJSONPointer(key)})
+        for key, value in new.iteritems():
+            keyPath = path + u"/" + escapeJSONPointer(key)
+            if key not in old:
+                operations.append({"op": "add", "path": keyPath, "value": value})
+            else:
+                operations.extend(json_patch(old[key], value, keyPath))
+        return operations
+
+    if isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        operations = []
+        for idx, (oldValue, newValue) in enumerate(zip(old, new)):
+            operations.extend(json_patch(oldValue, newValue, u"{0}/{1}".format(path, idx)))
+        return operations
+
+    if type(old) == type(new) and old == new:
+        return []
+
+    return [{"op": "replace", "path": path, "value": new}]
 
 
 class CachedURL():
@@ -47,6 +96,8 @@ class CachedURL():
         self.url = url
         self.cachedJSON = None
         self.clients = []
+        # clients that understand patches and have the latest cachedJSON
+        self.patchClients = set()
         self.lastChecked = 0
         self.errorCount = 0
         self.pollInterval = POLL_INTERVAL
@@ -69,7 +120,6 @@ class CachedURL():
         self.lastChecked = time.time()
         self.locked = False
         self.errorCount = 0
-        self.newData = False
 
         if self.currentPollInterval > self.pollInterval:
             self.currentPollInterval -= POLL_INTERVAL_STEP
@@ -127,66 +177,61 @@ class BroadcastServerFactory(WebSocketServerFactory):
         for client in clients:
             client.sendMessage(msg)
 
-    def jsonChanged(self, json, cachedJSON):
-        if cachedJSON is None:
-            return True
-        else:
-            if isinstance(cachedJSON, dict):
-                added, removed, modified, same = dict_compare(json, cachedJSON)
-                if len(added) > 0 or len(removed) > 0 or len(modified) > 0:
-                    return True
-            else:
-                return cachedJSON != json
-
-        return False
-
     def checkURLs(self):
         for urlCache in self.urlCacheDict.values():
-            #Thread each of these
             try:
                 if urlCache.locked is False and urlCache.pollNeeded():
-                    urlCache.locked = True
-
-                    p = Thread(target=self.checkURL, args=(urlCache, ))
-                    p.start()
+                    d = self.checkURL(urlCache)
+                    d.addErrback(self.checkURLFailed, urlCache)
             except Exception as e:
                 logging.error("{0}".format(e))
 
+    def checkURLFailed(self, failure, urlCache):
+        # errors raised while the clients are updated
+        logging.error("{0}: {1}".format(failure.getErrorMessage(), urlCache.url))
+        urlCache.pollFailure()
+
+    @defer.inlineCallbacks
     def checkURL(self, urlCache):
         url = urlCache.url
-        cachedURL = self.urlCacheDict[url]
-        if cachedURL.errorCount > MAX_ERRORS:
+        if urlCache.errorCount > MAX_ERRORS:
             logging.info("Removing cached URL as it has too many errors {0}".format(url))
-            self.sendClientCommand(cachedURL.clients, KRT_URL_DROPPED, url)
-            updateLock.acquire()
-            del self.urlCacheDict[url]
-            updateLock.release()
+            self.sendClientCommand(urlCache.clients, KRT_URL_DROPPED, url)
+            self.urlCacheDict.pop(url, None)
             return
-        if urlCache.pollNeeded():
-            try:
-                #logging.info("Polling: {0}".format(url))
-                response = urllib2.urlopen(url, timeout=MAX_POLL_INTERVAL)
-                updateLock.acquire()
-                cachedURL.pollSuccess()
-                jsonObj = json.load(response)
-                if self.jsonChanged(jsonObj, cachedURL.cachedJSON):
-                    cachedURL.cachedJSON = jsonObj
-                    clients = cachedURL.clients
-                    logging.info("JSON at {1} Changed, informing {0} client(s)".format(len(clients), url))
-                    data = {"url": url, "data": jsonObj}
-                    self.sendClientCommand(clients, KRT_JSON_DATA, data)
-
-                #Reset error count to reduce cutting of many users
-                #in busy times
-                cachedURL.errorCount = 0
-            except Exception as e:
-                logging.error("{0}: {1}".format(e, url))
-                cachedURL.pollFailure()
-            finally:
-                cachedURL.locked = False
 
-                if updateLock.locked():
-                    updateLock.release()
+        urlCache.locked = True
+        # events pushed while we are fetching will trigger another fetch
+        urlCache.newData = False
+        try:
+            jsonObj = yield fetchSemaphore.run(fetchJSON, url)
+        except Exception as e:
+            logging.error("{0}: {1}".format(e, url))
+            urlCache.pollFailure()
+            return
+
+        urlCache.pollSuccess()
+        self.updateClients(urlCache, jsonObj)
+
+    def updateClients(self, urlCache, jsonObj):
+        url = urlCache.url
+        patch = None
+        if urlCache.cachedJSON is not None:
+            patch = json_patch(urlCache.cachedJSON, jsonObj)
+            if not patch:
+                return
+
+        urlCache.cachedJSON = jsonObj
+        clients = urlCache.clients
+        logging.info("JSON at {1} Changed, informing {0} client(s)".format(len(clients), url))
+
+        fullClients = clients
+        if patch is not None and len(patch) <= MAX_PATCH_OPERATIONS:
+            patchClients = [c for c in clients if c in urlCache.patchClients]
+            fullClients = [c for c in clients if c not in urlCache.patchClients]
+            self.sendClientCommand(patchClients, KRT_JSON_PATCH, {"url": url, "patch": patch})
+
+        self.sendClientCommand(fullClients, KRT_JSON_DATA, {"url": url, "data": jsonObj})
 
     def register(self, client):
         if not client in self.clients:
@@ -202,6 +247,7 @@ class BroadcastServerFactory(WebSocketServerFactory):
                 urlCache = items[1]
                 if client in urlCache.clients:
                     urlCache.clients.remove(client)
+                urlCache.patchClients.discard(client)
 
                 if len(urlCache.clients) == 0:
                     del self.urlCacheDict[url]
@@ -224,6 +270,14 @@ class BroadcastServerFactory(WebSocketServerFactory):
                     logging.info("Added {1} to url {0}".format(url, client.peer))
                     self.urlCacheDict[url].clients.append(client)
 
+                if not isinstance(data["data"], basestring) and data["data"].get("acceptPatch"):
+                    urlCache = self.urlCacheDict[url]
+                    urlCache.patchClients.add(client)
+                    # patches are relative to the cached JSON so send it first
+                    if urlCache.cachedJSON is not None:
+                        self.sendClientCommand([client], KRT_JSON_DATA,
+                                               {"url": url, "data": urlCache.cachedJSON})
+
                 if not isinstance(data["data"], basestring) and "waitForPush" in data["data"] \
                         and data["data"]["waitForPush"] == "true":
                     self.urlCacheDict[url].waitForPush = True
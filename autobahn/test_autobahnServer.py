@@ -0,0 +1,130 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+import autobahnServer
+from autobahnServer import json_patch
+
+
+class TestJsonPatch(unittest.TestCase):
+
+    def test_equal(self):
+        self.assertEqual(json_patch({'builds': [{'number': 1}]}, {'builds': [{'number': 1}]}), [])
+
+    def test_add(self):
+        old = {'builder': {'builds': [{'number': 1, 'steps': []}]}}
+        new = {'builder': {'builds': [{'number': 1, 'steps': [], 'results': 0}]}, 'slaves': []}
+        self.assertEqual(sorted(json_patch(old, new)),
+                         sorted([{'op': 'add', 'path': u'/builder/builds/0/results', 'value': 0},
+                                 {'op': 'add', 'path': u'/slaves', 'value': []}]))
+
+    def test_remove(self):
+        old = {'builder': {'builds': [{'number': 1, 'eta': 10}], 'slaves': []}}
+        new = {'builder': {'builds': [{'number': 1}]}}
+        self.assertEqual(sorted(json_patch(old, new)),
+                         sorted([{'op': 'remove', 'path': u'/builder/builds/0/eta'},
+                                 {'op': 'remove', 'path': u'/builder/slaves'}]))
+
+    def test_replace(self):
+        old = {'builds': [{'number': 1, 'text': ['running']}, {'number': 2}]}
+        new = {'builds': [{'number': 1, 'text': ['build', 'successful']}, {'number': 2}]}
+        self.assertEqual(json_patch(old, new),
+                         [{'op': 'replace', 'path': u'/builds/0/text', 'value': ['build', 'successful']}])
+
+    def test_replace_lists_of_other_lengths(self):
+        old = {'builds': [[1, 2]]}
+        new = {'builds': [[1, 2, 3]]}
+        self.assertEqual(json_patch(old, new),
+                         [{'op': 'replace', 'path': u'/builds/0', 'value': [1, 2, 3]}])
+
+    def test_replace_types(self):
+        self.assertEqual(json_patch({'results': 0}, {'results': False}),
+                         [{'op': 'replace', 'path': u'/results', 'value': False}])
+        self.assertEqual(json_patch([{}], [[]]),
+                         [{'op': 'replace', 'path': u'/0', 'value': []}])
+
+    def test_escaped_keys(self):
+        self.assertEqual(json_patch({}, {'a/b~c': 1}),
+                         [{'op': 'add', 'path': u'/a~1b~0c', 'value': 1}])
+
+
+class TestFetchJSON(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.patch(autobahnServer, 'reactor', self.clock)
+        self.request = defer.Deferred()
+        self.agent = mock.Mock()
+        self.agent.request.return_value = self.request
+        self.patch(autobahnServer, 'agent', self.agent)
+        self.patch(autobahnServer, 'readBody', lambda response: defer.succeed(response.body))
+
+    def respond(self, code, body):
+        response = mock.Mock()
+        response.code = code
+        response.body = body
+        self.request.callback(response)
+
+    @defer.inlineCallbacks
+    def test_fetch(self):
+        d = autobahnServer.fetchJSON(u'http://localhost:8001/json/builders')
+        self.respond(200, '{"builds": [1, 2]}')
+        data = yield d
+        self.assertEqual(data, {'builds': [1, 2]})
+        self.assertEqual(self.agent.request.call_args[0][:2], ('GET', 'http://localhost:8001/json/builders'))
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_http_error(self):
+        d = autobahnServer.fetchJSON('http://localhost:8001/json/builders')
+        self.respond(404, 'Not Found')
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        return self.assertFailure(d, IOError)
+
+    def test_timeout(self):
+        d = autobahnServer.fetchJSON('http://localhost:8001/json/builders')
+        self.clock.advance(autobahnServer.MAX_POLL_INTERVAL)
+        return self.assertFailure(d, defer.CancelledError)
+
+
+class TestBroadcastServerFactory(unittest.TestCase):
+
+    def setUp(self):
+        self.patch(autobahnServer.BroadcastServerFactory, 'tick', lambda self: None)
+        self.factory = autobahnServer.BroadcastServerFactory("ws://localhost:8010")
+        self.urlCache = autobahnServer.CachedURL('http://localhost:8001/json/builders')
+        self.factory.urlCacheDict[self.urlCache.url] = self.urlCache
+        self.patch(autobahnServer, 'fetchJSON', lambda url: defer.succeed({'builds': []}))
+
+    def test_checkURLs(self):
+        self.factory.checkURLs()
+        self.assertEqual(self.urlCache.cachedJSON, {'builds': []})
+        self.assertEqual(self.urlCache.errorCount, 0)
+        self.assertFalse(self.urlCache.locked)
+
+    def test_checkURLs_fetch_failure(self):
+        self.patch(autobahnServer, 'fetchJSON', lambda url: defer.fail(IOError("HTTP 500")))
+        self.factory.checkURLs()
+        self.assertEqual(self.urlCache.errorCount, 1)
+        self.assertFalse(self.urlCache.locked)
+
+    def test_checkURLs_update_failure(self):
+        self.factory.updateClients = mock.Mock(side_effect=ValueError("cannot send"))
+        self.factory.checkURLs()
+        # counted as a poll failure rather than left unhandled
+        self.assertEqual(self.urlCache.errorCount, 1)
+        self.assertFalse(self.urlCache.locked)
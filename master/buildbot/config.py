@@ -72,6 +72,7 @@ class MasterConfig(object):
         self.buildHorizon = None
         self.logCompressionLimit = 4*1024
         self.logCompressionMethod = 'bz2'
+        self.logCompressionWorkers = 2
         self.logMaxTailSize = None
         self.logMaxSize = None
         self.properties = properties.Properties()
@@ -88,6 +89,8 @@ class MasterConfig(object):
         self.requireLogin = True
         self.autobahn_push = "false"
         self.lastBuildCacheDays = 30
+        self.buildCacheMemory = 256*1024*1024
+        self.dispatchBatchSize = 1
 
         self.validation = dict(
             branch=re.compile(r'^[\w.+/~-]*$'),
@@ -115,10 +118,10 @@ class MasterConfig(object):
         self.globalFactory = dict(initialSteps=[], lastSteps=[])
 
     _known_config_keys = set([
-        "buildbotURL", "buildCacheSize", "builders", "buildHorizon", "caches",
+        "buildbotURL", "buildCacheMemory", "buildCacheSize", "builders", "buildHorizon", "caches",
         "change_source", "codebaseGenerator", "changeCacheSize", "changeHorizon",
-        'db', "db_poll_interval", "db_url", "debugPassword", "eventHorizon",
-        "logCompressionLimit", "logCompressionMethod", "logHorizon",
+        'db', "db_poll_interval", "db_url", "debugPassword", "dispatchBatchSize", "eventHorizon",
+        "logCompressionLimit", "logCompressionMethod", "logCompressionWorkers", "logHorizon",
         "logMaxSize", "logMaxTailSize", "manhole", "mergeRequests", "metrics",
         "multiMaster", "prioritizeBuilders", "projects", "projectName", "projectURL",
         "properties", "revlink", "schedulers", "slavePortnum", "slaves",
@@ -272,15 +275,24 @@ class MasterConfig(object):
         copy_int_param('logHorizon')
         copy_int_param('buildHorizon')
         copy_int_param('lastBuildCacheDays')
+        copy_int_param('buildCacheMemory')
+
+        copy_int_param('dispatchBatchSize')
+        if self.dispatchBatchSize < 1:
+            error("c['dispatchBatchSize'] must be at least 1")
 
         copy_int_param('logCompressionLimit')
 
         if 'logCompressionMethod' in config_dict:
             logCompressionMethod = config_dict.get('logCompressionMethod')
-            if logCompressionMethod not in ('bz2', 'gz'):
-                error("c['logCompressionMethod'] must be 'bz2' or 'gz'")
+            if logCompressionMethod not in ('bz2', 'gz', 'zstd', 'lz4'):
+                error("c['logCompressionMethod'] must be 'bz2', 'gz', 'zstd' or 'lz4'")
             self.logCompressionMethod = logCompressionMethod
 
+        copy_int_param('logCompressionWorkers')
+        if self.logCompressionWorkers < 1:
+            error("c['logCompressionWorkers'] must be at least 1")
+
         copy_int_param('logMaxSize')
         copy_int_param('logMaxTailSize')
 
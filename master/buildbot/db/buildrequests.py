@@ -224,6 +224,34 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
 
         return self.db.pool.do(thd)
 
+    def getUnclaimedBuildRequestsSince(self, minbrid, submitted_since=None):
+        """
+        Get the unclaimed and incomplete build requests which are newer than
+        a previous poll: those with an id greater than C{minbrid}, or submitted
+        at or after C{submitted_since}.  The latter catches requests whose
+        insert committed after one with a higher id.
+
+        @param minbrid: the highest build request id seen so far
+        @param submitted_since: datetime, or None
+        @returns: list of brdicts, via Deferred
+        """
+        def thd(conn):
+            reqs_tbl = self.db.model.buildrequests
+            claims_tbl = self.db.model.buildrequest_claims
+
+            newer = reqs_tbl.c.id > minbrid
+            if submitted_since is not None:
+                newer = newer | (reqs_tbl.c.submitted_at >= datetime2epoch(submitted_since))
+
+            q = sa.select([reqs_tbl, claims_tbl],
+                          from_obj=reqs_tbl.outerjoin(claims_tbl,
+                                                      reqs_tbl.c.id == claims_tbl.c.brid),
+                          whereclause=((claims_tbl.c.claimed_at == None) &
+                                       (reqs_tbl.c.complete == 0) & newer))
+            res = conn.execute(q)
+            return [self._brdictFromRow(row, None) for row in res.fetchall()]
+        return self.db.pool.do(thd)
+
     def getTotalBuildsInTheLastDay(self):
         def thd(conn):
             reqs_tbl = self.db.model.buildrequests
@@ -312,10 +340,48 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
 
         return self.db.pool.do(thd)
 
+    @with_master_objectid
+    def getBuildRequestInQueueCounts(self, _master_objectid=None):
+        """
+        Counts the buildrequests returned by L{getBuildRequestInQueue}
+        without fetching them.
+
+        @returns: a dictionary mapping (buildername, priority) to the number
+        of buildrequests in the queue, via Deferred
+        """
+        def thd(conn):
+            reqs_tbl = self.db.model.buildrequests
+            claims_tbl = self.db.model.buildrequest_claims
+            columns = [reqs_tbl.c.buildername, reqs_tbl.c.priority, sa.func.count(reqs_tbl.c.id)]
+
+            pending = sa.select(columns,
+                                from_obj=reqs_tbl.outerjoin(claims_tbl, (reqs_tbl.c.id == claims_tbl.c.brid)),
+                                whereclause=((claims_tbl.c.claimed_at == None) &
+                                             (reqs_tbl.c.complete == 0)))
+
+            resume = sa.select(columns,
+                               from_obj=reqs_tbl.join(claims_tbl, (reqs_tbl.c.id == claims_tbl.c.brid)
+                                                      & (claims_tbl.c.objectid == _master_objectid))) \
+                .where(reqs_tbl.c.complete == 0) \
+                .where(reqs_tbl.c.results == RESUME) \
+                .where(reqs_tbl.c.mergebrid == None)
+
+            rv = {}
+            for query in (pending, resume):
+                query = query.group_by(reqs_tbl.c.buildername, reqs_tbl.c.priority)
+                res = conn.execute(query)
+                for buildername, priority, count in res.fetchall():
+                    rv[(buildername, priority)] = rv.get((buildername, priority), 0) + count
+                res.close()
+            return rv
+
+        return self.db.pool.do(thd)
+
     @with_master_objectid
     def getBuildRequestsInQueue(self, queue, buildername=None, sourcestamps=None,
                                 mergebrids=None, startbrid=None,
-                                order=True, _master_objectid=None):
+                                order=True, brids=None, minbrid=None,
+                                _master_objectid=None):
         """
         Finds the buildrequests that are in queue waiting to be process
         it will return empty list if there are no pending request.
@@ -326,6 +392,8 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
         @param sourcestamps: filter the results by sourcestamps
         @param mergebrids: fetch buildrequest that has been merged with brids
         @param startbrid: filter pending builds that belong to same build chain
+        @param brids: only check if these buildrequests are in the queue
+        @param minbrid: only fetch buildrequests with an id greater or equal than minbrid
         @param order: order the resutls by higher priority and oldest submitted time
         this can be skipped when applying filters to check request that can be merged.
 
@@ -394,6 +462,12 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
             if startbrid:
                 buildersqueue = buildersqueue.where(reqs_tbl.c.startbrid == startbrid)
 
+            if brids is not None:
+                buildersqueue = buildersqueue.where(reqs_tbl.c.id.in_(brids))
+
+            if minbrid is not None:
+                buildersqueue = buildersqueue.where(reqs_tbl.c.id >= minbrid)
+
             if order:
                 buildersqueue = buildersqueue.order_by(sa.desc(reqs_tbl.c.priority), sa.asc(reqs_tbl.c.submitted_at))
 
@@ -423,6 +497,49 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
 
         return self.db.pool.do(thd)
 
+    def getBuildRequestsSourceStamps(self, brids):
+        """
+        Fetches the sourcestamps of several buildrequests at once, so that
+        merge candidates can be grouped without querying per buildrequest.
+
+        @param brids: the buildrequests to look up
+        @returns: a dictionary mapping each brid to a list of sourcestamp
+        dictionaries with the keys codebase, branch, revision and
+        sourcestampsetid, via Deferred
+        """
+        def thd(conn):
+            reqs_tbl = self.db.model.buildrequests
+            buildsets_tbl = self.db.model.buildsets
+            sourcestamps_tbl = self.db.model.sourcestamps
+
+            rv = {}
+            # we'll need to batch the brids into groups of 100, so that the
+            # parameter lists supported by the DBAPI aren't exhausted
+            iterator = iter(brids)
+            batch = list(itertools.islice(iterator, 100))
+            while len(batch) > 0:
+                q = sa.select([reqs_tbl.c.id, sourcestamps_tbl.c.codebase,
+                               sourcestamps_tbl.c.branch, sourcestamps_tbl.c.revision,
+                               sourcestamps_tbl.c.sourcestampsetid],
+                              from_obj=reqs_tbl.join(buildsets_tbl,
+                                                     reqs_tbl.c.buildsetid == buildsets_tbl.c.id)
+                              .join(sourcestamps_tbl,
+                                    buildsets_tbl.c.sourcestampsetid == sourcestamps_tbl.c.sourcestampsetid)) \
+                    .where(reqs_tbl.c.id.in_(batch))
+
+                res = conn.execute(q)
+                for row in res.fetchall():
+                    rv.setdefault(row.id, []).append(dict(codebase=row.codebase,
+                                                          branch=row.branch,
+                                                          revision=row.revision,
+                                                          sourcestampsetid=row.sourcestampsetid))
+                res.close()
+                batch = list(itertools.islice(iterator, 100))
+
+            return rv
+
+        return self.db.pool.do(thd)
+
     def selectBuildSetsExactlyMatchesSourcestamps(self,
                                                   sourcestamps,
                                                   sourcestamps_tbl,
@@ -692,30 +809,75 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
         def thd(conn):
             transaction = conn.begin()
             try:
-                buildrequests_tbl = self.db.model.buildrequests
                 claimed_at = self.getClaimedAtValue(_reactor)
                 if queue == Queue.unclaimed:
                     self.insertBuildRequestClaimsTable(conn, _master_objectid, brids, claimed_at)
-                # we'll need to batch the brids into groups of 100, so that the
-                # parameter lists supported by the DBAPI aren't
-                iterator = iter(brids[1:])
-                batch = list(itertools.islice(iterator, 100))
-                while len(batch) > 0:
+                self.executeMergePendingBuildRequests(conn, brids, artifactbrid)
+
+            except:
+                transaction.rollback()
+                raise
+            transaction.commit()
+
+        return self.db.pool.do(thd)
+
+    def executeMergePendingBuildRequests(self, conn, brids, artifactbrid=None):
+        buildrequests_tbl = self.db.model.buildrequests
+        # we'll need to batch the brids into groups of 100, so that the
+        # parameter lists supported by the DBAPI aren't
+        iterator = iter(brids[1:])
+        batch = list(itertools.islice(iterator, 100))
+        while len(batch) > 0:
+
+            stmt = buildrequests_tbl.update() \
+                .where(sa.or_(buildrequests_tbl.c.id.in_(batch), buildrequests_tbl.c.mergebrid.in_(batch))) \
+                .values(mergebrid=brids[0])
+
+            if artifactbrid is not None:
+                stmt_br = sa.select([buildrequests_tbl.c.artifactbrid]) \
+                    .where(buildrequests_tbl.c.id == brids[0])
+                res = conn.execute(stmt_br)
+                row = res.fetchone()
+                stmt = stmt.values(artifactbrid=row.artifactbrid if row and row.artifactbrid else artifactbrid)
+
+            conn.execute(stmt)
+            batch = list(itertools.islice(iterator, 100))
 
-                    stmt = buildrequests_tbl.update() \
-                        .where(sa.or_(buildrequests_tbl.c.id.in_(batch), buildrequests_tbl.c.mergebrid.in_(batch))) \
-                        .values(mergebrid=brids[0])
+    @with_master_objectid
+    def claimBuildRequestGroups(self, groups, claimed_at=None, _reactor=reactor,
+                                _master_objectid=None):
+        """
+        Claim several groups of buildrequests at once, as when starting a
+        batch of builds.  Each group is the list of brids of one build, the
+        first of which the others are merged into.  All the claims are
+        inserted with a single statement, in one transaction with the merges,
+        so either every group is claimed or none is.
+
+        @param groups: list of lists of brids
+        @raises AlreadyClaimedError: if any of the buildrequests is already
+        claimed; nothing is claimed then
+        @returns: Deferred
+        """
+        if claimed_at is not None:
+            claimed_at = datetime2epoch(claimed_at)
+        else:
+            claimed_at = _reactor.seconds()
 
-                    if artifactbrid is not None:
-                        stmt_br = sa.select([buildrequests_tbl.c.artifactbrid]) \
-                            .where(buildrequests_tbl.c.id == brids[0])
-                        res = conn.execute(stmt_br)
-                        row = res.fetchone()
-                        stmt = stmt.values(artifactbrid=row.artifactbrid if row and row.artifactbrid else artifactbrid)
+        def thd(conn):
+            transaction = conn.begin()
+            tbl = self.db.model.buildrequest_claims
 
-                    conn.execute(stmt)
-                    batch = list(itertools.islice(iterator, 100))
+            try:
+                conn.execute(tbl.insert(), [dict(brid=brid, objectid=_master_objectid,
+                                                 claimed_at=claimed_at)
+                                            for brids in groups for brid in brids])
+            except (sa.exc.IntegrityError, sa.exc.ProgrammingError):
+                transaction.rollback()
+                raise AlreadyClaimedError
 
+            try:
+                for brids in groups:
+                    self.executeMergePendingBuildRequests(conn, brids)
             except:
                 transaction.rollback()
                 raise
@@ -1115,25 +1277,45 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
         return self.db.pool.do(thd)
 
     def unclaimExpiredRequests(self, old, _reactor=reactor):
+        """
+        Unclaim the incomplete requests claimed more than C{old} seconds ago.
+
+        @returns: list of dictionaries with the keys C{brid}, C{buildsetid}
+        and C{buildername} of the unclaimed requests, via Deferred
+        """
         def thd(conn):
             reqs_tbl = self.db.model.buildrequests
             claims_tbl = self.db.model.buildrequest_claims
             old_epoch = _reactor.seconds() - old
 
-            # select any expired requests, and delete each one individually
-            expired_brids = sa.select([reqs_tbl.c.id],
-                                      whereclause=(reqs_tbl.c.complete != 1))
-            res = conn.execute(claims_tbl.delete(
-                (claims_tbl.c.claimed_at < old_epoch) &
-                claims_tbl.c.brid.in_(expired_brids)))
-            return res.rowcount
+            # select any expired requests, and delete their claims
+            q = sa.select([reqs_tbl.c.id, reqs_tbl.c.buildsetid, reqs_tbl.c.buildername],
+                          from_obj=[reqs_tbl.join(claims_tbl,
+                                                  reqs_tbl.c.id == claims_tbl.c.brid)],
+                          whereclause=((reqs_tbl.c.complete != 1) &
+                                       (claims_tbl.c.claimed_at < old_epoch)))
+            expired = [dict(brid=row.id, buildsetid=row.buildsetid,
+                            buildername=row.buildername)
+                       for row in conn.execute(q).fetchall()]
+
+            # we'll need to batch the brids into groups of 100, so that the
+            # parameter lists supported by the DBAPI aren't exhausted
+            iterator = iter([e['brid'] for e in expired])
+            batch = list(itertools.islice(iterator, 100))
+            while len(batch) > 0:
+                conn.execute(claims_tbl.delete(
+                    (claims_tbl.c.claimed_at < old_epoch) &
+                    claims_tbl.c.brid.in_(batch)))
+                batch = list(itertools.islice(iterator, 100))
+            return expired
 
         d = self.db.pool.do(thd)
 
-        def log_nonzero_count(count):
-            if count != 0:
+        def log_nonzero_count(expired):
+            if expired:
                 log.msg("unclaimed %d expired buildrequests (over %d seconds "
-                        "old)" % (count, old))
+                        "old)" % (len(expired), old))
+            return expired
 
         d.addCallback(log_nonzero_count)
         return d
@@ -17,6 +17,7 @@
 Support for buildsets in the database
 """
 
+import itertools
 import sqlalchemy as sa
 from twisted.internet import reactor
 from buildbot.util import json
@@ -221,6 +222,58 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
             return dict(l)
         return self.db.pool.do(thd)
 
+    def getBuildsetsByIds(self, bsids):
+        """
+        Fetch several buildsets at once.
+
+        @param bsids: buildset IDs
+        @returns: dictionary mapping each existing bsid to its bsdict, via
+        Deferred
+        """
+        def thd(conn):
+            bs_tbl = self.db.model.buildsets
+            rv = {}
+            # batch the bsids so the parameter lists supported by the DBAPI
+            # aren't exhausted
+            iterator = iter(bsids)
+            batch = list(itertools.islice(iterator, 100))
+            while batch:
+                q = bs_tbl.select(whereclause=(bs_tbl.c.id.in_(batch)))
+                for row in conn.execute(q).fetchall():
+                    rv[row.id] = self._row2dict(row)
+                batch = list(itertools.islice(iterator, 100))
+            return rv
+        return self.db.pool.do(thd)
+
+    def getBuildsetsProperties(self, bsids):
+        """
+        Return the properties of several buildsets at once, in the same
+        format as L{getBuildsetProperties}.
+
+        @param bsids: buildset IDs
+        @returns: dictionary mapping each bsid to its properties dictionary,
+        via Deferred
+        """
+        def thd(conn):
+            bsp_tbl = self.db.model.buildset_properties
+            rv = dict((bsid, {}) for bsid in bsids)
+            iterator = iter(bsids)
+            batch = list(itertools.islice(iterator, 100))
+            while batch:
+                q = sa.select(
+                    [ bsp_tbl.c.buildsetid, bsp_tbl.c.property_name,
+                      bsp_tbl.c.property_value ],
+                    whereclause=(bsp_tbl.c.buildsetid.in_(batch)))
+                for row in conn.execute(q):
+                    try:
+                        properties = json.loads(row.property_value)
+                        rv[row.buildsetid][row.property_name] = tuple(properties)
+                    except ValueError:
+                        pass
+                batch = list(itertools.islice(iterator, 100))
+            return rv
+        return self.db.pool.do(thd)
+
     def _row2dict(self, row):
         def mkdt(epoch):
             if epoch:
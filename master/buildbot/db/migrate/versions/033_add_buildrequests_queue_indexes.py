@@ -0,0 +1,33 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import sqlalchemy as sa
+
+def upgrade(migrate_engine):
+
+    metadata = sa.MetaData()
+    metadata.bind = migrate_engine
+
+    # composite indexes for the queries run against the build queue: the
+    # unclaimed queue, ordered by priority and submission time, the same
+    # queue for a single builder, and the pending requests of a build chain
+    buildrequests = sa.Table('buildrequests', metadata, autoload=True)
+    sa.Index('buildrequests_queue', buildrequests.c.complete,
+             buildrequests.c.mergebrid, buildrequests.c.priority,
+             buildrequests.c.submitted_at).create()
+    sa.Index('buildrequests_buildername_complete', buildrequests.c.buildername,
+             buildrequests.c.complete, buildrequests.c.mergebrid).create()
+    sa.Index('buildrequests_startbrid_complete', buildrequests.c.startbrid,
+             buildrequests.c.complete, buildrequests.c.mergebrid).create()
@@ -424,6 +424,12 @@ class Model(base.DBConnectorComponent):
     sa.Index('buildrequests_triggeredbybrid', buildrequests.c.triggeredbybrid, unique=False)
     sa.Index('buildrequests_mergebrid', buildrequests.c.mergebrid, unique=False)
     sa.Index('buildrequests_startbrid', buildrequests.c.startbrid, unique=False)
+    sa.Index('buildrequests_queue', buildrequests.c.complete, buildrequests.c.mergebrid,
+            buildrequests.c.priority, buildrequests.c.submitted_at)
+    sa.Index('buildrequests_buildername_complete', buildrequests.c.buildername,
+            buildrequests.c.complete, buildrequests.c.mergebrid)
+    sa.Index('buildrequests_startbrid_complete', buildrequests.c.startbrid,
+            buildrequests.c.complete, buildrequests.c.mergebrid)
     sa.Index('builds_slavename', builds.c.slavename, unique=False)
     sa.Index('user_properties_uid', user_props.c.uid, unique=False)
     sa.Index('user_props_attrs', user_props.c.prop_type, user_props.c.prop_data)
@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 import base64
+import itertools
 import sqlalchemy as sa
 from twisted.internet import defer
 from twisted.python import log
@@ -120,12 +121,7 @@ class SourceStampsConnectorComponent(base.DBConnectorComponent):
             row = res.fetchone()
             if not row:
                 return None
-            ssdict = SsDict(ssid=ssid, branch=row.branch, sourcestampsetid=row.sourcestampsetid,
-                    revision=row.revision, patch_body=None, patch_level=None,
-                    patch_author=None, patch_comment=None, patch_subdir=None,
-                    repository=row.repository, codebase=row.codebase,
-                    project=row.project,
-                    changeids=set([]))
+            ssdict = self._row2dict(row)
             patchid = row.patchid
             res.close()
 
@@ -136,13 +132,7 @@ class SourceStampsConnectorComponent(base.DBConnectorComponent):
                 res = conn.execute(q)
                 row = res.fetchone()
                 if row:
-                    # note the subtle renaming here
-                    ssdict['patch_level'] = row.patchlevel
-                    ssdict['patch_subdir'] = row.subdir
-                    ssdict['patch_author'] = row.patch_author
-                    ssdict['patch_comment'] = row.patch_comment
-                    body = base64.b64decode(row.patch_base64)
-                    ssdict['patch_body'] = body
+                    self._addPatch(ssdict, row)
                 else:
                     log.msg('patchid %d, referenced from ssid %d, not found'
                             % (patchid, ssid))
@@ -158,3 +148,74 @@ class SourceStampsConnectorComponent(base.DBConnectorComponent):
 
             return ssdict
         return self.db.pool.do(thd)
+
+    def getSourceStampsForSets(self, sourcestampsetids):
+        """
+        Fetch the sourcestamps of several sourcestamp sets at once, with their
+        patches and change ids, in a fixed number of queries.
+
+        @param sourcestampsetids: sourcestamp set IDs
+        @returns: dictionary mapping each sourcestampsetid to an sslist, via
+        Deferred
+        """
+        def thd(conn):
+            ss_tbl = self.db.model.sourcestamps
+            patches_tbl = self.db.model.patches
+            changes_tbl = self.db.model.sourcestamp_changes
+
+            rv = dict((setid, SsList()) for setid in sourcestampsetids)
+            ssdicts = {}
+            patchids = {}
+
+            # batch the ids so the parameter lists supported by the DBAPI
+            # aren't exhausted
+            def batches(ids):
+                iterator = iter(ids)
+                batch = list(itertools.islice(iterator, 100))
+                while batch:
+                    yield batch
+                    batch = list(itertools.islice(iterator, 100))
+
+            for batch in batches(sourcestampsetids):
+                q = ss_tbl.select(whereclause=(ss_tbl.c.sourcestampsetid.in_(batch)),
+                                  order_by=[ss_tbl.c.id])
+                for row in conn.execute(q).fetchall():
+                    ssdict = self._row2dict(row)
+                    ssdicts[row.id] = ssdict
+                    rv[row.sourcestampsetid].append(ssdict)
+                    if row.patchid is not None:
+                        patchids.setdefault(row.patchid, []).append(ssdict)
+
+            for batch in batches(patchids.keys()):
+                q = patches_tbl.select(whereclause=(patches_tbl.c.id.in_(batch)))
+                for row in conn.execute(q).fetchall():
+                    for ssdict in patchids.pop(row.id):
+                        self._addPatch(ssdict, row)
+            for patchid, missing in patchids.iteritems():
+                for ssdict in missing:
+                    log.msg('patchid %d, referenced from ssid %d, not found'
+                            % (patchid, ssdict['ssid']))
+
+            for batch in batches(ssdicts.keys()):
+                q = changes_tbl.select(whereclause=(changes_tbl.c.sourcestampid.in_(batch)))
+                for row in conn.execute(q).fetchall():
+                    ssdicts[row.sourcestampid]['changeids'].add(row.changeid)
+
+            return rv
+        return self.db.pool.do(thd)
+
+    def _row2dict(self, row):
+        return SsDict(ssid=row.id, branch=row.branch, sourcestampsetid=row.sourcestampsetid,
+                revision=row.revision, patch_body=None, patch_level=None,
+                patch_author=None, patch_comment=None, patch_subdir=None,
+                repository=row.repository, codebase=row.codebase,
+                project=row.project,
+                changeids=set([]))
+
+    def _addPatch(self, ssdict, row):
+        # note the subtle renaming here
+        ssdict['patch_level'] = row.patchlevel
+        ssdict['patch_subdir'] = row.subdir
+        ssdict['patch_author'] = row.patch_author
+        ssdict['patch_comment'] = row.patch_comment
+        ssdict['patch_body'] = base64.b64decode(row.patch_base64)
@@ -17,6 +17,7 @@
 import os
 import signal
 import socket
+import datetime
 
 from zope.interface import implements
 from twisted.python import log, components, failure
@@ -66,6 +67,15 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
     # database poll operation.
     WARNING_UNCLAIMED_COUNT = 10000
 
+    # unclaimed build requests are polled incrementally, fetching only those
+    # newer than the last ones seen; this often, all the unclaimed requests are
+    # fetched instead, which also notices requests that were unclaimed again
+    UNCLAIMED_RECONCILE_INTERVAL = 5*60
+
+    # how far back in submission time an incremental poll looks, to catch
+    # requests whose insert committed after one with a higher id
+    UNCLAIMED_SUBMITTED_SLACK = 60
+
     def __init__(self, basedir, configFileName="master.cfg", umask=None):
         service.MultiService.__init__(self)
         self.setName("buildmaster")
@@ -739,6 +749,9 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         timer.stop()
 
     _last_unclaimed_brids_set = None
+    _last_unclaimed_brid = 0
+    _last_unclaimed_submitted_at = None
+    _last_unclaimed_reconcile = 0
     _last_claim_cleanup = 0
     @defer.inlineCallbacks
     def pollDatabaseBuildRequests(self):
@@ -748,11 +761,12 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         timer.start()
 
         # cleanup unclaimed builds
-        since_last_cleanup = reactor.seconds() - self._last_claim_cleanup 
-        if since_last_cleanup < self.RECLAIM_BUILD_INTERVAL:
+        expired = []
+        since_last_cleanup = reactor.seconds() - self._last_claim_cleanup
+        if since_last_cleanup >= self.RECLAIM_BUILD_INTERVAL:
             unclaimed_age = (self.RECLAIM_BUILD_INTERVAL
                            * self.UNCLAIMED_BUILD_FACTOR)
-            yield self.db.buildrequests.unclaimExpiredRequests(unclaimed_age)
+            expired = yield self.db.buildrequests.unclaimExpiredRequests(unclaimed_age)
 
             self._last_claim_cleanup = reactor.seconds()
 
@@ -768,24 +782,75 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
                     "producing builds for which no builder is running?"
                     % len(last_unclaimed))
 
-        # get the current set of unclaimed buildrequests
-        now_unclaimed_brdicts = \
-            yield self.db.buildrequests.getBuildRequests(claimed=False)
-        now_unclaimed = set([ brd['brid'] for brd in now_unclaimed_brdicts ])
+        # between reconciliations, only fetch the requests above the high
+        # water mark, and assume the ones we know of are still unclaimed,
+        # except those this master claimed since.  The requests whose claims
+        # expired are notified right away, and those this master unclaims are
+        # notified by the builder that unclaims them; a request claimed and
+        # unclaimed by another master in the meantime waits for the next
+        # reconciliation, but that master retries it on its own.
+        reconcile = (self._last_unclaimed_brids_set is None or
+                     reactor.seconds() - self._last_unclaimed_reconcile
+                     >= self.UNCLAIMED_RECONCILE_INTERVAL)
+        if reconcile:
+            brdicts = yield self.db.buildrequests.getBuildRequests(claimed=False)
+            now_unclaimed = set([ brd['brid'] for brd in brdicts ])
+            self._last_unclaimed_reconcile = reactor.seconds()
+        else:
+            submitted_since = None
+            if self._last_unclaimed_submitted_at is not None:
+                submitted_since = self._last_unclaimed_submitted_at - \
+                    datetime.timedelta(seconds=self.UNCLAIMED_SUBMITTED_SLACK)
+            brdicts = yield self.db.buildrequests.getUnclaimedBuildRequestsSince(
+                self._last_unclaimed_brid, submitted_since)
+            now_unclaimed = last_unclaimed | set([ brd['brid'] for brd in brdicts ])
 
         # and store that for next time
         self._last_unclaimed_brids_set = now_unclaimed
+        for brd in brdicts:
+            self._last_unclaimed_brid = max(self._last_unclaimed_brid, brd['brid'])
+            submitted_at = brd['submitted_at']
+            if submitted_at is not None and (self._last_unclaimed_submitted_at is None or
+                                             submitted_at > self._last_unclaimed_submitted_at):
+                self._last_unclaimed_submitted_at = submitted_at
 
         # see what's new, and notify if anything is
-        new_unclaimed = now_unclaimed - last_unclaimed
-        if new_unclaimed:
-            brdicts = dict((brd['brid'], brd) for brd in now_unclaimed_brdicts)
-            for brid in new_unclaimed:
-                brd = brdicts[brid]
+        notified = set()
+        for brd in brdicts:
+            if brd['brid'] not in last_unclaimed:
+                self.buildRequestAdded(brd['buildsetid'], brd['brid'],
+                                       brd['buildername'])
+                notified.add(brd['brid'])
+
+        # the requests which were claimed by a master that went away
+        for brd in expired:
+            self._last_unclaimed_brids_set.add(brd['brid'])
+            if brd['brid'] not in notified:
                 self.buildRequestAdded(brd['buildsetid'], brd['brid'],
                                        brd['buildername'])
         timer.stop()
 
+    def buildRequestsClaimed(self, brids):
+        """
+        Notifies the master that it claimed the given build requests, so that
+        it notifies them again when they are unclaimed.
+
+        @param brids: buildrequest IDs
+        """
+        if self._last_unclaimed_brids_set is not None:
+            self._last_unclaimed_brids_set.difference_update(brids)
+
+    def buildRequestsUnclaimed(self, brids):
+        """
+        Notifies the master that it unclaimed the given build requests, which
+        the incremental polls do not return, so that they are known to be
+        unclaimed again.
+
+        @param brids: buildrequest IDs
+        """
+        if self._last_unclaimed_brids_set is not None:
+            self._last_unclaimed_brids_set.update(brids)
+
     ## state maintenance (private)
 
     def _getState(self, name, default=None):
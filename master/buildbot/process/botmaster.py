@@ -162,6 +162,8 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
         # reconfigure builders
         yield self.reconfigServiceBuilders(new_config)
 
+        self.brd.dispatchBatchSize = new_config.dispatchBatchSize
+
         # call up
         yield config.ReconfigurableServiceMixin.reconfigService(self,
                                                     new_config)
@@ -229,8 +231,8 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
     def removeQueuedBuilds(self, removed_builders):
         if len(removed_builders):
             log.msg("removing %d builds from the build queue, the builder(s) was removed" % len(removed_builders))
-            for brdict in removed_builders:
-                br = yield BuildRequest.fromBrdict(self.master, brdict)
+            breqs = yield BuildRequest.fromBrdicts(self.master, removed_builders)
+            for br in breqs:
                 brc = BuildRequestControl(None, br)
                 yield brc.cancel()
 
@@ -601,6 +601,10 @@ class Builder(config.ReconfigurableServiceMixin,
     def _resubmit_buildreqs(self, out=None, build=None):
         brids = [br.id for br in build.requests]
         yield self.master.db.buildrequests.unclaimBuildRequests(brids, results=BEGINNING)
+        self.master.buildRequestsUnclaimed(brids)
+        # the queues only pick up the requests they are notified of
+        for br in build.requests:
+            self.master.buildRequestAdded(br.bsid, br.id, self.name)
         defer.returnValue(out)
 
     def setExpectations(self, progress):
@@ -750,11 +754,8 @@ class BuilderControl:
         brdicts = yield master.db.buildrequests.getBuildRequestInQueue(brids=brids, buildername=self.original.name)
 
         # convert those into BuildRequest objects
-        buildrequests = [ ]
-        for brdict in brdicts:
-            br = yield buildrequest.BuildRequest.fromBrdict(
-                    self.control.master, brdict)
-            buildrequests.append(br)
+        buildrequests = yield buildrequest.BuildRequest.fromBrdicts(
+                self.control.master, brdicts)
 
         # and return the corresponding control objects
         defer.returnValue([buildrequest.BuildRequestControl(self.original, r)
@@ -84,7 +84,7 @@ class BuildRequest(object):
     submittedAt = None
 
     @classmethod
-    def fromBrdict(cls, master, brdict):
+    def fromBrdict(cls, master, brdict, prefetched=None):
         """
         Construct a new L{BuildRequest} from a dictionary as returned by
         L{BuildRequestsConnectorComponent.getBuildRequest}.
@@ -95,6 +95,7 @@ class BuildRequest(object):
 
         @param master: current build master
         @param brdict: build request dictionary
+        @param prefetched: buildset data fetched by L{fromBrdicts}, if any
 
         @returns: L{BuildRequest}, via Deferred
         """
@@ -106,13 +107,52 @@ class BuildRequest(object):
             return br
 
         cache = master.caches.get_cache("BuildRequests", cls._make_br)
-        d = cache.get(brdict['brid'], brdict=brdict, master=master)
+        d = cache.get(brdict['brid'], brdict=brdict, master=master, prefetched=prefetched)
         d.addCallback(updateRequest)
         return d
 
     @classmethod
     @defer.inlineCallbacks
-    def _make_br(cls, brid, brdict, master):
+    def fromBrdicts(cls, master, brdicts):
+        """
+        Construct the L{BuildRequest}s for several build request dictionaries
+        at once.  The buildsets, properties and sourcestamps of the requests
+        which are not cached yet are fetched in a fixed number of queries,
+        rather than a few queries per request as L{fromBrdict} does.
+
+        @param master: current build master
+        @param brdicts: build request dictionaries
+
+        @returns: list of L{BuildRequest}, in the order of C{brdicts}, via
+        Deferred
+        """
+        cache = master.caches.get_cache("BuildRequests", cls._make_br)
+        bsids = set(brdict['buildsetid'] for brdict in brdicts
+                    if brdict['brid'] not in cache)
+        prefetched = None
+        if bsids:
+            prefetched = yield cls._prefetchBuildsets(master, bsids)
+
+        breqs = yield defer.gatherResults([cls.fromBrdict(master, brdict, prefetched=prefetched)
+                                           for brdict in brdicts])
+        defer.returnValue(breqs)
+
+    @staticmethod
+    @defer.inlineCallbacks
+    def _prefetchBuildsets(master, bsids):
+        # returns a dictionary mapping bsid to (buildset, properties, sslist)
+        bsids = list(bsids)
+        buildsets = yield master.db.buildsets.getBuildsetsByIds(bsids)
+        buildsets_properties = yield master.db.buildsets.getBuildsetsProperties(buildsets.keys())
+        sslists = yield master.db.sourcestamps.getSourceStampsForSets(
+            list(set(bs['sourcestampsetid'] for bs in buildsets.itervalues())))
+
+        defer.returnValue(dict((bsid, (bs, buildsets_properties[bsid], sslists[bs['sourcestampsetid']]))
+                               for bsid, bs in buildsets.iteritems()))
+
+    @classmethod
+    @defer.inlineCallbacks
+    def _make_br(cls, brid, brdict, master, prefetched=None):
         buildrequest = cls()
         buildrequest.id = brid
         buildrequest.bsid = brdict['buildsetid']
@@ -131,18 +171,22 @@ class BuildRequest(object):
         buildrequest.slavepool = brdict['slavepool'] if 'slavepool' in brdict else None
         buildrequest.results = brdict['results'] if 'results' in brdict and brdict['results'] is not None else None
 
-        # fetch the buildset to get the reason
-        buildset = yield master.db.buildsets.getBuildset(brdict['buildsetid'])
-        assert buildset # schema should guarantee this
-        buildrequest.reason = buildset['reason']
+        if prefetched and brdict['buildsetid'] in prefetched:
+            buildset, buildset_properties, sslist = prefetched[brdict['buildsetid']]
+        else:
+            # fetch the buildset to get the reason
+            buildset = yield master.db.buildsets.getBuildset(brdict['buildsetid'])
+            assert buildset # schema should guarantee this
 
-        # fetch the buildset properties, and convert to Properties
-        buildset_properties = yield master.db.buildsets.getBuildsetProperties(brdict['buildsetid'])
+            # fetch the buildset properties
+            buildset_properties = yield master.db.buildsets.getBuildsetProperties(brdict['buildsetid'])
 
+            # fetch the sourcestamp dictionary
+            sslist = yield  master.db.sourcestamps.getSourceStamps(buildset['sourcestampsetid'])
+
+        buildrequest.reason = buildset['reason']
         buildrequest.properties = properties.Properties.fromDict(buildset_properties)
 
-        # fetch the sourcestamp dictionary
-        sslist = yield  master.db.sourcestamps.getSourceStamps(buildset['sourcestampsetid'])
         assert len(sslist) > 0, "Empty sourcestampset: db schema enforces set to exist but cannot enforce a non empty set"
 
         # and turn it into a SourceStamps
@@ -17,7 +17,7 @@
 
 from twisted.python import log
 from twisted.python.failure import Failure
-from twisted.internet import defer
+from twisted.internet import defer, reactor
 from twisted.application import service
 
 from buildbot.process import metrics
@@ -25,6 +25,8 @@ from buildbot.process.buildrequest import BuildRequest
 from buildbot.status.results import RESUME, BEGINNING
 from buildbot.db.buildrequests import AlreadyClaimedError, UnsupportedQueueError, Queue
 from buildbot.process.builder import Slavepool
+from buildbot.process.priorityindex import BuildRequestPriorityIndex
+from buildbot.process.mergeplanner import MergePlanner
 from buildbot import util
 from buildbot.util import lru
 
@@ -363,17 +365,60 @@ class BasicBuildChooser(BuildChooserBase):
 
 class KatanaBuildChooser(BasicBuildChooser):
 
-    def __init__(self, builders, master):
+    # frequency, in seconds, with which the in-memory queues are checked
+    # against the database, to pick up changes made without notifying
+    # this master
+    QUEUE_RECONCILE_INTERVAL = 5*60
+
+    def __init__(self, builders, master, _reactor=reactor):
         # By default katana  merges Requests
         self.bldr = None
         self.master = master
+        self._reactor = _reactor
         self.initializeBreqCache()
         self.builders = builders
+        self.queues = {Queue.unclaimed: BuildRequestPriorityIndex(),
+                       Queue.resume: BuildRequestPriorityIndex()}
+        self.mergePlanners = {Queue.unclaimed: MergePlanner(),
+                              Queue.resume: MergePlanner()}
+        for queue, index in self.queues.iteritems():
+            index.addListener(self.mergePlanners[queue])
+        # slaves picked for a batch of builds which have not started yet
+        self.reservedSlaves = set()
         self.initializeBuildRequestQueue()
 
     def initializeBuildRequestQueue(self):
-        self.unclaimedBrdicts = None
-        self.resumeBrdicts = None
+        # the queues will be fully reloaded from the database on next use
+        for index in self.queues.itervalues():
+            index.invalidate()
+
+    def buildRequestAdded(self, notif):
+        # we don't know yet which queue the buildrequest belongs to, the next
+        # sync will fetch it from the db
+        for index in self.queues.itervalues():
+            index.markDirty(notif['brid'])
+
+    def buildRequestRemoved(self, notif):
+        for index in self.queues.itervalues():
+            index.remove(notif['brid'])
+
+    def reserveBuild(self, slave, breqs):
+        """
+        Keep C{slave} and C{breqs} out of the next choices, until the build
+        they were chosen for is started.  The buildrequests are only taken out
+        of the in-memory queue, so they are back with the next sync if the
+        build does not start.
+        """
+        self.reservedSlaves.add(slave.slave)
+        for breq in breqs:
+            for index in self.queues.itervalues():
+                index.remove(breq.id)
+
+    def releaseReservedSlaves(self):
+        self.reservedSlaves.clear()
+
+    def _isReserved(self, slavebuilder):
+        return slavebuilder.slave in self.reservedSlaves
 
     def setupNextBuildRequest(self, bldr, breq):
         # by default katana merges buildrequests
@@ -412,15 +457,13 @@ class KatanaBuildChooser(BasicBuildChooser):
             log.msg("merge pending buildrequest %s with %s " % (brids[0], brids[1:]))
         else:
             yield self.master.db.buildrequests.claimBuildRequests(brids)
+        self.master.buildRequestsClaimed(brids)
 
     def _removeBreq(self, breq):
         # reset the checkMerges in case the breq still in the master cache
         breq.checkMerges = True
-        if hasattr(breq, 'brdict') and breq.brdict:
-            if self.unclaimedBrdicts and breq.brdict in self.unclaimedBrdicts:
-                self.unclaimedBrdicts.remove(breq.brdict)
-            if self.resumeBrdicts and breq.brdict in self.resumeBrdicts:
-                self.resumeBrdicts.remove(breq.brdict)
+        for index in self.queues.itervalues():
+            index.remove(breq.id)
         self.breqCache.remove(breq.id)
 
     def _removeBuildRequests(self, breqs):
@@ -443,20 +486,68 @@ class KatanaBuildChooser(BasicBuildChooser):
         timerLogFinished(msg="_getBuildRequestForBrdict finished", timer=timer)
         defer.returnValue(breq)
 
+    @defer.inlineCallbacks
+    def _getBuildRequestsForBrdicts(self, brdicts):
+        # hydrate the requests missing from the cache in bulk, so the cache
+        # misses below are served from the master's BuildRequests cache
+        # instead of the database
+        missing = [brdict for brdict in brdicts if brdict['brid'] not in self.breqCache]
+        if missing:
+            yield BuildRequest.fromBrdicts(self.master, missing)
+        breqs = yield defer.gatherResults([self._getBuildRequestForBrdict(brdict)
+                                           for brdict in brdicts])
+        defer.returnValue(breqs)
+
     @defer.inlineCallbacks
     def _getBuildRequestsQueue(self, queue):
-        if queue == Queue.unclaimed:
-            if not self.unclaimedBrdicts:
-                self.unclaimedBrdicts = yield self.master.db.buildrequests\
-                    .getBuildRequestsInQueue(queue=queue)
-            defer.returnValue(self.unclaimedBrdicts)
-            return
+        """
+        Brings the in-memory index of C{queue} up to date with the database
+        and returns it.
+
+        The index is fully reloaded only when it was invalidated or on a slow
+        period; otherwise only the buildrequests newer than the ones already
+        seen, and the ones we were notified about, are fetched.
+        """
+        if queue not in self.queues:
+            raise UnsupportedQueueError
+
+        index = self.queues[queue]
+        now = self._reactor.seconds()
+        db = self.master.db.buildrequests
+
+        if index.needsFullSync(now, self.QUEUE_RECONCILE_INTERVAL):
+            brdicts = yield db.getBuildRequestsInQueue(queue=queue, order=False)
+            index.load(brdicts, now)
+        else:
+            minbrid = index.highWaterMark + 1 if index.highWaterMark is not None else None
+            brdicts = yield db.getBuildRequestsInQueue(queue=queue, minbrid=minbrid, order=False)
+            for brdict in brdicts:
+                index.add(brdict)
 
-        if queue == Queue.resume:
-            if not self.resumeBrdicts:
-                self.resumeBrdicts = yield self.master.db.buildrequests\
-                    .getBuildRequestsInQueue(queue=queue)
-            defer.returnValue(self.resumeBrdicts)
+            dirty = index.popDirty()
+            if dirty:
+                brdicts = yield db.getBuildRequestsInQueue(queue=queue, brids=list(dirty), order=False)
+                index.update(dirty, brdicts)
+
+            index.compact()
+
+        yield self._updateMergePlanner(queue, index)
+
+        defer.returnValue(index)
+
+    @defer.inlineCallbacks
+    def _updateMergePlanner(self, queue, index):
+        # fetch the sourcestamps of all the new buildrequests in one query, so
+        # that merge candidates are found without querying each time
+        planner = self.mergePlanners[queue]
+        missing = planner.missing()
+        if missing:
+            sourcestamps = yield self.master.db.buildrequests.getBuildRequestsSourceStamps(missing)
+            for brid in missing:
+                # it may have left the queue in the meantime
+                brdict = index.get(brid)
+                if brdict is not None:
+                    planner.add(brdict, sourcestamps.get(brid))
 
     # Katana's gets the next priority builder from the DB instead of keeping a local list
     @defer.inlineCallbacks
@@ -472,24 +563,28 @@ class KatanaBuildChooser(BasicBuildChooser):
         it will select only builds pending to be resume
         @returns: a build request dictionary or None via Deferred
         """
-        unavailableBuilderNames = []
+        unavailableBuckets = set()
         builderSlavepool = {}
 
-        # TODO: For performance reasons we may need to limit the searches but  we need to load test it first
         buildrequestQueue = yield self._getBuildRequestsQueue(queue)
 
         log.msg("getNextPriorityBuilder found %d buildrequests in the '%s' Queue" % (len(buildrequestQueue), queue))
 
-        for br in buildrequestQueue:
+        walk = buildrequestQueue.walk()
+        for br in walk:
             buildername = br['buildername']
+            bucket = buildrequestQueue.bucketKey(br)
 
             bldr = self.builders.get(buildername)
 
             if not bldr:
                 log.msg("BuildRequest %d uses unknown builder %s" % (br['brid'], buildername))
+                walk.skipBucket(bucket)
                 continue
 
-            if buildername in unavailableBuilderNames and not bldr.building and br['startbrid'] is None:
+            if bucket in unavailableBuckets and not bldr.building and br['startbrid'] is None:
+                if not buildrequestQueue.hasChainedRequests(bucket):
+                    walk.skipBucket(bucket)
                 continue
 
             breq = yield self._getBuildRequestForBrdict(br)
@@ -507,17 +602,19 @@ class KatanaBuildChooser(BasicBuildChooser):
 
             slavepool = getSlavepool()
 
-            if buildername not in builderSlavepool:
-                builderSlavepool[buildername] = bldr.getAvailableSlavesToProcessBuildRequests(slavepool=slavepool)
+            if bucket not in builderSlavepool:
+                builderSlavepool[bucket] = [sb for sb in
+                                            bldr.getAvailableSlavesToProcessBuildRequests(slavepool=slavepool)
+                                            if not self._isReserved(sb)]
 
-            if not builderSlavepool[buildername]:
-                unavailableBuilderNames.append(buildername)
+            if not builderSlavepool[bucket]:
+                unavailableBuckets.add(bucket)
                 log.msg("No idle slaves found in '%s' list to process buildrequest.id %d for builder %s"
                         % (slavepool, br['brid'], buildername))
 
                 continue
 
-            self.slavepool = builderSlavepool[buildername]
+            self.slavepool = builderSlavepool[bucket]
 
             buildRequestShouldUseSelectedSlave = "selected_slave" in br and br["selected_slave"] \
                                                  and br['results'] == BEGINNING and bldr.shouldUseSelectedSlave()
@@ -527,7 +624,8 @@ class KatanaBuildChooser(BasicBuildChooser):
                                                          and br['slavepool'] != Slavepool.startSlavenames
 
             if buildRequestShouldUseSelectedSlave or resumingBuildRequestShouldUseSelectedSlave:
-                if bldr.slaveIsAvailable(slavename=br["selected_slave"]):
+                slavebuilder = bldr.getSlaveBuilder(slavename=br["selected_slave"])
+                if slavebuilder and slavebuilder.isAvailable() and not self._isReserved(slavebuilder):
                     defer.returnValue(breq)
                     return
 
@@ -589,32 +687,26 @@ class KatanaBuildChooser(BasicBuildChooser):
                                                                              buildername=self.bldr.name,
                                                                              mergebrids=brids,
                                                                              order=False)
-        merged_breqs = yield defer.gatherResults([self._getBuildRequestForBrdict(brdict)
-                                                  for brdict in brdicts])
+        merged_breqs = yield self._getBuildRequestsForBrdicts(brdicts)
         defer.returnValue(breqs + merged_breqs)
 
     @defer.inlineCallbacks
     def mergeRequests(self, breq, queue, startbrid=None):
-        mergedRequests = [breq]
-
-        sourcestamps = []
-        for ss in breq.sources.itervalues():
-            sourcestamps.append({'b_codebase': ss.codebase, 'b_revision': ss.revision,
-                                 'b_branch': ss.branch, 'b_sourcestampsetid': ss.sourcestampsetid})
+        sourcestamps = [dict(codebase=ss.codebase, branch=ss.branch, revision=ss.revision,
+                             sourcestampsetid=ss.sourcestampsetid)
+                        for ss in breq.sources.itervalues()]
 
-        brdicts = yield self.master.db.buildrequests.getBuildRequestsInQueue(queue=queue,
-                                                                             buildername=self.bldr.name,
-                                                                             sourcestamps=sourcestamps,
-                                                                             startbrid=startbrid,
-                                                                             order=False)
+        brdicts = self.mergePlanners[queue].getCandidates(self.queues[queue],
+                                                          buildername=self.bldr.name,
+                                                          sourcestamps=sourcestamps,
+                                                          startbrid=startbrid)
+        brdicts = [brdict for brdict in brdicts if brdict['brid'] != breq.id]
 
-        for brdict in brdicts:
-            req = yield self._getBuildRequestForBrdict(brdict)
-            canMerge = yield self.mergeRequestsFn(self.bldr, breq, req)
-            if canMerge and req.id != breq.id:
-                mergedRequests.append(req)
+        reqs = yield self._getBuildRequestsForBrdicts(brdicts)
+        canMerge = yield defer.gatherResults([defer.maybeDeferred(self.mergeRequestsFn, self.bldr, breq, req)
+                                              for req in reqs])
 
-        defer.returnValue(mergedRequests)
+        defer.returnValue([breq] + [req for req, merge in zip(reqs, canMerge) if merge])
 
     @defer.inlineCallbacks
     def chooseNextBuildToResume(self):
@@ -1035,11 +1127,13 @@ class BuildRequestDistributor(service.Service):
                 # some brids were already claimed, so start over
                 bc = self.createBuildChooser(bldr, self.master)
                 continue
+            self.master.buildRequestsClaimed(brids)
 
             buildStarted = yield bldr.maybeStartBuild(slave, breqs)
 
             if not buildStarted:
                 yield self.master.db.buildrequests.unclaimBuildRequests(brids)
+                self.master.buildRequestsUnclaimed(brids)
 
                 # and try starting builds again.  If we still have a working slave,
                 # then this may re-claim the same buildrequests
@@ -1078,10 +1172,29 @@ class KatanaBuildRequestDistributor(service.Service):
         self._pendingMSBOCalls = []
         self.check_new_builds = True
         self.check_resume_builds = True
+        # number of new builds started together; see _maybeStartBuildBatch
+        self.dispatchBatchSize = 1
         self.katanaBuildChooser = self.createBuildChooser(builders=self.botmaster.builders, master=self.master)
+        self.buildrequest_sub = None
+        self.cancelled_buildrequest_sub = None
+
+    def startService(self):
+        # keep the build chooser's queues up to date without reloading them
+        self.buildrequest_sub = \
+            self.master.subscribeToBuildRequests(self.katanaBuildChooser.buildRequestAdded)
+        self.cancelled_buildrequest_sub = \
+            self.master.subscribeToCancelledBuildRequests(self.katanaBuildChooser.buildRequestRemoved)
+        service.Service.startService(self)
 
     @defer.inlineCallbacks
     def stopService(self):
+        if self.buildrequest_sub:
+            self.buildrequest_sub.unsubscribe()
+            self.buildrequest_sub = None
+        if self.cancelled_buildrequest_sub:
+            self.cancelled_buildrequest_sub.unsubscribe()
+            self.cancelled_buildrequest_sub = None
+
         # Lots of stuff happens asynchronously here, so we need to let it all
         # quiesce.  First, let the parent stopService succeed between
         # activities; then the loop will stop calling itself, since
@@ -1128,8 +1241,6 @@ class KatanaBuildRequestDistributor(service.Service):
     def _checkBuildRequests(self):
         self.check_new_builds = True
         self.check_resume_builds = True
-        self.katanaBuildChooser.initializeBuildRequestQueue()
-
 
 
     @defer.inlineCallbacks
@@ -1175,7 +1286,10 @@ class KatanaBuildRequestDistributor(service.Service):
                 break
 
             # continue checking new builds if we have pending builders
-            if self.check_new_builds:
+            if self.check_new_builds and self.dispatchBatchSize > 1:
+                self.check_new_builds = yield self._maybeStartBuildBatch()
+
+            elif self.check_new_builds:
                 nextBuilder = yield self._selectNextBuildRequest(queue=Queue.unclaimed,
                                                                  asyncFunc=self._maybeStartBuildsOnBuilder)
                 self.check_new_builds = nextBuilder is not None
@@ -1216,6 +1330,9 @@ class KatanaBuildRequestDistributor(service.Service):
 
         if not buildStarted:
             yield self.master.db.buildrequests.updateBuildRequests(brids, results=RESUME)
+            # the merged requests are no longer in the queue on their own
+            for brid in brids:
+                self.katanaBuildChooser.buildRequestAdded(dict(brid=brid))
             self.botmaster.maybeStartBuildsForBuilder(self.katanaBuildChooser.bldr.name)
             msg = "_maybeResumeBuildOnBuilder could not resume build"
         else:
@@ -1233,25 +1350,136 @@ class KatanaBuildRequestDistributor(service.Service):
             return
 
         # claim brid's
-        brids = [br.id for br in breqs]
         yield self.katanaBuildChooser.claimBuildRequests(breqs)
 
-        buildStarted = yield self.katanaBuildChooser.bldr.maybeStartBuild(slave, breqs)
+        bldr = self.katanaBuildChooser.bldr
+        buildStarted = yield bldr.maybeStartBuild(slave, breqs)
+        yield self._buildStartedOrRequeued(bldr, slave, breqs, buildStarted)
+        defer.returnValue(buildStarted)
 
+    @defer.inlineCallbacks
+    def _buildStartedOrRequeued(self, bldr, slave, breqs, buildStarted):
         msg = "_maybeStartNewBuildsOnBuilder is starting build"
 
         if not buildStarted:
+            brids = [br.id for br in breqs]
             yield self.master.db.buildrequests.unclaimBuildRequests(brids)
+            self.master.buildRequestsUnclaimed(brids)
+            # merged requests are back in the queue as separated requests
+            for brid in brids:
+                self.katanaBuildChooser.buildRequestAdded(dict(brid=brid))
             # and try starting builds again.  If we still have a working slave,
             # then this may re-claim the same buildrequests
-            self.botmaster.maybeStartBuildsForBuilder(self.katanaBuildChooser.bldr.name)
+            self.botmaster.maybeStartBuildsForBuilder(bldr.name)
             msg = "_maybeStartNewBuildsOnBuilder could not start build"
         else:
             self.katanaBuildChooser._removeBuildRequests(breqs)
 
         self.logResumeOrStartBuildStatus(msg, slave, breqs)
+
+    def _getBuildLocks(self, bldr, slave):
+        # the real locks a build of bldr on slave would take
+        return set(self.botmaster.getLockFromLockAccess(access).getLock(slave.slave)
+                   for access in bldr.config.locks)
+
+    @defer.inlineCallbacks
+    def _selectBuildBatch(self):
+        """
+        Choose up to C{dispatchBatchSize} new builds, in the order the
+        sequential loop would have started them, each one on a slave not used
+        by the others.  A build that would take a lock already taken by an
+        earlier build of the batch ends the batch; it will be chosen first by
+        the next one, so the outcome does not depend on the order in which the
+        builds start.
+
+        @returns: list of (builder, slavebuilder, breqs), via Deferred
+        """
+        chooser = self.katanaBuildChooser
+        batch = []
+        batchLocks = set()
+
+        while len(batch) < self.dispatchBatchSize:
+            breq = yield chooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+            if breq is None:
+                break
+
+            slave, breqs = yield chooser.chooseNextBuild()
+            if not slave or not breqs:
+                break
+
+            bldr = chooser.bldr
+            buildLocks = self._getBuildLocks(bldr, slave)
+            if buildLocks & batchLocks:
+                break
+
+            batchLocks.update(buildLocks)
+            chooser.reserveBuild(slave, breqs)
+            batch.append((bldr, slave, breqs))
+
+        defer.returnValue(batch)
+
+    @defer.inlineCallbacks
+    def _claimBuildBatch(self, batch):
+        # claim the buildrequests of every build at once; if another master
+        # claimed some of them in the meantime, claim build by build and
+        # leave out the ones that were lost
+        try:
+            yield self.master.db.buildrequests.claimBuildRequestGroups([[br.id for br in breqs]
+                                                                        for _, _, breqs in batch])
+            self.master.buildRequestsClaimed([br.id for _, _, breqs in batch for br in breqs])
+            defer.returnValue(batch)
+            return
+        except AlreadyClaimedError:
+            log.msg("some buildrequests of the batch were already claimed, claiming them one build at a time")
+
+        claimed = []
+        for bldr, slave, breqs in batch:
+            try:
+                yield self.master.db.buildrequests.claimBuildRequestGroups([[br.id for br in breqs]])
+                self.master.buildRequestsClaimed([br.id for br in breqs])
+                claimed.append((bldr, slave, breqs))
+            except AlreadyClaimedError:
+                for br in breqs:
+                    self.katanaBuildChooser.buildRequestAdded(dict(brid=br.id))
+        defer.returnValue(claimed)
+
+    @defer.inlineCallbacks
+    def _startBuildInBatch(self, bldr, slave, breqs):
+        try:
+            buildStarted = yield bldr.maybeStartBuild(slave, breqs)
+        except Exception:
+            log.err(Failure(), "while starting build on builder '%s'" % bldr.name)
+            buildStarted = False
+        yield self._buildStartedOrRequeued(bldr, slave, breqs, buildStarted)
         defer.returnValue(buildStarted)
 
+    @defer.inlineCallbacks
+    def _maybeStartBuildBatch(self):
+        """
+        Start a batch of new builds: choose them, claim all their
+        buildrequests with a single statement and start them concurrently.
+
+        @returns: True if any build was started, via Deferred; the builds
+        that did not start are retried when their builder is triggered again
+        """
+        started = []
+        try:
+            batch = yield self._selectBuildBatch()
+            if batch:
+                log.msg("_maybeStartBuildBatch starting %d builds" % len(batch))
+                claimed = yield self._claimBuildBatch(batch)
+                started = yield defer.gatherResults([self._startBuildInBatch(bldr, slave, breqs)
+                                                     for bldr, slave, breqs in claimed])
+
+        except Exception:
+            self.katanaBuildChooser.initializeBuildRequestQueue()
+            log.err(Failure(), "from _maybeStartBuildBatch")
+
+        finally:
+            self.katanaBuildChooser.releaseReservedSlaves()
+
+        defer.returnValue(any(started))
+
     def createBuildChooser(self, builders, master):
         # just instantiate the build chooser requested
         return self.BuildChooser(builders, master)
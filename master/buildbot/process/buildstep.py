@@ -176,19 +176,39 @@ class RemoteCommand(pb.Referenceable):
         self.buildslave.messageReceivedFromSlave()
         max_updatenum = 0
         for (update, num) in updates:
-            #log.msg("update[%d]:" % num)
+            if num > max_updatenum:
+                max_updatenum = num
+
+        for update in self._mergeUpdates([update for (update, num) in updates]):
+            if not self.active or self.ignore_updates:
+                break
             try:
-                if self.active and not self.ignore_updates:
-                    self.remoteUpdate(update)
+                self.remoteUpdate(update)
             except:
-                # log failure, terminate build, let slave retire the update
+                # log failure, terminate build, skip the rest of the updates
+                # but let slave retire them all
                 self._finished(Failure())
-                # TODO: what if multiple updates arrive? should
-                # skip the rest but ack them all
-            if num > max_updatenum:
-                max_updatenum = num
+                break
         return max_updatenum
 
+    @staticmethod
+    def _mergeUpdates(updates):
+        # slaves send their updates in batches: successive output to the
+        # same place is joined, so it is added to the log at once
+        merged = []
+        for update in updates:
+            if merged and len(update) == 1 and len(merged[-1]) == 1:
+                key, data = update.items()[0]
+                prevKey, prevData = merged[-1].items()[0]
+                if key == prevKey and key in ('stdout', 'stderr', 'header'):
+                    merged[-1] = {key: prevData + data}
+                    continue
+                if key == prevKey == 'log' and data[0] == prevData[0]:
+                    merged[-1] = {key: (data[0], prevData[1] + data[1])}
+                    continue
+            merged.append(update)
+        return merged
+
     def remote_complete(self, failure=None):
         """
         Called by the slave's L{buildbot.slave.bot.SlaveBuilder} to
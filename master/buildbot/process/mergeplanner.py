@@ -0,0 +1,112 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+
+def sourcestampsFingerprint(sourcestamps):
+    """
+    Returns a hashable key identifying a set of sourcestamps by codebase,
+    branch and revision; buildrequests can only be merged if their
+    fingerprints are equal.
+    """
+    return tuple(sorted((ss['codebase'], ss['branch'], ss['revision']) for ss in sourcestamps))
+
+
+class MergePlanner(object):
+    """
+    Groups the buildrequests of a L{BuildRequestPriorityIndex} by builder and
+    sourcestamps, so that the merge candidates of a buildrequest are found
+    without querying the database.
+
+    The planner listens to the index: the sourcestamps of a buildrequest
+    never change, so they only need to be fetched once, when it enters the
+    index; L{missing} returns the buildrequests that still need them.  The
+    buildrequests are forgotten when they leave the index.
+    """
+
+    def __init__(self):
+        # brid -> (buildername, sourcestampsetid, fingerprint)
+        self._brids = {}
+        # (buildername, fingerprint) -> set of brids
+        self._groups = {}
+        # brids in the index without their sourcestamps
+        self._missing = set()
+
+    def __len__(self):
+        return len(self._brids)
+
+    def missing(self):
+        return list(self._missing)
+
+    def requestAdded(self, brdict):
+        if brdict['brid'] not in self._brids:
+            self._missing.add(brdict['brid'])
+
+    def requestRemoved(self, brid):
+        self._missing.discard(brid)
+        self.remove(brid)
+
+    def add(self, brdict, sourcestamps):
+        brid = brdict['brid']
+        self._missing.discard(brid)
+        if brid in self._brids:
+            return
+
+        if not sourcestamps:
+            # remember it anyway, so it is not fetched again; it can't be merged
+            self._brids[brid] = (brdict['buildername'], None, None)
+            return
+
+        fingerprint = sourcestampsFingerprint(sourcestamps)
+        key = (brdict['buildername'], fingerprint)
+        self._brids[brid] = (brdict['buildername'], sourcestamps[0]['sourcestampsetid'], fingerprint)
+        self._groups.setdefault(key, set()).add(brid)
+
+    def remove(self, brid):
+        entry = self._brids.pop(brid, None)
+        if entry is None:
+            return
+        buildername, _, fingerprint = entry
+        key = (buildername, fingerprint)
+        group = self._groups.get(key)
+        if group is None:
+            return
+        group.discard(brid)
+        if not group:
+            del self._groups[key]
+
+    def getCandidates(self, index, buildername, sourcestamps, startbrid=None):
+        """
+        Returns the brdicts in C{index} for C{buildername} whose sourcestamps
+        match exactly C{sourcestamps}, excluding the ones that share its
+        sourcestampset.
+
+        @param startbrid: only return buildrequests of this build chain
+        @returns: a list of brdicts, sorted by brid
+        """
+        if not sourcestamps:
+            return []
+
+        sourcestampsetid = sourcestamps[0]['sourcestampsetid']
+        candidates = []
+        for brid in self._groups.get((buildername, sourcestampsFingerprint(sourcestamps)), ()):
+            brdict = index.get(brid)
+            if brdict is None or self._brids[brid][1] == sourcestampsetid:
+                continue
+            if startbrid and brdict.get('startbrid') != startbrid:
+                continue
+            candidates.append(brdict)
+
+        candidates.sort(key=lambda br: br['brid'])
+        return candidates
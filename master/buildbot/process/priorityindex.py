@@ -0,0 +1,227 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import heapq
+import itertools
+
+
+class _Bucket(object):
+    # A heap of the requests for one (buildername, slavepool) pair.  Entries
+    # are never removed from the heap directly; stale entries are skipped when
+    # walking and dropped when the bucket is compacted.
+
+    __slots__ = ('key', 'heap', 'chained')
+
+    def __init__(self, key):
+        self.key = key
+        self.heap = []
+        # number of live requests that belong to a build chain
+        self.chained = 0
+
+
+class PriorityWalk(object):
+    """
+    Iterates over the requests of a L{BuildRequestPriorityIndex} by higher
+    priority and oldest submitted time, without modifying the index.
+
+    Each step costs O(log n); buckets can be skipped as a whole with
+    L{skipBucket}, which is how the chooser ignores builders without idle
+    slaves.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.skipped = set()
+        self._heap = []
+        for bucket in index._buckets.itervalues():
+            if bucket.heap:
+                self._heap.append((bucket.heap[0], bucket, 0))
+        heapq.heapify(self._heap)
+
+    def __iter__(self):
+        return self
+
+    def skipBucket(self, key):
+        self.skipped.add(key)
+
+    def next(self):
+        while self._heap:
+            item, bucket, pos = heapq.heappop(self._heap)
+            if bucket.key in self.skipped:
+                continue
+
+            # the children of pos in the bucket heap are the next candidates
+            for child in (2 * pos + 1, 2 * pos + 2):
+                if child < len(bucket.heap):
+                    heapq.heappush(self._heap, (bucket.heap[child], bucket, child))
+
+            brdict = self.index._getLive(item)
+            if brdict is not None:
+                return brdict
+
+        raise StopIteration
+
+
+class BuildRequestPriorityIndex(object):
+    """
+    An in-memory index of the build requests waiting in one queue, ordered by
+    (priority, submitted_at) and bucketed by builder and slavepool.
+
+    The index is loaded from the database with L{load}, and kept up to date
+    with L{add} and L{remove}.  Requests that may have changed in the database
+    are marked with L{markDirty}; the owner of the index is expected to
+    re-fetch them before walking the queue again.
+
+    The listeners registered with L{addListener} have their C{requestAdded}
+    and C{requestRemoved} methods called as requests enter and leave the
+    index.
+    """
+
+    # compact a bucket when more than this fraction of its heap is stale
+    COMPACT_FACTOR = 2
+
+    def __init__(self):
+        self._counter = itertools.count()
+        self._buckets = {}
+        # brid -> (sequence number, bucket, brdict)
+        self._live = {}
+        self._stale = 0
+        self._dirty = set()
+        self.highWaterMark = None
+        self.lastFullSync = None
+        self.listeners = []
+
+    def __len__(self):
+        return len(self._live)
+
+    def __contains__(self, brid):
+        return brid in self._live
+
+    def brids(self):
+        return self._live.keys()
+
+    def get(self, brid):
+        entry = self._live.get(brid)
+        return entry[2] if entry else None
+
+    @staticmethod
+    def bucketKey(brdict):
+        return (brdict['buildername'], brdict.get('slavepool'))
+
+    def invalidate(self):
+        self.lastFullSync = None
+
+    def addListener(self, listener):
+        self.listeners.append(listener)
+
+    def needsFullSync(self, now, interval):
+        return self.lastFullSync is None or now - self.lastFullSync >= interval
+
+    def load(self, brdicts, now):
+        brdicts = list(brdicts)
+        loaded = set(brdict['brid'] for brdict in brdicts)
+        for brid in [brid for brid in self._live if brid not in loaded]:
+            for listener in self.listeners:
+                listener.requestRemoved(brid)
+
+        self._buckets = {}
+        self._live = {}
+        self._stale = 0
+        self._dirty = set()
+        self.highWaterMark = None
+        for brdict in brdicts:
+            self.add(brdict)
+        self.lastFullSync = now
+
+    def add(self, brdict):
+        brid = brdict['brid']
+        if brid in self._live:
+            self._discard(brid)
+
+        key = self.bucketKey(brdict)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(key)
+
+        seq = self._counter.next()
+        heapq.heappush(bucket.heap, (-(brdict['priority'] or 0), brdict['submitted_at'], brid, seq))
+        self._live[brid] = (seq, bucket, brdict)
+        if brdict.get('startbrid') is not None:
+            bucket.chained += 1
+
+        if self.highWaterMark is None or brid > self.highWaterMark:
+            self.highWaterMark = brid
+
+        for listener in self.listeners:
+            listener.requestAdded(brdict)
+
+    def remove(self, brid):
+        if self._discard(brid):
+            for listener in self.listeners:
+                listener.requestRemoved(brid)
+
+    def _discard(self, brid):
+        entry = self._live.pop(brid, None)
+        if entry is None:
+            return False
+        seq, bucket, brdict = entry
+        if brdict.get('startbrid') is not None:
+            bucket.chained -= 1
+        self._stale += 1
+        return True
+
+    def hasChainedRequests(self, key):
+        bucket = self._buckets.get(key)
+        return bucket is not None and bucket.chained > 0
+
+    def markDirty(self, brid):
+        self._dirty.add(brid)
+
+    def popDirty(self):
+        dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def update(self, brids, brdicts):
+        """
+        Replace the entries for C{brids} with the freshly fetched C{brdicts};
+        requests that were not returned are no longer in the queue.
+        """
+        found = set()
+        for brdict in brdicts:
+            found.add(brdict['brid'])
+            self.add(brdict)
+        for brid in set(brids) - found:
+            self.remove(brid)
+
+    def compact(self):
+        # only worth doing once the stale entries outweigh the live ones; it
+        # must not be called while a L{PriorityWalk} is in progress
+        if self._stale * self.COMPACT_FACTOR <= len(self._live):
+            return
+        for key, bucket in self._buckets.items():
+            bucket.heap = [item for item in bucket.heap if self._getLive(item) is not None]
+            heapq.heapify(bucket.heap)
+            if not bucket.heap:
+                del self._buckets[key]
+        self._stale = 0
+
+    def walk(self):
+        return PriorityWalk(self)
+
+    def _getLive(self, item):
+        entry = self._live.get(item[2])
+        if entry is not None and entry[0] == item[3]:
+            return entry[2]
+        return None
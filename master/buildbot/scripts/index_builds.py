@@ -0,0 +1,84 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import os
+import re
+import sys
+import traceback
+from cPickle import load
+from twisted.persisted import styles
+from buildbot.scripts import base
+from buildbot.status.buildsummary import BuildSummaryIndex, INDEX_FILENAME, DATA_FILENAME
+
+build_re = re.compile(r"^([0-9]+)$")
+
+
+def getBuilderDirs(basedir):
+    # builder directories are the ones holding a pickled BuilderStatus
+    for name in sorted(os.listdir(basedir)):
+        builderdir = os.path.join(basedir, name)
+        if os.path.isfile(os.path.join(builderdir, "builder")):
+            yield builderdir
+
+
+def indexBuilder(config, builderdir):
+    if config['rebuild']:
+        for filename in (INDEX_FILENAME, DATA_FILENAME):
+            if os.path.exists(os.path.join(builderdir, filename)):
+                os.unlink(os.path.join(builderdir, filename))
+
+    summaryIndex = BuildSummaryIndex(builderdir)
+    numbers = sorted(int(mo.group(1)) for mo in
+                     [build_re.match(f) for f in os.listdir(builderdir)] if mo)
+
+    indexed = 0
+    for number in numbers:
+        if summaryIndex.hasBuild(number):
+            continue
+
+        filename = os.path.join(builderdir, "%d" % number)
+        try:
+            with open(filename, "rb") as f:
+                build = load(f)
+            styles.doUpgrade()
+        except Exception:
+            print "unable to load %s, skipping it" % filename
+            traceback.print_exc(file=sys.stdout)
+            continue
+
+        if build.isFinished():
+            summaryIndex.addBuild(build, pickleSize=os.path.getsize(filename))
+            indexed += 1
+
+    summaryIndex.close()
+    return indexed
+
+
+def indexBuilds(config):
+    if not base.isBuildmasterDir(config['basedir']):
+        return 1
+
+    total = 0
+    for builderdir in getBuilderDirs(config['basedir']):
+        indexed = indexBuilder(config, builderdir)
+        total += indexed
+        if not config['quiet']:
+            print "%s: indexed %d builds" % (builderdir, indexed)
+
+    if not config['quiet']:
+        print "indexed %d builds" % total
+    return 0
@@ -86,6 +86,28 @@ class UpgradeMasterOptions(base.BasedirMixin, base.SubcommandOptions):
     """
 
 
+class IndexBuildsOptions(base.BasedirMixin, base.SubcommandOptions):
+    subcommandFunction = "buildbot.scripts.index_builds.indexBuilds"
+    optFlags = [
+        ["quiet", "q", "Do not emit the builder directories being indexed"],
+        ["rebuild", None, "Discard the existing summary indexes first"],
+        ]
+
+    def getSynopsis(self):
+        return "Usage:    buildbot index-builds [options] [<basedir>]"
+
+    longdesc = """
+    This command reads the build pickles of every builder directory in an
+    existing buildmaster working directory and writes their summaries to the
+    builds.idx and builds.dat files of the builder, so that lists of builds
+    can be served without unpickling them.
+
+    The master keeps these indexes up to date, and adds missing builds when
+    they are first loaded, so this only needs to be run once to convert the
+    history of a master that was upgraded.  Stop the master first.
+    """
+
+
 class CreateMasterOptions(base.BasedirMixin, base.SubcommandOptions):
     subcommandFunction = "buildbot.scripts.create_master.createMaster"
     optFlags = [
@@ -673,6 +695,8 @@ class Options(usage.Options):
          "Create and populate a directory for a new buildmaster"],
         ['upgrade-master', None, UpgradeMasterOptions,
          "Upgrade an existing buildmaster directory for the current version"],
+        ['index-builds', None, IndexBuildsOptions,
+         "Index the build pickles of an existing buildmaster directory"],
         ['start', None, StartOptions,
          "Start a buildmaster"],
         ['stop', None, StopOptions,
@@ -0,0 +1,108 @@
+import os
+from twisted.trial import unittest
+from twisted.internet import defer
+from buildbot.process.buildrequest import Priority
+from buildbot.status.results import BEGINNING
+from buildbot.test.util.katanabuildrequestdistributor import KatanaBuildRequestDistributorTestSetup, \
+    DistributorBenchmark, saveBenchmarkResults
+
+# Benchmarks of the Katana build request distributor.  Each test fills the
+# queue for one scenario, runs the distributor until it has nothing left to
+# do and saves what it measured in a JSON file, named by
+# BUILDBOT_BENCHMARK_RESULTS or written to the trial working directory.
+# BUILDBOT_BENCHMARK_SCALE multiplies the number of builders, requests and
+# slaves of every scenario, to get closer to the size of a production queue.
+#
+#   BUILDBOT_BENCHMARK_SCALE=10 BUILDBOT_BENCHMARK_RESULTS=/tmp/brd.json \
+#       trial buildbot.slow.loadtests.test_benchmark_buildrequestdistributor_katana
+
+RESULTS_FILENAME = 'benchmark_buildrequestdistributor_katana.json'
+
+
+class TestKatanaBuildRequestDistributorBenchmark(unittest.TestCase,
+                                                 KatanaBuildRequestDistributorTestSetup):
+
+    # the slow tests do not have to be quick, but a scenario should not hang
+    timeout = 1800
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        yield self.setUpComponents()
+        self.setUpKatanaBuildRequestDistributor()
+        self.scale = int(os.environ.get('BUILDBOT_BENCHMARK_SCALE', 1))
+        self.resultsFilename = os.environ.get('BUILDBOT_BENCHMARK_RESULTS',
+                                              os.path.abspath(RESULTS_FILENAME))
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.tearDownComponents()
+        self.stopKatanaBuildRequestDistributor()
+
+    @defer.inlineCallbacks
+    def generateScenario(self, builders, requests, slaves, mergeRatio):
+        """
+        Queue C{requests} pending requests on each of C{builders} builders,
+        sharing C{slaves} available slaves.  A C{mergeRatio} fraction of the
+        requests of each builder have the same sources, and can be merged
+        into a single build; the others all build different branches.
+        """
+        self.initialized()
+        slavenames = self.createSlaveList(available=True, xrange=xrange(0, slaves))
+        sources = [{'repository': 'repo1', 'codebase': 'cb1', 'branch': 'master', 'revision': 'asz3113'}]
+        mergeable = int(requests * mergeRatio)
+
+        for id in xrange(1, builders + 1):
+            buildername = 'bldr%d' % id
+            self.setupBuilderInMaster(name=buildername, slavenames=slavenames)
+            priority = (Priority.Default, Priority.High, Priority.VeryHigh)[id % 3]
+            if mergeable:
+                self.insertBuildrequests(buildername, priority, xrange(1, mergeable + 1),
+                                         results=BEGINNING, sources=sources)
+            if requests > mergeable:
+                self.insertBuildrequests(buildername, priority, xrange(1, requests - mergeable + 1),
+                                         results=BEGINNING)
+
+        yield self.insertTestData(self.testdata)
+
+    @defer.inlineCallbacks
+    def runScenario(self, name, builders, requests, slaves, mergeRatio):
+        builders, requests, slaves = builders * self.scale, requests * self.scale, slaves * self.scale
+        yield self.generateScenario(builders, requests, slaves, mergeRatio)
+
+        benchmark = DistributorBenchmark(self.brd, self.db_engine)
+        benchmark.start()
+        yield self.brd._maybeStartOrResumeBuildsOn(new_builders=self.botmaster.builders.keys())
+        benchmark.stop()
+
+        self.checkBRDCleanedUp()
+        dispatched = sum(len(brids) for _, brids in self.processedBuilds)
+        results = benchmark.getResults(builds=len(self.processedBuilds), requests=dispatched)
+        results.update(builders=builders, pending=builders * requests,
+                       slaves=slaves, merge_ratio=mergeRatio)
+        saveBenchmarkResults(self.resultsFilename, name, results)
+
+        # every slave runs one build, unless there are fewer builds to run
+        mergeable = int(requests * mergeRatio)
+        buildsPerBuilder = requests - mergeable + (1 if mergeable else 0)
+        self.assertEqual(len(self.processedBuilds), min(slaves, builders * buildsPerBuilder))
+        defer.returnValue(results)
+
+    def test_fewBuildersLongQueues(self):
+        return self.runScenario('fewBuildersLongQueues', builders=5, requests=200,
+                                slaves=50, mergeRatio=0)
+
+    def test_manyBuildersShortQueues(self):
+        return self.runScenario('manyBuildersShortQueues', builders=300, requests=2,
+                                slaves=200, mergeRatio=0)
+
+    def test_busyBuildFarm(self):
+        return self.runScenario('busyBuildFarm', builders=50, requests=20,
+                                slaves=10, mergeRatio=0)
+
+    def test_halfMergeable(self):
+        return self.runScenario('halfMergeable', builders=50, requests=20,
+                                slaves=200, mergeRatio=0.5)
+
+    def test_allMergeable(self):
+        return self.runScenario('allMergeable', builders=100, requests=20,
+                                slaves=200, mergeRatio=1)
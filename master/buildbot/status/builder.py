@@ -26,9 +26,12 @@ from zope.interface import implements
 from twisted.python import log, runtime
 from twisted.persisted import styles
 from buildbot import interfaces, util
-from buildbot.util.lru import LRUCache
+from buildbot.util.lru import WeightedLRUCache
 from buildbot.status.event import Event
 from buildbot.status.build import BuildStatus
+from buildbot.status.buildsummary import BuildSummaryIndex
+from buildbot.status.buildhistory import BuildHistory
+from buildbot.status.buildpruner import BuilderPruner
 from buildbot.status.buildrequest import BuildRequestStatus
 
 # user modules expect these symbols to be present here
@@ -39,6 +42,12 @@ _hush_pyflakes = [ SUCCESS, WARNINGS, FAILURE, SKIPPED,
 
 LATEST_BUILD_FORMAT = "{0}={1};"
 
+# rough cost of the builds held in the build cache: an unpickled build takes
+# a few times the size of its pickle, and a running build is estimated from
+# its number of steps
+BUILD_PICKLE_MEMORY_FACTOR = 4
+BUILD_STEP_WEIGHT = 16 * 1024
+
 class BuilderStatus(styles.Versioned):
     """I handle status information for a single process.build.Builder object.
     That object sends status changes to me (frequently as Events), and I
@@ -88,7 +97,7 @@ class BuilderStatus(styles.Versioned):
         self.currentBuilds = []
         self.nextBuild = None
         self.watchers = []
-        self.buildCache = LRUCache(self.cacheMiss)
+        self.buildCache = WeightedLRUCache(self.cacheMiss, weight_fn=self.estimateBuildWeight)
         self.reason = None
         self.unavailable_build_numbers = set()
         self.latestBuildCache = {}
@@ -96,12 +105,18 @@ class BuilderStatus(styles.Versioned):
         self.tags = []
         self.loadingBuilds = {}
         self.cancelBuilds = {}
+        self.summaryIndex = None
+        self.history = None
+        self.loadingHistory = None
+        self.pendingHistory = []
+        self.pruner = None
 
 
     # persistence
 
     def setStatus(self, status):
         self.status = status
+        self.buildCache.set_budget(status.buildCacheBudget)
         self.pendingBuildCache = PendingBuildsCache(self)
 
         if not hasattr(self, 'latestBuildCache'):
@@ -130,6 +145,11 @@ class BuilderStatus(styles.Versioned):
         self.deleteKey('nextBuildNumber', d)
         del d['master']
         self.deleteKey('loadingBuilds', d)
+        self.deleteKey('summaryIndex', d)
+        self.deleteKey('history', d)
+        self.deleteKey('loadingHistory', d)
+        self.deleteKey('pendingHistory', d)
+        self.deleteKey('pruner', d)
 
         if 'pendingBuildCache' in d:
             del d['pendingBuildCache']
@@ -141,13 +161,18 @@ class BuilderStatus(styles.Versioned):
         # when loading, re-initialize the transient stuff. Remember that
         # upgradeToVersion1 and such will be called after this finishes.
         styles.Versioned.__setstate__(self, d)
-        self.buildCache = LRUCache(self.cacheMiss)
+        self.buildCache = WeightedLRUCache(self.cacheMiss, weight_fn=self.estimateBuildWeight)
         self.currentBuilds = []
         self.watchers = []
         self.slavenames = []
         self.startSlavenames = []
         self.loadingBuilds = {}
         self.cancelBuilds = {}
+        self.summaryIndex = None
+        self.history = None
+        self.loadingHistory = None
+        self.pendingHistory = []
+        self.pruner = None
         # self.basedir must be filled in by our parent
         # self.status must be filled in by our parent
         # self.master must be filled in by our parent
@@ -212,6 +237,20 @@ class BuilderStatus(styles.Versioned):
     def setCacheSize(self, size):
         self.buildCache.set_max_size(size)
 
+    def estimateBuildWeight(self, number, build):
+        """
+        Estimate the memory used by a cached build, in bytes
+        """
+        try:
+            pickleSize = os.path.getsize(self.makeBuildFilename(number))
+        except OSError:
+            pickleSize = 0
+        return max(pickleSize * BUILD_PICKLE_MEMORY_FACTOR,
+                   (len(build.getSteps()) + 1) * BUILD_STEP_WEIGHT)
+
+    def getCacheMetrics(self):
+        return self.buildCache.get_metrics()
+
     def makeBuildFilename(self, number):
         return os.path.join(self.basedir, "%d" % number)
 
@@ -259,6 +298,85 @@ class BuilderStatus(styles.Versioned):
         except EOFError:
             raise IndexError("corrupted build pickle %d" % number)
 
+    def getSummaryIndex(self):
+        if self.summaryIndex is None:
+            self.summaryIndex = BuildSummaryIndex(self.basedir)
+        return self.summaryIndex
+
+    def getHistory(self):
+        """
+        Returns the L{BuildHistory} of this builder, or None while it is
+        being filled from the summary index in a thread; the first call
+        starts filling it.
+        """
+        if self.history is None and self.loadingHistory is None:
+            self.loadHistory()
+        return self.history
+
+    def _readHistory(self):
+        # runs in a thread, with its own index so that the one used by the
+        # reactor is not remapped under it
+        history = BuildHistory()
+        if self.basedir is None:
+            return history
+        summaryIndex = BuildSummaryIndex(self.basedir)
+        try:
+            for summary in summaryIndex.getSummaries(self):
+                history.addSummary(summary)
+        finally:
+            summaryIndex.close()
+        return history
+
+    def _historyRead(self, history):
+        if history is None:
+            history = BuildHistory()
+        # the builds which finished while the history was read
+        for build in self.pendingHistory:
+            history.addBuild(*build)
+        self.pendingHistory = []
+        self.history = history
+        self.loadingHistory = None
+
+    def _historyFailed(self, failure):
+        log.msg("unable to read the build history of %s" % self.name)
+        log.err(failure)
+
+    @defer.inlineCallbacks
+    def loadHistory(self):
+        """
+        Fills the L{BuildHistory} of this builder from the summary index in a
+        thread, and returns it.
+        """
+        if self.history is None:
+            if self.loadingHistory is None:
+                d = threads.deferToThread(self._readHistory)
+                d.addErrback(self._historyFailed)
+                d.addCallback(self._historyRead)
+                self.loadingHistory = d
+            yield self.loadingHistory
+        defer.returnValue(self.history)
+
+    def addBuildSummary(self, build):
+        filename = self.makeBuildFilename(build.getNumber())
+        if not os.path.exists(filename):
+            # the build could not be saved, its summary would outlive it
+            return
+
+        try:
+            self.getSummaryIndex().addBuild(build, pickleSize=os.path.getsize(filename))
+        except Exception:
+            log.msg("unable to add build %s-#%d to the summary index" % (self.name, build.getNumber()))
+            log.err()
+            return
+
+        started, finished = build.getTimes()
+        summary = (build.getNumber(), build.getResults(), started, finished, build.getSlavename(),
+                   [dict(codebase=ss.codebase, branch=ss.branch) for ss in build.getSourceStamps()])
+        if self.history is not None:
+            self.history.addBuild(*summary)
+        elif self.loadingHistory is not None:
+            self.pendingHistory.append(summary)
+
     def cacheMiss(self, number, **kwargs):
         # If kwargs['val'] exists, this is a new value being added to
         # the cache.  Just return it.
@@ -273,6 +391,11 @@ class BuilderStatus(styles.Versioned):
         # then fall back to loading it from disk
         return self.loadBuildFromFile(number)
 
+    def getPruner(self):
+        if self.pruner is None:
+            self.pruner = BuilderPruner(self)
+        return self.pruner
+
     def prune(self, events_only=False):
         # begin by pruning our own events
         eventHorizon = self.master.config.eventHorizon
@@ -281,52 +404,8 @@ class BuilderStatus(styles.Versioned):
         if events_only:
             return
 
-        # get the horizons straight
-        buildHorizon = self.master.config.buildHorizon
-        if buildHorizon is not None:
-            earliest_build = self.nextBuildNumber - buildHorizon
-        else:
-            earliest_build = 0
-
-        logHorizon = self.master.config.logHorizon
-        if logHorizon is not None:
-            earliest_log = self.nextBuildNumber - logHorizon
-        else:
-            earliest_log = 0
-
-        if earliest_log < earliest_build:
-            earliest_log = earliest_build
-
-        if earliest_build == 0:
-            return
-
-        # skim the directory and delete anything that shouldn't be there anymore
-        build_re = re.compile(r"^([0-9]+)$")
-        build_log_re = re.compile(r"^([0-9]+)-.*$")
-        # if the directory doesn't exist, bail out here
-        if not os.path.exists(self.basedir):
-            return
-
-        for filename in os.listdir(self.basedir):
-            num = None
-            mo = build_re.match(filename)
-            is_logfile = False
-            if mo:
-                num = int(mo.group(1))
-            else:
-                mo = build_log_re.match(filename)
-                if mo:
-                    num = int(mo.group(1))
-                    is_logfile = True
-
-            if num is None: continue
-            if num in self.buildCache.cache: continue
-
-            if (is_logfile and num < earliest_log) or num < earliest_build:
-                pathname = os.path.join(self.basedir, filename)
-                log.msg("pruning '%s'" % pathname)
-                try: os.unlink(pathname)
-                except OSError: pass
+        # the builds and logs are pruned in the background
+        return self.getPruner().prune()
 
     # IBuilderStatus methods
     def getName(self):
@@ -369,14 +448,18 @@ class BuilderStatus(styles.Versioned):
         return [self.status.getSlave(name) for name in self.getAllSlaveNames()]
 
     @defer.inlineCallbacks
-    def getPendingBuildRequestStatuses(self, codebases={}):
+    def getPendingBuildRequestStatuses(self, codebases={}, prefetch=False):
         sourcestamps = [{'b_codebase': key, 'b_branch': value} for key, value in codebases.iteritems()]
 
         brdicts = yield self.master.db.buildrequests.getBuildRequestInQueue(buildername=self.name,
                                                                             sourcestamps=sourcestamps,
                                                                             sorted=True)
 
-        result = [BuildRequestStatus(self.name, brdict['brid'], self.status) for brdict in brdicts]
+        if prefetch:
+            # load the build requests in bulk, for callers about to use them all
+            result = yield BuildRequestStatus.fromBrdicts(self.status, brdicts)
+        else:
+            result = [BuildRequestStatus(self.name, brdict['brid'], self.status) for brdict in brdicts]
 
         defer.returnValue(result)
 
@@ -541,19 +624,51 @@ class BuilderStatus(styles.Versioned):
         defer.returnValue(build)
 
     @defer.inlineCallbacks
-    def getFinishedBuildsByNumbers(self, buildnumbers=[], results=None):
+    def getFinishedBuildsByNumbers(self, buildnumbers=[], results=None, num_builds=None):
+        """
+        Returns the finished builds of C{buildnumbers} with C{results}, in the
+        same order; the builds are selected from the summary index, so only the
+        first C{num_builds} matching builds are unpickled.
+        """
+        summaries = yield self.getBuildSummariesByNumbers(buildnumbers=buildnumbers, results=results,
+                                                          num_builds=num_builds)
+
         finishedBuilds = []
+        for summary in summaries:
+            build = yield self.deferToThread(summary.getNumber())
+            if build:
+                finishedBuilds.append(build)
+
+        defer.returnValue(finishedBuilds)
+
+    @defer.inlineCallbacks
+    def getBuildSummariesByNumbers(self, buildnumbers=[], results=None, num_builds=None):
+        """
+        Like L{getFinishedBuildsByNumbers}, but returns L{BuildSummary}
+        objects read from the summary index; only the builds missing from the
+        index are unpickled, and added to it.  The builds that cannot be added
+        are returned as they are.
+        """
+        summaries = []
+        summaryIndex = self.getSummaryIndex()
         for bn in buildnumbers:
-            build = yield self.deferToThread(bn)
+            if num_builds is not None and len(summaries) >= num_builds:
+                break
+            summary = summaryIndex.getSummary(self, bn)
 
-            if build:
-                if results is not None and build.getResults() not in results:
+            if summary is None:
+                build = yield self.deferToThread(bn)
+                if build is None or not build.isFinished():
                     continue
+                self.addBuildSummary(build)
+                summary = summaryIndex.getSummary(self, bn) or build
 
-                finishedBuilds.append(build)
+            if results is not None and summary.getResults() not in results:
+                continue
 
-        defer.returnValue(finishedBuilds)
+            summaries.append(summary)
 
+        defer.returnValue(summaries)
 
     @defer.inlineCallbacks
     def generateFinishedBuildsAsync(self, branches=[], codebases={},
@@ -577,27 +692,35 @@ class BuilderStatus(styles.Versioned):
 
         buildNumbers = yield self.generateBuildNumbers(codebases, branches, results, num_builds)
 
-        for bn in buildNumbers:
-            build = yield self.deferToThread(bn)
-
-            if build is None:
-                continue
-
-            if results is not None:
-                if build.getResults() not in results:
-                    continue
-
-            finishedBuilds.append(build)
-
-            if num_builds == 1:
-                break
+        # the builds whose summaries don't match are not loaded at all
+        finishedBuilds = yield self.getFinishedBuildsByNumbers(buildnumbers=buildNumbers, results=results,
+                                                               num_builds=1 if num_builds == 1 else None)
 
         if key and useCache and num_builds == 1:
-            self.saveLatestBuild(build, key)
+            self.saveLatestBuild(finishedBuilds[0] if finishedBuilds else None, key)
 
         defer.returnValue(finishedBuilds)
         return
 
+    @defer.inlineCallbacks
+    def generateFinishedBuildSummariesAsync(self, branches=[], codebases={},
+                                            num_builds=None,
+                                            results=None):
+        """
+        Like L{generateFinishedBuildsAsync}, but returns the summaries of the
+        builds, which lets the callers load the builds one at a time.
+        """
+        buildNumbers = yield self.generateBuildNumbers(codebases, set(branches), results, num_builds)
+        summaries = yield self.getBuildSummariesByNumbers(buildnumbers=buildNumbers, results=results,
+                                                          num_builds=num_builds)
+        defer.returnValue(summaries)
+
+    def _summaryMatches(self, summary, filters):
+        # the filters of BuildHistory.getBuildNumbers, applied to one summary
+        history = BuildHistory()
+        history.addSummary(summary)
+        return bool(history.getBuildNumbers(**filters))
+
 
     def generateFinishedBuilds(self, branches=[], codebases={},
                                num_builds=None,
@@ -619,14 +742,34 @@ class BuilderStatus(styles.Versioned):
         got = 0
         branches = set(branches)
         codebases = codebases
+        # the builds in the history are only loaded if they match; until the
+        # history is read, each build is looked up in the summary index
+        history = self.getHistory()
+        filters = dict(results=results, branches=branches, codebases=codebases,
+                       max_buildnum=max_buildnum, finished_before=finished_before)
+        if history is not None:
+            matching = set(history.getBuildNumbers(**filters))
         for Nb in itertools.count(1):
             if Nb > self.nextBuildNumber:
                 break
             if Nb > max_search:
                 break
+            number = self.nextBuildNumber - Nb
+            if history is not None:
+                indexed = history.hasBuild(number)
+                if indexed and number not in matching:
+                    continue
+            else:
+                summary = self.getSummaryIndex().getSummary(self, number)
+                indexed = summary is not None
+                if indexed and not self._summaryMatches(summary, filters):
+                    continue
             build = self.getBuild(-Nb)
             if build is None:
                 continue
+            if not indexed and build.isFinished():
+                # builds from before the history, checked by loading them
+                self.addBuildSummary(build)
             if max_buildnum is not None:
                 if build.getNumber() > max_buildnum:
                     continue
@@ -851,6 +994,10 @@ class BuilderStatus(styles.Versioned):
     def _buildFinished(self, s):
         assert s in self.currentBuilds
         s.saveYourself()
+        # the build was weighed by its steps when it started, weigh it
+        # again now that its pickle exists
+        self.buildCache.put(s.number, s)
+        self.addBuildSummary(s)
         self.currentBuilds.remove(s)
 
         name = self.getName()
@@ -863,7 +1010,7 @@ class BuilderStatus(styles.Versioned):
                 log.err()
 
         self.saveLatestBuild(s)
-        yield threads.deferToThread(self.prune) # conserve disk
+        yield self.prune() # conserve disk
 
     def getCodebaseBranch(self, branch, codebases, key):
         if key in codebases:
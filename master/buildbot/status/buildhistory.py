@@ -0,0 +1,167 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from array import array
+from bisect import bisect_left
+
+
+class _Columns(object):
+    # the columns of a BuildHistory, ordered by build number
+
+    def __init__(self):
+        self.numbers = array('l')
+        self.results = array('b')
+        self.started = array('d')
+        self.finished = array('d')
+        self.slaves = array('H')
+        self.sourcestamps = array('I')
+
+    def __len__(self):
+        return len(self.numbers)
+
+
+class _Interned(object):
+    # maps values to small integer ids, so that columns hold the ids
+
+    def __init__(self):
+        self.values = []
+        self.ids = {}
+
+    def intern(self, value):
+        if value not in self.ids:
+            self.ids[value] = len(self.values)
+            self.values.append(value)
+        return self.ids[value]
+
+
+class BuildHistory(object):
+    """
+    An in-memory index of the finished builds of a builder, held in typed
+    arrays with one column per attribute: build number, results, start and
+    finish times, slave and sourcestamps.  Slaves and the (codebase, branch)
+    pairs of the sourcestamps are interned, so a filter on them is first
+    resolved against the few distinct values, and the columns are then
+    scanned without loading any build.
+
+    Builds which are not in the history are unknown to it, rather than not
+    matching; callers have to check those on the build itself.
+    """
+
+    NO_RESULTS = -1
+
+    def __init__(self):
+        self.columns = _Columns()
+        self.slaves = _Interned()
+        self.sourcestamps = _Interned()
+
+    def __len__(self):
+        return len(self.columns)
+
+    def addBuild(self, number, results, started, finished, slavename, sourcestamps):
+        """
+        Add a finished build; C{sourcestamps} is a list of dictionaries with
+        C{codebase} and C{branch} keys.
+        """
+        columns = self.columns
+        i = bisect_left(columns.numbers, number)
+        if i < len(columns) and columns.numbers[i] == number:
+            return
+
+        key = frozenset((ss.get('codebase', ''), ss.get('branch')) for ss in sourcestamps)
+        values = ((columns.numbers, number),
+                  (columns.results, self.NO_RESULTS if results is None else results),
+                  (columns.started, started or 0),
+                  (columns.finished, finished),
+                  (columns.slaves, self.slaves.intern(slavename)),
+                  (columns.sourcestamps, self.sourcestamps.intern(key)))
+        for column, value in values:
+            # builds mostly finish in order
+            if i == len(column):
+                column.append(value)
+            else:
+                column.insert(i, value)
+
+    def addSummary(self, summary):
+        """
+        Add a L{buildbot.status.buildsummary.BuildSummary}
+        """
+        started, finished = summary.getTimes()
+        self.addBuild(summary.getNumber(), summary.getResults(), started, finished,
+                      summary.getSlavename(), summary.getSourceStamps())
+
+    def hasBuild(self, number):
+        numbers = self.columns.numbers
+        i = bisect_left(numbers, number)
+        return i < len(numbers) and numbers[i] == number
+
+    def removeBuildsBefore(self, number):
+        """
+        Forget the builds older than C{number}.  The columns are replaced
+        rather than modified, so a scan running meanwhile is not disturbed.
+        """
+        old = self.columns
+        i = bisect_left(old.numbers, number)
+        if i == 0:
+            return
+        columns = _Columns()
+        for name in vars(columns):
+            getattr(columns, name).extend(getattr(old, name)[i:])
+        self.columns = columns
+
+    def _matchingSourceStamps(self, branches, codebases):
+        # the ids of the interned sourcestamps which match the filter
+        matching = set()
+        for key, ssid in self.sourcestamps.ids.iteritems():
+            if codebases:
+                # like BuilderStatus.foundCodebasesInBuild
+                if all(codebase in codebases and branch == codebases[codebase]
+                       for codebase, branch in key):
+                    matching.add(ssid)
+            elif set(branch for _, branch in key) & branches:
+                matching.add(ssid)
+        return matching
+
+    def getBuildNumbers(self, num_builds=None, results=None, branches=None, codebases=None,
+                        max_buildnum=None, finished_before=None):
+        """
+        Return the numbers of the builds in the history which match all of
+        the given filters, newest first.  C{codebases} maps codebases to
+        branches and takes precedence over C{branches}, as it does in
+        L{buildbot.status.builder.BuilderStatus.generateFinishedBuilds}.
+        """
+        columns = self.columns
+        end = len(columns)
+        if max_buildnum is not None:
+            end = bisect_left(columns.numbers, max_buildnum + 1, 0, end)
+
+        matchingSourceStamps = None
+        if codebases or branches:
+            matchingSourceStamps = self._matchingSourceStamps(set(branches or []), codebases)
+        if results is not None:
+            results = set(self.NO_RESULTS if r is None else r for r in results)
+
+        numbers = []
+        for i in xrange(end - 1, -1, -1):
+            if matchingSourceStamps is not None and \
+                    columns.sourcestamps[i] not in matchingSourceStamps:
+                continue
+            if results is not None and columns.results[i] not in results:
+                continue
+            if finished_before is not None and columns.finished[i] >= finished_before:
+                continue
+            numbers.append(columns.numbers[i])
+            if num_builds and len(numbers) >= num_builds:
+                break
+        return numbers
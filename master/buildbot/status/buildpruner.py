@@ -0,0 +1,237 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import os
+import re
+from twisted.python import log
+from twisted.internet import defer, threads
+from buildbot.process import metrics
+from buildbot.status import logchunks
+from buildbot.status.buildsummary import BuildSummaryIndex
+
+WATERMARK_FILENAME = "pruned"
+
+build_log_re = re.compile(r"^([0-9]+)-.*$")
+
+# the files a log may be stored in
+LOG_EXTENSIONS = ("", ".bz2", ".gz", logchunks.DATA_EXT, logchunks.INDEX_EXT)
+
+
+def readWatermark(basedir):
+    """
+    Returns the (build, log) numbers below which the builds and the logs of
+    the builder in C{basedir} were pruned, (0, 0) if it was never pruned.
+    """
+    try:
+        with open(os.path.join(basedir, WATERMARK_FILENAME)) as f:
+            build, loog = f.read().split()
+            return int(build), int(loog)
+    except (IOError, ValueError):
+        return 0, 0
+
+
+def writeWatermark(basedir, watermark):
+    filename = os.path.join(basedir, WATERMARK_FILENAME)
+    with open(filename + ".tmp", "w") as f:
+        f.write("%d %d\n" % watermark)
+    if os.path.exists(filename):
+        # windows cannot rename over an existing file
+        os.unlink(filename)
+    os.rename(filename + ".tmp", filename)
+
+
+def findPrunableFiles(basedir, watermark, earliest_build, earliest_log, keep=()):
+    """
+    Returns the names of the files of C{basedir} to delete: the builds older
+    than C{earliest_build} and the logs older than C{earliest_log}, but not
+    those of the builds in C{keep}, nor those under C{watermark}, which were
+    already pruned.
+
+    Only the build numbers between the watermark and the horizons are looked
+    up, with the log filenames recorded in the build summaries.  The
+    directory is listed for the logs of the builds without a summary.
+    """
+    if not os.path.exists(basedir):
+        return []
+
+    filenames = []
+    for num in xrange(watermark[0], earliest_build):
+        if num not in keep and os.path.exists(os.path.join(basedir, str(num))):
+            filenames.append(str(num))
+
+    unknown = set()
+    summaryIndex = BuildSummaryIndex(basedir)
+    try:
+        for num in xrange(watermark[1], earliest_log):
+            if num in keep:
+                continue
+            logFilenames = summaryIndex.getLogFilenames(num)
+            if logFilenames is None:
+                unknown.add(num)
+                continue
+            for logFilename in logFilenames:
+                for ext in LOG_EXTENSIONS:
+                    if os.path.exists(os.path.join(basedir, logFilename + ext)):
+                        filenames.append(logFilename + ext)
+    finally:
+        summaryIndex.close()
+
+    if unknown:
+        for filename in os.listdir(basedir):
+            mo = build_log_re.match(filename)
+            if mo and int(mo.group(1)) in unknown:
+                filenames.append(filename)
+    return filenames
+
+
+def removeFiles(basedir, filenames):
+    """
+    Deletes C{filenames} from C{basedir} and returns the number of files and
+    of bytes removed.
+    """
+    count = size = 0
+    for filename in filenames:
+        pathname = os.path.join(basedir, filename)
+        try:
+            fileSize = os.path.getsize(pathname)
+            os.unlink(pathname)
+        except OSError:
+            continue
+        count += 1
+        size += fileSize
+    return count, size
+
+
+class BuilderPruner(object):
+    """
+    Deletes the builds and logs of a builder which are beyond the build and
+    log horizons.
+
+    The files are looked up and deleted in a thread, C{BATCH_SIZE} at a time,
+    so other work proceeds between the batches.  The numbers below which
+    everything was pruned are kept in the builder directory, so a pass only
+    deals with the builds which went past the horizons since the last one,
+    and is skipped when there are none.  The files and bytes removed are
+    reported as the C{BuilderPruner.files_removed} and
+    C{BuilderPruner.bytes_reclaimed} metrics.
+    """
+
+    BATCH_SIZE = 200
+
+    def __init__(self, builder_status):
+        self.builder_status = builder_status
+        self.running = False
+        self.again = False
+        # (files removed, files to remove) by the current pass
+        self.progress = (0, 0)
+
+    def getHorizons(self):
+        builder_status = self.builder_status
+        config = builder_status.master.config
+        if config.buildHorizon is None:
+            return None
+
+        earliest_build = builder_status.nextBuildNumber - config.buildHorizon
+        earliest_log = 0
+        if config.logHorizon is not None:
+            earliest_log = builder_status.nextBuildNumber - config.logHorizon
+        return earliest_build, max(earliest_log, earliest_build)
+
+    def prune(self):
+        """
+        Prunes the builder, unless a pass is already running, in which case
+        another one follows it.
+        """
+        if self.running:
+            self.again = True
+            return defer.succeed(None)
+        self.running = True
+        return self._run()
+
+    @defer.inlineCallbacks
+    def _run(self):
+        try:
+            self.again = True
+            while self.again:
+                self.again = False
+                yield self._prune()
+        except Exception:
+            log.msg("unable to prune builder %s" % self.builder_status.getName())
+            log.err()
+        finally:
+            self.running = False
+
+    @defer.inlineCallbacks
+    def _prune(self):
+        horizons = self.getHorizons()
+        if horizons is None or horizons[0] <= 0:
+            return
+
+        basedir = self.builder_status.basedir
+        watermark = yield threads.deferToThread(readWatermark, basedir)
+        earliest_build, earliest_log = horizons
+        if earliest_build <= watermark[0] and earliest_log <= watermark[1]:
+            return
+
+        # the builds in use are kept, and pruned by a later pass
+        keep = set(self.builder_status.buildCache.cache)
+        keep.update(b.getNumber() for b in self.builder_status.currentBuilds)
+
+        timer = metrics.Timer("BuilderPruner.prune()")
+        timer.start()
+        filenames = yield threads.deferToThread(findPrunableFiles, basedir, watermark,
+                                                earliest_build, earliest_log, keep)
+        self.progress = (0, len(filenames))
+        total = 0
+        for i in xrange(0, len(filenames), self.BATCH_SIZE):
+            count, size = yield threads.deferToThread(removeFiles, basedir,
+                                                      filenames[i:i + self.BATCH_SIZE])
+            metrics.MetricCountEvent.log("BuilderPruner.files_removed", count)
+            metrics.MetricCountEvent.log("BuilderPruner.bytes_reclaimed", size)
+            self.progress = (self.progress[0] + count, self.progress[1])
+            total += size
+
+        # builds finishing while the summaries are compacted append to the
+        # data, and the compacted copy is then left for a later pass
+        summaryIndex = self.builder_status.getSummaryIndex()
+        dataSize = summaryIndex.getDataSize()
+        compacted = yield threads.deferToThread(self._removeSummaries, basedir, earliest_build)
+        if compacted:
+            if summaryIndex.getDataSize() == dataSize:
+                summaryIndex.replaceWithCompacted()
+                metrics.MetricCountEvent.log("BuilderPruner.summaries_compacted", 1)
+            else:
+                summaryIndex.discardCompacted()
+        if self.builder_status.history is not None:
+            self.builder_status.history.removeBuildsBefore(earliest_build)
+
+        watermark = (min([earliest_build] + [n for n in keep if n < earliest_build]),
+                     min([earliest_log] + [n for n in keep if n < earliest_log]))
+        yield threads.deferToThread(writeWatermark, basedir, watermark)
+        timer.stop()
+        if filenames:
+            log.msg("pruned %d files (%d bytes) of builder %s" % (self.progress[0], total,
+                                                                   self.builder_status.getName()))
+
+    def _removeSummaries(self, basedir, earliest_build):
+        # this runs in a thread, so don't share the mmap of the builder's index
+        summaryIndex = BuildSummaryIndex(basedir)
+        try:
+            summaryIndex.removeBuildsBefore(earliest_build)
+            return summaryIndex.writeCompacted()
+        finally:
+            summaryIndex.close()
@@ -22,15 +22,31 @@ from buildbot.util.eventual import eventually
 class BuildRequestStatus:
     implements(interfaces.IBuildRequestStatus)
 
-    def __init__(self, buildername, brid, status):
+    def __init__(self, buildername, brid, status, buildrequest=None):
         self.buildername = buildername
         self.brid = brid
         self.status = status
         self.master = status.master
 
-        self._buildrequest = None
+        self._buildrequest = buildrequest
         self._buildrequest_lock = defer.DeferredLock()
 
+    @classmethod
+    @defer.inlineCallbacks
+    def fromBrdicts(cls, status, brdicts):
+        """
+        Create the statuses of several build requests, fetching their
+        underlying BuildRequest objects at once.
+
+        @returns: list of L{BuildRequestStatus}, via Deferred
+        """
+        # late binding to avoid an import cycle
+        from buildbot.process import buildrequest
+
+        breqs = yield buildrequest.BuildRequest.fromBrdicts(status.master, brdicts)
+        defer.returnValue([cls(brdict['buildername'], brdict['brid'], status, buildrequest=breq)
+                           for brdict, breq in zip(brdicts, breqs)])
+
     @defer.inlineCallbacks
     def _getBuildRequest(self):
         """
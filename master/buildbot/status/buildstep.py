@@ -297,10 +297,10 @@ class BuildStepStatus(styles.Versioned):
             # HTMLLogFiles aren't files
             if logCompressionLimit is not False and \
                     isinstance(loog, LogFile):
-                if os.path.getsize(loog.getFilename()) > logCompressionLimit:
-                    loog_deferred = loog.compressLog()
-                    if loog_deferred:
-                        cld.append(loog_deferred)
+                # the size is known once the log is written
+                loog_deferred = loog.waitUntilFinished()
+                loog_deferred.addCallback(self._compressLog, logCompressionLimit)
+                cld.append(loog_deferred)
 
         for r in self.updates.keys():
             if self.updates[r] is not None:
@@ -314,6 +314,10 @@ class BuildStepStatus(styles.Versioned):
         if cld:
             return defer.DeferredList(cld)
 
+    def _compressLog(self, loog, logCompressionLimit):
+        if os.path.getsize(loog.getFilename()) > logCompressionLimit:
+            return loog.compressLog()
+
     def checkLogfiles(self):
         # filter out logs that have been deleted
         self.logs = [ l for l in self.logs if l.hasContents() ]
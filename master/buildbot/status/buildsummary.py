@@ -0,0 +1,368 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import os
+import mmap
+import struct
+from twisted.python import log
+from buildbot.util import json
+from buildbot.status import logchunks
+
+INDEX_FILENAME = "builds.idx"
+DATA_FILENAME = "builds.dat"
+LOW_WATER_FILENAME = "builds.low"
+COMPACTED_EXT = ".compacted"
+
+
+class BuildSummary(object):
+    """
+    The summary of a finished build, as stored in the L{BuildSummaryIndex}.
+
+    It provides the parts of L{buildbot.interfaces.IBuildStatus} that list
+    pages need, without unpickling the build; the full L{BuildStatus} can be
+    loaded with L{getBuild} when the steps or logs are required.
+    """
+
+    def __init__(self, builder, number, results, started, finished, pickleSize,
+                 slavename=None, reason=None, text=None, sourcestamps=None, logSize=0):
+        self.builder = builder
+        self.number = number
+        self.results = results
+        self.started = started
+        self.finished = finished
+        self.pickleSize = pickleSize
+        self.slavename = slavename
+        self.reason = reason
+        self.text = text or []
+        self.sourcestamps = sourcestamps or []
+        self.logSize = logSize
+
+    def getBuilder(self):
+        return self.builder
+
+    def getNumber(self):
+        return self.number
+
+    def getResults(self):
+        return self.results
+
+    def getTimes(self):
+        return (self.started, self.finished)
+
+    def isFinished(self):
+        return self.finished is not None
+
+    def getSlavename(self):
+        return self.slavename
+
+    def getReason(self):
+        return self.reason
+
+    def getText(self):
+        return self.text
+
+    def getSourceStamps(self):
+        return self.sourcestamps
+
+    def getBuild(self):
+        return self.builder.getBuild(self.number)
+
+    def asDict(self):
+        return {'builderName': self.builder.getName(),
+                'number': self.number,
+                'results': self.results,
+                'times': self.getTimes(),
+                'slave': self.slavename,
+                'reason': self.reason,
+                'text': self.text,
+                'sourceStamps': self.sourcestamps}
+
+
+class BuildSummaryIndex(object):
+    """
+    A per-builder index of the finished builds, stored next to the build
+    pickles.
+
+    C{builds.idx} holds one fixed-size record per build number, so the record
+    of a build is found by seeking, and the file is read through C{mmap}.  The
+    variable-length part of the summary (slave, reason, text, sourcestamps) is
+    appended as JSON to C{builds.dat} and referenced by offset from the record.
+    """
+
+    # present, results, number, started, finished, data offset, data length,
+    # pickle size
+    RECORD = struct.Struct("<BbxxIddQII")
+    PRESENT = 1
+    NO_RESULTS = -1
+
+    def __init__(self, basedir):
+        self.basedir = basedir
+        self.indexFilename = os.path.join(basedir, INDEX_FILENAME)
+        self.dataFilename = os.path.join(basedir, DATA_FILENAME)
+        self._map = None
+        self._mapSize = 0
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._mapSize = 0
+
+    def _getMap(self):
+        # remap when the index grew since the last read
+        try:
+            size = os.path.getsize(self.indexFilename)
+        except OSError:
+            return None
+
+        if self._map is None or size != self._mapSize:
+            self.close()
+            if size == 0:
+                return None
+            with open(self.indexFilename, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapSize = size
+
+        return self._map
+
+    def _readRecord(self, number):
+        m = self._getMap()
+        offset = number * self.RECORD.size
+        if m is None or number < 0 or offset + self.RECORD.size > self._mapSize:
+            return None
+
+        record = self.RECORD.unpack_from(m, offset)
+        if record[0] != self.PRESENT or record[2] != number:
+            return None
+        return record
+
+    def hasBuild(self, number):
+        return self._readRecord(number) is not None
+
+    def getSummary(self, builder, number):
+        """
+        Returns the L{BuildSummary} of build C{number} or None if the build is
+        not in the index
+        """
+        record = self._readRecord(number)
+        if record is None:
+            return None
+
+        try:
+            with open(self.dataFilename, "rb") as dataFile:
+                return self._makeSummary(builder, record, dataFile)
+        except IOError:
+            return self._makeSummary(builder, record, None)
+
+    def _makeSummary(self, builder, record, dataFile):
+        _, results, number, started, finished, dataOffset, dataLength, pickleSize = record
+        if results == self.NO_RESULTS:
+            results = None
+        data = {}
+        if dataLength:
+            try:
+                if dataFile is None:
+                    raise IOError("no summary data")
+                dataFile.seek(dataOffset)
+                data = json.loads(dataFile.read(dataLength))
+            except (IOError, ValueError):
+                log.msg("unable to read the summary of build %s-#%d" % (builder.getName(), number))
+                return None
+
+        return BuildSummary(builder, number, results, started, finished, pickleSize,
+                            slavename=data.get('slavename'),
+                            reason=data.get('reason'),
+                            text=data.get('text'),
+                            sourcestamps=data.get('sourcestamps'),
+                            logSize=data.get('logSize', 0))
+
+    def getLogFilenames(self, number):
+        """
+        Returns the filenames of the logs of build C{number}, relative to the
+        builder directory, or None if the index does not know them
+        """
+        record = self._readRecord(number)
+        if record is None or not record[6]:
+            return None
+        try:
+            with open(self.dataFilename, "rb") as dataFile:
+                dataFile.seek(record[5])
+                return json.loads(dataFile.read(record[6])).get('logs')
+        except (IOError, ValueError):
+            return None
+
+    def getSummaries(self, builder):
+        """
+        Yields the L{BuildSummary} of every build in the index, oldest first
+        """
+        m = self._getMap()
+        if m is None or not os.path.exists(self.dataFilename):
+            return
+        with open(self.dataFilename, "rb") as dataFile:
+            for number in xrange(self._mapSize // self.RECORD.size):
+                record = self._readRecord(number)
+                if record is None:
+                    continue
+                summary = self._makeSummary(builder, record, dataFile)
+                if summary is not None:
+                    yield summary
+
+    def addBuild(self, build, pickleSize=0):
+        """
+        Adds the summary of a finished L{BuildStatus} to the index
+        """
+        started, finished = build.getTimes()
+        if finished is None:
+            return
+
+        data = json.dumps({'slavename': build.getSlavename(),
+                           'reason': build.getReason(),
+                           'text': build.getText(),
+                           'sourcestamps': [dict(codebase=ss.codebase, repository=ss.repository,
+                                                 branch=ss.branch, revision=ss.revision)
+                                            for ss in build.getSourceStamps()],
+                           'logSize': self._getLogSize(build),
+                           'logs': [loog.filename for loog in build.getLogs()
+                                    if getattr(loog, 'filename', None)]},
+                          separators=(',', ':'))
+
+        with open(self.dataFilename, "ab") as f:
+            f.seek(0, os.SEEK_END)
+            dataOffset = f.tell()
+            f.write(data)
+
+        results = build.getResults()
+        record = self.RECORD.pack(self.PRESENT, self.NO_RESULTS if results is None else results,
+                                  build.getNumber(),
+                                  started or 0, finished, dataOffset, len(data), pickleSize)
+        self._writeRecord(build.getNumber(), record)
+        if build.getNumber() < self.getLowWaterMark():
+            self._setLowWaterMark(build.getNumber())
+
+    def getLowWaterMark(self):
+        """
+        Returns the number below which the index holds no builds
+        """
+        try:
+            with open(os.path.join(self.basedir, LOW_WATER_FILENAME)) as f:
+                return int(f.read())
+        except (IOError, ValueError):
+            return 0
+
+    def _setLowWaterMark(self, number):
+        filename = os.path.join(self.basedir, LOW_WATER_FILENAME)
+        with open(filename + ".tmp", "w") as f:
+            f.write("%d\n" % number)
+        if os.path.exists(filename):
+            # windows cannot rename over an existing file
+            os.unlink(filename)
+        os.rename(filename + ".tmp", filename)
+
+    def removeBuildsBefore(self, number):
+        """
+        Forgets the builds older than C{number}, once they have been pruned;
+        only the records above the low-water mark of the previous call are
+        read.
+        """
+        m = self._getMap()
+        if m is None:
+            return
+        first = self.getLowWaterMark()
+        last = min(number, self._mapSize // self.RECORD.size)
+        if first >= number:
+            return
+        empty = '\0' * self.RECORD.size
+        with open(self.indexFilename, "r+b") as f:
+            for n in xrange(first, last):
+                if self.RECORD.unpack_from(m, n * self.RECORD.size)[0] == self.PRESENT:
+                    f.seek(n * self.RECORD.size)
+                    f.write(empty)
+        self._setLowWaterMark(number)
+
+    def getDataSize(self):
+        try:
+            return os.path.getsize(self.dataFilename)
+        except OSError:
+            return 0
+
+    def writeCompacted(self):
+        """
+        Writes a copy of the index and of its data without the data of the
+        removed or replaced builds, for L{replaceWithCompacted}.  Returns False
+        if less than half of the data is unused, and the index is not copied.
+        """
+        m = self._getMap()
+        dataSize = self.getDataSize()
+        if m is None or not dataSize:
+            return False
+
+        records = []
+        used = 0
+        for number in xrange(self.getLowWaterMark(), self._mapSize // self.RECORD.size):
+            record = self._readRecord(number)
+            if record is not None:
+                records.append(record)
+                used += record[6]
+        if used * 2 > dataSize:
+            return False
+
+        with open(self.dataFilename, "rb") as dataFile:
+            with open(self.dataFilename + COMPACTED_EXT, "wb") as compactedData:
+                with open(self.indexFilename + COMPACTED_EXT, "wb") as compactedIndex:
+                    for record in records:
+                        record = list(record)
+                        dataFile.seek(record[5])
+                        data = dataFile.read(record[6])
+                        record[5] = compactedData.tell()
+                        compactedData.write(data)
+                        compactedIndex.seek(record[2] * self.RECORD.size)
+                        compactedIndex.write(self.RECORD.pack(*record))
+        return True
+
+    def replaceWithCompacted(self):
+        """
+        Puts the copy made by L{writeCompacted} in place of the index
+        """
+        self.close()
+        for filename in (self.dataFilename, self.indexFilename):
+            if os.path.exists(filename):
+                # windows cannot rename over an existing file
+                os.unlink(filename)
+            os.rename(filename + COMPACTED_EXT, filename)
+
+    def discardCompacted(self):
+        for filename in (self.dataFilename, self.indexFilename):
+            if os.path.exists(filename + COMPACTED_EXT):
+                os.unlink(filename + COMPACTED_EXT)
+
+    def _writeRecord(self, number, record):
+        mode = "r+b" if os.path.exists(self.indexFilename) else "wb"
+        with open(self.indexFilename, mode) as f:
+            f.seek(number * self.RECORD.size)
+            f.write(record)
+
+    def _getLogSize(self, build):
+        size = 0
+        for loog in build.getLogs():
+            if not getattr(loog, 'filename', None):
+                continue
+            filename = os.path.join(self.basedir, loog.filename)
+            for ext in ("", logchunks.DATA_EXT, ".bz2", ".gz"):
+                if os.path.exists(filename + ext):
+                    size += os.path.getsize(filename + ext)
+                    break
+        return size
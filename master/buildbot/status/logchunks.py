@@ -0,0 +1,381 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Compressed logs made of independently compressed blocks.
+
+A finished log is stored as C{<log>.chunked}, the concatenation of the
+compressed blocks, and C{<log>.chunked.idx}, a sidecar index with one fixed
+size record per block.  Each block holds whole netstring entries, so the
+decompressed blocks put back together are the original log file, and a single
+block can be decoded on its own.  The index records where each block lives in
+both files, the number of the line the block starts in, how many newlines it
+holds and which channels it contains, which is enough to read the tail of a
+log or a range of lines by decompressing only the blocks involved.
+"""
+
+from __future__ import with_statement
+
+import os
+import bz2
+import zlib
+import struct
+from bisect import bisect_left, bisect_right
+
+DATA_EXT = ".chunked"
+INDEX_EXT = ".chunked.idx"
+
+BLOCK_SIZE = 256 * 1024
+
+CODECS = {
+    'bz2': ('b', lambda data: bz2.compress(data, 9), bz2.decompress),
+    'gz': ('z', lambda data: zlib.compress(data, 9), zlib.decompress),
+}
+
+# faster codecs, used when their modules are installed
+try:
+    import zstd
+    CODECS['zstd'] = ('s', lambda data: zstd.compress(data, 3), zstd.decompress)
+except ImportError:
+    pass
+
+try:
+    import lz4.block
+    CODECS['lz4'] = ('l', lz4.block.compress, lz4.block.decompress)
+except ImportError:
+    pass
+
+# the methods which may be configured, and the one used instead when a
+# method is not available
+METHODS = {
+    'bz2': 'bz2',
+    'gz': 'gz',
+    'zstd': 'gz',
+    'lz4': 'gz',
+}
+
+DECOMPRESSORS = dict((code, decompress) for code, _, decompress in CODECS.values())
+
+
+def getMethod(method):
+    """
+    Return the compression method to use for the configured C{method}: the
+    method itself if it is available, its fallback otherwise, or None if
+    logs should not be compressed.
+    """
+    if method in CODECS:
+        return method
+    return METHODS.get(method)
+
+
+def sliceLines(chunks, start, end=None, firstLine=0):
+    """
+    Yield the parts of the (channel, text) C{chunks} which are on lines
+    C{start} up to, but not including, C{end}.  Lines are counted from 0
+    across all the channels, and C{firstLine} is the number of the line the
+    first chunk starts in.
+    """
+    line = firstLine
+    for channel, text in chunks:
+        if end is not None and line >= end:
+            break
+        newlines = text.count("\n")
+        if line >= start and (end is None or line + newlines < end):
+            yield (channel, text)
+        elif line + newlines >= start:
+            parts = text.split("\n")
+            lo = max(start - line, 0)
+            hi = len(parts) if end is None else min(end - line, len(parts))
+            selected = "\n".join(parts[lo:hi])
+            if hi < len(parts):
+                selected += "\n"
+            if selected:
+                yield (channel, selected)
+        line += newlines
+
+
+def filterChunks(chunks, channels=[], onlyText=False):
+    for channel, text in chunks:
+        if channels and channel not in channels:
+            continue
+        if onlyText:
+            yield text
+        else:
+            yield (channel, text)
+
+
+def hasChunkedLog(filename):
+    return os.path.exists(filename + INDEX_EXT)
+
+
+class ChunkedLogWriter(object):
+    """
+    Writes the entries of a netstring log as a chunked log next to
+    C{filename}.  The files are written under a temporary name and only
+    renamed once complete, the index last, so readers never see a partial
+    log.
+    """
+
+    # magic, version, codec, number of lines
+    HEADER = struct.Struct("<4sBcxxQ")
+    MAGIC = "BBLC"
+    VERSION = 1
+
+    def __init__(self, filename, method, blockSize=BLOCK_SIZE):
+        if method not in CODECS:
+            raise ValueError("unknown log compression method %r" % (method,))
+        self.filename = filename
+        self.codec, self.compress, _ = CODECS[method]
+        self.blockSize = blockSize
+
+        self.dataFile = open(filename + DATA_EXT + ".tmp", "wb")
+        self.indexFile = open(filename + INDEX_EXT + ".tmp", "wb")
+        self.indexFile.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.codec, 0))
+
+        self.rawOffset = 0
+        self.lines = 0
+        self.endsWithNewline = True
+        self._block = []
+        self._blockSize = 0
+        self._blockLines = 0
+        self._blockChannels = 0
+
+    def addEntry(self, channel, text, raw):
+        """
+        Add an entry of the log; C{raw} is its netstring encoding
+        """
+        self._block.append(raw)
+        self._blockSize += len(raw)
+        self._blockChannels |= 1 << channel
+        if text:
+            self._blockLines += text.count("\n")
+            self.endsWithNewline = text.endswith("\n")
+        if self._blockSize >= self.blockSize:
+            self._flush()
+
+    def _flush(self):
+        if not self._block:
+            return
+        data = self.compress("".join(self._block))
+        offset = self.dataFile.tell()
+        self.dataFile.write(data)
+        self.indexFile.write(ChunkedLog.RECORD.pack(self.rawOffset, offset, len(data),
+                                                    self._blockSize, self.lines,
+                                                    self._blockLines, self._blockChannels))
+        self.rawOffset += self._blockSize
+        self.lines += self._blockLines
+        self._block = []
+        self._blockSize = 0
+        self._blockLines = 0
+        self._blockChannels = 0
+
+    def close(self):
+        self._flush()
+        # a last line without a trailing newline is still a line
+        lineCount = self.lines
+        if not self.endsWithNewline:
+            lineCount += 1
+        self.indexFile.seek(0)
+        self.indexFile.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.codec, lineCount))
+        self.dataFile.close()
+        self.indexFile.close()
+
+        for ext in (DATA_EXT, INDEX_EXT):
+            target = self.filename + ext
+            if os.path.exists(target):
+                # windows cannot rename over an existing file
+                os.unlink(target)
+            os.rename(target + ".tmp", target)
+
+    def abort(self):
+        self.dataFile.close()
+        self.indexFile.close()
+        for ext in (DATA_EXT, INDEX_EXT):
+            if os.path.exists(self.filename + ext + ".tmp"):
+                os.unlink(self.filename + ext + ".tmp")
+
+
+def writeChunkedLog(infile, filename, method, blockSize=BLOCK_SIZE, bufsize=1024*1024):
+    """
+    Read the netstring log from C{infile} and write it as a chunked log for
+    C{filename}.  Raises ValueError if the log is not made of well-formed
+    entries, in which case nothing is written.
+    """
+    writer = ChunkedLogWriter(filename, method, blockSize)
+    try:
+        buf = ""
+        while True:
+            data = infile.read(bufsize)
+            buf = _writeEntries(writer, buf + data)
+            if not data:
+                break
+        if buf:
+            raise ValueError("truncated log entry")
+        writer.close()
+    except:
+        writer.abort()
+        raise
+
+
+def _writeEntries(writer, buf):
+    # hand the complete netstrings in buf to writer, and return what is left
+    pos = 0
+    while True:
+        colon = buf.find(":", pos)
+        if colon == -1:
+            if len(buf) - pos > 10:
+                raise ValueError("malformed log entry")
+            return buf[pos:]
+        length = int(buf[pos:colon])
+        end = colon + 1 + length
+        if end >= len(buf):
+            return buf[pos:]
+        if length < 1 or buf[end] != ",":
+            raise ValueError("malformed log entry")
+        writer.addEntry(int(buf[colon + 1]), buf[colon + 2:end], buf[pos:end + 1])
+        pos = end + 1
+
+
+class ChunkedLog(object):
+    """
+    Reads a chunked log through its index.
+    """
+
+    # raw offset, compressed offset, compressed length, raw length, first
+    # line, newlines, channel mask
+    RECORD = struct.Struct("<QQIIQIB3x")
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename + INDEX_EXT, "rb") as f:
+            header = f.read(ChunkedLogWriter.HEADER.size)
+            magic, version, codec, self.lineCount = ChunkedLogWriter.HEADER.unpack(header)
+            if magic != ChunkedLogWriter.MAGIC or codec not in DECOMPRESSORS:
+                raise IOError("%s is not a chunked log index" % (filename + INDEX_EXT))
+            index = f.read()
+
+        self.decompress = DECOMPRESSORS[codec]
+        self.blocks = [self.RECORD.unpack_from(index, offset)
+                       for offset in xrange(0, len(index) - self.RECORD.size + 1,
+                                            self.RECORD.size)]
+        self.rawOffsets = [b[0] for b in self.blocks]
+        self.firstLines = [b[4] for b in self.blocks]
+        self.lastLines = [b[4] + b[5] for b in self.blocks]
+        if self.blocks:
+            self.rawLength = self.blocks[-1][0] + self.blocks[-1][3]
+        else:
+            self.rawLength = 0
+
+    def getLineCount(self):
+        return self.lineCount
+
+    def readBlock(self, i):
+        """
+        Return the decompressed netstrings of block C{i}
+        """
+        _, offset, length, _, _, _, _ = self.blocks[i]
+        with open(self.filename + DATA_EXT, "rb") as f:
+            f.seek(offset)
+            return self.decompress(f.read(length))
+
+    def getBlockChunks(self, i):
+        """
+        Return the (channel, text) entries of block C{i}
+        """
+        data = self.readBlock(i)
+        chunks = []
+        pos = 0
+        while pos < len(data):
+            colon = data.index(":", pos)
+            end = colon + 1 + int(data[pos:colon])
+            chunks.append((int(data[colon + 1]), data[colon + 2:end]))
+            pos = end + 1
+        return chunks
+
+    def getChunks(self, start=0, end=None, channels=[], onlyText=False):
+        """
+        Yield the entries on lines C{start} up to C{end}, decompressing only
+        the blocks those lines are in.
+        """
+        if end is None:
+            end = self.lineCount
+        return filterChunks(self._getLineChunks(start, end, channels), channels, onlyText)
+
+    def _getLineChunks(self, start, end, channels):
+        mask = 0
+        for channel in channels:
+            mask |= 1 << channel
+        # the first block that reaches line start; blocks ending with a
+        # newline end before their last line, so this may be one too early
+        i = bisect_left(self.lastLines, start)
+        while i < len(self.blocks) and self.firstLines[i] < end:
+            if not mask or self.blocks[i][6] & mask:
+                for chunk in sliceLines(self.getBlockChunks(i), start, end,
+                                        firstLine=self.firstLines[i]):
+                    yield chunk
+            i += 1
+
+    def getTail(self, numLines, channels=[], onlyText=False):
+        start = max(self.lineCount - numLines, 0)
+        return self.getChunks(start, self.lineCount, channels, onlyText)
+
+    def open(self):
+        return ChunkedLogFile(self)
+
+
+class ChunkedLogFile(object):
+    """
+    A read-only file object over the netstrings of a L{ChunkedLog}, so it can
+    be used anywhere the uncompressed log file is read.
+    """
+
+    def __init__(self, chunkedLog):
+        self.log = chunkedLog
+        self.pos = 0
+        self._blockIndex = None
+        self._blockData = None
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.log.rawLength
+        self.pos = max(offset, 0)
+
+    def tell(self):
+        return self.pos
+
+    def _getBlock(self, i):
+        if i != self._blockIndex:
+            self._blockData = self.log.readBlock(i)
+            self._blockIndex = i
+        return self._blockData
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.log.rawLength - self.pos
+        parts = []
+        while size > 0 and self.pos < self.log.rawLength:
+            i = bisect_right(self.log.rawOffsets, self.pos) - 1
+            data = self._getBlock(i)
+            start = self.pos - self.log.rawOffsets[i]
+            part = data[start:start + size]
+            parts.append(part)
+            self.pos += len(part)
+            size -= len(part)
+        return "".join(parts)
+
+    def close(self):
+        self._blockData = None
@@ -0,0 +1,108 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import heapq
+import itertools
+from twisted.python import threadpool
+from twisted.internet import defer, threads, reactor
+from buildbot.process import metrics
+
+
+class LogCompressor(object):
+    """
+    Compresses finished logs in a thread pool of its own, so that builds
+    finishing together do not take over the reactor's thread pool.
+
+    At most C{workers} logs are compressed at a time; the others wait, and
+    the smallest logs are compressed first, so most logs are compressed
+    soon and a large log does not hold back the others.  The compressed
+    bytes, the time taken and the throughput of each log are reported as the
+    C{LogCompressor.bytes}, C{LogCompressor.compress} and
+    C{LogCompressor.throughput} metrics, and the number of logs waiting as
+    C{LogCompressor.queued}.
+    """
+
+    def __init__(self, workers=2, _reactor=reactor):
+        self._reactor = _reactor
+        self.workers = workers
+        self.running = 0
+        self.queue = []
+        self.counter = itertools.count()
+        self.pool = None
+
+    def setWorkers(self, workers):
+        """
+        Compress up to C{workers} logs at a time from now on
+        """
+        if workers == self.workers:
+            return
+        self.workers = workers
+        if self.pool is not None:
+            self.pool.adjustPoolsize(maxthreads=workers)
+        self._dispatch()
+
+    def compress(self, size, fn):
+        """
+        Call C{fn} in the pool, once the logs smaller than C{size} which are
+        waiting have been compressed.
+
+        @returns: the result of C{fn}, via Deferred
+        """
+        d = defer.Deferred()
+        heapq.heappush(self.queue, (size, self.counter.next(), fn, d))
+        self._dispatch()
+        return d
+
+    def _getPool(self):
+        if self.pool is None:
+            self.pool = threadpool.ThreadPool(minthreads=0, maxthreads=self.workers,
+                                              name='LogCompressor')
+            self.pool.start()
+            self._reactor.addSystemEventTrigger('during', 'shutdown', self.pool.stop)
+        return self.pool
+
+    def _dispatch(self):
+        while self.queue and self.running < self.workers:
+            size, _, fn, d = heapq.heappop(self.queue)
+            self.running += 1
+            started = self._reactor.seconds()
+            run = threads.deferToThreadPool(self._reactor, self._getPool(), fn)
+            run.addBoth(self._done, size, started)
+            run.chainDeferred(d)
+        metrics.MetricCountEvent.log("LogCompressor.queued", len(self.queue), absolute=True)
+
+    def _done(self, result, size, started):
+        self.running -= 1
+        elapsed = self._reactor.seconds() - started
+        metrics.MetricCountEvent.log("LogCompressor.bytes", size)
+        metrics.MetricTimeEvent.log("LogCompressor.compress", elapsed)
+        if elapsed > 0:
+            metrics.MetricCountEvent.log("LogCompressor.throughput", int(size / elapsed),
+                                         absolute=True)
+        self._dispatch()
+        return result
+
+
+_compressor = None
+
+
+def getCompressor():
+    """
+    Returns the L{LogCompressor} shared by all the logs
+    """
+    global _compressor
+    if _compressor is None:
+        _compressor = LogCompressor()
+    return _compressor
@@ -13,17 +13,20 @@
 #
 # Copyright Buildbot Team Members
 
+import bisect
 import os
+import struct
 from cStringIO import StringIO
 from bz2 import BZ2File
 from gzip import GzipFile
 
 from zope.interface import implements
-from twisted.python import log, runtime
-from twisted.internet import defer, threads, reactor
+from twisted.python import log
+from twisted.internet import defer, reactor
 from buildbot.util import netstrings
 from buildbot.util.eventual import eventually
 from buildbot import interfaces
+from buildbot.status import logchunks, logcompressor, logwriter
 from twisted.persisted import styles
 import time
 
@@ -101,11 +104,17 @@ class LogFileProducer:
                 yield chunks.pop(0)
             f.seek(offset)
             data = f.read(self.BUFFERSIZE)
+            if not data:
+                # the entries merged while we were yielding are read too
+                f = self.logfile.getFile()
+                f.seek(offset)
+                data = f.read(self.BUFFERSIZE)
             offset = f.tell()
         del f
 
         # now subscribe them to receive new entries
         self.subscribed = True
+        self.logfile.notifyWatchers()
         self.logfile.watchers.append(self)
         d = self.logfile.waitUntilFinished()
 
@@ -175,6 +184,46 @@ class LogFileProducer:
             self.consumer.finish()
             self.consumer = None
 
+class PendingLogFile:
+    """
+    A read-only view of a log which is being written: the C{size} bytes
+    already written to the file C{f}, followed by the C{tail} still queued in
+    the log writer.
+    """
+
+    def __init__(self, f, size, tail):
+        self.f = f
+        self.size = size
+        self.tail = tail
+        self.offset = 0
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.offset
+        elif whence == 2:
+            offset += self.size + len(self.tail)
+        self.offset = max(offset, 0)
+
+    def tell(self):
+        return self.offset
+
+    def read(self, size=-1):
+        end = self.size + len(self.tail)
+        if size < 0 or self.offset + size > end:
+            size = max(end - self.offset, 0)
+        data = ""
+        if self.offset < self.size:
+            self.f.seek(self.offset)
+            data = self.f.read(min(size, self.size - self.offset))
+        if len(data) < size:
+            start = self.offset + len(data) - self.size
+            data += self.tail[start:start + size - len(data)]
+        self.offset += len(data)
+        return data
+
+    def close(self):
+        pass
+
 class LogFile:
     """
     A LogFile keeps all of its contents on disk, in a non-pickle format to
@@ -204,6 +253,16 @@ class LogFile:
     BUFFERSIZE = 2048
     filename = None # relative to the Builder's basedir
     openfile = None
+    pendingWrites = None
+    # (line, offset) of some of the merged chunks, see getLineChunks; None
+    # for the logs pickled before it was kept
+    lineIndex = None
+    LINE_INDEX_INTERVAL = 64*1024
+    lineCount = 0
+    endsWithNewline = True
+    fileSize = 0
+    pendingChunks = [] # provided so old pickled builds can be subscribed to
+    notifyCall = None
 
     def __init__(self, parent, name, logfilename):
         """
@@ -230,8 +289,12 @@ class LogFile:
         dirname = os.path.dirname(fn)
         if not os.path.exists(dirname):
             os.makedirs(dirname)
+        # the data is appended by the log writer, this handle is for reading
+        logwriter.getWriter().close(fn)
         self.openfile = open(fn, "w+")
         self.runEntries = []
+        self.lineIndex = [(0, 0)]
+        self.pendingChunks = []
         self.watchers = []
         self.finishedWatchers = []
         self.tailBuffer = []
@@ -263,7 +326,8 @@ class LogFile:
 
         @returns: boolean
         """
-        return os.path.exists(self.getFilename() + '.bz2') or \
+        return logchunks.hasChunkedLog(self.getFilename()) or \
+            os.path.exists(self.getFilename() + '.bz2') or \
             os.path.exists(self.getFilename() + '.gz') or \
             os.path.exists(self.getFilename())
 
@@ -295,10 +359,10 @@ class LogFile:
 
     def waitUntilFinished(self):
         """
-        Return a Deferred that will fire when this logfile is finished, or will
-        fire immediately if the logfile is already finished.
+        Return a Deferred that will fire when this logfile is finished and
+        written, or will fire immediately if that is already the case.
         """
-        if self.finished:
+        if self.finished and not self.openfile:
             d = defer.succeed(self)
         else:
             d = defer.Deferred()
@@ -315,11 +379,18 @@ class LogFile:
         @returns: file object
         """
         if self.openfile:
-            # this is the filehandle we're using to write to the log, so
-            # don't close it!
-            return self.openfile
+            # this is the filehandle we're using to read the log while it is
+            # written, so don't close it! The data still queued in the log
+            # writer is read from memory.
+            if self.pendingWrites is None:
+                return PendingLogFile(self.openfile, 0, "")
+            return PendingLogFile(self.openfile, self.pendingWrites.written,
+                                  self.pendingWrites.getTail())
         # otherwise they get their own read-only handle
         # try a compressed log first
+        chunkedLog = self.getChunkedLog()
+        if chunkedLog is not None:
+            return chunkedLog.open()
         try:
             return BZ2File(self.getFilename() + ".bz2", "r")
         except IOError:
@@ -330,6 +401,77 @@ class LogFile:
             pass
         return open(self.getFilename(), "r")
 
+    def getChunkedLog(self):
+        """
+        Get the L{logchunks.ChunkedLog} of this log, if it was compressed into
+        independent blocks, or None.
+
+        @returns: L{logchunks.ChunkedLog} instance or None
+        """
+        if self.openfile or not logchunks.hasChunkedLog(self.getFilename()):
+            return None
+        try:
+            return logchunks.ChunkedLog(self.getFilename())
+        except (IOError, struct.error):
+            log.msg("unable to read the index of %s" % self.getFilename())
+            return None
+
+    def getLineCount(self):
+        """
+        Get the number of lines in this log, counted across all channels.
+        """
+        chunkedLog = self.getChunkedLog()
+        if chunkedLog is not None:
+            return chunkedLog.getLineCount()
+        if self.lineIndex is not None:
+            # counted as the entries are merged
+            lines = self.lineCount
+            endsWithNewline = self.endsWithNewline
+            texts = [c[1] for c in self.runEntries]
+        else:
+            lines = 0
+            endsWithNewline = True
+            texts = self.getChunks(onlyText=True)
+        for text in texts:
+            if text:
+                lines += text.count("\n")
+                endsWithNewline = text.endswith("\n")
+        if not endsWithNewline:
+            lines += 1
+        return lines
+
+    def getLineChunks(self, start, end=None, channels=[], onlyText=False):
+        """
+        Generate the chunks on lines C{start} up to, but not including, line
+        C{end}.  Lines are numbered from 0 and counted across all channels,
+        the C{channels} filter is applied to the selected lines.
+
+        Compressed logs only decompress the blocks holding those lines, other
+        logs are read from the last chunk of the line index before them.
+        """
+        chunkedLog = self.getChunkedLog()
+        if chunkedLog is not None:
+            return chunkedLog.getChunks(start, end, channels, onlyText)
+        line, offset = 0, 0
+        if self.lineIndex:
+            # the last indexed chunk starting before line start
+            i = bisect.bisect_left(self.lineIndex, (start,))
+            line, offset = self.lineIndex[max(i - 1, 0)]
+        return logchunks.filterChunks(logchunks.sliceLines(self._getChunksFrom(offset),
+                                                           start, end, line),
+                                      channels, onlyText)
+
+    def getTailChunks(self, numLines, channels=[], onlyText=False):
+        """
+        Generate the chunks on the last C{numLines} lines of the log, see
+        L{getLineChunks}.
+        """
+        chunkedLog = self.getChunkedLog()
+        if chunkedLog is not None:
+            return chunkedLog.getTail(numLines, channels, onlyText)
+        start = max(self.getLineCount() - numLines, 0)
+        return self.getLineChunks(start, None, channels, onlyText)
+
     def getText(self):
         # this produces one ginormous string
         return "".join(self.getChunks([STDOUT, STDERR], onlyText=True))
@@ -349,14 +491,15 @@ class LogFile:
         # point. To use this in subscribe(catchup=True) without missing any
         # data, you must insure that nothing will be added to the log during
         # yield() calls.
+        return self._getChunksFrom(0, channels, onlyText)
 
+    def _getChunksFrom(self, offset, channels=[], onlyText=False):
+        # the chunks from the one at offset in the file
         f = self.getFile()
         if not self.finished:
-            offset = 0
             f.seek(0, 2)
-            remaining = f.tell()
+            remaining = max(f.tell() - offset, 0)
         else:
-            offset = 0
             remaining = None
 
         leftover = None
@@ -415,6 +558,8 @@ class LogFile:
     def subscribe(self, receiver, catchup):
         if self.finished:
             return
+        # the receiver only gets the entries added from now on
+        self.notifyWatchers()
         self.watchers.append(receiver)
         if catchup:
             for channel, text in self.getChunks():
@@ -423,6 +568,7 @@ class LogFile:
                                   channel, text)
 
     def unsubscribe(self, receiver):
+        self.notifyWatchers()
         if receiver in self.watchers:
             self.watchers.remove(receiver)
 
@@ -430,6 +576,30 @@ class LogFile:
         p = LogFileProducer(self, consumer)
         p.resumeProducing()
 
+    def notifyWatchers(self):
+        """
+        Send the entries added since the last notification to the watchers.
+        This happens once per reactor turn, with consecutive entries of a
+        channel joined together.
+        """
+        if self.notifyCall is not None:
+            if self.notifyCall.active():
+                self.notifyCall.cancel()
+            self.notifyCall = None
+        chunks, self.pendingChunks = self.pendingChunks, []
+        for channel, texts in chunks:
+            text = "".join(texts)
+            for w in self.watchers:
+                w.logChunk(self.step.build, self.step, self, channel, text)
+
+    def _queueNotification(self, channel, text):
+        if self.pendingChunks and self.pendingChunks[-1][0] == channel:
+            self.pendingChunks[-1][1].append(text)
+        else:
+            self.pendingChunks.append((channel, [text]))
+        if self.notifyCall is None:
+            self.notifyCall = reactor.callLater(0, self.notifyWatchers)
+
     # interface used by the build steps to add things to the log
 
     def _merge(self):
@@ -440,15 +610,23 @@ class LogFile:
         channel = self.runEntries[0][0]
         text = "".join([c[1] for c in self.runEntries])
         assert channel < 10, "channel number must be a single decimal digit"
-        f = self.openfile
-        f.seek(0, 2)
+        data = []
         offset = 0
         while offset < len(text):
             size = min(len(text)-offset, self.chunkSize)
-            f.write("%d:%d" % (1 + size, channel))
-            f.write(text[offset:offset+size])
-            f.write(",")
+            data.append("%d:%d" % (1 + size, channel))
+            data.append(text[offset:offset+size])
+            data.append(",")
             offset += size
+        data = "".join(data)
+        if self.lineIndex is not None:
+            if self.fileSize - self.lineIndex[-1][1] >= self.LINE_INDEX_INTERVAL:
+                self.lineIndex.append((self.lineCount, self.fileSize))
+            self.lineCount += text.count("\n")
+            if text:
+                self.endsWithNewline = text.endswith("\n")
+        self.fileSize += len(data)
+        self.pendingWrites = logwriter.getWriter().write(self.getFilename(), data)
         self.runEntries = []
         self.runLength = 0
 
@@ -481,9 +659,8 @@ class LogFile:
         # notify watchers first, before the chunk gets munged, so that they get
         # a complete picture of the actual log output
         # TODO: is this right, or should the watchers get a picture of the chunks?
-        if not _no_watchers:
-            for w in self.watchers:
-                w.logChunk(self.step.build, self.step, self, channel, text)
+        if not _no_watchers and self.watchers:
+            self._queueNotification(channel, text)
 
         if channel != HEADER:
             # Truncate the log if it's more than logMaxSize bytes
@@ -559,6 +736,7 @@ class LogFile:
         Finish the logfile, flushing any buffers and preventing any further
         writes to the log.
         """
+        self.notifyWatchers()
         self._merge()
         if self.tailBuffer:
             msg = "\nFinal %i bytes follow below:\n" % self.tailLength
@@ -571,13 +749,23 @@ class LogFile:
             self._merge()
             self.tailBuffer = []
 
-        if self.openfile:
-            # we don't do an explicit close, because there might be readers
-            # shareing the filehandle. As soon as they stop reading, the
-            # filehandle will be released and automatically closed.
-            self.openfile.flush()
-            self.openfile = None
         self.finished = True
+        if self.openfile:
+            # the finished watchers are called once the log writer has
+            # written the whole log
+            writer = logwriter.getWriter()
+            writer.close(self.getFilename())
+            d = writer.drain()
+            d.addCallback(lambda _: self._written())
+        else:
+            self._written()
+
+    def _written(self):
+        # we don't do an explicit close, because there might be readers
+        # shareing the filehandle. As soon as they stop reading, the
+        # filehandle will be released and automatically closed.
+        self.openfile = None
+        self.pendingWrites = None
         watchers = self.finishedWatchers
         self.finishedWatchers = []
         for w in watchers:
@@ -586,51 +774,31 @@ class LogFile:
 
 
     def compressLog(self):
-        logCompressionMethod = self.master.config.logCompressionMethod
+        config = self.master.config
+        logCompressionMethod = logchunks.getMethod(config.logCompressionMethod)
         # bail out if there's no compression support
-        if logCompressionMethod == "bz2":
-            compressed = self.getFilename() + ".bz2.tmp"
-        elif logCompressionMethod == "gz":
-            compressed = self.getFilename() + ".gz.tmp"
-        else:
+        if logCompressionMethod is None:
             return defer.succeed(None)
 
         def _compressLog():
+            # the log is stored as independently compressed blocks, so that
+            # parts of it can be read back without decompressing it all
             infile = self.getFile()
-            if logCompressionMethod == "bz2":
-                cf = BZ2File(compressed, 'w')
-            elif logCompressionMethod == "gz":
-                cf = GzipFile(compressed, 'w')
-            bufsize = 1024*1024
-            while True:
-                buf = infile.read(bufsize)
-                cf.write(buf)
-                if len(buf) < bufsize:
-                    break
-            cf.close()
-        d = threads.deferToThread(_compressLog)
-
-        def _renameCompressedLog(rv):
-            if logCompressionMethod == "bz2":
-                filename = self.getFilename() + '.bz2'
-            else:
-                filename = self.getFilename() + '.gz'
-            if runtime.platformType  == 'win32':
-                # windows cannot rename a file on top of an existing one, so
-                # fall back to delete-first. There are ways this can fail and
-                # lose the builder's history, so we avoid using it in the
-                # general (non-windows) case
-                if os.path.exists(filename):
-                    os.unlink(filename)
-            if not os.path.exists(filename):
-                os.rename(compressed, filename)
+            infile.seek(0)
+            logchunks.writeChunkedLog(infile, self.getFilename(), logCompressionMethod)
+        compressor = logcompressor.getCompressor()
+        compressor.setWorkers(config.logCompressionWorkers)
+        # the log must be written before it is compressed
+        d = self.waitUntilFinished()
+        d.addCallback(lambda _: compressor.compress(os.path.getsize(self.getFilename()),
+                                                    _compressLog))
+
+        def _removeUncompressedLog(rv):
             _tryremove(self.getFilename(), 1, 5)
-        d.addCallback(_renameCompressedLog)
+        d.addCallback(_removeUncompressedLog)
 
         def _cleanupFailedCompress(failure):
             log.msg("failed to compress %s" % self.getFilename())
-            if os.path.exists(compressed):
-                _tryremove(compressed, 1, 5)
             failure.trap() # reraise the failure
         d.addErrback(_cleanupFailedCompress)
         return d
@@ -649,6 +817,9 @@ class LogFile:
         d['entries'] = []  # let 0.6.4 tolerate the saved log. TODO: really?
         self.deleteKey('finished', d)
         self.deleteKey('openfile', d)
+        self.deleteKey('pendingWrites', d)
+        self.deleteKey('pendingChunks', d)
+        self.deleteKey('notifyCall', d)
 
     def __getstate__(self):
         d = self.__dict__.copy()
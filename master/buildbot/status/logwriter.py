@@ -0,0 +1,203 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import collections
+import Queue
+import threading
+import time
+from twisted.python import log, failure
+from twisted.internet import defer, reactor
+from buildbot.process import metrics
+
+_CLOSE = object()
+_STOP = object()
+
+
+class PendingWrites(object):
+    """
+    The data queued for a file: C{written} bytes of it are on disk, the
+    C{chunks} that follow them are still queued.
+    """
+
+    def __init__(self):
+        self.written = 0
+        self.chunks = collections.deque()
+
+    def getTail(self):
+        return "".join(self.chunks)
+
+
+class LogWriter(object):
+    """
+    Appends the data of the logs being written to their files from a
+    dedicated thread, so the reactor does not wait for the disk.
+
+    The writes are queued in order, and everything queued when the thread
+    wakes up is written at once, with a single write per file.  Queueing
+    never blocks: until the thread reports a write back to the reactor, its
+    data stays in the L{PendingWrites} of the file, where the readers of the
+    file find it.  The queue depth and the time each batch took are reported
+    as the C{LogWriter.queued} and C{LogWriter.flush} metrics.
+    """
+
+    def __init__(self, _reactor=reactor):
+        self._reactor = _reactor
+        self.queue = Queue.Queue()
+        self.pending = {}
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name="LogWriter")
+            self.thread.setDaemon(True)
+            self.thread.start()
+        self._reactor.addSystemEventTrigger('during', 'shutdown', self.stop)
+
+    def write(self, filename, data):
+        """
+        Append C{data} to C{filename}
+
+        @returns: the L{PendingWrites} of C{filename} since it was opened
+        """
+        self._start()
+        if filename not in self.pending:
+            self.pending[filename] = PendingWrites()
+        pending = self.pending[filename]
+        pending.chunks.append(data)
+        self.queue.put((filename, data, pending))
+        return pending
+
+    def close(self, filename):
+        """
+        Close C{filename} once the data queued for it is written
+        """
+        self.pending.pop(filename, None)
+        if self.thread is not None:
+            self.queue.put((filename, _CLOSE, None))
+
+    def drain(self):
+        """
+        Returns a Deferred which fires once everything queued so far is
+        written
+        """
+        if self.thread is None:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self.queue.put((None, d, None))
+        return d
+
+    def stop(self):
+        """
+        Write everything which is queued and stop the thread
+        """
+        if self.thread is None:
+            return
+        self.queue.put((None, _STOP, None))
+        self.thread.join()
+        self.thread = None
+
+    def _run(self):
+        files = {}
+        while True:
+            batch = [self.queue.get()]
+            try:
+                while True:
+                    batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                pass
+
+            start = time.time()
+            stop = self._writeBatch(files, batch)
+            self._reactor.callFromThread(self._report, time.time() - start)
+            if stop:
+                for f in files.values():
+                    f.close()
+                return
+
+    def _writeBatch(self, files, batch):
+        # the writes to each file are joined into a single write; the other
+        # requests apply to what was queued before them
+        stop = False
+        pending = {}
+        order = []
+        for filename, data, writes in batch + [(None, None, None)]:
+            if isinstance(data, str):
+                if writes not in pending:
+                    pending[writes] = []
+                    order.append((filename, writes))
+                pending[writes].append(data)
+                continue
+
+            written = []
+            for pendingFilename, writes in order:
+                chunks = pending[writes]
+                size = self._writeFile(files, pendingFilename, "".join(chunks))
+                written.append((writes, len(chunks), size))
+            if written:
+                self._reactor.callFromThread(self._written, written)
+            pending = {}
+            order = []
+
+            if data is _CLOSE:
+                f = files.pop(filename, None)
+                if f is not None:
+                    f.close()
+            elif data is _STOP:
+                stop = True
+            elif data is not None:
+                # drain() waits on this Deferred
+                self._reactor.callFromThread(data.callback, None)
+        return stop
+
+    def _writeFile(self, files, filename, data):
+        try:
+            if filename not in files:
+                files[filename] = open(filename, "ab")
+            f = files[filename]
+            f.write(data)
+            f.flush()
+            return len(data)
+        except IOError:
+            self._reactor.callFromThread(log.err, failure.Failure(),
+                                         "while writing to %s" % filename)
+            return 0
+
+    def _written(self, written):
+        for writes, count, size in written:
+            for _ in xrange(count):
+                writes.chunks.popleft()
+            writes.written += size
+
+    def _report(self, elapsed):
+        metrics.MetricCountEvent.log("LogWriter.queued", self.queue.qsize(), absolute=True)
+        metrics.MetricTimeEvent.log("LogWriter.flush", elapsed)
+
+
+_writer = None
+
+
+def getWriter():
+    """
+    Returns the L{LogWriter} shared by all the logs
+    """
+    global _writer
+    if _writer is None:
+        _writer = LogWriter()
+    return _writer
@@ -24,10 +24,10 @@ from twisted.application import service
 from zope.interface import implements
 from buildbot import config, interfaces, util
 from buildbot.status.web.base import getCodebasesArg, _revlinkcfg
-from buildbot.util import bbcollections
+from buildbot.util import bbcollections, lru
 from buildbot.util.eventual import eventually
 from buildbot.changes import changes
-from buildbot.status import buildset, builder, buildrequest
+from buildbot.status import buildset, builder, buildrequest, queuesnapshot
 from buildbot.status.results import RETRY
 from datetime import datetime, timedelta
 
@@ -52,6 +52,9 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         self._change_sub = None
         self.rev_url_func = None
         self.total_builds_lastday = {}
+        # shared by the build caches of all the builders
+        self.buildCacheBudget = lru.LRUBudget()
+        self.queueSnapshot = queuesnapshot.QueueSnapshot(self)
 
     # service management
 
@@ -95,6 +98,8 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
             sr.master = self.master
             sr.setServiceParent(self)
 
+        self.buildCacheBudget.set_max_weight(new_config.buildCacheMemory)
+
         # reconfig any newly-added change sources, as well as existing
         yield config.ReconfigurableServiceMixin.reconfigService(self,
                                                             new_config)
@@ -145,6 +150,20 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
     def getMetrics(self):
         return self.master.metrics
 
+    def getBuildCacheMetrics(self):
+        """
+        Returns the hits, misses and evictions of the build cache of each
+        builder, along with the memory budget shared by those caches
+        """
+        builders = {}
+        for name in self.getBuilderNames():
+            builder_status = self.getBuilder(name)
+            if builder_status is not None:
+                builders[name] = builder_status.getCacheMetrics()
+        return dict(max_weight=self.buildCacheBudget.max_weight,
+                    weight=self.buildCacheBudget.weight,
+                    builders=builders)
+
     def getBuildersPath(self, builder_name, build_number):
         builder_path = ""
         if len(self.botmaster.builders) > 0:
@@ -359,7 +378,11 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         defer.returnValue(self.total_builds_lastday[lastday])
 
     @defer.inlineCallbacks
-    def generateFinishedBuildsAsync(self, num_builds=15, results=None, slavename=None):
+    def generateFinishedBuildSummariesAsync(self, num_builds=15, results=None, slavename=None):
+        """
+        Returns the summaries of the latest C{num_builds} finished builds,
+        most recent first, which lets the callers load the builds one at a time.
+        """
         #TODO: support filter by RETRY result
         results_filter = [r for r in results if r is not None and r != RETRY] if results else []
         lastBuilds = yield self.master.db.builds.getLastsBuildsNumbersBySlave(slavename, results_filter, num_builds)
@@ -369,14 +392,34 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         if builders:
             builder_names = self.getBuildersConfigured(builders)
 
-        all_builds = []
+        all_summaries = []
         for bn in builder_names:
             b = self.getBuilder(bn)
-            finished_builds = yield b.getFinishedBuildsByNumbers(buildnumbers=lastBuilds[bn],
-                                                                 results=results)
-            all_builds.extend(finished_builds)
+            summaries = yield b.getBuildSummariesByNumbers(buildnumbers=lastBuilds[bn],
+                                                           results=results)
+            all_summaries.extend(summaries)
+
+        sorted_summaries = sorted(all_summaries, key=lambda summary: summary.finished, reverse=True)
+        if num_builds is not None:
+            sorted_summaries = sorted_summaries[:num_builds]
+        defer.returnValue(sorted_summaries)
+
+    @defer.inlineCallbacks
+    def generateFinishedBuildsAsync(self, num_builds=15, results=None, slavename=None, summaryOnly=False):
+        # the builds are selected from the summaries, and only those listed
+        # are unpickled
+        sorted_summaries = yield self.generateFinishedBuildSummariesAsync(num_builds=num_builds,
+                                                                          results=results,
+                                                                          slavename=slavename)
+        if summaryOnly:
+            defer.returnValue(sorted_summaries)
+            return
 
-        sorted_builds = sorted(all_builds, key=lambda build: build.finished, reverse=True)
+        sorted_builds = []
+        for summary in sorted_summaries:
+            build = yield summary.getBuilder().deferToThread(summary.getNumber())
+            if build is not None:
+                sorted_builds.append(build)
         defer.returnValue(sorted_builds)
 
     def generateFinishedBuilds(self, builders=[], branches=[],
@@ -539,6 +582,7 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         return result
 
     def build_started(self, brid, buildername, build_status):
+        self.queueSnapshot.invalidate()
         if brid in self._buildreq_observers:
             for o in self._buildreq_observers[brid]:
                 eventually(o, build_status)
@@ -591,6 +635,7 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         self._maybeBuildsetFinished(bsid)
 
     def _buildRequestCallback(self, notif):
+        self.queueSnapshot.invalidate()
         buildername = notif['buildername']
         if buildername in self._builder_observers:
             brs = buildrequest.BuildRequestStatus(buildername,
@@ -600,6 +645,7 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
                     eventually(observer.requestSubmitted, brs)
 
     def _cancelledBuildRequestCallback(self, notif):
+        self.queueSnapshot.invalidate()
         buildername = notif['buildername']
         if buildername in self._builder_observers:
             brs = buildrequest.BuildRequestStatus(buildername,
@@ -18,6 +18,7 @@ from __future__ import with_statement
 
 from collections import deque
 import os
+import struct
 import cPickle as pickle
 
 from zope.interface import implements, Interface
@@ -247,6 +248,257 @@ class DiskQueue(object):
             self.lastItemId = files[-1]
 
 
+class SegmentQueue(object):
+    """Keeps a list of abstract items in append-only segment files.
+
+    Each segment file holds up to segmentItems items, as length-prefixed
+    records, and the items are numbered in the order they were pushed.  The
+    number of the first item not popped yet is checkpointed in a cursor file,
+    and the segments below it are deleted, so at startup only the segments
+    from the cursor on are scanned to rebuild their offset index.  Items
+    inserted back after a failure are kept in a separate head file, as the
+    segments are never rewritten.
+
+    Items left by a DiskQueue in the same directory are moved into the
+    segments when the queue is loaded.
+
+    Use pickle for serialization."""
+    implements(IQueue)
+
+    RECORD = struct.Struct("<I")
+    SEGMENT_PREFIX = "segment."
+    CURSOR = "cursor"
+    HEAD = "head"
+
+    def __init__(self, path, maxItems=None, segmentItems=1000,
+                 pickleFn=pickle.dumps, unpickleFn=pickle.loads):
+        """
+        @path: directory to save the items.
+        @maxItems: maximum number of items to keep on disk, flush the
+        older ones.
+        @segmentItems: number of items in each segment file.
+        @pickleFn: function used to pack the items to disk.
+        @unpickleFn: function used to unpack items from disk.
+        """
+        self.path = path
+        self._maxItems = maxItems
+        if self._maxItems is None:
+            self._maxItems = 100000
+        if not os.path.isdir(self.path):
+            os.mkdir(self.path)
+        self.segmentItems = segmentItems
+        self.pickleFn = pickleFn
+        self.unpickleFn = unpickleFn
+
+        # Items inserted back, older than those in the segments.
+        self.head = []
+        # Number of the first item not popped, and of the next item pushed.
+        self.firstItemId = 0
+        self.nextItemId = 0
+        # Offsets of the records in each segment still in use.
+        self.offsets = {}
+        self._writeFile = None
+        self._loadFromDisk()
+
+    def pushItem(self, item):
+        ret = None
+        if self.nbItems() == self._maxItems:
+            ret = self.popChunk(1)[0]
+        self._append([self.pickleFn(item)])
+        return ret
+
+    def insertBackChunk(self, chunk):
+        ret = None
+        excess = self.nbItems() + len(chunk) - self._maxItems
+        if excess > 0:
+            ret = chunk[0:excess]
+            chunk = chunk[excess:]
+        if chunk:
+            self.head[0:0] = chunk
+            self._saveHead()
+        return ret
+
+    def popChunk(self, nbItems=None):
+        if nbItems is None:
+            nbItems = self._maxItems
+        ret = self.head[:nbItems]
+        if ret:
+            del self.head[:nbItems]
+            self._saveHead()
+        end = min(self.firstItemId + nbItems - len(ret), self.nextItemId)
+        if end > self.firstItemId:
+            ret.extend(self._read(self.firstItemId, end))
+            self.firstItemId = end
+            self._compact()
+        return ret
+
+    def save(self):
+        if self._writeFile is not None:
+            self._writeFile.close()
+            self._writeFile = None
+
+    def items(self):
+        """Warning, slow."""
+        return self.head + self._read(self.firstItemId, self.nextItemId)
+
+    def nbItems(self):
+        return len(self.head) + self.nextItemId - self.firstItemId
+
+    def maxItems(self):
+        return self._maxItems
+
+    #### Protected functions
+
+    def _segmentPath(self, segment):
+        return os.path.join(self.path, self.SEGMENT_PREFIX + str(segment))
+
+    def _append(self, records):
+        for data in records:
+            segment, index = divmod(self.nextItemId, self.segmentItems)
+            if index == 0 or self._writeFile is None:
+                self.save()
+                self._writeFile = open(self._segmentPath(segment), 'ab')
+                self._writeFile.seek(0, os.SEEK_END)
+                self.offsets.setdefault(segment, [])
+            offsets = self.offsets[segment]
+            offsets.append(self._writeFile.tell())
+            self._writeFile.write(self.RECORD.pack(len(data)) + data)
+            self.nextItemId += 1
+        self._writeFile.flush()
+
+    def _read(self, start, end):
+        # read the items start to end, with a single read per segment
+        ret = []
+        while start < end:
+            segment, index = divmod(start, self.segmentItems)
+            offsets = self.offsets[segment]
+            last = min(index + end - start, len(offsets))
+            with open(self._segmentPath(segment), 'rb') as f:
+                f.seek(offsets[index])
+                if last < len(offsets):
+                    buf = f.read(offsets[last] - offsets[index])
+                else:
+                    buf = f.read()
+            pos = 0
+            for i in xrange(last - index):
+                length, = self.RECORD.unpack_from(buf, pos)
+                pos += self.RECORD.size
+                ret.append(self.unpickleFn(buf[pos:pos + length]))
+                pos += length
+            start += last - index
+        return ret
+
+    def _compact(self):
+        # delete the segments which were entirely popped, and checkpoint the
+        # cursor
+        if self.firstItemId == self.nextItemId and not self.head:
+            # the queue is empty, start over
+            self.save()
+            for segment in self.offsets:
+                os.remove(self._segmentPath(segment))
+            self.offsets = {}
+            self.firstItemId = self.nextItemId = 0
+            _tryremove(os.path.join(self.path, self.CURSOR))
+            return
+
+        _writeAtomically(os.path.join(self.path, self.CURSOR),
+                         "%d\n" % self.firstItemId)
+        firstSegment = self.firstItemId // self.segmentItems
+        for segment in sorted(self.offsets):
+            if segment >= firstSegment:
+                break
+            os.remove(self._segmentPath(segment))
+            del self.offsets[segment]
+
+    def _saveHead(self):
+        path = os.path.join(self.path, self.HEAD)
+        if self.head:
+            _writeAtomically(path, pickle.dumps(
+                [self.pickleFn(item) for item in self.head], -1))
+        else:
+            _tryremove(path)
+
+    def _scanSegment(self, segment):
+        # rebuild the offset index of a segment; a record which was only
+        # partly written is dropped
+        offsets = []
+        path = self._segmentPath(segment)
+        with open(path, 'rb') as f:
+            pos = 0
+            size = os.fstat(f.fileno()).st_size
+            while pos + self.RECORD.size <= size:
+                f.seek(pos)
+                length, = self.RECORD.unpack(f.read(self.RECORD.size))
+                if pos + self.RECORD.size + length > size:
+                    break
+                offsets.append(pos)
+                pos += self.RECORD.size + length
+        if pos < size:
+            with open(path, 'r+b') as f:
+                f.truncate(pos)
+        return offsets
+
+    def _loadFromDisk(self):
+        legacy = []
+        segments = []
+        for filename in os.listdir(self.path):
+            if filename.startswith(self.SEGMENT_PREFIX):
+                try:
+                    segments.append(int(filename[len(self.SEGMENT_PREFIX):]))
+                except ValueError:
+                    pass
+            elif filename.isdigit():
+                legacy.append(filename)
+        segments.sort()
+
+        try:
+            with open(os.path.join(self.path, self.CURSOR)) as f:
+                self.firstItemId = int(f.read().split()[0])
+        except (IOError, ValueError, IndexError):
+            pass
+        if segments:
+            self.firstItemId = max(self.firstItemId, segments[0] * self.segmentItems)
+
+        for segment in segments:
+            if (segment + 1) * self.segmentItems <= self.firstItemId:
+                # popped, but not deleted yet
+                os.remove(self._segmentPath(segment))
+                continue
+            self.offsets[segment] = self._scanSegment(segment)
+            self.nextItemId = segment * self.segmentItems + len(self.offsets[segment])
+        self.firstItemId = min(self.firstItemId, self.nextItemId)
+
+        try:
+            self.head = [self.unpickleFn(data) for data in
+                         pickle.loads(ReadFile(os.path.join(self.path, self.HEAD)))]
+        except IOError:
+            pass
+
+        if legacy:
+            diskQueue = DiskQueue(self.path, maxItems=len(legacy),
+                                  pickleFn=self.pickleFn,
+                                  unpickleFn=self.unpickleFn)
+            for item in diskQueue.items():
+                self.pushItem(item)
+            # only delete the files once their items are in the segments
+            diskQueue.popChunk()
+
+
+def _writeAtomically(path, buf):
+    WriteFile(path + '.tmp', buf)
+    if os.path.exists(path):
+        # windows cannot rename over an existing file
+        os.remove(path)
+    os.rename(path + '.tmp', path)
+
+
+def _tryremove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
 class PersistentQueue(object):
     """Keeps a list of abstract items and serializes it to the disk.
 
@@ -261,14 +513,14 @@ class PersistentQueue(object):
         """
         @primaryQueue: memory queue to use before buffering to disk.
         @secondaryQueue: disk queue to use as permanent buffer.
-        @path: path is a shortcut when using default DiskQueue settings.
+        @path: path is a shortcut when using default SegmentQueue settings.
         """
         self.primaryQueue = primaryQueue
         if self.primaryQueue is None:
             self.primaryQueue = MemoryQueue()
         self.secondaryQueue = secondaryQueue
         if self.secondaryQueue is None:
-            self.secondaryQueue = DiskQueue(path)
+            self.secondaryQueue = SegmentQueue(path)
         # Preload data from the secondary queue only if we know we won't start
         # using the secondary queue right away.
         if self.secondaryQueue.nbItems() < self.primaryQueue.maxItems():
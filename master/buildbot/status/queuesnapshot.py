@@ -0,0 +1,121 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from twisted.python import log, failure
+from twisted.internet import defer, reactor
+from buildbot.status.buildrequest import BuildRequestStatus
+
+
+class QueueSnapshot(object):
+    """
+    A pre-rendered view of the build queue, shared by the status pages that
+    show it.
+
+    The snapshot holds the number of queued build requests per builder and
+    per priority, and the first entries of the queue as dictionaries ready to
+    be serialized.  It is invalidated when build requests are submitted,
+    cancelled or start building, and rebuilt the next time it is read, at
+    most once every C{MIN_REFRESH_INTERVAL} seconds.  Since requests claimed
+    by other masters are not notified, it is also rebuilt once it is older
+    than C{MAX_AGE} seconds.
+    """
+
+    MAX_ENTRIES = 200
+    MIN_REFRESH_INTERVAL = 1
+    MAX_AGE = 30
+
+    def __init__(self, status, _reactor=reactor):
+        self.status = status
+        self._reactor = _reactor
+        self.snapshot = None
+        self.version = 0
+        self.updatedAt = None
+        self.dirty = True
+        self._waiting = None
+
+    def invalidate(self):
+        self.dirty = True
+
+    def isStale(self):
+        if self.snapshot is None:
+            return True
+        age = self._reactor.seconds() - self.updatedAt
+        if self.dirty:
+            return age >= self.MIN_REFRESH_INTERVAL
+        return age >= self.MAX_AGE
+
+    def getSnapshot(self):
+        """
+        Get the current snapshot of the queue, a dictionary with the keys
+        C{version}, C{total}, C{builders} (mapping buildername to the number
+        of requests), C{priorities} (mapping priority to the number of
+        requests) and C{entries} (the status dictionaries of the first
+        requests in the queue, highest priority and oldest first).
+
+        Concurrent calls share a single refresh.
+
+        @returns: dictionary, via Deferred
+        """
+        if not self.isStale():
+            return defer.succeed(self.snapshot)
+
+        d = defer.Deferred()
+        if self._waiting is not None:
+            self._waiting.append(d)
+            return d
+
+        self._waiting = [d]
+
+        def notify(result):
+            waiting, self._waiting = self._waiting, None
+            if isinstance(result, failure.Failure):
+                log.err(result, "while refreshing the queue snapshot")
+                self.dirty = True
+                if self.snapshot is not None:
+                    # keep serving the last snapshot until a refresh succeeds
+                    result = self.snapshot
+            for w in waiting:
+                w.callback(result)
+
+        self._refresh().addBoth(notify)
+        return d
+
+    @defer.inlineCallbacks
+    def _refresh(self):
+        # events received from now on apply to the next snapshot
+        self.dirty = False
+        startedAt = self._reactor.seconds()
+        db = self.status.master.db.buildrequests
+
+        counts = yield db.getBuildRequestInQueueCounts()
+        builders = {}
+        priorities = {}
+        for (buildername, priority), count in counts.iteritems():
+            builders[buildername] = builders.get(buildername, 0) + count
+            priorities[priority] = priorities.get(priority, 0) + count
+
+        brdicts = yield db.getBuildRequestInQueue(sorted=True, limit=True)
+        brdicts.sort(key=lambda brdict: (-brdict['priority'], brdict['submitted_at']))
+        brstatuses = yield BuildRequestStatus.fromBrdicts(self.status, brdicts[:self.MAX_ENTRIES])
+        entries = yield defer.gatherResults([brstatus.asDict_async() for brstatus in brstatuses])
+
+        self.version += 1
+        self.updatedAt = startedAt
+        self.snapshot = dict(version=self.version,
+                             total=sum(builders.itervalues()),
+                             builders=builders,
+                             priorities=priorities,
+                             entries=[entry for entry in entries if entry])
+        defer.returnValue(self.snapshot)
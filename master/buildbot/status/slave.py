@@ -140,16 +140,17 @@ class SlaveStatus:
         return my_builders
 
     @defer.inlineCallbacks
-    def getRecentBuilds(self, num_builds=15):
+    def getRecentBuilds(self, num_builds=15, summaryOnly=False):
         status = self.master.status
-        builds = yield status.generateFinishedBuildsAsync(num_builds=num_builds, slavename=self.name)
+        builds = yield status.generateFinishedBuildsAsync(num_builds=num_builds, slavename=self.name,
+                                                          summaryOnly=summaryOnly)
         defer.returnValue(builds)
 
     @defer.inlineCallbacks
     def updateHealth(self):
         num_builds = 15
         health = 0
-        builds = yield self.getRecentBuilds(num_builds)
+        builds = yield self.getRecentBuilds(num_builds, summaryOnly=True)
 
         if len(builds) == 0:
             self.health = 0
@@ -16,8 +16,11 @@
 from __future__ import with_statement
 try:
     from autobahn.twisted.websocket import WebSocketClientFactory, WebSocketClientProtocol
+    from autobahn.websocket.compress import PerMessageDeflateOffer, \
+        PerMessageDeflateResponse, PerMessageDeflateResponseAccept
     assert WebSocketClientFactory
 except ImportError:
+    PerMessageDeflateOffer = None
     class WebSocketClientProtocol:
         def __init__(self):
             return
@@ -31,6 +34,7 @@ Implements the HTTP receiver."""
 
 import datetime
 import os
+from collections import OrderedDict
 import urllib
 import urlparse
 
@@ -41,9 +45,10 @@ except ImportError:
     import json
 
 from buildbot import config
+from buildbot.process import metrics
 from buildbot.status.base import StatusReceiverMultiService
-from buildbot.status.persistent_queue import DiskQueue, IndexedQueue, \
-        MemoryQueue, PersistentQueue
+from buildbot.status.persistent_queue import IndexedQueue, MemoryQueue, \
+        PersistentQueue, SegmentQueue
 from buildbot.status.web.status_json import FilterOut
 from twisted.internet import defer, reactor
 from twisted.python import log
@@ -364,7 +369,7 @@ class HttpStatusPush(StatusPush):
                     urlparse.urlparse(self.serverUrl)[1].split(':')[0])
             queue = PersistentQueue(
                         primaryQueue=MemoryQueue(maxItems=maxMemoryItems),
-                        secondaryQueue=DiskQueue(path, maxItems=maxDiskItems))
+                        secondaryQueue=SegmentQueue(path, maxItems=maxDiskItems))
         else:
             path = None
             queue = MemoryQueue(maxItems=maxMemoryItems)
@@ -483,11 +488,29 @@ class AutobahnFactory(WebSocketClientFactory):
         connector.connect()
 
 
+def acceptDeflateResponse(response):
+    """Accept the permessage-deflate response of the autobahn server."""
+    if isinstance(response, PerMessageDeflateResponse):
+        return PerMessageDeflateResponseAccept(response)
+
+
 class AutobahnStatusPush(StatusPush):
-    """Event streamer to a Autobahn server."""
+    """Event streamer to a Autobahn server.
+
+    Events which only update a build, such as ETA updates, are coalesced: the
+    events with the same name for the same build are held for coalesceWindow
+    seconds, and only the last one is pushed.  Any other event pushes the
+    held events first, so the order of the events is kept, except for the ETA
+    updates of a build which finished, which are dropped.  The events are
+    sent in batches of chunkSize, one websocket message per batch, which is
+    compressed when the server supports permessage-deflate."""
+
+    # events superseded by the next event with the same name for the same build
+    coalescedEvents = ('buildETAUpdate', 'stepStarted', 'stepFinished')
 
     def __init__(self, serverIP, serverPort, debug=None, maxMemoryItems=None,
-                 maxDiskItems=None, chunkSize=200, **kwargs):
+                 maxDiskItems=None, chunkSize=200, coalesceWindow=1,
+                 events=None, **kwargs):
         """
         @serverIP: IP of the autobahn server
         @serverPort: Port of the autobahn server
@@ -496,6 +519,10 @@ class AutobahnStatusPush(StatusPush):
         @maxDiskItems: Maximum number of items to buffer to disk, if 0, doesn't
         use disk at all.
         @chunkSize: maximum number of items to send in each at each PUSH.
+        @coalesceWindow: amount of time the coalesced events are held, 0
+        disables coalescing.
+        @events: the events the subscribers of the autobahn server filter on,
+        the other events are dropped. Defaults to all the events.
         """
         if not serverIP and not serverPort:
             raise config.ConfigErrors(['AutobahnStatusPush requires a serverIP and serverPort'])
@@ -509,13 +536,18 @@ class AutobahnStatusPush(StatusPush):
         self.lastPushWasSuccessful = True
         self.protocol = None
         self.factory = None
+        self.coalesceWindow = coalesceWindow
+        self.events = events
+        # (event, builderName, number) -> payload, in the order received
+        self.coalesced = OrderedDict()
+        self.coalesceTask = None
         if maxDiskItems != 0:
             # The queue directory is determined by the server url.
             path = ('events_' +
                     urlparse.urlparse(self.serverUrl)[1].split(':')[0])
             queue = PersistentQueue(
                         primaryQueue=MemoryQueue(maxItems=maxMemoryItems),
-                        secondaryQueue=DiskQueue(path, maxItems=maxDiskItems))
+                        secondaryQueue=SegmentQueue(path, maxItems=maxDiskItems))
         else:
             path = None
             queue = MemoryQueue(maxItems=maxMemoryItems)
@@ -529,12 +561,50 @@ class AutobahnStatusPush(StatusPush):
     def connectToAutobahn(self):
         factory = AutobahnFactory(self, self.serverUrl, debug=self.debug)
         factory.protocol = AutobahnProtocol
+        if PerMessageDeflateOffer is not None:
+            factory.setProtocolOptions(
+                perMessageCompressionOffers=[PerMessageDeflateOffer()],
+                perMessageCompressionAccept=acceptDeflateResponse)
         reactor.connectTCP(self.serverIP, self.serverPort, factory)
         self.factory = factory
 
     def setProtocolInstance(self, protocol_instance):
         self.protocol = protocol_instance
 
+    def push(self, event, **objs):
+        """Push a new event, once superseded events are coalesced."""
+        if self.events is not None and event not in self.events:
+            return
+        if self.coalesceWindow and event in self.coalescedEvents:
+            key = (event, objs.get('builderName'), objs.get('number'))
+            if self.coalesced.pop(key, None) is not None:
+                metrics.MetricCountEvent.log('AutobahnStatusPush.coalesced', 1)
+            self.coalesced[key] = objs
+            if self.coalesceTask is None:
+                self.coalesceTask = reactor.callLater(self.coalesceWindow,
+                                                      self.pushCoalesced)
+            return
+        if event == 'buildFinished':
+            # the ETA of a finished build is of no use
+            self.coalesced.pop(('buildETAUpdate', objs.get('builderName'),
+                                objs.get('number')), None)
+        self.pushCoalesced()
+        return StatusPush.push(self, event, **objs)
+
+    def pushCoalesced(self):
+        """Push the coalesced events held so far."""
+        if self.coalesceTask is not None:
+            if self.coalesceTask.active():
+                self.coalesceTask.cancel()
+            self.coalesceTask = None
+        coalesced, self.coalesced = self.coalesced, OrderedDict()
+        for (event, _, _), objs in coalesced.iteritems():
+            StatusPush.push(self, event, **objs)
+
+    def stopService(self):
+        self.pushCoalesced()
+        return StatusPush.stopService(self)
+
     def wasLastPushSuccessful(self):
         return self.lastPushWasSuccessful
 
@@ -19,7 +19,7 @@
 ."""
 
 from buildbot.status.status_push import StatusPush
-from buildbot.status.persistent_queue import DiskQueue, MemoryQueue, PersistentQueue
+from buildbot.status.persistent_queue import MemoryQueue, PersistentQueue, SegmentQueue
 
 from twisted.python import log
 import json
@@ -49,7 +49,7 @@ class QueuedStatusPush(StatusPush):
             path = 'queue_%s' % (self.eventName())
             queue = PersistentQueue(
                         primaryQueue=MemoryQueue(maxItems=maxMemoryItems),
-                        secondaryQueue=DiskQueue(path, maxItems=maxDiskItems))
+                        secondaryQueue=SegmentQueue(path, maxItems=maxDiskItems))
         else:
             path = None
             queue = MemoryQueue(maxItems=maxMemoryItems)
@@ -53,17 +53,48 @@ from twisted.cred.portal import IRealm, Portal
 from twisted.web import resource, guard
 from twisted.cred.checkers import InMemoryUsernamePasswordDatabaseDontUse
 
+class SafeGzipEncoder(object):
+    """
+    Compresses a response as it is written, unless its resource already set
+    its Content-Encoding, as the cached json responses do.
+    """
+
+    def __init__(self, compressLevel, request):
+        self._compressLevel = compressLevel
+        self._request = request
+        self._zlibCompressor = None
+
+    def encode(self, data):
+        if not self._request.startedWriting:
+            headers = self._request.responseHeaders
+            if not headers.hasHeader('content-encoding'):
+                # the compressed length is not known in advance
+                headers.removeHeader('content-length')
+                headers.setRawHeaders('content-encoding', ['gzip'])
+                self._zlibCompressor = zlib.compressobj(self._compressLevel, zlib.DEFLATED,
+                                                        10 + zlib.MAX_WBITS, 1)
+        if self._zlibCompressor is None:
+            return data
+        return self._zlibCompressor.compress(data)
+
+    def finish(self):
+        if self._zlibCompressor is None:
+            return ""
+        remain = self._zlibCompressor.flush()
+        self._zlibCompressor = None
+        return remain
+
+
 class SafeGzipEncoderFactory(server.GzipEncoderFactory):
     """
     Overwrite the default gzip encoder factory as some larger files
     fail to compress on the default settings
     """
     def encoderForRequest(self, request):
-        compressor = server.GzipEncoderFactory.encoderForRequest(self, request)
-        if compressor is not None:
-            compressor._zlibCompressor = zlib.compressobj(self.compressLevel, zlib.DEFLATED, 10 + zlib.MAX_WBITS, 1)
-
-        return compressor
+        acceptHeaders = request.requestHeaders.getRawHeaders('accept-encoding', [])
+        supported = [encoding.strip() for encoding in ','.join(acceptHeaders).split(',')]
+        if 'gzip' in supported:
+            return SafeGzipEncoder(self.compressLevel, request)
 
 if hasattr(server, 'GzipEncoderFactory'):
     class wrapper(resource.EncodingResourceWrapper):
@@ -85,9 +85,9 @@ class CancelBuildQueueActionResource(ActionResource):
 
         brdicts = yield master.db.buildrequests.getBuildRequestInQueue(brids=buildrequest)
 
-        for brdict in brdicts:
-            br = yield BuildRequest.fromBrdict(
-                master, brdict)
+        breqs = yield BuildRequest.fromBrdicts(master, brdicts)
+
+        for brdict, br in zip(brdicts, breqs):
             b = master.botmaster.builders[brdict['buildername']]
             brc = BuildRequestControl(b, br)
             yield brc.cancel()
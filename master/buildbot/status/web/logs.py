@@ -108,10 +108,33 @@ class TextLog(Resource, ContextMixin):
         req.setHeader("content-length", self.original.length)
         return ''
 
+    def _getLineRange(self, req):
+        # ?tail=N selects the last N lines, ?start=N&end=M lines N up to M;
+        # returns None when the whole log is requested
+        def intArg(name):
+            try:
+                value = int(req.args[name][0])
+            except (KeyError, IndexError, ValueError):
+                return None
+            return max(value, 0)
+
+        tail = intArg("tail")
+        if tail is not None:
+            return self.original.getTailChunks(tail)
+
+        start, end = intArg("start"), intArg("end")
+        if start is None and end is None:
+            return None
+        return self.original.getLineChunks(start or 0, end)
+
     def render_GET(self, req):
         self._setContentType(req)
         self.req = req
 
+        chunks = None
+        if self.asText or self.iFrame:
+            chunks = self._getLineRange(req)
+
         if self.original.isFinished():
             req.setHeader("Cache-Control", "max-age=604800")
         else:
@@ -128,6 +151,8 @@ class TextLog(Resource, ContextMixin):
                 data = self.chunk_template.module.page_header(version)
                 data = data.encode('utf-8')
                 req.write(data)
+                if chunks is not None:
+                    return self._renderLineRange(req, chunks)
                 self.original.subscribeConsumer(ChunkConsumer(req, self))
                 return server.NOT_DONE_YET
 
@@ -138,6 +163,9 @@ class TextLog(Resource, ContextMixin):
             project = builder_status.getProject()
             cxt["pageTitle"] = "Log File Contents"
             cxt["iframe_url"] = req.path + "/iframe"
+            query = req.uri.split("?", 1)[1] if "?" in req.uri else ""
+            if query:
+                cxt["iframe_url"] += "?" + query
             cxt["builder_name"] = builder.getFriendlyName()
             cxt['path_to_builder'] = path_to_builder(req, builder_status)
             cxt['path_to_builders'] = path_to_builders(req, project)
@@ -153,6 +181,20 @@ class TextLog(Resource, ContextMixin):
 
             return ""
 
+        if chunks is not None:
+            return self._renderLineRange(req, chunks)
+
+    def _renderLineRange(self, req, chunks):
+        # a range of a log is served at once rather than followed
+        data = self.content(list(chunks))
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        req.write(data)
+        if not self.asText:
+            req.write(self.chunk_template.module.page_footer().encode('utf-8'))
+        self.req = None
+        self.template = None
+        return ""
 
     def _setContentType(self, req):
         if self.asText:
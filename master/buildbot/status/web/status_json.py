@@ -17,13 +17,18 @@
 """Simple JSON exporter."""
 
 import datetime
+import hashlib
 import re
+import weakref
+import zlib
+from collections import OrderedDict
+from zope.interface import implements
 from twisted.python import log
 
-from twisted.internet import defer
-from twisted.web import html, resource, server
+from twisted.internet import defer, interfaces
+from twisted.web import html, http, resource, server
 
-from buildbot.status.buildrequest import BuildRequestStatus
+from buildbot.status.base import StatusReceiverBase
 from buildbot.status.web.base import HtmlResource, path_to_root, map_branches, getCodebasesArg, getRequestCharset, getResultsArg
 import json
 import time
@@ -159,15 +164,279 @@ def FilterOut(data):
     else:
         return data
 
+def getCallbackArg(request):
+    """Returns the jsonp callback of the request, if any."""
+    callback = request.args.get('callback')
+    # Only accept things that look like identifiers for now
+    if callback and re.match(r'^[a-zA-Z$_][a-zA-Z$0-9._]*$', callback[0]):
+        return callback[0]
+    return None
+
 def getSlaveName(slave_status):
     return slave_status.getName() if slave_status else None
 
 
+# the status events which invalidate cached responses
+BUILDS = 'builds'
+STEPS = 'steps'
+REQUESTS = 'requests'
+BUILDERS = 'builders'
+
+
+def acceptsGzip(request):
+    encodings = (request.getHeader("Accept-Encoding") or "").split(",")
+    return "gzip" in [e.split(";")[0].strip() for e in encodings]
+
+
+class JsonResponse(object):
+    """A rendered json document, with its ETags and gzip encoding."""
+
+    def __init__(self, body):
+        if isinstance(body, unicode):
+            body = body.encode("utf-8")
+        self.body = body
+        digest = hashlib.sha1(body).hexdigest()
+        self.etag = '"%s"' % digest
+        self.gzipEtag = '"%s-gzip"' % digest
+        self.created = time.time()
+        self._gzipped = None
+
+    def getGzipped(self):
+        if self._gzipped is None:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._gzipped = compressor.compress(self.body) + compressor.flush()
+        return self._gzipped
+
+
+class JsonResponseCache(StatusReceiverBase):
+    """
+    Caches the rendered responses of the json resources which set
+    C{cacheEvents}.  A response is keyed by the request path and arguments,
+    and by the generation of each status event in C{cacheEvents} within the
+    scopes of the resource, which is bumped whenever such an event happens to
+    the scope, so that it is rendered again after any change that can affect
+    it.  Responses are also rendered again once they are C{cache_seconds}
+    old, for the durations they hold, and the ETAs of the running steps are
+    updated every C{ETA_UPDATE_INTERVAL} seconds.
+
+    Only the latest response of a resource is kept, and the responses are
+    bounded by their number and the total size of their bodies.  Concurrent
+    requests for the same response share a single rendering.
+    """
+
+    MAX_RESPONSES = 500
+    MAX_RESPONSES_SIZE = 64 * 1024 * 1024
+    ETA_UPDATE_INTERVAL = 60
+
+    _caches = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def forStatus(cls, status):
+        # one cache per status, which lives as long as the status does
+        if status is None:
+            return None
+        if status not in cls._caches:
+            cache = cls._caches[status] = cls(status)
+            status.subscribe(cache)
+        return cls._caches[status]
+
+    def __init__(self, status):
+        self.status = status
+        # {(event,) + scope: generation}, see JsonResource.getCacheScopes
+        self.generations = {}
+        self.generation = 0
+        # {key: JsonResponse}, least recently used first
+        self.responses = OrderedDict()
+        self.size = 0
+        # {(path, args): key} of the latest response of each resource
+        self.latest = {}
+        # {key: [Deferred]} of the responses being rendered
+        self.rendering = {}
+
+    def getKey(self, resource, request):
+        args = tuple(sorted((name, tuple(values)) for name, values in request.args.iteritems()))
+        generations = tuple(self.generations.get((event,) + scope, 0)
+                            for scope in resource.getCacheScopes()
+                            for event in resource.cacheEvents)
+        age = int(time.time() // resource.cache_seconds) if resource.cache_seconds else None
+        return ((request.path, args), generations, age)
+
+    def getResponse(self, resource, request):
+        key = self.getKey(resource, request)
+        if key in self.responses:
+            response = self.responses[key] = self.responses.pop(key)
+            return defer.succeed(response)
+
+        if key in self.rendering:
+            d = defer.Deferred()
+            self.rendering[key].append(d)
+            return d
+
+        self.rendering[key] = []
+        d = defer.maybeDeferred(lambda: resource.content(request))
+        d.addCallback(JsonResponse)
+
+        def rendered(response):
+            self._add(key, response)
+            for waiting in self.rendering.pop(key):
+                waiting.callback(response)
+            return response
+
+        def failed(f):
+            for waiting in self.rendering.pop(key):
+                waiting.errback(f)
+            return f
+
+        d.addCallbacks(rendered, failed)
+        return d
+
+    def _add(self, key, response):
+        # the previous response of the resource is stale
+        latest = self.latest.get(key[0])
+        if latest in self.responses:
+            self._remove(latest)
+        self.latest[key[0]] = key
+        self.responses[key] = response
+        self.size += len(response.body)
+        while self.responses and (len(self.responses) > self.MAX_RESPONSES or
+                                  self.size > self.MAX_RESPONSES_SIZE):
+            self._remove(next(iter(self.responses)))
+
+    def _remove(self, key):
+        self.size -= len(self.responses.pop(key).body)
+        if self.latest.get(key[0]) == key:
+            del self.latest[key[0]]
+
+    def bump(self, event, builderName=None, number=None):
+        self.generation += 1
+        self.generations[(event,)] = self.generation
+        if builderName is not None:
+            self.generations[(event, builderName)] = self.generation
+            if number is not None:
+                self.generations[(event, builderName, number)] = self.generation
+
+    def bumpBuild(self, event, build):
+        self.bump(event, build.getBuilder().getName(), build.getNumber())
+
+    # status events
+
+    def builderAdded(self, builderName, builder, **kwargs):
+        self.bump(BUILDERS, builderName)
+        return self
+
+    def builderRemoved(self, builderName):
+        self.bump(BUILDERS, builderName)
+
+    def builderChangedState(self, builderName, state):
+        self.bump(BUILDERS, builderName)
+
+    def requestSubmitted(self, request):
+        self.bump(REQUESTS, request.getBuilderName())
+
+    def requestCancelled(self, builder, request):
+        self.bump(REQUESTS, request.getBuilderName())
+
+    def buildStarted(self, builderName, build):
+        self.bumpBuild(BUILDS, build)
+        # subscribe to the steps of the build
+        return self
+
+    def buildETAUpdate(self, build, ETA):
+        self.bumpBuild(BUILDS, build)
+
+    def stepStarted(self, build, step):
+        self.bumpBuild(STEPS, build)
+        # subscribe to the text changes and ETA updates of the step
+        return (self, self.ETA_UPDATE_INTERVAL)
+
+    def stepTextChanged(self, build, step, text):
+        self.bumpBuild(STEPS, build)
+
+    def stepText2Changed(self, build, step, text2):
+        self.bumpBuild(STEPS, build)
+
+    def stepETAUpdate(self, build, step, ETA, expectations):
+        self.bumpBuild(STEPS, build)
+
+    def stepFinished(self, build, step, results):
+        self.bumpBuild(STEPS, build)
+
+    def buildFinished(self, builderName, build, results):
+        self.bumpBuild(BUILDS, build)
+        # the generations of a finished build are back to 0, which none of
+        # its responses had while it was running
+        for event in (BUILDS, STEPS):
+            self.generations.pop((event, builderName, build.getNumber()), None)
+
+
+class JsonItemsProducer(object):
+    """
+    Writes a json list to a request one item at a time, as the items are
+    generated, so that only one of them is held in memory.  Registered as
+    the producer of the request, it stops generating items while the
+    transport is paused and when the connection is lost.
+    """
+
+    implements(interfaces.IPushProducer)
+
+    def __init__(self, request, items, encode):
+        self.request = request
+        self.items = items
+        self.encode = encode
+        self.paused = None
+        self.stopped = False
+
+    def pauseProducing(self):
+        if self.paused is None:
+            self.paused = defer.Deferred()
+
+    def resumeProducing(self):
+        if self.paused is not None:
+            d, self.paused = self.paused, None
+            d.callback(None)
+
+    def stopProducing(self):
+        self.stopped = True
+        self.resumeProducing()
+
+    @defer.inlineCallbacks
+    def produce(self, prefix="", suffix=""):
+        """
+        Write C{prefix}, the encoded items as a json list and C{suffix}, and
+        finish the request.
+        """
+        self.request.registerProducer(self, True)
+        try:
+            self.request.write(prefix + "[")
+            separator = ""
+            for item in self.items:
+                # items may be Deferreds, and are left out if they are None
+                item = yield item
+                if item is None:
+                    continue
+                if self.paused is not None:
+                    yield self.paused
+                if self.stopped:
+                    return
+                self.request.write(separator + self.encode(item))
+                separator = ","
+            self.request.write("]" + suffix)
+        finally:
+            self.request.unregisterProducer()
+        self.request.finish()
+
+
 class JsonResource(resource.Resource):
     """Base class for json data."""
 
     contentType = "application/json"
     cache_seconds = 60
+    # the status events after which a cached response is stale; resources
+    # which leave it to None are rendered for every request
+    cacheEvents = None
+    # resources which generate their json list with asItems set this to
+    # write the items to the request as they are generated
+    streaming = False
     help = None
     pageTitle = None
     level = 0
@@ -205,26 +474,68 @@ class JsonResource(resource.Resource):
         RecurseFix(res, self.level)
         resource.Resource.putChild(self, name, res)
 
+    def getCacheScopes(self):
+        """
+        Returns the scopes of the status events which affect this resource:
+        C{()} for the whole status, C{(builderName,)} for a builder and
+        C{(builderName, number)} for a build.
+        """
+        return [()]
+
+    def isCacheable(self, request):
+        # selected children may depend on other events than this resource
+        return self.cacheEvents is not None and 'select' not in request.args
+
+    def isStreamed(self, request):
+        return self.streaming and 'select' not in request.args
+
+    def setHeaders(self, request):
+        request.setHeader("Access-Control-Allow-Origin", "*")
+        if RequestArgToBool(request, 'as_text', False):
+            request.setHeader("content-type", 'text/plain')
+        else:
+            request.setHeader("content-type", self.contentType)
+            # Make sure we get fresh pages.
+        if self.cache_seconds:
+            now = datetime.datetime.utcnow()
+            expires = now + datetime.timedelta(seconds=self.cache_seconds)
+            request.setHeader("Expires",
+                              expires.strftime("%a, %d %b %Y %H:%M:%S GMT"))
+            request.setHeader("Pragma", "no-cache")
+
     def render_GET(self, request):
         """Renders a HTTP GET at the http request level."""
-        d = defer.maybeDeferred(lambda: self.content(request))
-
-        def handle(data):
-            if isinstance(data, unicode):
-                data = data.encode("utf-8")
-            request.setHeader("Access-Control-Allow-Origin", "*")
-            if RequestArgToBool(request, 'as_text', False):
-                request.setHeader("content-type", 'text/plain')
-            else:
-                request.setHeader("content-type", self.contentType)
-                # Make sure we get fresh pages.
-            if self.cache_seconds:
-                now = datetime.datetime.utcnow()
-                expires = now + datetime.timedelta(seconds=self.cache_seconds)
-                request.setHeader("Expires",
-                                  expires.strftime("%a, %d %b %Y %H:%M:%S GMT"))
-                request.setHeader("Pragma", "no-cache")
-            return data
+        if self.isStreamed(request):
+            return self.renderStream(request)
+
+        cache = None
+        if self.isCacheable(request):
+            cache = JsonResponseCache.forStatus(self.status)
+        if cache is not None:
+            d = cache.getResponse(self, request)
+        else:
+            d = defer.maybeDeferred(lambda: self.content(request))
+            d.addCallback(JsonResponse)
+
+        def handle(response):
+            # cached responses keep their gzipped body, which is sent instead
+            # of having the site compress it again
+            gzipped = cache is not None and acceptsGzip(request)
+            etag = response.gzipEtag if gzipped else response.etag
+            self.setHeaders(request)
+            request.setHeader("ETag", etag)
+            request.setHeader("Vary", "Accept-Encoding")
+            if cache is not None:
+                request.setHeader("Last-Modified", http.datetimeToString(response.created))
+
+            if request.getHeader("If-None-Match") == etag:
+                request.setResponseCode(http.NOT_MODIFIED)
+                return ""
+
+            if gzipped:
+                request.setHeader("Content-Encoding", "gzip")
+                return response.getGzipped()
+            return response.body
 
         d.addCallback(handle)
 
@@ -242,6 +553,49 @@ class JsonResource(resource.Resource):
         d.addCallbacks(ok, fail)
         return server.NOT_DONE_YET
 
+    def renderStream(self, request):
+        """Renders the items of asItems as they are generated."""
+        as_text = RequestArgToBool(request, 'as_text', False)
+        filter_out = RequestArgToBool(request, 'filter', as_text)
+        compact = RequestArgToBool(request, 'compact', not as_text)
+        callback = getCallbackArg(request)
+
+        def encode(item):
+            if filter_out:
+                item = FilterOut(item)
+            if compact:
+                return json.dumps(item, separators=(',', ':'))
+            return json.dumps(item, sort_keys=True, indent=2)
+
+        d = defer.maybeDeferred(lambda: self.asItems(request))
+
+        def produce(items):
+            self.setHeaders(request)
+            prefix, suffix = ("%s(" % callback, ");") if callback else ("", "")
+            producer = JsonItemsProducer(request, items, encode)
+            d = producer.produce(prefix, suffix)
+
+            def failed(f):
+                # the response has started, so the best that can be done is
+                # to not complete it
+                log.err(f, "while streaming %s" % request.path)
+                request.transport.loseConnection()
+            d.addErrback(failed)
+
+        def fail(f):
+            request.processingFailed(f)
+            return None # processingFailed will log this for us
+
+        d.addCallbacks(produce, fail)
+        return server.NOT_DONE_YET
+
+    def asItems(self, request):
+        """Generates the items of the json list of a streaming resource.
+
+        Returns an iterable of dictionaries or Deferreds, possibly via a
+        Deferred; it is consumed as the items are written."""
+        raise NotImplementedError()
+
     @defer.inlineCallbacks
     def content(self, request):
         """Renders the json dictionaries."""
@@ -250,7 +604,7 @@ class JsonResource(resource.Resource):
         as_text = RequestArgToBool(request, 'as_text', False)
         filter_out = RequestArgToBool(request, 'filter', as_text)
         compact = RequestArgToBool(request, 'compact', not as_text)
-        callback = request.args.get('callback')
+        callback = getCallbackArg(request)
 
         # Implement filtering at global level and every child.
         if select is not None:
@@ -299,10 +653,7 @@ class JsonResource(resource.Resource):
         else:
             data = json.dumps(data, sort_keys=True, indent=2)
         if callback:
-            # Only accept things that look like identifiers for now
-            callback = callback[0]
-            if re.match(r'^[a-zA-Z$_][a-zA-Z$0-9._]*$', callback):
-                data = '%s(%s);' % (callback, data)
+            data = '%s(%s);' % (callback, data)
         defer.returnValue(data)
 
     @defer.inlineCallbacks
@@ -419,11 +770,15 @@ class BuilderPendingBuildsJsonResource(JsonResource):
     help = """Describe pending builds for a builder.
 """
     pageTitle = 'Builder'
+    cacheEvents = (REQUESTS, BUILDS)
 
     def __init__(self, status, builder_status):
         JsonResource.__init__(self, status)
         self.builder_status = builder_status
 
+    def getCacheScopes(self):
+        return [(self.builder_status.getName(),)]
+
     def asDict(self, request):
         # buildbot.status.builder.BuilderStatus
         d = self.builder_status.getPendingBuildRequestStatuses()
@@ -440,6 +795,7 @@ class BuilderJsonResource(JsonResource):
     help = """Describe a single builder.
 """
     pageTitle = 'Builder'
+    cacheEvents = (BUILDS, REQUESTS, BUILDERS)
 
     def __init__(self, status, builder_status):
         JsonResource.__init__(self, status)
@@ -453,6 +809,9 @@ class BuilderJsonResource(JsonResource):
             'pendingBuilds',
             BuilderPendingBuildsJsonResource(status, builder_status))
 
+    def getCacheScopes(self):
+        return [(self.builder_status.getName(),)]
+
     def asDict(self, request):
         # buildbot.status.builder.BuilderStatus
         return self.builder_status.asDict_async()
@@ -462,6 +821,7 @@ class BuildersJsonResource(JsonResource):
     help = """List of all the builders defined on a master.
 """
     pageTitle = 'Builders'
+    cacheEvents = (BUILDS, REQUESTS, BUILDERS)
 
     def __init__(self, status):
         JsonResource.__init__(self, status)
@@ -508,6 +868,7 @@ class BuildJsonResource(JsonResource):
     help = """Describe a single build.
 """
     pageTitle = 'Build'
+    cacheEvents = (BUILDS, STEPS)
 
     def __init__(self, status, build_status):
         JsonResource.__init__(self, status)
@@ -518,6 +879,9 @@ class BuildJsonResource(JsonResource):
                       SourceStampJsonResource(status, sourcestamp))
         self.putChild('steps', BuildStepsJsonResource(status, build_status))
 
+    def getCacheScopes(self):
+        return [(self.build_status.getBuilder().getName(), self.build_status.getNumber())]
+
     def asDict(self, request):
         return self.build_status.asDict(request)
 
@@ -526,11 +890,15 @@ class AllBuildsJsonResource(JsonResource):
     help = """All the builds that were run on a builder.
 """
     pageTitle = 'AllBuilds'
+    cacheEvents = (BUILDS,)
 
     def __init__(self, status, builder_status):
         JsonResource.__init__(self, status)
         self.builder_status = builder_status
 
+    def getCacheScopes(self):
+        return [(self.builder_status.getName(),)]
+
     def getChild(self, path, request):
         # Dynamic childs.
         if isinstance(path, int) or _IS_INT.match(path):
@@ -571,6 +939,7 @@ class AllBuildsJsonResource(JsonResource):
 class PastBuildsJsonResource(JsonResource):
     help = """Previous x number of builds that were run on a builder."""
     pageTitle = 'Builds'
+    streaming = True
 
     def __init__(self, status, number, builder_status=None, slave_status=None):
         JsonResource.__init__(self, status)
@@ -580,6 +949,24 @@ class PastBuildsJsonResource(JsonResource):
 
     @defer.inlineCallbacks
     def asDict(self, request, params=None):
+        items = yield self.asItems(request, params)
+        builds = []
+        for item in items:
+            item = yield item
+            if item is not None:
+                builds.append(item)
+        defer.returnValue(builds)
+
+    def _loadBuilds(self, summaries, request, **kwargs):
+        # the builds are only loaded as their items are written, so that one
+        # of them is held in memory at a time
+        for summary in summaries:
+            d = summary.getBuilder().deferToThread(summary.getNumber())
+            d.addCallback(lambda build: build.asDict(request, **kwargs) if build is not None else None)
+            yield d
+
+    @defer.inlineCallbacks
+    def asItems(self, request, params=None):
         include_steps = True
         include_props = True
 
@@ -601,26 +988,28 @@ class PastBuildsJsonResource(JsonResource):
             encoding = getRequestCharset(request)
             branches = [b.decode(encoding) for b in request.args.get("branch", []) if b]
 
-            builds = yield self.builder_status.generateFinishedBuildsAsync(branches=map_branches(branches),
-                                                                           codebases=codebases,
-                                                                           results=results,
-                                                                           num_builds=self.number)
+            summaries = yield self.builder_status.generateFinishedBuildSummariesAsync(
+                branches=map_branches(branches), codebases=codebases, results=results,
+                num_builds=self.number)
 
-            defer.returnValue([b.asDict(request,
-                                        include_artifacts=True,
-                                        include_failure_url=True,
-                                        include_steps=include_steps,
-                                        include_properties=include_props) for b in builds])
+            defer.returnValue(self._loadBuilds(summaries, request,
+                                               include_artifacts=True,
+                                               include_failure_url=True,
+                                               include_steps=include_steps,
+                                               include_properties=include_props))
             return
 
         if self.slave_status is not None:
             slavename = self.slave_status.getName()
-            builds = yield self.status.generateFinishedBuildsAsync(num_builds=self.number, results=results,
-                                                                   slavename=slavename)
+            summaries = yield self.status.generateFinishedBuildSummariesAsync(num_builds=self.number,
+                                                                              results=results,
+                                                                              slavename=slavename)
 
-            defer.returnValue([rb.asDict(request=request, include_steps=False) for rb in builds])
+            defer.returnValue(self._loadBuilds(summaries, request, include_steps=False))
             return
 
+        defer.returnValue([])
+
 
 class BuildsJsonResource(AllBuildsJsonResource):
     help = """Builds that were run on a builder.
@@ -662,6 +1051,7 @@ class BuildStepJsonResource(JsonResource):
     help = """A single build step.
 """
     pageTitle = 'BuildStep'
+    cacheEvents = (BUILDS, STEPS)
 
     def __init__(self, status, build_step_status):
         # buildbot.status.buildstep.BuildStepStatus
@@ -669,6 +1059,10 @@ class BuildStepJsonResource(JsonResource):
         self.build_step_status = build_step_status
         # TODO self.putChild('logs', LogsJsonResource())
 
+    def getCacheScopes(self):
+        build = self.build_step_status.getBuild()
+        return [(build.getBuilder().getName(), build.getNumber())]
+
     def asDict(self, request):
         return self.build_step_status.asDict()
 
@@ -677,6 +1071,7 @@ class BuildStepsJsonResource(JsonResource):
     help = """A list of build steps that occurred during a build.
 """
     pageTitle = 'BuildSteps'
+    cacheEvents = (BUILDS, STEPS)
 
     def __init__(self, status, build_status):
         JsonResource.__init__(self, status)
@@ -684,6 +1079,9 @@ class BuildStepsJsonResource(JsonResource):
         # The build steps are constantly changing until the build is done so
         # keep a reference to build_status instead
 
+    def getCacheScopes(self):
+        return [(self.build_status.getBuilder().getName(), self.build_status.getNumber())]
+
     def getChild(self, path, request):
         # Dynamic childs.
         build_step_status = None
@@ -826,12 +1224,16 @@ class LatestRevisionResource(JsonResource):
 class SingleProjectJsonResource(LatestRevisionResource):
     help = """Describe a project in katana"""
     pageTitle = 'Project'
+    cacheEvents = (BUILDS, STEPS, REQUESTS, BUILDERS)
 
     def __init__(self, status, project_status):
         LatestRevisionResource.__init__(self, status, project_status)
         self.name = self.project_status.name
         self.setup_children(status, project_status)
 
+    def getCacheScopes(self):
+        return [(name,) for name in self.status.getBuilderNamesByProject(self.project_status.name)]
+
     def setup_children(self, status, project):
         builder_names = self.status.getBuilderNamesByProject(self.project_status.name)
         for b in builder_names:
@@ -871,6 +1273,7 @@ class SingleProjectBuilderJsonResource(LatestRevisionResource):
     Returns  a single builder for a project JSON with
     latestBuild info
     """
+    cacheEvents = (BUILDS, STEPS, REQUESTS, BUILDERS)
 
     def __init__(self, status, builder, latest_rev=False):
         projects = status.getProjects()
@@ -881,6 +1284,9 @@ class SingleProjectBuilderJsonResource(LatestRevisionResource):
         self.latest_rev = latest_rev
 
 
+    def getCacheScopes(self):
+        return [(self.builder.getName(),)]
+
     @defer.inlineCallbacks
     def builder_dict(self, builder, codebases, request, branches, base_build_dict, include_build_steps,
                      include_build_props):
@@ -938,18 +1344,8 @@ class QueueJsonResource(JsonResource):
 
     @defer.inlineCallbacks
     def asDict(self, request):
-        unclaimed_brq = yield self.status.master.db.buildrequests\
-            .getBuildRequestInQueue(sorted=True, limit=200)
-
-        #Convert to dictionary
-        output = []
-        for br_dict in unclaimed_brq:
-            br = BuildRequestStatus(br_dict['buildername'], br_dict['brid'], self.status)
-            brstatus_dict = yield br.asDict_async()
-            if brstatus_dict:
-                output.append(brstatus_dict)
-
-        defer.returnValue(output)
+        snapshot = yield self.status.queueSnapshot.getSnapshot()
+        defer.returnValue(snapshot['entries'])
 
 
 class PendingBuildsJsonResource(JsonResource):
@@ -968,12 +1364,16 @@ class PendingBuildsJsonResource(JsonResource):
 class SinglePendingBuildsJsonResource(JsonResource):
     help = """List the pending builds for a specific builder."""
     pageTitle = 'Queue'
+    cacheEvents = (REQUESTS, BUILDS)
 
     def __init__(self, status, builder):
         JsonResource.__init__(self, status)
         self.status = status
         self.builder = builder
 
+    def getCacheScopes(self):
+        return [(self.builder.getName(),)]
+
     @defer.inlineCallbacks
     def asDict(self, request):
         #Get codebases
@@ -981,7 +1381,7 @@ class SinglePendingBuildsJsonResource(JsonResource):
         getCodebasesArg(request=request, codebases=codebases)
 
         # Get pending request filtered + sorted
-        builds = yield self.builder.getPendingBuildRequestStatuses(codebases=codebases)
+        builds = yield self.builder.getPendingBuildRequestStatuses(codebases=codebases, prefetch=True)
 
         #Convert to dictionary
         output = []
@@ -1134,17 +1534,19 @@ class SourceStampJsonResource(JsonResource):
 
 
 class MetricsJsonResource(JsonResource):
-    help = """Master metrics.
+    help = """Master metrics, and the statistics of the build caches.
 """
     title = "Metrics"
 
     def asDict(self, request):
         metrics = self.status.getMetrics()
         if metrics:
-            return metrics.asDict()
+            result = metrics.asDict()
         else:
             # Metrics are disabled
-            return None
+            result = {}
+        result['buildCache'] = self.status.getBuildCacheMetrics()
+        return result
 
 
 class GlobalJsonResource(JsonResource):
@@ -1171,13 +1573,12 @@ class GlobalJsonResource(JsonResource):
         for b in self.builders.values():
             current_builds += len(b.builder_status.getCurrentBuilds())
 
-        # TODO: change to get the total instead of all the buildrequests in queue
-        queue = yield self.status.master.db.buildrequests.getBuildRequestInQueue(sorted=False)
+        queue = yield self.status.queueSnapshot.getSnapshot()
         total_builds_lastday = yield self.status.getNumberOfBuildsInLastDay()
         result = {"slaves_count": connected_slaves,
                   "slaves_busy": slave_busy,
                   "running_builds": current_builds,
-                  "build_load": len(queue) + current_builds,
+                  "build_load": queue['total'] + current_builds,
                   "utc": time.time() * 1000,
                   "total_builds_lastday": total_builds_lastday}
 
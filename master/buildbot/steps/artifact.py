@@ -1,6 +1,7 @@
 from buildbot.process.buildstep import LoggingBuildStep, SUCCESS, SKIPPED
 from twisted.internet import defer
 from buildbot.steps.shell import ShellCommand
+import posixpath
 import re
 from buildbot.util import epoch2datetime
 from buildbot.util import safeTranslate
@@ -262,19 +263,81 @@ def retryCommandWindowsOSPwShell(command):
     return 'powershell.exe -C for ($i=1; $i -le  5; $i++) { '+ command \
            +'; if ($?) { exit 0 } else { sleep 5} } exit -1'
 
-def rsyncWithRetry(step, origin, destination):
+def rsyncCommand(origin, destination, options=()):
+    return "rsync -var --progress --partial %s'%s' '%s'" % ("".join("%s " % o for o in options),
+                                                           origin, destination)
 
-    rsync_command = "rsync -var --progress --partial '%s' '%s'" % (origin, destination)
+def chainCommands(step, first, second):
+    # run second only if first succeeded, as a single command for the retry loops
+    if _isWindowsSlave(step) and step.usePowerShell:
+        return first + '; if ($?) { ' + second + ' } else { cmd /c exit 1 }'
+    return first + ' && ' + second
+
+def retryCommand(step, command):
     if _isWindowsSlave(step):
         if step.usePowerShell:
-            return retryCommandWindowsOSPwShell(rsync_command)
-        return retryCommandWindowsOS(rsync_command)
+            return retryCommandWindowsOSPwShell(command)
+        return retryCommandWindowsOS(command)
+
+    return retryCommandLinuxOS(command)
 
-    return retryCommandLinuxOS(rsync_command)
+def rsyncWithRetry(step, origin, destination, options=()):
+    return retryCommand(step, rsyncCommand(origin, destination, options))
 
 def getRemoteLocation(artifactServer, artifactServerDir, artifactPath, artifact):
     return artifactServer + ":" + artifactServerDir + "/" + artifactPath + "/" + artifact.replace(" ", r"\ ")
 
+def _remoteDirectory(artifactServerDir, artifactPath, artifact):
+    # the directory rsync writes the artifact to on the artifact server
+    path = posixpath.join(artifactServerDir, artifactPath, artifact)
+    if artifact.endswith("/"):
+        return path.rstrip("/")
+    return posixpath.dirname(path)
+
+def getLinkDest(artifactServerDir, artifactPath, previousPath, artifact):
+    """
+    Returns the --link-dest directory, relative to the destination directory
+    as rsync expects it, which makes an upload to C{artifactPath} reuse the
+    upload of the same artifact to C{previousPath}
+    """
+    destination = _remoteDirectory(artifactServerDir, artifactPath, artifact)
+    previous = _remoteDirectory(artifactServerDir, previousPath, artifact)
+    return posixpath.relpath(previous, destination).replace(" ", r"\ ")
+
+
+class ArtifactIndex(object):
+    """
+    Remembers where each artifact was last uploaded to on the artifact
+    servers, so that the next upload of the same artifact is made against
+    it.  rsync then only sends the blocks which changed, and hard links the
+    files which did not change instead of storing them again.
+    """
+
+    def __init__(self):
+        self.uploads = {}
+
+    def getPreviousUpload(self, key):
+        """
+        Returns the artifact path of the last upload of C{key}, or None
+        """
+        return self.uploads.get(key)
+
+    def addUpload(self, key, artifactPath):
+        self.uploads[key] = artifactPath
+
+
+_index = None
+
+
+def getArtifactIndex():
+    """
+    Returns the L{ArtifactIndex} shared by the artifact steps
+    """
+    global _index
+    if _index is None:
+        _index = ArtifactIndex()
+    return _index
+
 class UploadArtifact(ShellCommand):
 
     name = "Upload Artifact(s)"
@@ -282,16 +345,22 @@ class UploadArtifact(ShellCommand):
     descriptionDone="Artifact(s) uploaded."
 
     def __init__(self, artifact=None, artifactDirectory=None, artifactServer=None, artifactServerDir=None,
-                 artifactServerURL=None, usePowerShell=True, **kwargs):
+                 artifactServerURL=None, usePowerShell=True, deduplicate=True, **kwargs):
         self.artifact=artifact
         self.artifactURL = None
+        self.artifactPath = None
         self.artifactDirectory = artifactDirectory
         self.artifactServer = artifactServer
         self.artifactServerDir = artifactServerDir
         self.artifactServerURL = artifactServerURL
         self.usePowerShell = usePowerShell
+        self.deduplicate = deduplicate
         ShellCommand.__init__(self, **kwargs)
 
+    def getIndexKey(self):
+        return (self.artifactServer, self.artifactServerDir, self.build.builder.config.builddir,
+                self.artifactDirectory, self.artifact)
+
     @defer.inlineCallbacks
     def start(self):
         br = self.build.requests[0]
@@ -312,8 +381,15 @@ class UploadArtifact(ShellCommand):
 
         remotelocation = getRemoteLocation(self.artifactServer, self.artifactServerDir, artifactPath, self.artifact)
 
-        command = rsyncWithRetry(self, self.artifact, remotelocation)
+        options = []
+        previousPath = getArtifactIndex().getPreviousUpload(self.getIndexKey())
+        if self.deduplicate and previousPath is not None and previousPath != artifactPath:
+            options.append("--link-dest=%s" % getLinkDest(self.artifactServerDir, artifactPath,
+                                                          previousPath, self.artifact))
+
+        command = rsyncWithRetry(self, self.artifact, remotelocation, options)
 
+        self.artifactPath = artifactPath
         self.artifactURL = self.artifactServerURL + "/" + artifactPath + "/" + self.artifact
         self.setCommand(command)
         ShellCommand.start(self)
@@ -321,6 +397,7 @@ class UploadArtifact(ShellCommand):
     def finished(self, results):
         if results == SUCCESS:
             self.addURL(self.artifact, self.artifactURL)
+            getArtifactIndex().addUpload(self.getIndexKey(), self.artifactPath)
         ShellCommand.finished(self, results)
 
 
@@ -330,13 +407,15 @@ class DownloadArtifact(ShellCommand):
     descriptionDone="Artifact(s) downloaded."
 
     def __init__(self, artifactBuilderName=None, artifact=None, artifactDirectory=None, artifactDestination=None,
-                 artifactServer=None, artifactServerDir=None, usePowerShell=True, **kwargs):
+                 artifactServer=None, artifactServerDir=None, usePowerShell=True, artifactCache=None,
+                 **kwargs):
         self.artifactBuilderName = artifactBuilderName
         self.artifact = artifact
         self.artifactDirectory = artifactDirectory
         self.artifactServer = artifactServer
         self.artifactServerDir = artifactServerDir
         self.artifactDestination = artifactDestination or artifact
+        self.artifactCache = artifactCache
         self.master = None
         self.usePowerShell = usePowerShell
         name = "Download Artifact for '%s'" % artifactBuilderName
@@ -361,11 +440,33 @@ class DownloadArtifact(ShellCommand):
 
         remotelocation = getRemoteLocation(self.artifactServer, self.artifactServerDir, artifactPath, self.artifact)
 
-        command = rsyncWithRetry(self, remotelocation, self.artifactDestination)
+        if self.artifactCache:
+            command = self.getCachedDownloadCommand(remotelocation)
+        else:
+            command = rsyncWithRetry(self, remotelocation, self.artifactDestination)
 
         self.setCommand(command)
         ShellCommand.start(self)
 
+    def getCachedDownloadCommand(self, remotelocation):
+        # the artifact is downloaded to the same place of the cache every
+        # time, so rsync only fetches what changed since the last download,
+        # and it is then copied locally to its destination. Each slave
+        # builder has its own place, as the builds running at the same time
+        # would delete each other's downloads
+        cacheDir = "%s/%s/" % (self.artifactCache.rstrip("/"),
+                               safeTranslate("%s_%s_%s_%s_%s" % (self.build.slavebuilder.slave.slavename,
+                                                                 self.build.builder.config.builddir,
+                                                                 self.artifactBuilderName,
+                                                                 self.artifactDirectory or "",
+                                                                 self.artifact)))
+        cached = cacheDir
+        if not self.artifact.endswith("/"):
+            cached += posixpath.basename(self.artifact)
+        return retryCommand(self, chainCommands(self,
+                                                rsyncCommand(remotelocation, cacheDir, ["--delete"]),
+                                                rsyncCommand(cached, self.artifactDestination)))
+
 
 class AcquireBuildLocks(LoggingBuildStep):
     name = "Acquire Build Slave"
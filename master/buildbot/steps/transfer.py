@@ -16,7 +16,8 @@
 from __future__ import with_statement
 
 
-import os.path, tarfile, tempfile
+import os.path, shutil, tarfile, tempfile, threading, time
+from collections import deque
 try:
     from cStringIO import StringIO
     assert StringIO
@@ -24,6 +25,8 @@ except ImportError:
     from StringIO import StringIO
 from twisted.spread import pb
 from twisted.python import log
+from twisted.python.failure import Failure
+from twisted.internet import defer, reactor
 from buildbot.process import buildstep
 from buildbot.process.buildstep import BuildStep
 from buildbot.process.buildstep import SUCCESS, FAILURE, SKIPPED
@@ -33,7 +36,32 @@ from buildbot.util.eventual import eventually
 from buildbot import config
 
 
-class _FileWriter(pb.Referenceable):
+class _Transfer(pb.Referenceable):
+    """
+    Base class for the transfer helpers, which counts the bytes transferred
+    """
+
+    transferred = 0
+    started = None
+    stopped = None
+
+    def _record(self, nbytes):
+        now = time.time()
+        if self.started is None:
+            self.started = now
+        self.stopped = now
+        self.transferred += nbytes
+
+    def getThroughput(self):
+        """
+        @return: the bytes transferred and the time it took
+        """
+        if self.started is None:
+            return 0, 0
+        return self.transferred, self.stopped - self.started
+
+
+class _FileWriter(_Transfer):
     """
     Helper class that acts as a file-object with write access
     """
@@ -59,6 +87,7 @@ class _FileWriter(pb.Referenceable):
         @type  data: C{string}
         @param data: String of data to write
         """
+        self._record(len(data))
         if self.remaining is not None:
             if len(data) > self.remaining:
                 data = data[:self.remaining]
@@ -130,45 +159,206 @@ def _extractall(self, path=".", members=None):
             else:
                 self._dbg(1, "tarfile: %s" % e)
 
-class _DirectoryWriter(_FileWriter):
+class _TarReader(object):
     """
-    A DirectoryWriter is implemented as a FileWriter, with an added post-processing
-    step to unpack the archive, once the transfer has completed.
+    File object which the blocks of an upload are added to in the reactor,
+    and read from by a thread unpacking them.  The Deferred returned when a
+    block is added fires once the thread read it, so the slave does not send
+    more than the thread keeps up with.
     """
 
-    def __init__(self, destroot, maxsize, compress, mode):
-        self.destroot = destroot
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.blocks = deque()
+        self.closed = False
+        self.aborted = False
+        self.done = False
+        self.failure = None
+
+    # called in the reactor
+
+    def add(self, data):
+        with self.cond:
+            if self.failure is not None:
+                return defer.fail(self.failure)
+            if self.done:
+                # anything after the end of the archive is ignored
+                return defer.succeed(None)
+            d = defer.Deferred()
+            self.blocks.append((data, d))
+            self.cond.notify()
+        return d
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def abort(self):
+        with self.cond:
+            self.aborted = True
+            self.cond.notify()
+
+    def finish(self, why=None):
+        """
+        Called once the thread stopped reading, with the failure that stopped
+        it, if any
+        """
+        with self.cond:
+            self.done = True
+            self.failure = why
+            blocks, self.blocks = self.blocks, deque()
+        for _, d in blocks:
+            if why is None:
+                d.callback(None)
+            else:
+                d.errback(why)
+
+    # called from the thread
+
+    def read(self, size=-1):
+        with self.cond:
+            while not self.blocks and not self.closed and not self.aborted:
+                self.cond.wait()
+            if self.aborted:
+                raise IOError("upload cancelled")
+            if not self.blocks:
+                return ''
+            data, d = self.blocks[0]
+            if 0 <= size < len(data):
+                self.blocks[0] = (data[size:], d)
+                return data[:size]
+            self.blocks.popleft()
+        reactor.callFromThread(d.callback, None)
+        return data
+
+
+def _mergeTree(src, dst):
+    """
+    Move the contents of directory C{src} into C{dst}, replacing the files
+    which are already there, and remove C{src}
+    """
+    if not os.path.lexists(dst):
+        os.rename(src, dst)
+        return
+    if os.path.isdir(src) and not os.path.islink(src) and \
+            os.path.isdir(dst) and not os.path.islink(dst):
+        for name in os.listdir(src):
+            _mergeTree(os.path.join(src, name), os.path.join(dst, name))
+        os.rmdir(src)
+        return
+    if os.path.isdir(dst) and not os.path.islink(dst):
+        shutil.rmtree(dst)
+    else:
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+class _DirectoryWriter(_Transfer):
+    """
+    Helper class that unpacks the tar archive of a directory upload as its
+    blocks are written, rather than once it is complete.
+
+    The archive is unpacked by a thread of its own, since it waits for the
+    slave between the blocks, into a temporary directory next to
+    C{destroot}, which is moved into place once the slave states that the
+    upload is complete.
+    """
+
+    def __init__(self, destroot, maxsize, compress):
+        self.destroot = os.path.abspath(destroot)
         self.compress = compress
+        self.remaining = maxsize
+        self.reader = _TarReader()
+        self.unpacked = None
 
-        self.fd, self.tarname = tempfile.mkstemp()
-        os.close(self.fd)
+    def remote_write(self, data):
+        """
+        Called from remote slave to write L{data} to the archive within
+        boundaries of L{maxsize}
 
-        _FileWriter.__init__(self, self.tarname, maxsize, mode)
+        @type  data: C{string}
+        @param data: String of data to write
+
+        @returns: Deferred which fires once the data was unpacked
+        """
+        self._record(len(data))
+        if self.remaining is not None:
+            data = data[:self.remaining]
+            self.remaining = self.remaining - len(data)
+        self._startUnpacking()
+        return self.reader.add(data)
 
     def remote_unpack(self):
         """
         Called by remote slave to state that no more data will be transfered
+
+        @returns: Deferred which fires once the archive was unpacked
         """
-        # Make sure remote_close is called, otherwise atomic rename wont happen
-        self.remote_close()
+        self._startUnpacking()
+        self.reader.close()
+        return self.unpacked
+
+    def cancel(self):
+        self.reader.abort()
+        if self.unpacked is not None:
+            # the upload failed, and nobody waits for the unpacking anymore
+            self.unpacked.addErrback(lambda _: None)
 
+    def _startUnpacking(self):
+        if self.unpacked is not None:
+            return
+        self.unpacked = defer.Deferred()
+        thread = threading.Thread(target=self._run, name="DirectoryUpload")
+        thread.setDaemon(True)
+        thread.start()
+
+    def _run(self):
+        try:
+            self._unpack()
+        except:
+            reactor.callFromThread(self._finished, Failure())
+        else:
+            reactor.callFromThread(self._finished, None)
+
+    def _finished(self, why):
+        self.reader.finish(why)
+        if why is None:
+            self.unpacked.callback(None)
+        else:
+            self.unpacked.errback(why)
+
+    def _unpack(self):
         # Map configured compression to a TarFile setting
         if self.compress == 'bz2':
             mode='r|bz2'
         elif self.compress == 'gz':
             mode='r|gz'
         else:
-            mode = 'r'
+            mode = 'r|'
 
         # Support old python
         if not hasattr(tarfile.TarFile, 'extractall'):
             tarfile.TarFile.extractall = _extractall
 
-        # Unpack archive and clean up after self
-        archive = tarfile.open(name=self.tarname, mode=mode)
-        archive.extractall(path=self.destroot)
-        archive.close()
-        os.remove(self.tarname)
+        parent = os.path.dirname(self.destroot)
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+        # not mkdtemp, which would leave the directory private once it is
+        # moved into place
+        tmpdir = tempfile.mktemp(prefix='.upload-', dir=parent)
+        os.mkdir(tmpdir)
+        try:
+            archive = tarfile.open(mode=mode, fileobj=self.reader)
+            archive.extractall(path=tmpdir)
+            archive.close()
+            # read what is left, until the slave states the upload is complete
+            while self.reader.read():
+                pass
+            _mergeTree(tmpdir, self.destroot)
+        finally:
+            if os.path.exists(tmpdir):
+                shutil.rmtree(tmpdir, ignore_errors=True)
 
 
 def makeStatusRemoteCommand(step, remote_command, args):
@@ -189,6 +379,9 @@ class _TransferBuildStep(BuildStep):
     haltOnFailure = True
     flunkOnFailure = True
 
+    # the _FileWriter or _FileReader of the transfer
+    transfer = None
+
     def setDefaultWorkdir(self, workdir):
         if self.workdir is None:
             self.workdir = workdir
@@ -200,6 +393,23 @@ class _TransferBuildStep(BuildStep):
             workdir = self.workdir
         return workdir
 
+    def _getWindowArgs(self, command):
+        # slaves from 2.17 on keep up to 'window' blocks in flight, older
+        # ones wait for each block to be acknowledged
+        if self.window > 1 and not self.slaveVersionIsOlderThan(command, "2.17"):
+            return {'window': self.window}
+        return {}
+
+    def _reportThroughput(self):
+        if self.transfer is None:
+            return
+        transferred, elapsed = self.transfer.getThroughput()
+        self.step_status.setStatistic('bytes_transferred', transferred)
+        if elapsed > 0:
+            throughput = transferred / elapsed
+            self.step_status.setStatistic('throughput', throughput)
+            self.step_status.setText2(['%.1f KiB/s' % (throughput / 1024)])
+
     def interrupt(self, reason):
         self.addCompleteLog('interrupt', str(reason))
         if self.cmd:
@@ -213,6 +423,7 @@ class _TransferBuildStep(BuildStep):
         if result == SKIPPED:
             return BuildStep.finished(self, SKIPPED)
 
+        self._reportThroughput()
         if self.cmd.didFail():
             return BuildStep.finished(self, FAILURE)
         return BuildStep.finished(self, SUCCESS)
@@ -226,7 +437,7 @@ class FileUpload(_TransferBuildStep):
 
     def __init__(self, slavesrc, masterdest,
                  workdir=None, maxsize=None, blocksize=16*1024, mode=None,
-                 keepstamp=False, url=None,
+                 keepstamp=False, url=None, window=16,
                  **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
 
@@ -235,6 +446,7 @@ class FileUpload(_TransferBuildStep):
         self.workdir = workdir
         self.maxsize = maxsize
         self.blocksize = blocksize
+        self.window = window
         if not isinstance(mode, (int, type(None))):
             config.error(
                 'mode must be an integer or None')
@@ -264,7 +476,7 @@ class FileUpload(_TransferBuildStep):
             self.addURL(os.path.basename(masterdest), self.url)
 
         # we use maxsize to limit the amount of data on both sides
-        fileWriter = _FileWriter(masterdest, self.maxsize, self.mode)
+        fileWriter = self.transfer = _FileWriter(masterdest, self.maxsize, self.mode)
 
         if self.keepstamp and self.slaveVersionIsOlderThan("uploadFile","2.13"):
             m = ("This buildslave (%s) does not support preserving timestamps. "
@@ -280,6 +492,7 @@ class FileUpload(_TransferBuildStep):
             'blocksize': self.blocksize,
             'keepstamp': self.keepstamp,
             }
+        args.update(self._getWindowArgs('uploadFile'))
 
         self.cmd = makeStatusRemoteCommand(self, 'uploadFile', args)
         d = self.runCommand(self.cmd)
@@ -298,7 +511,7 @@ class DirectoryUpload(_TransferBuildStep):
 
     def __init__(self, slavesrc, masterdest,
                  workdir=None, maxsize=None, blocksize=16*1024,
-                 compress=None, url=None, **buildstep_kwargs):
+                 compress=None, url=None, window=16, **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
 
         self.slavesrc = slavesrc
@@ -306,6 +519,7 @@ class DirectoryUpload(_TransferBuildStep):
         self.workdir = workdir
         self.maxsize = maxsize
         self.blocksize = blocksize
+        self.window = window
         if compress not in (None, 'gz', 'bz2'):
             config.error(
                 "'compress' must be one of None, 'gz', or 'bz2'")
@@ -334,7 +548,8 @@ class DirectoryUpload(_TransferBuildStep):
             self.addURL(os.path.basename(masterdest), self.url)
         
         # we use maxsize to limit the amount of data on both sides
-        dirWriter = _DirectoryWriter(masterdest, self.maxsize, self.compress, 0600)
+        dirWriter = self.transfer = _DirectoryWriter(masterdest, self.maxsize,
+                                                     self.compress)
 
         # default arguments
         args = {
@@ -345,6 +560,7 @@ class DirectoryUpload(_TransferBuildStep):
             'blocksize': self.blocksize,
             'compress': self.compress
             }
+        args.update(self._getWindowArgs('uploadDirectory'))
 
         self.cmd = makeStatusRemoteCommand(self, 'uploadDirectory', args)
         d = self.runCommand(self.cmd)
@@ -354,19 +570,8 @@ class DirectoryUpload(_TransferBuildStep):
             return res
         d.addCallback(self.finished).addErrback(self.failed)
 
-    def finished(self, result):
-        # Subclasses may choose to skip a transfer. In those cases, self.cmd
-        # will be None, and we should just let BuildStep.finished() handle
-        # the rest
-        if result == SKIPPED:
-            return BuildStep.finished(self, SKIPPED)
-
-        if self.cmd.didFail():
-            return BuildStep.finished(self, FAILURE)
-        return BuildStep.finished(self, SUCCESS)
 
-
-class _FileReader(pb.Referenceable):
+class _FileReader(_Transfer):
     """
     Helper class that acts as a file-object with read access
     """
@@ -388,6 +593,7 @@ class _FileReader(pb.Referenceable):
             return ''
 
         data = self.fp.read(maxlength)
+        self._record(len(data))
         return data
 
     def remote_close(self):
@@ -407,7 +613,7 @@ class FileDownload(_TransferBuildStep):
 
     def __init__(self, mastersrc, slavedest,
                  workdir=None, maxsize=None, blocksize=16*1024, mode=None,
-                 **buildstep_kwargs):
+                 window=16, **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
 
         self.mastersrc = mastersrc
@@ -415,6 +621,7 @@ class FileDownload(_TransferBuildStep):
         self.workdir = workdir
         self.maxsize = maxsize
         self.blocksize = blocksize
+        self.window = window
         if not isinstance(mode, (int, type(None))):
             config.error(
                 'mode must be an integer or None')
@@ -447,7 +654,7 @@ class FileDownload(_TransferBuildStep):
             # maybeDeferred, just re-raise the exception here.
             eventually(BuildStep.finished, self, FAILURE)
             return
-        fileReader = _FileReader(fp)
+        fileReader = self.transfer = _FileReader(fp)
 
         # default arguments
         args = {
@@ -458,6 +665,7 @@ class FileDownload(_TransferBuildStep):
             'workdir': self._getWorkdir(),
             'mode': self.mode,
             }
+        args.update(self._getWindowArgs('downloadFile'))
 
         self.cmd = makeStatusRemoteCommand(self, 'downloadFile', args)
         d = self.runCommand(self.cmd)
@@ -471,7 +679,7 @@ class StringDownload(_TransferBuildStep):
 
     def __init__(self, s, slavedest,
                  workdir=None, maxsize=None, blocksize=16*1024, mode=None,
-                 **buildstep_kwargs):
+                 window=16, **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
 
         self.s = s
@@ -479,6 +687,7 @@ class StringDownload(_TransferBuildStep):
         self.workdir = workdir
         self.maxsize = maxsize
         self.blocksize = blocksize
+        self.window = window
         if not isinstance(mode, (int, type(None))):
             config.error(
                 'mode must be an integer or None')
@@ -500,7 +709,7 @@ class StringDownload(_TransferBuildStep):
 
         # setup structures for reading the file
         fp = StringIO(self.s)
-        fileReader = _FileReader(fp)
+        fileReader = self.transfer = _FileReader(fp)
 
         # default arguments
         args = {
@@ -511,6 +720,7 @@ class StringDownload(_TransferBuildStep):
             'workdir': self._getWorkdir(),
             'mode': self.mode,
             }
+        args.update(self._getWindowArgs('downloadFile'))
 
         self.cmd = makeStatusRemoteCommand(self, 'downloadFile', args)
         d = self.runCommand(self.cmd)
@@ -643,6 +643,14 @@ class FakeSourceStampsComponent(FakeDBComponent):
                 sslist.append(ssdictcpy)
         return defer.succeed(sslist)
 
+    def getSourceStampsForSets(self, sourcestampsetids):
+        rv = dict((setid, []) for setid in sourcestampsetids)
+        for ssid in sorted(self.sourcestamps):
+            setid = self.sourcestamps[ssid]['sourcestampsetid']
+            if setid in rv:
+                rv[setid].append(self._getSourceStamp(ssid))
+        return defer.succeed(rv)
+
 class FakeBuildsetsComponent(FakeDBComponent):
 
     def setUp(self):
@@ -733,6 +741,14 @@ class FakeBuildsetsComponent(FakeDBComponent):
         else:
             return defer.succeed({})
 
+    def getBuildsetsByIds(self, bsids):
+        return defer.succeed(dict((bsid, self._row2dict(self.buildsets[bsid]))
+                                  for bsid in bsids if bsid in self.buildsets))
+
+    def getBuildsetsProperties(self, bsids):
+        return defer.succeed(dict((bsid, self.buildsets[bsid]['properties'] if bsid in self.buildsets else {})
+                                  for bsid in bsids))
+
     # fake methods
 
     def fakeBuildsetCompletion(self, bsid, result):
@@ -974,12 +990,50 @@ class FakeBuildRequestsComponent(FakeDBComponent):
 
         return defer.succeed(rv)
 
-    def getBuildRequestsInQueue(self, queue=None):
-        return self.getBuildRequests(complete=False, claimed=False)
+    def getUnclaimedBuildRequestsSince(self, minbrid, submitted_since=None):
+        d = self.getBuildRequests(complete=False, claimed=False)
+
+        def filterBrdicts(brdicts):
+            return [br for br in brdicts
+                    if br['brid'] > minbrid or
+                    (submitted_since is not None and br['submitted_at'] is not None
+                     and br['submitted_at'] >= submitted_since)]
+        d.addCallback(filterBrdicts)
+        return d
+
+    def getBuildRequestsInQueue(self, queue=None, order=True, brids=None, minbrid=None):
+        d = self.getBuildRequests(complete=False, claimed=False)
+
+        def filterBrdicts(brdicts):
+            if brids is not None:
+                brdicts = [br for br in brdicts if br['brid'] in brids]
+            if minbrid is not None:
+                brdicts = [br for br in brdicts if br['brid'] >= minbrid]
+            return brdicts
+        d.addCallback(filterBrdicts)
+        return d
+
+    def getBuildRequestsSourceStamps(self, brids):
+        rv = {}
+        for brid in brids:
+            if brid in self.sourcestamps:
+                rv[brid] = [dict(codebase=ss.codebase, branch=ss.branch, revision=ss.revision,
+                                 sourcestampsetid=ss.sourcestampsetid)
+                            for ss in self.sourcestamps[brid]]
+        return defer.succeed(rv)
 
     def getBuildRequestInQueue(self, buildername=None, sourcestamps=None, sorted=True, limit=None):
         return self.getBuildRequests(buildername=buildername, complete=False, claimed=False)
 
+    @defer.inlineCallbacks
+    def getBuildRequestInQueueCounts(self):
+        brdicts = yield self.getBuildRequestInQueue()
+        counts = {}
+        for brdict in brdicts:
+            key = (brdict['buildername'], brdict['priority'])
+            counts[key] = counts.get(key, 0) + 1
+        defer.returnValue(counts)
+
     def claimBuildRequests(self, brids, claimed_at=None):
         for brid in brids:
             if brid not in self.reqs or brid in self.claims:
@@ -1007,6 +1061,17 @@ class FakeBuildRequestsComponent(FakeDBComponent):
 
         return defer.succeed(None)
 
+    def unclaimExpiredRequests(self, old, _reactor=None):
+        old_epoch = (_reactor or self._reactor).seconds() - old
+        expired = []
+        for brid, claim in self.claims.items():
+            br = self.reqs.get(brid)
+            if br is not None and not br.complete and claim.claimed_at < old_epoch:
+                del self.claims[brid]
+                expired.append(dict(brid=brid, buildsetid=br.buildsetid,
+                                    buildername=br.buildername))
+        return defer.succeed(expired)
+
     def updateBuildRequests(self, brids, results):
         return defer.succeed(None)
 
@@ -1081,6 +1146,10 @@ class FakeBuildRequestsComponent(FakeDBComponent):
         return defer.succeed(None)
 
 
+    def claimBuildRequestGroups(self, groups, claimed_at=None):
+        return self.claimBuildRequests([brid for brids in groups for brid in brids],
+                                       claimed_at=claimed_at)
+
     def mergeBuildingRequest(self, requests, brids, number, queue):
         if queue == Queue.unclaimed:
             return self.claimBuildRequests(brids)
@@ -1131,8 +1200,10 @@ class FakeBuildRequestsComponent(FakeDBComponent):
     def fakeClaimBuildRequest(self, brid, claimed_at=None, objectid=None):
         if objectid is None:
             objectid = self.MASTER_ID
+        if claimed_at is None:
+            claimed_at = self._reactor.seconds()
         self.claims[brid] = BuildRequestClaim(brid=brid,
-            objectid=objectid, claimed_at=self._reactor.seconds())
+            objectid=objectid, claimed_at=claimed_at)
 
     def fakeUnclaimBuildRequest(self, brid):
         del self.claims[brid]
@@ -40,6 +40,9 @@ class FakeCache(object):
         d.addCallback(mkref)
         return d
 
+    def __contains__(self, key):
+        return False
+
 
 class FakeCaches(object):
 
@@ -136,6 +139,9 @@ class FakeMaster(object):
     def subscribeToBuildRequests(self, callback):
         pass
 
+    def subscribeToCancelledBuildRequests(self, callback):
+        pass
+
     # work around http://code.google.com/p/mock/issues/detail?id=105
     def _get_child_mock(self, **kw):
         return mock.Mock(**kw)
@@ -143,9 +149,18 @@ class FakeMaster(object):
     def maybeBuildsetComplete(self, bsid):
         pass
 
+    def buildRequestAdded(self, bsid, brid, buildername):
+        pass
+
     def buildRequestRemoved(self, bsid, brid, buildername):
         pass
 
+    def buildRequestsClaimed(self, brids):
+        pass
+
+    def buildRequestsUnclaimed(self, brids):
+        pass
+
     def getLockByID(self, lockid):
         if not lockid in self.locks:
             self.locks[lockid] = lockid.lockClass(lockid)
@@ -15,7 +15,7 @@
 
 import mock
 import textwrap
-from buildbot.status import logfile
+from buildbot.status import logfile, logwriter
 from buildbot.test.util import interfaces, dirs
 from buildbot.test.fake import remotecommand
 from twisted.trial import unittest
@@ -113,7 +113,10 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin, RealTests):
         self.setUpDirs('basedir')
 
     def tearDown(self):
-        self.tearDownDirs()
+        # let the log writer finish with the files first
+        d = logwriter.getWriter().drain()
+        d.addCallback(lambda _: self.tearDownDirs())
+        return d
 
     def makeLogFile(self, name='n', logfilename='nLog'):
         # this is one reason this interface sucks:
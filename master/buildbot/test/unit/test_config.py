@@ -42,6 +42,7 @@ global_defaults = dict(
     buildHorizon=None,
     logCompressionLimit=4096,
     logCompressionMethod='bz2',
+    logCompressionWorkers=2,
     logMaxTailSize=None,
     logMaxSize=None,
     properties=properties.Properties(),
@@ -62,6 +63,7 @@ load_global_defaults = dict(
     buildHorizon=None,
     logCompressionLimit=4096,
     logCompressionMethod='bz2',
+    logCompressionWorkers=2,
     logMaxTailSize=None,
     logMaxSize=None,
     properties=properties.Properties(),
@@ -427,7 +429,7 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
     def test_load_global_logCompressionMethod_invalid(self):
         self.cfg.load_global(self.filename,
                 dict(logCompressionMethod='foo'))
-        self.assertConfigError(self.errors, "must be 'bz2' or 'gz'")
+        self.assertConfigError(self.errors, "must be 'bz2', 'gz', 'zstd' or 'lz4'")
 
     def test_load_global_codebaseGenerator(self):
         func = lambda _: "dummy"
@@ -441,6 +443,27 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
                 "codebaseGenerator must be a callable "
                 "accepting a dict and returning a str")
 
+    def test_load_global_buildCacheMemory(self):
+        self.do_test_load_global(dict(buildCacheMemory=1024), buildCacheMemory=1024)
+
+    def test_load_global_logCompressionMethod_zstd(self):
+        self.do_test_load_global(dict(logCompressionMethod='zstd'),
+                                 logCompressionMethod='zstd')
+
+    def test_load_global_logCompressionWorkers(self):
+        self.do_test_load_global(dict(logCompressionWorkers=4), logCompressionWorkers=4)
+
+    def test_load_global_logCompressionWorkers_invalid(self):
+        self.cfg.load_global(self.filename, dict(logCompressionWorkers=0))
+        self.assertConfigError(self.errors, "must be at least 1")
+
+    def test_load_global_dispatchBatchSize(self):
+        self.do_test_load_global(dict(dispatchBatchSize=50), dispatchBatchSize=50)
+
+    def test_load_global_dispatchBatchSize_invalid(self):
+        self.cfg.load_global(self.filename, dict(dispatchBatchSize=0))
+        self.assertConfigError(self.errors, "must be at least 1")
+
     def test_load_global_logMaxSize(self):
         self.do_test_load_global(dict(logMaxSize=123), logMaxSize=123)
 
@@ -712,9 +712,13 @@ class TestBuildsetsConnectorComponent(
         clock.advance(self.CLAIMED_AT_EPOCH)
 
         meth = self.db.buildrequests.unclaimExpiredRequests
-        return self.do_test_unclaimMethod(
-            lambda : meth(100, _reactor=clock),
+        expired = []
+        d = self.do_test_unclaimMethod(
+            lambda : meth(100, _reactor=clock).addCallback(expired.extend),
             [47, 49])
+        d.addCallback(lambda _: self.assertEqual(expired,
+            [dict(brid=49, buildsetid=self.BSID, buildername='bldr')]))
+        return d
 
     def test_unclaimBuildRequests(self):
         to_unclaim = [
@@ -953,6 +957,37 @@ class TestBuildsetsConnectorComponent(
         d.addCallback(checkBuildRequests, 1)
         return d
 
+    @defer.inlineCallbacks
+    def test_claimBuildRequestGroups(self):
+        clock = task.Clock()
+        clock.advance(1300305712)
+        yield self.insertTestData([fakedb.BuildRequest(id=brid, buildsetid=self.BSID)
+                                   for brid in range(1, 6)])
+
+        yield self.db.buildrequests.claimBuildRequestGroups([[1, 2, 3], [4]], _reactor=clock)
+
+        brdicts = yield self.db.buildrequests.getBuildRequests(brids=range(1, 6))
+        self.assertEqual(sorted((br['brid'], br['mergebrid'], br['claimed'], br['mine'])
+                                for br in brdicts),
+                         [(1, None, True, True), (2, 1, True, True), (3, 1, True, True),
+                          (4, None, True, True), (5, None, False, False)])
+
+    @db.skip_for_dialect('mysql')
+    @defer.inlineCallbacks
+    def test_claimBuildRequestGroups_other_master_claim(self):
+        yield self.insertTestData([fakedb.BuildRequest(id=brid, buildsetid=self.BSID)
+                                   for brid in range(1, 5)] +
+                                  [fakedb.BuildRequestClaim(brid=4, objectid=self.OTHER_MASTER_ID,
+                                                            claimed_at=1300103810)])
+
+        yield self.assertFailure(self.db.buildrequests.claimBuildRequestGroups([[1, 2], [3, 4]]),
+                                 buildrequests.AlreadyClaimedError)
+
+        # nothing was claimed or merged
+        brdicts = yield self.db.buildrequests.getBuildRequests(brids=range(1, 5))
+        self.assertEqual(sorted((br['brid'], br['mergebrid'], br['mine']) for br in brdicts),
+                         [(1, None, False), (2, None, False), (3, None, False), (4, None, False)])
+
     def test_findCompatibleFinishedBuildRequest(self):
         breqs = [fakedb.BuildRequest(id=1, buildsetid=1, buildername="B", complete=1, results=0,
                                      submitted_at=1418823086, complete_at=1418823086),
@@ -1222,6 +1257,37 @@ class TestBuildsetsConnectorComponent(
         d = self.insertTestData(breqs + breqsclaims + breqs_sourcestamps)
         return d
 
+    @defer.inlineCallbacks
+    def test_getBuildRequestsSourceStamps(self):
+        yield self.insertBuildRequestsInQueue()
+
+        sourcestamps = yield self.db.buildrequests.getBuildRequestsSourceStamps([1, 6, 42])
+        self.assertEqual(sorted(sourcestamps.keys()), [1, 6])
+        self.assertEqual(sorted(sourcestamps[6]),
+                         sorted([dict(codebase='1', branch='master', revision='a6', sourcestampsetid=6),
+                                 dict(codebase='2', branch='5.2/staging', revision='b6', sourcestampsetid=6)]))
+
+    @defer.inlineCallbacks
+    def test_getBuildRequestInQueueCounts(self):
+        yield self.insertBuildRequestsInQueue()
+
+        counts = yield self.db.buildrequests.getBuildRequestInQueueCounts()
+        # the pending requests 1, 2 and 8, and the resume requests 3 and 7
+        self.assertEqual(counts, {('bldr1', 20): 1, ('bldr1', 30): 1, ('bldr1', 50): 1,
+                                  ('bldr1', 100): 1, ('bldr2', 50): 1})
+
+    @defer.inlineCallbacks
+    def test_getUnclaimedBuildRequestsSince(self):
+        yield self.insertBuildRequestsInQueue()
+
+        brdicts = yield self.db.buildrequests.getUnclaimedBuildRequestsSince(1)
+        self.assertEqual(sorted(br['brid'] for br in brdicts), [2, 8])
+
+        # requests below the high water mark are found by submission time
+        brdicts = yield self.db.buildrequests.getUnclaimedBuildRequestsSince(
+            8, submitted_since=epoch2datetime(1450171030))
+        self.assertEqual([br['brid'] for br in brdicts], [2])
+
     def test_getBuildRequestInQueueCodebasesFound(self, filter = None):
         expectedBreqs = [self.fakeRequest(brid=8, bsid=8, results=BEGINNING, priority=30, submitted_at=1450171024),
                          self.fakeRequest(brid=1, bsid=1, results=BEGINNING, priority=20, submitted_at=1450171024),
@@ -1338,6 +1404,17 @@ class TestBuildsetsConnectorComponent(
         d.addCallback(lambda queue: self.assertEqual(queue, expectedBreqs))
         return d
 
+    @defer.inlineCallbacks
+    def test_getPrioritizedBuildRequestsInUnclaimedQueueByBrids(self):
+        yield self.insertPrioritizedBreqs()
+
+        queue = yield self.db.buildrequests.getBuildRequestsInQueue(queue=Queue.unclaimed, brids=[1, 4, 9])
+        # brid 4 is waiting to be resumed, so it is not in the unclaimed queue
+        self.assertEqual([br['brid'] for br in queue], [9, 1])
+
+        queue = yield self.db.buildrequests.getBuildRequestsInQueue(queue=Queue.unclaimed, minbrid=3)
+        self.assertEqual([br['brid'] for br in queue], [9, 3])
+
 
     def test_getPrioritizedBuildRequestsInResumeQueue(self):
         expectedBreqs = [self.fakePrioritzedRequest(brid=6, results=RESUME,
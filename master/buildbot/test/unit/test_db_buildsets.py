@@ -491,3 +491,43 @@ class TestBuildsetsConnectorComponent(
               self.assertEqual(bsdictlist, [])
           d.addCallback(check)
           return d
+
+    def test_getBuildsetsByIds(self):
+        d = self.insertTestData([
+            fakedb.Buildset(id=91, sourcestampsetid=234, complete=0,
+                    results=-1, submitted_at=266761875, reason='rsn'),
+            fakedb.Buildset(id=92, sourcestampsetid=234, complete=1,
+                    complete_at=298297875, results=7, submitted_at=266761875),
+        ])
+        d.addCallback(lambda _ :
+                self.db.buildsets.getBuildsetsByIds([91, 92, 93]))
+        def check(bsdicts):
+            self.assertEqual(sorted(bsdicts.keys()), [91, 92])
+            self.assertEqual((bsdicts[91]['reason'], bsdicts[91]['complete']),
+                             ('rsn', False))
+            self.assertEqual((bsdicts[92]['bsid'], bsdicts[92]['results']), (92, 7))
+        d.addCallback(check)
+        return d
+
+    def test_getBuildsetsProperties(self):
+        d = self.insertTestData([
+            fakedb.Buildset(id=91, sourcestampsetid=234, complete=0,
+                    results=-1, submitted_at=0),
+            fakedb.Buildset(id=92, sourcestampsetid=234, complete=0,
+                    results=-1, submitted_at=0),
+            fakedb.BuildsetProperty(buildsetid=91, property_name='prop1',
+                    property_value='["one", "fake1"]'),
+            fakedb.BuildsetProperty(buildsetid=91, property_name='prop2',
+                    property_value='["two", "fake2"]'),
+            fakedb.BuildsetProperty(buildsetid=92, property_name='prop1',
+                    property_value='["three", "fake3"]'),
+        ])
+        d.addCallback(lambda _ :
+                self.db.buildsets.getBuildsetsProperties([91, 92, 93]))
+        def check(props):
+            self.assertEqual(props, {
+                91: dict(prop1=("one", "fake1"), prop2=("two", "fake2")),
+                92: dict(prop1=("three", "fake3")),
+                93: {}})
+        d.addCallback(check)
+        return d
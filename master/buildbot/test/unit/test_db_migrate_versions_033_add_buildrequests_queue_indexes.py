@@ -0,0 +1,74 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from twisted.trial import unittest
+from buildbot.test.util import migration
+import sqlalchemy as sa
+from sqlalchemy.engine import reflection
+
+class Migration(migration.MigrateTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        return self.setUpMigrateTest()
+
+    def tearDown(self):
+        return self.tearDownMigrateTest()
+
+    def create_tables_thd(self, conn):
+        metadata = sa.MetaData()
+        metadata.bind = conn
+
+        buildrequests = sa.Table('buildrequests', metadata,
+            sa.Column('id', sa.Integer,  primary_key=True),
+            sa.Column('buildsetid', sa.Integer, nullable=False),
+            sa.Column('buildername', sa.String(length=256), nullable=False),
+            sa.Column('priority', sa.Integer, nullable=False,
+                server_default=sa.DefaultClause("0")),
+            sa.Column('complete', sa.Integer,
+                server_default=sa.DefaultClause("0")),
+            sa.Column('results', sa.SmallInteger),
+            sa.Column('submitted_at', sa.Integer, nullable=False),
+            sa.Column('complete_at', sa.Integer),
+            sa.Column('artifactbrid', sa.Integer, nullable=True),
+            sa.Column('triggeredbybrid', sa.Integer, nullable=True),
+            sa.Column('mergebrid', sa.Integer, nullable=True),
+            sa.Column('startbrid', sa.Integer, nullable=True),
+            sa.Column('slavepool', sa.String(128), nullable=True),
+        )
+        buildrequests.create(bind=conn)
+
+        sa.Index('buildrequests_complete', buildrequests.c.complete).create()
+
+    # tests
+
+    def test_migrate(self):
+        def setup_thd(conn):
+            self.create_tables_thd(conn)
+
+        def verify_thd(conn):
+            insp = reflection.Inspector.from_engine(conn)
+            indexes = dict((i['name'], i['column_names'])
+                           for i in insp.get_indexes('buildrequests'))
+            self.assertEqual(indexes, {
+                'buildrequests_complete': ['complete'],
+                'buildrequests_queue': ['complete', 'mergebrid', 'priority',
+                                        'submitted_at'],
+                'buildrequests_buildername_complete': ['buildername',
+                                                       'complete', 'mergebrid'],
+                'buildrequests_startbrid_complete': ['startbrid', 'complete',
+                                                     'mergebrid'],
+            })
+
+        return self.do_test_migration(32, 33, setup_thd, verify_thd)
@@ -0,0 +1,201 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import re
+import datetime
+import sqlalchemy as sa
+from twisted.trial import unittest
+from twisted.internet import defer
+from buildbot.db import buildrequests
+from buildbot.db.buildrequests import Queue
+from buildbot.test.util import connector_component
+from buildbot.test.fake import fakedb
+from buildbot.util import UTC
+from buildbot.status.results import RESUME
+
+# sqlite reports a full table scan as 'SCAN TABLE <name>' or, from 3.36,
+# 'SCAN <name>', followed by the index used to walk the table, if any
+sqlite_scan_re = re.compile(r"^SCAN (TABLE )?(\w+)(?: AS \w+)?( USING (COVERING )?INDEX)?")
+
+
+class QueryPlanMixin(connector_component.ConnectorComponentMixin):
+    """
+    Runs the statements a connector method executes through the database's
+    EXPLAIN, to catch queries that have to read a whole table.  This runs on
+    SQLite, and on MySQL when BUILDBOT_TEST_DB_URL points to a MySQL database.
+    """
+
+    def setUpQueryPlans(self):
+        dialect = self.db_engine.dialect.name
+        if dialect not in ('sqlite', 'mysql'):
+            raise unittest.SkipTest("query plans are not checked on %s" % dialect)
+
+        self.statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                self.statements.append((statement, parameters))
+        sa.event.listen(self.db_engine, 'before_cursor_execute', before_cursor_execute)
+
+    def explain(self, statement, parameters):
+        def thd(conn):
+            # use the DBAPI cursor, so the statement runs exactly as it was
+            # captured, with its parameters already in the DBAPI's format
+            cursor = conn.connection.cursor()
+            try:
+                if conn.dialect.name == 'sqlite':
+                    cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+                    # the detail is the last column whatever the sqlite version
+                    return [row[-1] for row in cursor.fetchall()]
+                else:
+                    cursor.execute("EXPLAIN " + statement, parameters)
+                    names = [col[0] for col in cursor.description]
+                    return [dict(zip(names, row)) for row in cursor.fetchall()]
+            finally:
+                cursor.close()
+        return self.db_pool.do(thd)
+
+    def fullScans(self, plan, tables):
+        scans = []
+        for step in plan:
+            if isinstance(step, dict):
+                # mysql: an access type of ALL reads every row of the table
+                if step['table'] in tables and step['type'] == 'ALL':
+                    scans.append("%(table)s: %(type)s" % step)
+            else:
+                mo = sqlite_scan_re.match(step)
+                # walking a whole index is as bad as walking the table
+                if mo and mo.group(2) in tables:
+                    scans.append(step)
+        return scans
+
+    @defer.inlineCallbacks
+    def assertNoFullScans(self, fn, tables, *args, **kwargs):
+        """
+        Call C{fn} and check that none of the SELECT statements it runs scans
+        all of one of C{tables}.
+        """
+        self.statements = []
+        yield fn(*args, **kwargs)
+        self.assertTrue(self.statements, "%s ran no queries" % fn.__name__)
+        for statement, parameters in self.statements:
+            plan = yield self.explain(statement, parameters)
+            scans = self.fullScans(plan, tables)
+            if scans:
+                self.fail("%s scans %s in\n%s\nplan: %r" %
+                          (fn.__name__, ", ".join(scans), statement, plan))
+
+
+class TestBuildRequestsQueryPlans(QueryPlanMixin, unittest.TestCase):
+
+    MASTER_ID = fakedb.FakeBuildRequestsComponent.MASTER_ID
+    OTHER_MASTER_ID = MASTER_ID + 1111
+    tables = ('buildrequests', 'buildrequest_claims')
+
+    def setUp(self):
+        d = self.setUpConnectorComponent(
+            table_names=['patches', 'changes', 'sourcestamp_changes',
+                         'buildsets', 'buildset_properties', 'buildrequests',
+                         'objects', 'buildrequest_claims', 'sourcestamps',
+                         'sourcestampsets', 'builds'])
+
+        def finish_setup(_):
+            self.db.buildrequests = buildrequests.BuildRequestsConnectorComponent(self.db)
+            self.db.master.getObjectId = lambda: defer.succeed(self.MASTER_ID)
+            self.setUpQueryPlans()
+        d.addCallback(finish_setup)
+
+        # enough completed requests that walking the table would be costly,
+        # with a few pending, merged, claimed and resumed ones mixed in
+        rows = [fakedb.SourceStampSet(id=234),
+                fakedb.SourceStamp(id=234, sourcestampsetid=234),
+                fakedb.Object(id=self.MASTER_ID, name="fake master",
+                              class_name="BuildMaster"),
+                fakedb.Object(id=self.OTHER_MASTER_ID, name="other master",
+                              class_name="BuildMaster"),
+                fakedb.Buildset(id=567, sourcestampsetid=234)]
+        for brid in range(1, 201):
+            complete = int(brid < 190)
+            rows.append(fakedb.BuildRequest(id=brid, buildsetid=567,
+                                            buildername="bldr%d" % (brid % 10),
+                                            priority=brid % 3, complete=complete,
+                                            submitted_at=1300305712 + brid,
+                                            startbrid=brid - brid % 5 or None))
+            if complete:
+                objectid = (self.MASTER_ID, self.OTHER_MASTER_ID)[brid % 2]
+                rows.append(fakedb.BuildRequestClaim(brid=brid, objectid=objectid,
+                                                     claimed_at=1300305712 + brid))
+        rows.append(fakedb.BuildRequest(id=201, buildsetid=567, buildername="bldr1",
+                                        complete=0, mergebrid=195, startbrid=195))
+        rows.append(fakedb.BuildRequest(id=202, buildsetid=567, buildername="bldr2",
+                                        complete=0, results=RESUME))
+        rows.append(fakedb.BuildRequestClaim(brid=202, objectid=self.MASTER_ID,
+                                             claimed_at=1300305712))
+        d.addCallback(lambda _: self.insertTestData(rows))
+
+        def analyze(conn):
+            # give the planner the same statistics it would have on a live
+            # database
+            if conn.dialect.name == 'sqlite':
+                conn.execute("ANALYZE")
+            else:
+                conn.execute("ANALYZE TABLE buildrequests, buildrequest_claims")
+        d.addCallback(lambda _: self.db_pool.do(analyze))
+        return d
+
+    def tearDown(self):
+        return self.tearDownConnectorComponent()
+
+    def test_getBuildRequestsInQueue_unclaimed(self):
+        return self.assertNoFullScans(self.db.buildrequests.getBuildRequestsInQueue,
+                                      self.tables, queue=Queue.unclaimed)
+
+    def test_getBuildRequestsInQueue_unclaimed_buildername(self):
+        return self.assertNoFullScans(self.db.buildrequests.getBuildRequestsInQueue,
+                                      self.tables, queue=Queue.unclaimed, buildername="bldr1")
+
+    def test_getBuildRequestsInQueue_resume(self):
+        return self.assertNoFullScans(self.db.buildrequests.getBuildRequestsInQueue,
+                                      self.tables, queue=Queue.resume)
+
+    def test_getBuildRequestsInQueue_mergebrids(self):
+        return self.assertNoFullScans(self.db.buildrequests.getBuildRequestsInQueue,
+                                      self.tables, queue=Queue.unclaimed,
+                                      mergebrids=[195], order=False)
+
+    def test_getBuildRequestsInQueue_startbrid(self):
+        return self.assertNoFullScans(self.db.buildrequests.getBuildRequestsInQueue,
+                                      self.tables, queue=Queue.unclaimed, startbrid=195)
+
+    def test_getBuildRequestInQueue(self):
+        return self.assertNoFullScans(self.db.buildrequests.getBuildRequestInQueue,
+                                      self.tables, buildername="bldr1", sorted=True)
+
+    def test_getBuildRequests_unclaimed(self):
+        return self.assertNoFullScans(self.db.buildrequests.getBuildRequests,
+                                      self.tables, buildername="bldr1", claimed=False)
+
+    def test_getUnclaimedBuildRequestsSince(self):
+        return self.assertNoFullScans(self.db.buildrequests.getUnclaimedBuildRequestsSince,
+                                      self.tables, 195,
+                                      datetime.datetime(2011, 3, 16, 20, 0, tzinfo=UTC))
+
+    def test_getBuildRequestBuildChain(self):
+        return self.assertNoFullScans(self.db.buildrequests.getBuildRequestBuildChain,
+                                      self.tables, 195)
+
+    def test_findCompatibleFinishedBuildRequest(self):
+        return self.assertNoFullScans(self.db.buildrequests.findCompatibleFinishedBuildRequest,
+                                      self.tables, "bldr5", 185)
@@ -246,3 +246,39 @@ class TestSourceStampsConnectorComponent(
         d.addCallback(checkRevision, codebase='c2', revision='r2')
 
         return d
+
+    def test_getSourceStampsForSets(self):
+        d = self.insertTestData([
+            fakedb.Change(changeid=16),
+            fakedb.Change(changeid=20),
+            fakedb.Patch(id=99, patch_base64='aGVsbG8sIHdvcmxk',
+                patch_author='bar', patch_comment='foo', subdir='/foo',
+                patchlevel=3),
+            fakedb.SourceStampSet(id=1),
+            fakedb.SourceStampSet(id=2),
+            fakedb.SourceStamp(id=1, sourcestampsetid=1, branch='b1', codebase='c1'),
+            fakedb.SourceStamp(id=2, sourcestampsetid=1, branch='b2', codebase='c2',
+                patchid=99),
+            fakedb.SourceStamp(id=3, sourcestampsetid=2, branch='b1', codebase='c1'),
+            fakedb.SourceStampChange(sourcestampid=1, changeid=16),
+            fakedb.SourceStampChange(sourcestampid=1, changeid=20),
+            fakedb.SourceStampChange(sourcestampid=3, changeid=20),
+        ])
+        d.addCallback(lambda _ :
+                self.db.sourcestamps.getSourceStampsForSets([1, 2, 3]))
+        def check(sslists):
+            self.assertEqual(dict((setid, [ss['ssid'] for ss in sslist])
+                                  for setid, sslist in sslists.iteritems()),
+                             {1: [1, 2], 2: [3], 3: []})
+            self.assertEqual([ss['changeids'] for ss in sslists[1]],
+                             [set([16, 20]), set()])
+            self.assertEqual((sslists[1][1]['patch_body'], sslists[1][1]['patch_subdir']),
+                             ('hello, world', '/foo'))
+            self.assertEqual(sslists[2][0]['patch_body'], None)
+        d.addCallback(check)
+        d.addCallback(lambda _ :
+                self.db.sourcestamps.getSourceStamps(1))
+        d.addCallback(lambda sslist :
+                self.db.sourcestamps.getSourceStampsForSets([1]).addCallback(
+                    lambda sslists : self.assertEqual(sslists[1], sslist)))
+        return d
@@ -527,7 +527,109 @@ class Polling(dirs.DirsMixin, misc.PatcherMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    @defer.inlineCallbacks
+    def test_pollDatabaseBuildRequests_highWaterMark(self):
+        self.db.insertTestData([
+            fakedb.BuildRequest(id=11, buildsetid=9, buildername='eleventy',
+                                submitted_at=1000),
+        ])
+        yield self.master.pollDatabaseBuildRequests()
+        self.assertEqual((self.master._last_unclaimed_brid,
+                          self.master._last_unclaimed_submitted_at),
+                         (11, epoch2datetime(1000)))
+
+        # a request that is unclaimed again is not noticed before the next
+        # reconciliation, unlike new requests, including those with a lower
+        # id that were submitted recently
+        self.db.buildrequests.fakeClaimBuildRequest(11)
+        yield self.master.pollDatabaseBuildRequests()
+        self.db.buildrequests.fakeUnclaimBuildRequest(11)
+        self.db.insertTestData([
+            fakedb.BuildRequest(id=10, buildsetid=9, buildername='ten',
+                                submitted_at=990),
+            fakedb.BuildRequest(id=5, buildsetid=9, buildername='five',
+                                submitted_at=500),
+            fakedb.BuildRequest(id=12, buildsetid=9, buildername='twelve',
+                                submitted_at=900),
+        ])
+        self.gotten_buildrequest_additions = []
+        yield self.master.pollDatabaseBuildRequests()
+        self.assertEqual(sorted(self.gotten_buildrequest_additions),
+                         [dict(bsid=9, brid=10, buildername='ten'),
+                          dict(bsid=9, brid=12, buildername='twelve')])
+
+        self.gotten_buildrequest_additions = []
+        self.master._last_unclaimed_reconcile = 0
+        yield self.master.pollDatabaseBuildRequests()
+        self.assertEqual(self.gotten_buildrequest_additions,
+                         [dict(bsid=9, brid=5, buildername='five')])
+
+    @defer.inlineCallbacks
+    def test_pollDatabaseBuildRequests_expiredClaim(self):
+        self.db.insertTestData([
+            fakedb.BuildRequest(id=11, buildsetid=9, buildername='eleventy'),
+        ])
+        yield self.master.pollDatabaseBuildRequests()
+
+        # another master claims the request, and goes away
+        self.db.buildrequests.fakeClaimBuildRequest(11, objectid=99,
+            claimed_at=reactor.seconds() - 2 * self.master.RECLAIM_BUILD_INTERVAL *
+                       self.master.UNCLAIMED_BUILD_FACTOR)
+        yield self.master.pollDatabaseBuildRequests()
+
+        # once its claim expired, the request is unclaimed and notified again
+        self.master._last_claim_cleanup = 0
+        yield self.master.pollDatabaseBuildRequests()
+        self.assertEqual(self.gotten_buildrequest_additions,
+                         [dict(bsid=9, brid=11, buildername='eleventy'),
+                          dict(bsid=9, brid=11, buildername='eleventy')])
+        self.assertNotIn(11, self.db.buildrequests.claims)
+
+        # and not a third time
+        yield self.master.pollDatabaseBuildRequests()
+        self.assertEqual(len(self.gotten_buildrequest_additions), 2)
+
+    @defer.inlineCallbacks
+    def test_pollDatabaseBuildRequests_claimedByThisMaster(self):
+        self.db.insertTestData([
+            fakedb.BuildRequest(id=11, buildsetid=9, buildername='eleventy'),
+        ])
+        yield self.master.pollDatabaseBuildRequests()
+        self.db.buildrequests.fakeClaimBuildRequest(11)
+        self.master.buildRequestsClaimed([11])
+        self.db.buildrequests.fakeUnclaimBuildRequest(11)
+
+        # the request is not known as unclaimed anymore, so the next
+        # reconciliation notifies it again
+        self.master._last_unclaimed_reconcile = 0
+        yield self.master.pollDatabaseBuildRequests()
+        self.assertEqual(self.gotten_buildrequest_additions,
+                         [dict(bsid=9, brid=11, buildername='eleventy'),
+                          dict(bsid=9, brid=11, buildername='eleventy')])
+
+    @defer.inlineCallbacks
+    def test_pollDatabaseBuildRequests_unclaimedByThisMaster(self):
+        self.db.insertTestData([
+            fakedb.BuildRequest(id=11, buildsetid=9, buildername='eleventy'),
+        ])
+        yield self.master.pollDatabaseBuildRequests()
+        self.db.buildrequests.fakeClaimBuildRequest(11)
+        self.master.buildRequestsClaimed([11])
+
+        # a retried build unclaims its request, which the builder notifies
+        self.db.buildrequests.fakeUnclaimBuildRequest(11)
+        self.master.buildRequestsUnclaimed([11])
+
+        # so that the next reconciliation does not notify it again
+        self.master._last_unclaimed_reconcile = 0
+        yield self.master.pollDatabaseBuildRequests()
+        self.assertEqual(self.gotten_buildrequest_additions,
+                         [dict(bsid=9, brid=11, buildername='eleventy')])
+        self.assertIn(11, self.master._last_unclaimed_brids_set)
+
     def test_pollDatabaseBuildRequests_incremental(self):
+        # claims and unclaims are only noticed by full reconciliations
+        self.patch(self.master, 'UNCLAIMED_RECONCILE_INTERVAL', 0)
         d = defer.succeed(None)
         def insert1(_):
             self.db.insertTestData([
@@ -156,6 +156,8 @@ class TestBotMaster(unittest.TestCase):
                     new_config)
             self.assertTrue(
                     self.botmaster.maybeStartBuildsForAllBuilders.called)
+            self.assertEqual(self.botmaster.brd.dispatchBatchSize,
+                    new_config.dispatchBatchSize)
         return d
 
     @defer.inlineCallbacks
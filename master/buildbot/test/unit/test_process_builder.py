@@ -23,6 +23,7 @@ from buildbot.test.fake import fakedb, fakemaster
 from buildbot.test.fake import fakebuild
 from buildbot.process import builder, factory
 from buildbot.util import epoch2datetime
+from buildbot.status.results import RETRY
 
 class BuilderMixin(object):
     def makeBuilder(self, name="bldr", patch_random=False, **config_kwargs):
@@ -288,6 +289,33 @@ class TestBuilderBuildCreation(BuilderMixin, unittest.TestCase):
 
         self.assertEqual(claims, [ (set([10,11,12,15]),) ])
 
+    @defer.inlineCallbacks
+    def test_buildFinished_retry_notifies_requests(self):
+        yield self.makeBuilder()
+        self.db.insertTestData([
+            fakedb.SourceStampSet(id=1),
+            fakedb.SourceStamp(id=1, sourcestampsetid=1),
+            fakedb.Buildset(id=11, sourcestampsetid=1),
+            fakedb.BuildRequest(id=111, buildsetid=11, buildername="bldr"),
+            fakedb.BuildRequest(id=112, buildsetid=11, buildername="bldr"),
+        ])
+        yield self.db.buildrequests.claimBuildRequests([111, 112])
+        self.master.buildRequestAdded = mock.Mock()
+        self.master.buildRequestsUnclaimed = mock.Mock()
+
+        build = mock.Mock()
+        build.requests = [mock.Mock(id=111, bsid=11), mock.Mock(id=112, bsid=11)]
+        build.build_status.getResults.return_value = RETRY
+        self.bldr.building = [build]
+        slavebuilder = mock.Mock()
+        slavebuilder.slave = None
+
+        self.bldr.buildFinished(build, slavebuilder, [])
+        self.assertEqual(self.master.buildRequestAdded.call_args_list,
+                         [mock.call(11, 111, 'bldr'), mock.call(11, 112, 'bldr')])
+        self.master.buildRequestsUnclaimed.assert_called_once_with([111, 112])
+
+
 class TestGetOldestRequestTime(BuilderMixin, unittest.TestCase):
 
     def setUp(self):
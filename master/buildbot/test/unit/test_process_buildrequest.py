@@ -14,8 +14,9 @@
 # Copyright Buildbot Team Members
 
 from twisted.trial import unittest
+from twisted.internet import defer
 from buildbot.test.fake import fakedb, fakemaster
-from buildbot.process import buildrequest
+from buildbot.process import buildrequest, cache
 from buildbot.status.results import CANCELED, BEGINNING
 import mock
 
@@ -111,6 +112,75 @@ class TestBuildRequest(unittest.TestCase):
             buildrequest.BuildRequest.fromBrdict(master, brdict))
         return self.assertFailure(d, AssertionError)
         
+    @defer.inlineCallbacks
+    def test_fromBrdicts(self):
+        master = fakemaster.make_master()
+        master.db = fakedb.FakeDBConnector(self)
+        master.db.insertTestData([
+            fakedb.SourceStampSet(id=234),
+            fakedb.SourceStamp(id=234, sourcestampsetid=234, branch='trunk',
+                        revision='9284', codebase='A'),
+            fakedb.SourceStampSet(id=235),
+            fakedb.SourceStamp(id=235, sourcestampsetid=235, branch='trunk',
+                        revision='9285', codebase='A'),
+            fakedb.SourceStamp(id=236, sourcestampsetid=235, branch='trunk',
+                        revision='1234', codebase='B'),
+            fakedb.Buildset(id=539, reason='triggered', sourcestampsetid=234),
+            fakedb.BuildsetProperty(buildsetid=539, property_name='x',
+                        property_value='[1, "X"]'),
+            fakedb.Buildset(id=540, reason='forced', sourcestampsetid=235),
+            fakedb.BuildRequest(id=288, buildsetid=539, buildername='bldr1',
+                        priority=13, submitted_at=1200000000),
+            fakedb.BuildRequest(id=289, buildsetid=539, buildername='bldr2',
+                        priority=13, submitted_at=1200000000),
+            fakedb.BuildRequest(id=290, buildsetid=540, buildername='bldr1',
+                        priority=50, submitted_at=1200000001),
+        ])
+        for method in ('getBuildset', 'getBuildsetProperties'):
+            setattr(master.db.buildsets, method, mock.Mock())
+        master.db.sourcestamps.getSourceStamps = mock.Mock()
+
+        brdicts = yield master.db.buildrequests.getBuildRequests()
+        brdicts.sort(key=lambda brdict: brdict['brid'])
+        breqs = yield buildrequest.BuildRequest.fromBrdicts(master, brdicts)
+
+        self.assertEqual([(br.id, br.bsid, br.buildername, br.reason) for br in breqs],
+                         [(288, 539, 'bldr1', 'triggered'), (289, 539, 'bldr2', 'triggered'),
+                          (290, 540, 'bldr1', 'forced')])
+        self.assertEqual(breqs[1].properties.getProperty('x'), 1)
+        self.assertEqual(dict((c, ss.revision) for c, ss in breqs[2].sources.iteritems()),
+                         {'A': '9285', 'B': '1234'})
+        # nothing was fetched build request by build request
+        self.assertFalse(master.db.buildsets.getBuildset.called)
+        self.assertFalse(master.db.buildsets.getBuildsetProperties.called)
+        self.assertFalse(master.db.sourcestamps.getSourceStamps.called)
+
+    @defer.inlineCallbacks
+    def test_fromBrdicts_skips_cached_requests(self):
+        master = fakemaster.make_master()
+        master.db = fakedb.FakeDBConnector(self)
+        master.caches = cache.CacheManager()
+        master.db.insertTestData([
+            fakedb.SourceStampSet(id=234),
+            fakedb.SourceStamp(id=234, sourcestampsetid=234, branch='trunk',
+                        revision='9284'),
+            fakedb.Buildset(id=539, reason='triggered', sourcestampsetid=234),
+            fakedb.Buildset(id=540, reason='forced', sourcestampsetid=234),
+            fakedb.BuildRequest(id=288, buildsetid=539, buildername='bldr'),
+            fakedb.BuildRequest(id=289, buildsetid=540, buildername='bldr'),
+        ])
+        brdicts = yield master.db.buildrequests.getBuildRequests()
+        brdicts.sort(key=lambda brdict: brdict['brid'])
+        cached = yield buildrequest.BuildRequest.fromBrdict(master, brdicts[0])
+
+        master.db.buildsets.getBuildsetsByIds = mock.Mock(
+            wraps=master.db.buildsets.getBuildsetsByIds)
+        breqs = yield buildrequest.BuildRequest.fromBrdicts(master, brdicts)
+
+        self.assertIdentical(breqs[0], cached)
+        self.assertEqual(breqs[1].reason, 'forced')
+        master.db.buildsets.getBuildsetsByIds.assert_called_once_with([540])
+
     def test_fromBrdict_multiple_sourcestamps(self):
         master = fakemaster.make_master()
         master.db = fakedb.FakeDBConnector(self)
@@ -5,7 +5,7 @@ from buildbot.test.fake import fakedb
 from buildbot.process import buildrequestdistributor
 from buildbot.process.buildrequestdistributor import Slavepool
 from buildbot.process import builder, factory
-from buildbot import config
+from buildbot import config, locks
 import mock
 from buildbot.db.buildrequests import Queue
 from buildbot.status.results import RESUME, BEGINNING
@@ -243,6 +243,58 @@ class TestKatanaBuildRequestDistributorGetNextPriorityBuilder(unittest.TestCase,
         breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.resume)
         self.assertEquals((breq.buildername, breq.id), ("bldr1", 2))
 
+    @defer.inlineCallbacks
+    def test_getNextPriorityBuilderUpdatesQueueIncrementally(self):
+        testdata = [fakedb.BuildRequest(id=1, buildsetid=1, buildername="bldr1",
+                                        priority=20, submitted_at=1449578391),
+                    fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
+                                        priority=50, submitted_at=1450171039)]
+        testdata += self.getBuildSetTestData(xrange(1, 3))
+        yield self.insertTestData(testdata)
+
+        self.setupBuilderInMaster(name='bldr1', slavenames={'slave-01': True}, startSlavenames={'slave-02': True})
+
+        chooser = self.brd.katanaBuildChooser
+        breq = yield chooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 2)
+
+        queries = []
+        getBuildRequestsInQueue = self.db.buildrequests.getBuildRequestsInQueue
+
+        def trackQueries(**kwargs):
+            queries.append(kwargs)
+            return getBuildRequestsInQueue(**kwargs)
+
+        self.patch(self.db.buildrequests, 'getBuildRequestsInQueue', trackQueries)
+
+        # new buildrequests are fetched using the high-water mark
+        testdata = [fakedb.BuildRequest(id=3, buildsetid=3, buildername="bldr1",
+                                        priority=100, submitted_at=1450171039)]
+        testdata += self.getBuildSetTestData(xrange(3, 4))
+        yield self.insertTestData(testdata)
+
+        breq = yield chooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 3)
+        self.assertEquals([q.get('minbrid') for q in queries], [3])
+
+        # cancelled buildrequests are removed without querying the db
+        chooser.buildRequestRemoved(dict(bsid=3, brid=3, buildername='bldr1'))
+        breq = yield chooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 2)
+
+        # notified buildrequests are refreshed from the db
+        chooser.buildRequestAdded(dict(bsid=1, brid=1, buildername='bldr1'))
+        breq = yield chooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 2)
+        self.assertEquals(queries[-1]['brids'], [1])
+        self.assertTrue(1 in chooser.queues[Queue.unclaimed])
+
+        # after an error, the queue is fully reloaded
+        chooser.initializeBuildRequestQueue()
+        breq = yield chooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 3)
+        self.assertFalse('minbrid' in queries[-1])
+
 
 class TestKatanaBuildRequestDistributorMaybeStartBuildsOn(KatanaBuildRequestDistributorTestSetup, unittest.TestCase):
 
@@ -617,6 +669,108 @@ class TestKatanaBuildRequestDistributorMaybeStartBuildsOn(KatanaBuildRequestDist
         return self.quiet_deferred
 
 
+class TestKatanaBuildRequestDistributorBatchDispatch(KatanaBuildRequestDistributorTestSetup, unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        yield self.setUpComponents()
+        yield self.setUpKatanaBuildRequestDistributor()
+        self.brd.dispatchBatchSize = 10
+
+        claimBuildRequestGroups = self.db.buildrequests.claimBuildRequestGroups
+        self.claimedGroups = []
+
+        def claim(groups):
+            self.claimedGroups.append(groups)
+            return claimBuildRequestGroups(groups)
+        self.db.buildrequests.claimBuildRequestGroups = claim
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.tearDownComponents()
+        yield self.stopKatanaBuildRequestDistributor()
+
+    @defer.inlineCallbacks
+    def generateBuilds(self, buildernames, slavenames, locks=[]):
+        self.initialized()
+        sources = [{'repository': 'repo1', 'codebase': 'cb1', 'branch': 'master', 'revision': 'asz3113'}]
+        for idx, buildername in enumerate(buildernames):
+            bldr = self.setupBuilderInMaster(name=buildername, slavenames=slavenames)
+            bldr.config.locks = locks
+            bldr.botmaster = self.botmaster
+            self.insertBuildrequests(buildername, 50 - idx, xrange(1, 3), sources=sources)
+        yield self.insertTestData(self.testdata)
+
+    @defer.inlineCallbacks
+    def test_startsBatchOnDifferentSlaves(self):
+        yield self.generateBuilds(['bldr1', 'bldr2', 'bldr3'],
+                                  slavenames={'slave-01': True, 'slave-02': True})
+
+        yield self.brd._maybeStartOrResumeBuildsOn(['bldr1', 'bldr2', 'bldr3'])
+
+        self.checkBRDCleanedUp()
+        # the two highest priority builders get a slave each, and their
+        # requests are merged and claimed at once
+        self.assertEqual(self.claimedGroups, [[[1, 2], [3, 4]]])
+        self.assertEqual(sorted(brids for _, brids in self.processedBuilds), [[1, 2], [3, 4]])
+        self.assertEqual(len(set(slave for slave, _ in self.processedBuilds)), 2)
+        self.assertEqual(self.brd.katanaBuildChooser.reservedSlaves, set())
+
+    @defer.inlineCallbacks
+    def test_lockConflictEndsBatch(self):
+        lockid = locks.MasterLock('lock')
+        realLock = locks.RealMasterLock(lockid)
+        self.botmaster.getLockFromLockAccess = lambda access: realLock
+        yield self.generateBuilds(['bldr1', 'bldr2'],
+                                  slavenames={'slave-01': True, 'slave-02': True},
+                                  locks=[lockid.access('exclusive')])
+
+        yield self.brd._maybeStartOrResumeBuildsOn(['bldr1', 'bldr2'])
+
+        self.checkBRDCleanedUp()
+        # builds needing the same lock are never in the same batch
+        self.assertEqual(self.claimedGroups, [[[1, 2]], [[3, 4]]])
+        self.assertEqual([brids for _, brids in self.processedBuilds], [[1, 2], [3, 4]])
+
+    @defer.inlineCallbacks
+    def test_claimsBuildByBuildWhenAlreadyClaimed(self):
+        yield self.generateBuilds(['bldr1', 'bldr2'],
+                                  slavenames={'slave-01': True, 'slave-02': True})
+
+        selectBuildBatch = self.brd._selectBuildBatch
+
+        @defer.inlineCallbacks
+        def selectAndClaimElsewhere():
+            batch = yield selectBuildBatch()
+            if not self.claimedGroups:
+                # another master claims one of bldr1's requests before we do
+                yield self.insertTestData([fakedb.BuildRequestClaim(brid=1, objectid=self.MASTER_ID + 1,
+                                                                    claimed_at=1449578391)])
+            defer.returnValue(batch)
+        self.brd._selectBuildBatch = selectAndClaimElsewhere
+
+        yield self.brd._maybeStartOrResumeBuildsOn(['bldr1', 'bldr2'])
+
+        self.checkBRDCleanedUp()
+        # the batch is claimed again build by build, then the request left
+        # over by the other master is started on its own
+        self.assertEqual(self.claimedGroups, [[[1, 2], [3, 4]], [[1, 2]], [[3, 4]], [[2]]])
+        self.assertEqual([brids for _, brids in self.processedBuilds], [[3, 4], [2]])
+
+    @defer.inlineCallbacks
+    def test_requeuesBuildsThatDidNotStart(self):
+        yield self.generateBuilds(['bldr1', 'bldr2'], slavenames={'slave-01': True, 'slave-02': True})
+        self.botmaster.builders['bldr1'].maybeStartBuild = lambda slave, breqs: defer.succeed(False)
+
+        yield self.brd._maybeStartOrResumeBuildsOn(['bldr1', 'bldr2'])
+
+        self.checkBRDCleanedUp()
+        self.assertEqual([brids for _, brids in self.processedBuilds], [[3, 4]])
+        brdicts = yield self.db.buildrequests.getBuildRequests(brids=[1, 2])
+        self.assertEqual([br['claimed'] for br in brdicts], [False, False])
+        self.botmaster.maybeStartBuildsForBuilder.assert_called_with('bldr1')
+
+
 class TestKatanaBuildChooser(KatanaBuildRequestDistributorTestSetup, unittest.TestCase):
 
     @defer.inlineCallbacks
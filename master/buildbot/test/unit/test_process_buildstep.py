@@ -346,6 +346,45 @@ class TestCustomStepExecution(steps.BuildStepMixin, unittest.TestCase):
         return d
 
 
+class TestRemoteCommand(unittest.TestCase):
+
+    def setUp(self):
+        self.cmd = buildstep.RemoteCommand("shell", {}, collectStdout=True)
+        self.cmd.active = True
+        self.cmd.buildslave = mock.Mock()
+        self.stdio = mock.Mock()
+        self.cmd.logs['stdio'] = self.stdio
+
+    def test_remote_update_batch(self):
+        ret = self.cmd.remote_update([[{'header': 'a'}, 0], [{'stdout': 'b'}, 0],
+                                      [{'stdout': 'c'}, 0], [{'stderr': 'd'}, 0],
+                                      [{'stdout': 'e'}, 3], [{'rc': 0}, 2]])
+        self.assertEqual(ret, 3)
+        self.assertEqual(self.stdio.method_calls, [
+            mock.call.addHeader('a'),
+            mock.call.addStdout('bc'),
+            mock.call.addStderr('d'),
+            mock.call.addStdout('e'),
+            mock.call.addHeader('program finished with exit code 0\n'),
+        ])
+        self.assertEqual((self.cmd.stdout, self.cmd.rc), ('bce', 0))
+
+    def test_remote_update_batch_failure(self):
+        self.cmd._finished = mock.Mock()
+        self.stdio.addStdout.side_effect = RuntimeError('oh noes')
+        self.cmd.remote_update([[{'stdout': 'a'}, 0], [{'stderr': 'b'}, 0]])
+        # the rest of the batch is skipped
+        self.assertEqual(self.cmd._finished.call_count, 1)
+        self.assertFalse(self.stdio.addStderr.called)
+
+    def test_mergeUpdates(self):
+        self.assertEqual(buildstep.RemoteCommand._mergeUpdates([
+                {'log': ('a', '1')}, {'log': ('a', '2')}, {'log': ('b', '3')},
+                {'stdout': 'x', 'stderr': 'y'}, {'stdout': 'z'}]),
+            [{'log': ('a', '12')}, {'log': ('b', '3')},
+             {'stdout': 'x', 'stderr': 'y'}, {'stdout': 'z'}])
+
+
 class RemoteShellCommandTests(object):
 
     def test_user_argument(self):
@@ -0,0 +1,94 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from twisted.trial import unittest
+from buildbot.process.mergeplanner import MergePlanner
+from buildbot.process.priorityindex import BuildRequestPriorityIndex
+from buildbot.util import epoch2datetime
+
+
+def mkbrdict(brid, buildername='bldr1', startbrid=None):
+    return dict(brid=brid, buildername=buildername, priority=50,
+                submitted_at=epoch2datetime(1449578391), results=-1,
+                buildsetid=brid, selected_slave=None, slavepool=None,
+                startbrid=startbrid)
+
+
+def mksourcestamps(sourcestampsetid, *revisions):
+    return [dict(codebase='cb%d' % idx, branch='master', revision=revision,
+                 sourcestampsetid=sourcestampsetid)
+            for idx, revision in enumerate(revisions)]
+
+
+class TestMergePlanner(unittest.TestCase):
+
+    def setUp(self):
+        self.index = BuildRequestPriorityIndex()
+        self.planner = MergePlanner()
+        self.index.addListener(self.planner)
+        self.addRequest(mkbrdict(1), mksourcestamps(1, 'a', 'b'))
+        self.addRequest(mkbrdict(2), mksourcestamps(2, 'a', 'b'))
+        self.addRequest(mkbrdict(3), mksourcestamps(3, 'a'))
+        self.addRequest(mkbrdict(4, buildername='bldr2'), mksourcestamps(4, 'a', 'b'))
+        self.addRequest(mkbrdict(5, startbrid=2), mksourcestamps(2, 'a', 'b'))
+        self.addRequest(mkbrdict(6, startbrid=2), mksourcestamps(6, 'a', 'b'))
+
+    def addRequest(self, brdict, sourcestamps):
+        self.index.add(brdict)
+        self.planner.add(brdict, sourcestamps)
+
+    def getCandidates(self, sourcestamps, buildername='bldr1', startbrid=None):
+        return [br['brid'] for br in self.planner.getCandidates(self.index, buildername, sourcestamps,
+                                                                startbrid=startbrid)]
+
+    def test_getCandidatesMatchesSourcestamps(self):
+        self.assertEqual(self.getCandidates(mksourcestamps(1, 'a', 'b')), [2, 5, 6])
+        self.assertEqual(self.getCandidates(mksourcestamps(7, 'a')), [3])
+        self.assertEqual(self.getCandidates(mksourcestamps(7, 'b', 'a')), [])
+        self.assertEqual(self.getCandidates(mksourcestamps(7, 'a', 'b'), buildername='bldr2'), [4])
+
+    def test_getCandidatesExcludesSameSourcestampset(self):
+        self.assertEqual(self.getCandidates(mksourcestamps(2, 'a', 'b')), [1, 6])
+
+    def test_getCandidatesInBuildChain(self):
+        self.assertEqual(self.getCandidates(mksourcestamps(1, 'a', 'b'), startbrid=2), [5, 6])
+
+    def test_getCandidatesSkipsRequestsNotInQueue(self):
+        self.index.remove(2)
+        self.assertEqual(self.getCandidates(mksourcestamps(1, 'a', 'b')), [5, 6])
+
+    def test_followsIndex(self):
+        self.index.add(mkbrdict(7))
+        self.assertEqual(self.planner.missing(), [7])
+        self.planner.add(mkbrdict(7), None)
+        self.assertEqual(self.planner.missing(), [])
+
+        # requests updated in the index keep their sourcestamps
+        self.index.add(mkbrdict(2))
+        self.assertEqual(self.planner.missing(), [])
+
+        self.index.remove(1)
+        self.assertEqual(len(self.planner), 6)
+        self.assertEqual(self.getCandidates(mksourcestamps(2, 'a', 'b')), [6])
+
+        self.index.add(mkbrdict(8))
+        self.index.remove(8)
+        self.assertEqual(self.planner.missing(), [])
+
+    def test_followsIndexLoad(self):
+        self.index.load([mkbrdict(2), mkbrdict(3), mkbrdict(8)], 0)
+        self.assertEqual(self.planner.missing(), [8])
+        self.assertEqual(len(self.planner), 2)
+        self.assertEqual(self.getCandidates(mksourcestamps(7, 'a', 'b')), [2])
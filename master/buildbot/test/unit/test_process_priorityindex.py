@@ -0,0 +1,107 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from twisted.trial import unittest
+from buildbot.process.priorityindex import BuildRequestPriorityIndex
+from buildbot.util import epoch2datetime
+
+
+def mkbrdict(brid, buildername='bldr1', priority=50, submitted_at=1449578391,
+             slavepool=None, startbrid=None):
+    return dict(brid=brid, buildername=buildername, priority=priority,
+                submitted_at=epoch2datetime(submitted_at), results=-1,
+                buildsetid=brid, selected_slave=None, slavepool=slavepool,
+                startbrid=startbrid)
+
+
+class TestBuildRequestPriorityIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = BuildRequestPriorityIndex()
+        self.index.load([mkbrdict(1, priority=20),
+                         mkbrdict(2, buildername='bldr2', priority=50, submitted_at=1450171039),
+                         mkbrdict(3, priority=50, submitted_at=1449578391),
+                         mkbrdict(4, buildername='bldr2', priority=100, slavepool='slavenames'),
+                         mkbrdict(5, buildername='bldr3', priority=50, submitted_at=1449578391)],
+                        now=0)
+
+    def walk(self):
+        return [br['brid'] for br in self.index.walk()]
+
+    def test_walkByPriorityAndSubmittedTime(self):
+        self.assertEqual(self.walk(), [4, 3, 5, 2, 1])
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.index.highWaterMark, 5)
+
+    def test_add(self):
+        self.index.add(mkbrdict(6, buildername='bldr3', priority=75))
+        self.assertEqual(self.walk(), [4, 6, 3, 5, 2, 1])
+        self.assertEqual(self.index.highWaterMark, 6)
+
+    def test_addReplacesEntry(self):
+        self.index.add(mkbrdict(1, priority=100, submitted_at=1449578000))
+        self.assertEqual(self.walk(), [1, 4, 3, 5, 2])
+        self.assertEqual(len(self.index), 5)
+
+    def test_remove(self):
+        self.index.remove(3)
+        self.index.remove(42)
+        self.assertEqual(self.walk(), [4, 5, 2, 1])
+        self.assertFalse(3 in self.index)
+
+    def test_removeWhileWalking(self):
+        walk = self.index.walk()
+        self.assertEqual(walk.next()['brid'], 4)
+        self.index.remove(5)
+        self.assertEqual([br['brid'] for br in walk], [3, 2, 1])
+
+    def test_skipBucket(self):
+        walk = self.index.walk()
+        seen = []
+        for br in walk:
+            seen.append(br['brid'])
+            if br['buildername'] == 'bldr1':
+                walk.skipBucket(self.index.bucketKey(br))
+        self.assertEqual(seen, [4, 3, 5, 2])
+
+    def test_hasChainedRequests(self):
+        self.index.add(mkbrdict(6, buildername='bldr3', startbrid=1))
+        self.assertTrue(self.index.hasChainedRequests(('bldr3', None)))
+        self.assertFalse(self.index.hasChainedRequests(('bldr1', None)))
+        self.index.remove(6)
+        self.assertFalse(self.index.hasChainedRequests(('bldr3', None)))
+
+    def test_update(self):
+        self.index.markDirty(1)
+        self.index.markDirty(2)
+        dirty = self.index.popDirty()
+        self.assertEqual(dirty, set([1, 2]))
+        self.assertEqual(self.index.popDirty(), set())
+
+        self.index.update(dirty, [mkbrdict(1, priority=80)])
+        self.assertEqual(self.walk(), [4, 1, 3, 5])
+
+    def test_compact(self):
+        for brid in (1, 2, 3, 5):
+            self.index.remove(brid)
+        self.index.compact()
+        self.assertEqual(self.walk(), [4])
+        self.assertEqual(sorted(self.index._buckets.keys()), [('bldr2', 'slavenames')])
+
+    def test_needsFullSync(self):
+        self.assertFalse(self.index.needsFullSync(now=10, interval=300))
+        self.assertTrue(self.index.needsFullSync(now=300, interval=300))
+        self.index.invalidate()
+        self.assertTrue(self.index.needsFullSync(now=10, interval=300))
@@ -0,0 +1,88 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import os
+from cPickle import dump
+from twisted.trial import unittest
+from buildbot.scripts import index_builds
+from buildbot.status import builder
+from buildbot.status.build import BuildStatus
+from buildbot.status.buildsummary import BuildSummaryIndex
+from buildbot.status.results import SUCCESS
+from buildbot.test.fake import fakemaster
+from buildbot.test.util import dirs, misc
+
+
+def mkconfig(**kwargs):
+    config = dict(quiet=True, rebuild=False, basedir=os.path.abspath('test'))
+    config.update(kwargs)
+    return config
+
+
+class TestIndexBuilds(dirs.DirsMixin, misc.StdoutAssertionsMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.setUpDirs('test', os.path.join('test', 'builder-01'), os.path.join('test', 'other'))
+        self.setUpStdoutAssertions()
+        self.builderdir = os.path.abspath(os.path.join('test', 'builder-01'))
+
+        with open(os.path.join('test', 'buildbot.tac'), 'wt') as f:
+            f.write("Application('buildmaster')")
+        with open(os.path.join(self.builderdir, 'builder'), 'wb') as f:
+            f.write('')
+
+        master = fakemaster.make_master(testcase=self)
+        self.builder_status = builder.BuilderStatus(buildername="builder-01", category=None, master=master)
+        self.builder_status.basedir = self.builderdir
+        for number in range(2):
+            build = BuildStatus(self.builder_status, master, number)
+            build.started = 1422441401.0
+            build.finished = 1422441501.21
+            build.results = SUCCESS
+            build.sources = []
+            with open(os.path.join(self.builderdir, '%d' % number), 'wb') as f:
+                dump(build, f, -1)
+
+        # logs and corrupted pickles are skipped
+        with open(os.path.join(self.builderdir, '1-log-shell-stdio'), 'wb') as f:
+            f.write('log')
+        with open(os.path.join(self.builderdir, '2'), 'wb') as f:
+            f.write('')
+
+    def tearDown(self):
+        return self.tearDownDirs()
+
+    def indexedBuilds(self):
+        summaryIndex = BuildSummaryIndex(self.builderdir)
+        indexed = [n for n in range(3) if summaryIndex.hasBuild(n)]
+        summaryIndex.close()
+        return indexed
+
+    def test_indexBuilds(self):
+        self.assertEqual(index_builds.indexBuilds(mkconfig()), 0)
+        self.assertInStdout('unable to load')
+        self.assertEqual(self.indexedBuilds(), [0, 1])
+
+        # already indexed builds are skipped
+        self.assertEqual(index_builds.indexBuilder(mkconfig(), self.builderdir), 0)
+        self.assertEqual(index_builds.indexBuilder(mkconfig(rebuild=True), self.builderdir), 2)
+        self.assertEqual(self.indexedBuilds(), [0, 1])
+
+    def test_indexBuildsNotMasterDir(self):
+        os.unlink(os.path.join('test', 'buildbot.tac'))
+        self.assertEqual(index_builds.indexBuilds(mkconfig()), 1)
+        self.assertInStdout('invalid buildmaster directory')
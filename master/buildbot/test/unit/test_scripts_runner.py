@@ -73,6 +73,31 @@ class TestUpgradeMasterOptions(OptionsMixin, unittest.TestCase):
         self.assertOptions(opts, exp)
 
 
+class TestIndexBuildsOptions(OptionsMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.setUpOptions()
+
+    def parse(self, *args):
+        self.opts = runner.IndexBuildsOptions()
+        self.opts.parseOptions(args)
+        return self.opts
+
+    def test_synopsis(self):
+        opts = runner.IndexBuildsOptions()
+        self.assertIn('buildbot index-builds', opts.getSynopsis())
+
+    def test_defaults(self):
+        opts = self.parse()
+        exp = dict(quiet=False, rebuild=False)
+        self.assertOptions(opts, exp)
+
+    def test_long(self):
+        opts = self.parse('--quiet', '--rebuild')
+        exp = dict(quiet=True, rebuild=True)
+        self.assertOptions(opts, exp)
+
+
 class TestCreateMasterOptions(OptionsMixin, unittest.TestCase):
 
     def setUp(self):
@@ -1,5 +1,7 @@
+import os
 from twisted.trial import unittest
 from buildbot.test.fake import fakemaster
+from buildbot.test.util import dirs
 from buildbot.status import builder
 from buildbot.config import ProjectConfig
 from mock import Mock
@@ -10,9 +12,10 @@ from twisted.internet import defer
 
 import datetime
 
-class TestBuilderStatus(unittest.TestCase):
+class TestBuilderStatus(dirs.DirsMixin, unittest.TestCase):
 
     def setUp(self):
+        self.setUpDirs('builder-01')
         self.master = fakemaster.make_master(wantDb=True, testcase="TestBuilderStatus")
 
         katana = {'katana-buildbot':
@@ -35,6 +38,7 @@ class TestBuilderStatus(unittest.TestCase):
                                     master=self.master)
 
         self.builder_status.nextBuildNumber = 39
+        self.builder_status.basedir = os.path.abspath('builder-01')
         self.builder_status.master = self.master
 
         self.builder_status.buildCache = Mock()
@@ -55,6 +59,10 @@ class TestBuilderStatus(unittest.TestCase):
 
         self.builder_status.saveYourself = lambda skipBuilds: True
 
+    def tearDown(self):
+        self.builder_status.getSummaryIndex().close()
+        return self.tearDownDirs()
+
     @defer.inlineCallbacks
     def test_generateFinishedBuildsUseLatestBuildCache(self):
 
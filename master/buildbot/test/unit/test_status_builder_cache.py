@@ -71,3 +71,38 @@ class TestBuildStatus(unittest.TestCase):
                              'propval%d' % build.number)
             self.assertEqual(b.buildCache.hits, hits+1)
             hits = hits + 1
+
+    def testBuildCacheBudget(self):
+        b1 = self.setupBuilder('builder_1')
+        s = self.setupStatus(b1)
+        s.buildCacheBudget.set_max_weight(2 * builder.BUILD_STEP_WEIGHT)
+        b2 = self.setupBuilder('builder_2')
+        for b in (b1, b2):
+            b.buildCache.set_budget(s.buildCacheBudget)
+
+        for b in (b1, b2, b1):
+            build = b.newBuild()
+            build.buildStarted(build)
+            build.buildFinished()
+
+        # builds without steps weigh one BUILD_STEP_WEIGHT until they are
+        # pickled, and the oldest build of all the builders was evicted
+        self.assertEqual(b1.buildCache.keys(), [1])
+        self.assertEqual(b2.buildCache.keys(), [0])
+        self.assertEqual(b1.getCacheMetrics()['evictions'], 1)
+        self.assertEqual(s.buildCacheBudget.weight, 2 * builder.BUILD_STEP_WEIGHT)
+
+    def testBuildCacheWeightAfterSave(self):
+        b = self.setupBuilder('builder_1')
+        build = b.newBuild()
+        build.setProperty('propkey', 'x' * builder.BUILD_STEP_WEIGHT, 'test')
+        build.buildStarted(build)
+
+        # a running build has no pickle yet, it is weighed by its steps
+        self.assertEqual(b.buildCache.weight, builder.BUILD_STEP_WEIGHT)
+
+        build.buildFinished()
+        pickleSize = os.path.getsize(b.makeBuildFilename(build.number))
+        self.assertEqual(b.buildCache.keys(), [build.number])
+        self.assertEqual(b.buildCache.weight,
+                         pickleSize * builder.BUILD_PICKLE_MEMORY_FACTOR)
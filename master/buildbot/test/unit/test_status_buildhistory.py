@@ -0,0 +1,58 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from twisted.trial import unittest
+from buildbot.status.buildhistory import BuildHistory
+from buildbot.status.results import SUCCESS, FAILURE
+
+
+class TestBuildHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.history = BuildHistory()
+        for number, results, branch in [(1, SUCCESS, 'master'), (3, FAILURE, 'katana'),
+                                        (2, FAILURE, 'master'), (4, SUCCESS, 'katana'),
+                                        (5, None, 'master')]:
+            self.history.addBuild(number, results, 1000 + number, 1100 + number,
+                                  'slave-%d' % (number % 2),
+                                  [dict(codebase='katana-buildbot', branch=branch)])
+
+    def test_addBuild(self):
+        self.assertEqual(list(self.history.columns.numbers), [1, 2, 3, 4, 5])
+        self.assertEqual(list(self.history.columns.slaves), [0, 1, 0, 1, 0])
+        self.history.addBuild(3, SUCCESS, 0, 0, None, [])
+        self.assertEqual(len(self.history), 5)
+        self.assertTrue(self.history.hasBuild(5))
+        self.assertFalse(self.history.hasBuild(6))
+
+    def test_getBuildNumbers(self):
+        self.assertEqual(self.history.getBuildNumbers(), [5, 4, 3, 2, 1])
+        self.assertEqual(self.history.getBuildNumbers(results=[FAILURE], branches=['master']), [2])
+        self.assertEqual(self.history.getBuildNumbers(results=[None]), [5])
+        self.assertEqual(self.history.getBuildNumbers(num_builds=2, max_buildnum=3), [3, 2])
+        self.assertEqual(self.history.getBuildNumbers(finished_before=1103), [2, 1])
+
+    def test_getBuildNumbers_codebases(self):
+        self.assertEqual(self.history.getBuildNumbers(codebases={'katana-buildbot': 'katana'},
+                                                      branches=['master']), [4, 3])
+        self.assertEqual(self.history.getBuildNumbers(codebases={'other': 'katana'}), [])
+
+    def test_removeBuildsBefore(self):
+        columns = self.history.columns
+        self.history.removeBuildsBefore(3)
+        self.assertEqual(list(self.history.columns.numbers), [3, 4, 5])
+        self.assertEqual(list(self.history.columns.results), [FAILURE, SUCCESS, -1])
+        # the previous columns are left untouched
+        self.assertEqual(len(columns), 5)
@@ -0,0 +1,167 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer
+from buildbot.process import metrics
+from buildbot.status import builder, buildpruner
+from buildbot.status.build import BuildStatus
+from buildbot.status.buildsummary import BuildSummaryIndex
+from buildbot.test.fake import fakemaster
+from buildbot.test.util import dirs
+
+
+class TestBuilderPruner(dirs.DirsMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.setUpDirs('builder-01')
+        self.master = fakemaster.make_master(testcase=self)
+        self.master.config.buildHorizon = 5
+        self.master.config.logHorizon = 3
+        self.builder_status = builder.BuilderStatus(buildername="builder-01", category=None,
+                                                    master=self.master)
+        self.builder_status.basedir = os.path.abspath('builder-01')
+        self.builder_status.nextBuildNumber = 10
+        for number in range(10):
+            self.writeFile(str(number))
+            self.writeFile('%d-compile-stdio' % number)
+        self.writeFile('builder')
+
+        self.metrics = []
+        self.patch(metrics.MetricCountEvent, 'log',
+                   classmethod(lambda cls, counter, count: self.metrics.append((counter, count))))
+
+    def tearDown(self):
+        return self.tearDownDirs()
+
+    def writeFile(self, filename):
+        with open(os.path.join('builder-01', filename), 'w') as f:
+            f.write('x' * 10)
+
+    def getNumbers(self, suffix=''):
+        return sorted(n for n in range(10) if os.path.exists(os.path.join('builder-01', str(n) + suffix)))
+
+    @defer.inlineCallbacks
+    def test_prune(self):
+        yield self.builder_status.prune()
+        self.assertEqual(self.getNumbers(), [5, 6, 7, 8, 9])
+        self.assertEqual(self.getNumbers('-compile-stdio'), [7, 8, 9])
+        self.assertTrue(os.path.exists(os.path.join('builder-01', 'builder')))
+        self.assertEqual(buildpruner.readWatermark(self.builder_status.basedir), (5, 7))
+        self.assertEqual(self.metrics, [('BuilderPruner.files_removed', 12),
+                                        ('BuilderPruner.bytes_reclaimed', 120)])
+
+    @defer.inlineCallbacks
+    def test_prune_from_watermark(self):
+        yield self.builder_status.prune()
+        find = mock.Mock(wraps=buildpruner.findPrunableFiles)
+        self.patch(buildpruner, 'findPrunableFiles', find)
+
+        # nothing went past the horizons since
+        yield self.builder_status.prune()
+        self.assertFalse(find.called)
+
+        self.writeFile('1-left-over')
+        self.builder_status.nextBuildNumber = 11
+        yield self.builder_status.prune()
+        self.assertEqual(self.getNumbers('-compile-stdio'), [8, 9])
+        # the files under the watermark are not looked at again
+        self.assertTrue(os.path.exists(os.path.join('builder-01', '1-left-over')))
+        self.assertEqual(buildpruner.readWatermark(self.builder_status.basedir), (6, 8))
+
+    def addSummaries(self):
+        index = BuildSummaryIndex(self.builder_status.basedir)
+        for number in range(10):
+            build = BuildStatus(self.builder_status, self.master, number)
+            build.started, build.finished = 1422441401.0, 1422441501.21
+            build.getLogs = mock.Mock(return_value=[mock.Mock(filename='%d-compile-stdio' % number)])
+            index.addBuild(build)
+        index.close()
+
+    @defer.inlineCallbacks
+    def test_prune_compacts_summaries(self):
+        self.addSummaries()
+        summaryIndex = self.builder_status.getSummaryIndex()
+        dataSize = summaryIndex.getDataSize()
+
+        self.master.config.buildHorizon = 4
+        yield self.builder_status.prune()
+        self.assertTrue(summaryIndex.getDataSize() < dataSize / 2)
+        self.assertEqual([n for n in range(10) if summaryIndex.hasBuild(n)], [6, 7, 8, 9])
+        self.assertEqual(summaryIndex.getLogFilenames(6), ['6-compile-stdio'])
+        self.assertIn(('BuilderPruner.summaries_compacted', 1), self.metrics)
+        summaryIndex.close()
+
+    @defer.inlineCallbacks
+    def test_prune_keeps_summaries_added_while_compacting(self):
+        self.addSummaries()
+        summaryIndex = self.builder_status.getSummaryIndex()
+        pruner = self.builder_status.getPruner()
+        removeSummaries = pruner._removeSummaries
+
+        def addBuild(basedir, earliest_build):
+            compacted = removeSummaries(basedir, earliest_build)
+            with open(summaryIndex.dataFilename, "ab") as f:
+                f.write("{}")
+            return compacted
+        pruner._removeSummaries = addBuild
+
+        self.master.config.buildHorizon = 4
+        yield self.builder_status.prune()
+        self.assertEqual(sorted(f for f in os.listdir('builder-01') if f.startswith('builds.')),
+                         ['builds.dat', 'builds.idx', 'builds.low'])
+        self.assertEqual([n for n in range(10) if summaryIndex.hasBuild(n)], [6, 7, 8, 9])
+        self.assertEqual(summaryIndex.getLogFilenames(6), ['6-compile-stdio'])
+        summaryIndex.close()
+
+    def test_findPrunableFiles_from_summaries(self):
+        self.addSummaries()
+        self.writeFile('4-compile-stdio.bz2')
+
+        # the directory is not listed when the summaries know the logs
+        self.patch(os, 'listdir', mock.Mock(side_effect=AssertionError("listed")))
+        filenames = buildpruner.findPrunableFiles(self.builder_status.basedir, (3, 4), 5, 7, keep=[6])
+        self.assertEqual(sorted(filenames), ['3', '4', '4-compile-stdio', '4-compile-stdio.bz2',
+                                             '5-compile-stdio'])
+
+    @defer.inlineCallbacks
+    def test_prune_keeps_cached_builds(self):
+        self.builder_status.buildCache.cache[2] = mock.Mock()
+        yield self.builder_status.prune()
+        self.assertEqual(self.getNumbers(), [2, 5, 6, 7, 8, 9])
+        self.assertEqual(buildpruner.readWatermark(self.builder_status.basedir), (2, 2))
+
+    @defer.inlineCallbacks
+    def test_prune_while_running(self):
+        d = defer.Deferred()
+        pruner = self.builder_status.getPruner()
+        pruner._prune = mock.Mock(return_value=d)
+        running = pruner.prune()
+        yield pruner.prune()
+        self.assertEqual(pruner._prune.call_count, 1)
+
+        pruner._prune.return_value = defer.succeed(None)
+        d.callback(None)
+        yield running
+        self.assertEqual(pruner._prune.call_count, 2)
+        self.assertFalse(pruner.running)
+
+    @defer.inlineCallbacks
+    def test_no_build_horizon(self):
+        self.master.config.buildHorizon = None
+        yield self.builder_status.prune()
+        self.assertEqual(self.getNumbers(), range(10))
@@ -0,0 +1,215 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer
+from buildbot.status import builder
+from buildbot.status.build import BuildStatus
+from buildbot.status.buildsummary import BuildSummaryIndex
+from buildbot.status.results import SUCCESS, FAILURE
+from buildbot.sourcestamp import SourceStamp
+from buildbot.test.fake import fakemaster
+from buildbot.test.util import dirs
+
+
+class TestBuildSummaryIndex(dirs.DirsMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.setUpDirs('builder-01')
+        self.master = fakemaster.make_master(testcase=self)
+        self.builder_status = builder.BuilderStatus(buildername="builder-01", category=None,
+                                                    master=self.master)
+        self.builder_status.basedir = os.path.abspath('builder-01')
+        self.builder_status.nextBuildNumber = 10
+        self.index = BuildSummaryIndex(self.builder_status.basedir)
+
+    def tearDown(self):
+        self.index.close()
+        return self.tearDownDirs()
+
+    def makeBuild(self, number, results=SUCCESS, finished=1422441501.21):
+        build = BuildStatus(self.builder_status, self.master, number)
+        build.started = 1422441401.0
+        build.finished = finished
+        build.reason = 'A build was forced by user@localhost'
+        build.slavename = 'build-slave-01'
+        build.results = results
+        build.text = ['build', 'successful']
+        build.sources = [SourceStamp(branch='katana', codebase='katana-buildbot',
+                                     repository='https://github.com/Unity-Technologies/buildbot.git',
+                                     revision='804d540eac7b90022130d34616a8f8336fe5691a')]
+        return build
+
+    def test_addBuild(self):
+        self.index.addBuild(self.makeBuild(3), pickleSize=1024)
+        self.index.addBuild(self.makeBuild(1, results=FAILURE))
+
+        summary = self.index.getSummary(self.builder_status, 3)
+        self.assertEqual((summary.getNumber(), summary.getResults(), summary.pickleSize),
+                         (3, SUCCESS, 1024))
+        self.assertEqual(summary.getTimes(), (1422441401.0, 1422441501.21))
+        self.assertEqual(summary.getSlavename(), 'build-slave-01')
+        self.assertEqual(summary.getText(), ['build', 'successful'])
+        self.assertEqual(summary.getSourceStamps(),
+                         [dict(codebase='katana-buildbot', branch='katana',
+                               repository='https://github.com/Unity-Technologies/buildbot.git',
+                               revision='804d540eac7b90022130d34616a8f8336fe5691a')])
+
+        self.assertEqual(self.index.getSummary(self.builder_status, 1).getResults(), FAILURE)
+        self.assertEqual(self.index.getSummary(self.builder_status, 2), None)
+        self.assertEqual(self.index.getSummary(self.builder_status, 42), None)
+        self.assertEqual(self.index.getLogFilenames(3), [])
+        self.assertEqual(self.index.getLogFilenames(2), None)
+
+    def test_addBuildSkipsUnfinishedBuilds(self):
+        self.index.addBuild(self.makeBuild(1, finished=None))
+        self.assertFalse(self.index.hasBuild(1))
+
+    def test_removeBuildsBefore(self):
+        for number in range(5):
+            self.index.addBuild(self.makeBuild(number))
+
+        self.index.removeBuildsBefore(3)
+        self.assertEqual([n for n in range(5) if self.index.hasBuild(n)], [3, 4])
+        self.assertEqual(self.index.getLowWaterMark(), 3)
+
+    def test_removeBuildsBefore_from_low_water_mark(self):
+        for number in range(5):
+            self.index.addBuild(self.makeBuild(number))
+        self.index.removeBuildsBefore(2)
+
+        # the records under the low-water mark are not read again
+        self.index.RECORD = mock.Mock(wraps=BuildSummaryIndex.RECORD, size=BuildSummaryIndex.RECORD.size)
+        self.index.removeBuildsBefore(4)
+        self.assertEqual([c[0][1] // self.index.RECORD.size
+                          for c in self.index.RECORD.unpack_from.call_args_list], [2, 3])
+        self.assertEqual([n for n in range(5) if self.index.hasBuild(n)], [4])
+
+    def test_addBuild_under_low_water_mark(self):
+        self.index.addBuild(self.makeBuild(3))
+        self.index.removeBuildsBefore(3)
+        self.index.addBuild(self.makeBuild(1))
+        self.assertEqual(self.index.getLowWaterMark(), 1)
+
+    def test_compact(self):
+        for number in range(6):
+            self.index.addBuild(self.makeBuild(number))
+        dataSize = self.index.getDataSize()
+
+        # the data is only copied once most of it is unused
+        self.index.removeBuildsBefore(2)
+        self.assertFalse(self.index.writeCompacted())
+
+        self.index.removeBuildsBefore(4)
+        self.assertTrue(self.index.writeCompacted())
+        self.index.replaceWithCompacted()
+        self.assertEqual(self.index.getDataSize(), dataSize // 3)
+        self.assertEqual([s.getNumber() for s in self.index.getSummaries(self.builder_status)], [4, 5])
+        self.assertEqual(self.index.getSummary(self.builder_status, 5).getText(), ['build', 'successful'])
+
+        self.index.addBuild(self.makeBuild(6))
+        self.assertEqual(self.index.getSummary(self.builder_status, 6).getNumber(), 6)
+
+    def test_discardCompacted(self):
+        for number in range(4):
+            self.index.addBuild(self.makeBuild(number))
+        self.index.removeBuildsBefore(3)
+        self.assertTrue(self.index.writeCompacted())
+        self.index.discardCompacted()
+        self.assertEqual(sorted(os.listdir(self.builder_status.basedir)),
+                         ['builds.dat', 'builds.idx', 'builds.low'])
+
+    @defer.inlineCallbacks
+    def test_getBuildSummariesByNumbers(self):
+        build = self.makeBuild(3)
+        build.saveYourself()
+        self.builder_status.addBuildSummary(build)
+        unindexedBuild = self.makeBuild(2, results=FAILURE)
+        unindexedBuild.saveYourself()
+        self.builder_status.deferToThread = mock.Mock(return_value=defer.succeed(unindexedBuild))
+
+        summaries = yield self.builder_status.getBuildSummariesByNumbers(buildnumbers=[3, 2])
+        self.assertEqual([s.getNumber() for s in summaries], [3, 2])
+        self.builder_status.deferToThread.assert_called_once_with(2)
+
+        # the missing build was added to the index
+        summaries = yield self.builder_status.getBuildSummariesByNumbers(buildnumbers=[2, 3],
+                                                                         results=[SUCCESS])
+        self.assertEqual([s.getNumber() for s in summaries], [3])
+        self.assertEqual(self.builder_status.deferToThread.call_count, 1)
+
+    @defer.inlineCallbacks
+    def test_getFinishedBuildsByNumbers(self):
+        for number in range(5):
+            build = self.makeBuild(number, results=FAILURE if number % 2 else SUCCESS)
+            build.saveYourself()
+            self.builder_status.addBuildSummary(build)
+        self.builder_status.deferToThread = mock.Mock(
+            side_effect=lambda number: defer.succeed(self.makeBuild(number, results=FAILURE)))
+
+        # only the builds selected from the summaries are unpickled
+        builds = yield self.builder_status.getFinishedBuildsByNumbers(buildnumbers=[4, 3, 2, 1, 0],
+                                                                      results=[FAILURE], num_builds=1)
+        self.assertEqual([b.getNumber() for b in builds], [3])
+        self.builder_status.deferToThread.assert_called_once_with(3)
+
+    @defer.inlineCallbacks
+    def test_getHistory(self):
+        for number in range(3):
+            self.index.addBuild(self.makeBuild(number, results=[SUCCESS, FAILURE][number % 2]))
+        self.builder_status.summaryIndex = self.index
+
+        # the history is read in a thread
+        self.assertIdentical(self.builder_status.getHistory(), None)
+        history = yield self.builder_status.loadHistory()
+        self.assertEqual(history.getBuildNumbers(results=[FAILURE]), [1])
+        self.assertIdentical(self.builder_status.getHistory(), history)
+
+    @defer.inlineCallbacks
+    def test_getHistory_builds_finished_while_loading(self):
+        build = self.makeBuild(0)
+        build.saveYourself()
+        self.builder_status.addBuildSummary(build)
+
+        self.assertIdentical(self.builder_status.getHistory(), None)
+        build = self.makeBuild(1, results=FAILURE)
+        build.saveYourself()
+        self.builder_status.addBuildSummary(build)
+
+        history = yield self.builder_status.loadHistory()
+        self.assertEqual(history.getBuildNumbers(), [1, 0])
+        self.assertEqual(history.getBuildNumbers(results=[FAILURE]), [1])
+
+    @defer.inlineCallbacks
+    def test_generateFinishedBuilds_loads_matching_builds(self):
+        for number in range(10):
+            build = self.makeBuild(number, results=FAILURE if number == 4 else SUCCESS)
+            build.saveYourself()
+            self.builder_status.addBuildSummary(build)
+        self.builder_status.getBuildByNumber = mock.Mock(
+            side_effect=lambda number: self.makeBuild(number, results=FAILURE))
+
+        # the summary index is used while the history is read
+        builds = list(self.builder_status.generateFinishedBuilds(results=[FAILURE]))
+        self.assertEqual([b.getNumber() for b in builds], [4])
+        self.builder_status.getBuildByNumber.assert_called_once_with(4)
+
+        yield self.builder_status.loadHistory()
+        self.builder_status.getBuildByNumber.reset_mock()
+        builds = list(self.builder_status.generateFinishedBuilds(results=[FAILURE]))
+        self.assertEqual([b.getNumber() for b in builds], [4])
+        self.builder_status.getBuildByNumber.assert_called_once_with(4)
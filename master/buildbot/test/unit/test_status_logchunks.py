@@ -0,0 +1,119 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import mock
+import cStringIO
+from twisted.trial import unittest
+from buildbot.status import logchunks
+from buildbot.test.util import dirs
+
+
+def netstrings(chunks):
+    return "".join("%d:%d%s," % (len(text) + 1, channel, text) for channel, text in chunks)
+
+
+class TestSliceLines(unittest.TestCase):
+
+    chunks = [(2, 'header\n'), (0, 'a\nb'), (0, 'c\nd\n'), (1, 'e\n')]
+
+    def test_all(self):
+        self.assertEqual(list(logchunks.sliceLines(self.chunks, 0)), self.chunks)
+
+    def test_range(self):
+        self.assertEqual(list(logchunks.sliceLines(self.chunks, 1, 3)),
+                         [(0, 'a\nb'), (0, 'c\n')])
+
+    def test_firstLine(self):
+        self.assertEqual(list(logchunks.sliceLines(self.chunks[2:], 3, 5, firstLine=2)),
+                         [(0, 'd\n'), (1, 'e\n')])
+
+
+class TestGetMethod(unittest.TestCase):
+
+    def test_available(self):
+        self.assertEqual(logchunks.getMethod('bz2'), 'bz2')
+
+    def test_fallback(self):
+        self.patch(logchunks, 'CODECS', dict(bz2=logchunks.CODECS['bz2'],
+                                             gz=logchunks.CODECS['gz']))
+        self.assertEqual(logchunks.getMethod('zstd'), 'gz')
+        self.assertEqual(logchunks.getMethod('lz4'), 'gz')
+
+    def test_none(self):
+        self.assertEqual(logchunks.getMethod(None), None)
+
+
+class TestChunkedLog(dirs.DirsMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.setUpDirs('logs')
+        self.filename = os.path.abspath(os.path.join('logs', '1-log-shell-stdio'))
+        self.chunks = [(2, 'running\n')]
+        for i in range(100):
+            self.chunks.append((i % 2, 'line %d\n' % i))
+        self.chunks.append((2, 'exit 0'))
+        self.raw = netstrings(self.chunks)
+
+    def tearDown(self):
+        return self.tearDownDirs()
+
+    def writeLog(self, method='bz2', blockSize=100):
+        logchunks.writeChunkedLog(cStringIO.StringIO(self.raw), self.filename, method,
+                                  blockSize=blockSize, bufsize=64)
+        return logchunks.ChunkedLog(self.filename)
+
+    def test_index(self):
+        chunkedLog = self.writeLog()
+        self.assertTrue(logchunks.hasChunkedLog(self.filename))
+        self.assertTrue(len(chunkedLog.blocks) > 10)
+        self.assertEqual(chunkedLog.getLineCount(), 102)
+        self.assertEqual(chunkedLog.rawLength, len(self.raw))
+        self.assertEqual(chunkedLog.blocks[0][6], 0x7)
+
+    def test_getChunks(self):
+        chunkedLog = self.writeLog(method='gz')
+        self.assertEqual(list(chunkedLog.getChunks()), self.chunks)
+        self.assertEqual(list(chunkedLog.getChunks(51, 53)),
+                         [(0, 'line 50\n'), (1, 'line 51\n')])
+        self.assertEqual(list(chunkedLog.getChunks(51, 55, channels=[1], onlyText=True)),
+                         ['line 51\n', 'line 53\n'])
+
+    def test_getTail_reads_last_blocks(self):
+        chunkedLog = self.writeLog()
+        chunkedLog.readBlock = mock.Mock(wraps=chunkedLog.readBlock)
+        self.assertEqual(list(chunkedLog.getTail(2)), [(1, 'line 99\n'), (2, 'exit 0')])
+        self.assertEqual([c[0][0] for c in chunkedLog.readBlock.call_args_list],
+                         [len(chunkedLog.blocks) - 1])
+
+    def test_open(self):
+        f = self.writeLog().open()
+        self.assertEqual(f.read(), self.raw)
+        f.seek(95)
+        self.assertEqual(f.read(150), self.raw[95:245])
+        self.assertEqual(f.tell(), 245)
+        f.seek(-3, 2)
+        self.assertEqual(f.read(10), self.raw[-3:])
+
+    def test_empty_log(self):
+        self.raw = ''
+        chunkedLog = self.writeLog()
+        self.assertEqual((chunkedLog.getLineCount(), list(chunkedLog.getTail(10))), (0, []))
+        self.assertEqual(chunkedLog.open().read(), '')
+
+    def test_malformed_log(self):
+        self.raw = 'xyz' * 100
+        self.assertRaises(ValueError, self.writeLog)
+        self.assertEqual(os.listdir('logs'), [])
@@ -0,0 +1,71 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import threading
+from twisted.trial import unittest
+from twisted.internet import defer
+from buildbot.status import logcompressor
+
+
+class TestLogCompressor(unittest.TestCase):
+
+    def setUp(self):
+        self.compressor = logcompressor.LogCompressor(workers=1)
+
+    def tearDown(self):
+        if self.compressor.pool is not None:
+            self.compressor.pool.stop()
+
+    @defer.inlineCallbacks
+    def test_compress(self):
+        result = yield self.compressor.compress(10, lambda: 'done')
+        self.assertEqual(result, 'done')
+        self.assertEqual(self.compressor.running, 0)
+
+    @defer.inlineCallbacks
+    def test_compress_failure(self):
+        def fail():
+            raise ValueError('malformed')
+        yield self.assertFailure(self.compressor.compress(10, fail), ValueError)
+        self.assertEqual(self.compressor.running, 0)
+
+    @defer.inlineCallbacks
+    def test_compress_smallest_first(self):
+        order = []
+        release = threading.Event()
+
+        def compress(size):
+            def fn():
+                if size == 1000:
+                    release.wait()
+                order.append(size)
+            return self.compressor.compress(size, fn)
+
+        # the first log is running, and the others wait for it
+        ds = [compress(size) for size in (1000, 30, 500, 20)]
+        self.assertEqual((self.compressor.running, len(self.compressor.queue)), (1, 3))
+        release.set()
+        yield defer.gatherResults(ds)
+        self.assertEqual(order, [1000, 20, 30, 500])
+
+    @defer.inlineCallbacks
+    def test_setWorkers(self):
+        self.compressor.setWorkers(0)
+        d1 = self.compressor.compress(10, lambda: None)
+        d2 = self.compressor.compress(10, lambda: None)
+        self.assertEqual((self.compressor.running, len(self.compressor.queue)), (0, 2))
+        self.compressor.setWorkers(2)
+        self.assertEqual((self.compressor.running, len(self.compressor.queue)), (2, 0))
+        yield defer.gatherResults([d1, d2])
@@ -21,7 +21,7 @@ import mock
 import time
 from twisted.trial import unittest
 from twisted.internet import defer
-from buildbot.status import logfile
+from buildbot.status import logfile, logchunks, logwriter
 from buildbot.test.util import dirs
 from buildbot import config
 
@@ -65,7 +65,10 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin):
                 self.logfile.openfile.close()
             except:
                 pass # oh well, we tried
-        self.tearDownDirs()
+        # let the log writer finish with the files first
+        d = logwriter.getWriter().drain()
+        d.addCallback(lambda _: self.tearDownDirs())
+        return d
 
     def pickle_and_restore(self):
         pkl = cPickle.dumps(self.logfile)
@@ -134,7 +137,8 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin):
         d.addCallback(lambda _ : state.append('called'))
         self.assertEqual(state, []) # not called yet
         self.logfile.finish()
-        self.assertEqual(state, ['called'])
+        d.addCallback(lambda _ : self.assertEqual(state, ['called']))
+        return d
 
     def test_getFile(self):
         # test getFile at a number of points in the life-cycle
@@ -169,7 +173,7 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin):
         d = self.logfile.compressLog()
         def check(_):
             self.assertTrue(
-                    os.path.exists(os.path.join(self.basedir, '123-stdio.bz2')))
+                    os.path.exists(os.path.join(self.basedir, '123-stdio.chunked')))
             fp = self.logfile.getFile()
             fp.seek(0, 0)
             self.assertIn('hello, world', fp.read())
@@ -282,6 +286,51 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin):
         logChunk_chunks = [ tuple(args[0][3:])
                             for args in watcher.logChunk.call_args_list ]
 
+    def test_addEntry_watchers_coalesced(self):
+        watcher = mock.Mock(name='watcher')
+        self.logfile.watchers.append(watcher)
+        for chan, txt in [(0, 'a'), (0, 'b'), (1, 'c'), (0, 'd')]:
+            self.logfile.addEntry(chan, txt)
+        self.assertFalse(watcher.logChunk.called)
+
+        # a new watcher does not get the entries added before it
+        late = mock.Mock(name='late')
+        self.logfile.subscribe(late, False)
+        self.assertEqual([args[0][3:] for args in watcher.logChunk.call_args_list],
+                         [(0, 'ab'), (1, 'c'), (0, 'd')])
+        self.assertFalse(late.logChunk.called)
+
+        self.logfile.addEntry(0, 'e')
+        self.logfile.finish()
+        late.logChunk.assert_called_once_with(mock.ANY, mock.ANY, self.logfile, 0, 'e')
+
+    @defer.inlineCallbacks
+    def test_finish_waits_for_writes(self):
+        self.logfile.addEntry(0, 'x' * self.logfile.chunkSize)
+        self.logfile.finish()
+        yield self.logfile.waitUntilFinished()
+        self.assertEqual(os.path.getsize(os.path.join(self.basedir, '123-stdio')),
+                         self.logfile.chunkSize + len('10001:0,'))
+
+    def test_getFile_pending_writes(self):
+        self.logfile.addEntry(0, 'abc')
+        self.logfile._merge()
+        self.logfile.addEntry(1, 'de')
+        self.logfile._merge()
+        # the first write is on disk, the second is still queued
+        with open(self.logfile.getFilename(), 'w') as f:
+            f.write('4:0abc,')
+        self.patch(self.logfile, 'pendingWrites', mock.Mock(written=7))
+        self.logfile.pendingWrites.getTail.return_value = '3:1de,'
+
+        fp = self.logfile.getFile()
+        fp.seek(0, 2)
+        self.assertEqual(fp.tell(), 13)
+        fp.seek(5)
+        self.assertEqual(fp.read(4), 'c,3:')
+        self.assertEqual(fp.read(), '1de,')
+        self.assertEqual(list(self.logfile.getChunks()), [(0, 'abc'), (1, 'de')])
+
     def test_enable_timestamps(self):
         #
         # test enabling timestamp prepending
@@ -315,27 +364,101 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin):
         addEntry.assert_called_with(2, 'hed')
 
     def do_test_compressLog(self, ext, expect_comp=True):
-        self.logfile.openfile.write('xyz' * 1000)
+        self.logfile.openfile.write('3001:0' + 'xyz' * 1000 + ',')
+        self.logfile.openfile.flush()
         self.logfile.finish()
         d = self.logfile.compressLog()
         def check(_):
             st = os.stat(self.logfile.getFilename() + ext)
             if expect_comp:
                 self.assertTrue(0 < st.st_size < 3000)
+                self.assertFalse(os.path.exists(self.logfile.getFilename()))
+                self.assertEqual(self.logfile.getText(), 'xyz' * 1000)
             else:
-                self.assertTrue(st.st_size == 3000)
+                self.assertTrue(st.st_size == 3007)
         d.addCallback(check)
         return d
 
     def test_compressLog_gz(self):
         self.config.logCompressionMethod = 'gz'
-        return self.do_test_compressLog('.gz')
+        return self.do_test_compressLog('.chunked')
 
     def test_compressLog_bz2(self):
         self.config.logCompressionMethod = 'bz2'
-        return self.do_test_compressLog('.bz2')
+        return self.do_test_compressLog('.chunked')
+
+    def test_compressLog_fallback(self):
+        self.patch(logchunks, 'CODECS', dict(bz2=logchunks.CODECS['bz2'],
+                                             gz=logchunks.CODECS['gz']))
+        self.config.logCompressionMethod = 'zstd'
+        return self.do_test_compressLog('.chunked')
 
     def test_compressLog_none(self):
         self.config.logCompressionMethod = None
         return self.do_test_compressLog('', expect_comp=False)
 
+    @defer.inlineCallbacks
+    def test_compressLog_malformed(self):
+        self.config.logCompressionMethod = 'bz2'
+        self.logfile.openfile.write('xyz' * 1000)
+        self.logfile.finish()
+        yield self.assertFailure(self.logfile.compressLog(), ValueError)
+        self.assertTrue(os.path.exists(self.logfile.getFilename()))
+        self.assertEqual(os.listdir(self.basedir), ['123-stdio'])
+
+    def add_lines(self):
+        self.logfile.addHeader('running\n')
+        for i in range(10):
+            self.logfile.addStdout('out %d\n' % i)
+            self.logfile.addStderr('err %d\n' % i)
+        self.logfile.addHeader('done')
+        self.logfile.finish()
+
+    def do_test_line_reads(self):
+        self.assertEqual(self.logfile.getLineCount(), 22)
+        self.assertEqual(list(self.logfile.getTailChunks(2)),
+                         [(1, 'err 9\n'), (2, 'done')])
+        self.assertEqual(''.join(self.logfile.getLineChunks(2, 5, onlyText=True)),
+                         'err 0\nout 1\nerr 1\n')
+        self.assertEqual(list(self.logfile.getLineChunks(19, None, channels=[logfile.STDOUT])),
+                         [(0, 'out 9\n')])
+
+    def test_line_reads_uncompressed(self):
+        self.add_lines()
+        self.do_test_line_reads()
+
+    def test_line_reads_indexed(self):
+        self.logfile.LINE_INDEX_INTERVAL = 20
+        self.add_lines()
+        self.assertEqual(self.logfile.lineIndex[:3], [(0, 0), (2, 22), (4, 42)])
+
+        getChunksFrom = mock.Mock(wraps=self.logfile._getChunksFrom)
+        self.patch(self.logfile, '_getChunksFrom', getChunksFrom)
+        self.do_test_line_reads()
+        # the tail is read from the last indexed chunk before it
+        offset = [o for l, o in self.logfile.lineIndex if l < 20][-1]
+        self.assertTrue(offset > 0)
+        self.assertEqual(getChunksFrom.call_args_list[0], mock.call(offset))
+
+    def test_line_reads_unindexed(self):
+        self.add_lines()
+        # logs pickled before the line index was kept are scanned
+        self.logfile.lineIndex = None
+        self.do_test_line_reads()
+
+    def test_line_reads_unfinished(self):
+        self.logfile.LINE_INDEX_INTERVAL = 20
+        for i in range(10):
+            self.logfile.addStdout('out %d\n' % i)
+        self.logfile.addStdout('partial')
+        self.assertEqual(self.logfile.getLineCount(), 11)
+        self.assertEqual(''.join(self.logfile.getTailChunks(2, onlyText=True)), 'out 9\npartial')
+
+    @defer.inlineCallbacks
+    def test_line_reads_chunked(self):
+        self.add_lines()
+        self.config.logCompressionMethod = 'gz'
+        yield self.logfile.compressLog()
+        self.assertNotEqual(self.logfile.getChunkedLog(), None)
+        self.do_test_line_reads()
+
@@ -0,0 +1,105 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import mock
+from twisted.trial import unittest
+from buildbot.status import logwriter
+from buildbot.test.util import dirs
+
+
+class TestLogWriter(dirs.DirsMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.setUpDirs('logs')
+        self.reactor = mock.Mock()
+        # the calls from the writer thread are run in that thread, they are
+        # done once the thread is stopped
+        self.reactor.callFromThread.side_effect = lambda f, *a, **kw: f(*a, **kw)
+        self.writer = logwriter.LogWriter(_reactor=self.reactor)
+
+    def tearDown(self):
+        self.writer.stop()
+        return self.tearDownDirs()
+
+    def read(self, filename):
+        with open(os.path.join('logs', filename)) as f:
+            return f.read()
+
+    def test_write(self):
+        for i in range(3):
+            self.writer.write(os.path.join('logs', 'a'), 'a%d,' % i)
+            self.writer.write(os.path.join('logs', 'b'), 'b%d,' % i)
+        self.writer.stop()
+        self.assertEqual((self.read('a'), self.read('b')), ('a0,a1,a2,', 'b0,b1,b2,'))
+        self.reactor.addSystemEventTrigger.assert_called_once_with('during', 'shutdown',
+                                                                   self.writer.stop)
+
+    def test_write_pending(self):
+        filename = os.path.join('logs', 'a')
+        self.writer.queue = mock.Mock()  # nothing is written
+        self.writer.thread = mock.Mock()
+        pending = self.writer.write(filename, 'x')
+        self.assertIdentical(self.writer.write(filename, 'yz'), pending)
+        self.assertEqual((pending.written, pending.getTail()), (0, 'xyz'))
+
+        self.writer._written([(pending, 1, 1)])
+        self.assertEqual((pending.written, pending.getTail()), (1, 'yz'))
+        self.writer.thread = None
+
+    def test_write_written(self):
+        pending = self.writer.write(os.path.join('logs', 'a'), 'xyz')
+        self.writer.stop()
+        self.assertEqual((pending.written, pending.getTail()), (3, ''))
+
+    def test_drain(self):
+        self.assertTrue(self.writer.drain().called)
+        self.writer.write(os.path.join('logs', 'a'), 'x')
+        d = self.writer.drain()
+        self.writer.stop()
+        self.assertTrue(d.called)
+        self.assertEqual(self.read('a'), 'x')
+
+    def test_writeBatch_joins_writes(self):
+        files = {}
+        a, a2, b = mock.Mock(name='a'), mock.Mock(name='a2'), mock.Mock(name='b')
+        self.writer._writeFile = mock.Mock(return_value=1)
+        self.writer._written = mock.Mock()
+        self.writer._writeBatch(files, [('a', 'x', a), ('b', 'y', b), ('a', 'z', a),
+                                        ('a', logwriter._CLOSE, None), ('a', 'w', a2)])
+        self.assertEqual(self.writer._writeFile.call_args_list,
+                         [mock.call(files, 'a', 'xz'), mock.call(files, 'b', 'y'),
+                          mock.call(files, 'a', 'w')])
+        self.assertEqual(self.writer._written.call_args_list,
+                         [mock.call([(a, 2, 1), (b, 1, 1)]), mock.call([(a2, 1, 1)])])
+
+    def test_close(self):
+        filename = os.path.join('logs', 'a')
+        self.writer.write(filename, 'x')
+        self.writer.close(filename)
+        self.writer.stop()
+        # the file is opened again after it was closed
+        os.unlink(filename)
+        pending = self.writer.write(filename, 'y')
+        self.writer.stop()
+        self.assertEqual(self.read('a'), 'y')
+        self.assertEqual(pending.written, 1)
+
+    def test_stop(self):
+        self.writer.write(os.path.join('logs', 'a'), 'x')
+        self.writer.stop()
+        self.assertEqual(self.writer.thread, None)
+        self.assertEqual(self.read('a'), 'x')
+        self.assertTrue(self.reactor.callFromThread.called)
@@ -108,3 +108,29 @@ class TestStatus(unittest.TestCase):
 
         self.assertEqual(url['text'], 'buildername #1')
         self.assertEqual(url['path'], 'baseurl/builders/buildername/builds/1?c1_branch=b1&c2_branch=b2')
+
+    @defer.inlineCallbacks
+    def test_generateFinishedBuildsAsync(self):
+        s = self.makeStatus()
+        s.master.db.builds.getLastsBuildsNumbersBySlave = \
+            lambda slavename, results, num_builds: defer.succeed({'b1': [2, 1], 'b2': [7]})
+        s.getBuilderNames = lambda: ['b1', 'b2']
+
+        builders = {}
+        for name, finished in [('b1', {2: 30, 1: 10}), ('b2', {7: 20})]:
+            b = builders[name] = mock.Mock(name=name)
+            summaries = [mock.Mock(finished=finished[n], getBuilder=lambda b=b: b,
+                                   getNumber=lambda n=n: n) for n in finished]
+            b.getBuildSummariesByNumbers.side_effect = \
+                lambda buildnumbers, results, summaries=summaries: defer.succeed(summaries)
+            b.deferToThread.side_effect = lambda n, name=name: defer.succeed((name, n))
+        s.getBuilder = builders.get
+
+        # the builds are selected from the summaries, and only those listed are loaded
+        builds = yield s.generateFinishedBuildsAsync(num_builds=2, slavename='slave-01')
+        self.assertEqual(builds, [('b1', 2), ('b2', 7)])
+        self.assertEqual(builders['b1'].deferToThread.call_args_list, [mock.call(2)])
+
+        summaries = yield s.generateFinishedBuildsAsync(num_builds=2, slavename='slave-01',
+                                                        summaryOnly=True)
+        self.assertEqual([summary.getNumber() for summary in summaries], [2, 7])
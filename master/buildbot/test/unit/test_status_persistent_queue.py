@@ -19,7 +19,7 @@ from twisted.trial import unittest
 from buildbot.test.util import dirs
 
 from buildbot.status.persistent_queue import MemoryQueue, DiskQueue, \
-    IQueue, PersistentQueue, WriteFile
+    IQueue, PersistentQueue, SegmentQueue, WriteFile
 
 class test_Queues(dirs.DirsMixin, unittest.TestCase):
 
@@ -41,6 +41,40 @@ class test_Queues(dirs.DirsMixin, unittest.TestCase):
         self.assertEqual(3, queue.nbItems())
         self.assertEqual(['foo3', 'foo5', 'foo8'], queue.popChunk())
 
+    def testQueuedLegacy(self):
+        # Items left by a DiskQueue are moved into the segments.
+        WriteFile(os.path.join('fake_dir', '3'), 'foo3')
+        WriteFile(os.path.join('fake_dir', '5'), 'foo5')
+        WriteFile(os.path.join('fake_dir', 'state'), '{}')
+        queue = SegmentQueue('fake_dir', 5, pickleFn=str, unpickleFn=str)
+        self.assertEqual(['foo3', 'foo5'], queue.items())
+        self.assertEqual(sorted(os.listdir('fake_dir')), ['segment.0', 'state'])
+        self.assertEqual(['foo3', 'foo5'], queue.popChunk())
+        os.remove(os.path.join('fake_dir', 'state'))
+
+    def testSegmentQueueReload(self):
+        q = SegmentQueue('fake_dir', 100, segmentItems=3)
+        for i in range(8):
+            q.pushItem(i)
+        self.assertEqual([0, 1, 2, 3], q.popChunk(4))
+        self.assertEqual(None, q.insertBackChunk(['a']))
+        # the first segment was entirely popped
+        self.assertEqual(sorted(os.listdir('fake_dir')),
+                         ['cursor', 'head', 'segment.1', 'segment.2'])
+        q.save()
+
+        # a record which was only partly written is dropped
+        with open(os.path.join('fake_dir', 'segment.2'), 'ab') as f:
+            f.write(SegmentQueue.RECORD.pack(100) + 'trunc')
+
+        q = SegmentQueue('fake_dir', 100, segmentItems=3)
+        self.assertEqual(5, q.nbItems())
+        self.assertEqual(['a', 4, 5, 6, 7], q.items())
+        q.pushItem(8)
+        self.assertEqual(['a', 4, 5, 6], q.popChunk(4))
+        self.assertEqual(sorted(os.listdir('fake_dir')), ['cursor', 'segment.2'])
+        self.assertEqual([7, 8], q.popChunk())
+
     def _test_helper(self, q):
         self.assertTrue(IQueue.providedBy(q))
         self.assertEqual(8, q.maxItems())
@@ -144,4 +178,11 @@ class test_Queues(dirs.DirsMixin, unittest.TestCase):
         self._test_helper(PersistentQueue(MemoryQueue(3),
                                           DiskQueue('fake_dir', 5)))
 
+    def testSegmentQueue(self):
+        self._test_helper(SegmentQueue('fake_dir', maxItems=8, segmentItems=3))
+
+    def testPersistentSegmentQueue(self):
+        self._test_helper(PersistentQueue(MemoryQueue(3),
+                                          SegmentQueue('fake_dir', 5, segmentItems=2)))
+
 # vim: set ts=4 sts=4 sw=4 et:
@@ -0,0 +1,120 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from buildbot.status import queuesnapshot
+from buildbot.status.buildrequest import BuildRequestStatus
+from buildbot.test.fake import fakemaster, fakedb
+
+
+class TestQueueSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.master = fakemaster.make_master(wantDb=True, testcase=self)
+        self.status = mock.Mock()
+        self.status.master = self.master
+        self.snapshot = queuesnapshot.QueueSnapshot(self.status, _reactor=self.clock)
+
+        def asDict_async(brstatus, request=None):
+            # requests for unknown builders have no status
+            if brstatus.buildername == 'removed':
+                return defer.succeed({})
+            return defer.succeed(dict(brid=brstatus.brid, priority=brstatus._buildrequest.priority))
+        self.patch(BuildRequestStatus, 'asDict_async', asDict_async)
+
+    def insertBuildRequests(self, requests):
+        rows = []
+        for brid, buildername, priority, submitted_at in requests:
+            rows += [fakedb.SourceStampSet(id=brid),
+                     fakedb.SourceStamp(id=brid, sourcestampsetid=brid),
+                     fakedb.Buildset(id=brid, sourcestampsetid=brid),
+                     fakedb.BuildRequest(id=brid, buildsetid=brid, buildername=buildername,
+                                         priority=priority, submitted_at=submitted_at)]
+        return self.master.db.insertTestData(rows)
+
+    @defer.inlineCallbacks
+    def test_getSnapshot(self):
+        yield self.insertBuildRequests([(1, 'bldr1', 50, 1449578391),
+                                        (2, 'bldr2', 80, 1449578392),
+                                        (3, 'bldr1', 50, 1449578390),
+                                        (4, 'removed', 50, 1449578390)])
+
+        snapshot = yield self.snapshot.getSnapshot()
+        self.assertEqual((snapshot['version'], snapshot['total']), (1, 4))
+        self.assertEqual(snapshot['builders'], dict(bldr1=2, bldr2=1, removed=1))
+        self.assertEqual(snapshot['priorities'], {50: 3, 80: 1})
+        self.assertEqual([entry['brid'] for entry in snapshot['entries']], [2, 3, 1])
+
+    @defer.inlineCallbacks
+    def test_getSnapshot_refreshes_when_invalidated(self):
+        yield self.insertBuildRequests([(1, 'bldr1', 50, 1449578391)])
+        yield self.snapshot.getSnapshot()
+        yield self.insertBuildRequests([(2, 'bldr1', 50, 1449578392)])
+
+        # not refreshed until invalidated
+        snapshot = yield self.snapshot.getSnapshot()
+        self.assertEqual((snapshot['version'], snapshot['total']), (1, 1))
+
+        # and then at most once per refresh interval
+        self.snapshot.invalidate()
+        snapshot = yield self.snapshot.getSnapshot()
+        self.assertEqual(snapshot['version'], 1)
+
+        self.clock.advance(self.snapshot.MIN_REFRESH_INTERVAL)
+        snapshot = yield self.snapshot.getSnapshot()
+        self.assertEqual((snapshot['version'], snapshot['total']), (2, 2))
+
+    @defer.inlineCallbacks
+    def test_getSnapshot_refreshes_when_too_old(self):
+        yield self.insertBuildRequests([(1, 'bldr1', 50, 1449578391)])
+        yield self.snapshot.getSnapshot()
+        yield self.insertBuildRequests([(2, 'bldr1', 50, 1449578392)])
+
+        self.clock.advance(self.snapshot.MAX_AGE)
+        snapshot = yield self.snapshot.getSnapshot()
+        self.assertEqual((snapshot['version'], snapshot['total']), (2, 2))
+
+    @defer.inlineCallbacks
+    def test_getSnapshot_shares_refresh(self):
+        yield self.insertBuildRequests([(1, 'bldr1', 50, 1449578391)])
+        db = self.master.db.buildrequests
+        counts = defer.Deferred()
+        getCounts = db.getBuildRequestInQueueCounts
+        db.getBuildRequestInQueueCounts = mock.Mock(return_value=counts)
+
+        d1 = self.snapshot.getSnapshot()
+        d2 = self.snapshot.getSnapshot()
+        counts.callback((yield getCounts()))
+        snapshots = yield defer.gatherResults([d1, d2])
+
+        self.assertIdentical(snapshots[0], snapshots[1])
+        self.assertEqual(db.getBuildRequestInQueueCounts.call_count, 1)
+
+    @defer.inlineCallbacks
+    def test_getSnapshot_keeps_last_snapshot_on_failure(self):
+        yield self.insertBuildRequests([(1, 'bldr1', 50, 1449578391)])
+        previous = yield self.snapshot.getSnapshot()
+
+        self.master.db.buildrequests.getBuildRequestInQueueCounts = \
+            mock.Mock(return_value=defer.fail(RuntimeError('oh noes')))
+        self.clock.advance(self.snapshot.MAX_AGE)
+        snapshot = yield self.snapshot.getSnapshot()
+
+        self.assertIdentical(snapshot, previous)
+        self.assertTrue(self.snapshot.dirty)
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
@@ -0,0 +1,73 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import task
+from buildbot.status import status_push
+
+
+class TestAutobahnStatusPush(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.patch(status_push, 'reactor', self.clock)
+        self.patch(status_push.AutobahnStatusPush, 'connectToAutobahn', lambda self: None)
+
+    def makePush(self, **kwargs):
+        sp = status_push.AutobahnStatusPush('localhost', 9000, maxDiskItems=0, **kwargs)
+        sp.status = mock.Mock()
+        sp.status.getTitle.return_value = 'katana'
+        return sp
+
+    def pushed(self, sp):
+        return [(item['event'], item['payload'].get('number'), item['payload'].get('ETA'))
+                for item in sp.queue.items()]
+
+    def test_coalesce_superseded_events(self):
+        sp = self.makePush()
+        for eta in (30, 20, 10):
+            sp.push('buildETAUpdate', builderName='b', number=1, ETA=eta)
+            sp.push('buildETAUpdate', builderName='b', number=2, ETA=eta + 1)
+        self.assertEqual(self.pushed(sp), [])
+
+        self.clock.advance(sp.coalesceWindow)
+        self.assertEqual(self.pushed(sp), [('buildETAUpdate', 1, 10),
+                                           ('buildETAUpdate', 2, 11)])
+
+    def test_other_events_keep_order(self):
+        sp = self.makePush()
+        sp.push('buildETAUpdate', builderName='b', number=1, ETA=10)
+        sp.push('stepStarted', builderName='b', number=1)
+        sp.push('buildETAUpdate', builderName='b', number=2, ETA=20)
+        sp.push('buildFinished', builderName='b', number=2)
+        # the ETA of build 2 is dropped, as it finished
+        self.assertEqual(self.pushed(sp), [('buildETAUpdate', 1, 10),
+                                           ('stepStarted', 1, None),
+                                           ('buildFinished', 2, None)])
+        self.assertEqual(sp.coalesceTask, None)
+
+    def test_events_filter(self):
+        sp = self.makePush(events=['buildFinished'])
+        sp.push('buildStarted', builderName='b', number=1)
+        sp.push('buildFinished', builderName='b', number=1)
+        self.assertEqual(self.pushed(sp), [('buildFinished', 1, None)])
+
+    def test_no_coalescing(self):
+        sp = self.makePush(coalesceWindow=0)
+        sp.push('buildETAUpdate', builderName='b', number=1, ETA=20)
+        sp.push('buildETAUpdate', builderName='b', number=1, ETA=10)
+        self.assertEqual(self.pushed(sp), [('buildETAUpdate', 1, 20),
+                                           ('buildETAUpdate', 1, 10)])
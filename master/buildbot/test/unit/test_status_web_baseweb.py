@@ -0,0 +1,51 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import zlib
+import mock
+from twisted.trial import unittest
+from twisted.web.http_headers import Headers
+from buildbot.status.web import baseweb
+
+
+class TestSafeGzipEncoderFactory(unittest.TestCase):
+
+    def makeRequest(self, acceptEncoding='gzip, deflate'):
+        request = mock.Mock()
+        request.startedWriting = False
+        request.requestHeaders = Headers({'accept-encoding': [acceptEncoding]})
+        request.responseHeaders = Headers({'content-length': ['5']})
+        return request
+
+    def test_not_accepted(self):
+        request = self.makeRequest(acceptEncoding='deflate')
+        self.assertIdentical(baseweb.SafeGzipEncoderFactory().encoderForRequest(request), None)
+
+    def test_compresses(self):
+        request = self.makeRequest()
+        encoder = baseweb.SafeGzipEncoderFactory().encoderForRequest(request)
+        data = encoder.encode('hello')
+        request.startedWriting = True
+        data += encoder.encode(' world') + encoder.finish()
+        self.assertEqual(zlib.decompress(data, 16 + zlib.MAX_WBITS), 'hello world')
+        self.assertEqual(request.responseHeaders.getRawHeaders('content-encoding'), ['gzip'])
+        self.assertFalse(request.responseHeaders.hasHeader('content-length'))
+
+    def test_encoded_by_resource(self):
+        request = self.makeRequest()
+        request.responseHeaders.setRawHeaders('content-encoding', ['gzip'])
+        encoder = baseweb.SafeGzipEncoderFactory().encoderForRequest(request)
+        self.assertEqual(encoder.encode('gzipped') + encoder.finish(), 'gzipped')
+        self.assertEqual(request.responseHeaders.getRawHeaders('content-encoding'), ['gzip'])
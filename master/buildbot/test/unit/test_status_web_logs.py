@@ -17,7 +17,8 @@ from buildbot.status.web.jsontestresults import JSONTestResource
 from buildbot.status.buildstep import BuildStepStatus
 from buildbot.status.build import BuildStatus
 from buildbot.status.logfile import HTMLLogFile, LogFile
-from buildbot.status.web.logs import LogsResource
+from buildbot.status.web.logs import LogsResource, TextLog
+from buildbot.test.fake.web import FakeRequest
 
 import mock
 from buildbot.status.web.xmltestresults import XMLTestResource
@@ -112,3 +113,24 @@ class TestLogsResource(unittest.TestCase):
         htmllog = HTMLLogFile(step, "example", "test file", "test html")
 
         self.assertEquals(htmllog.content_type, "")
+
+    def test_text_log_tail(self):
+        log = mock.Mock(LogFile)
+        log.getTailChunks = lambda numLines: [(2, 'exit 0\n'), (0, 'done\n')][-numLines:]
+        textlog = TextLog(log)
+        textlog.asText = True
+
+        req = FakeRequest(args={'tail': ['1']})
+        textlog.render_GET(req)
+        self.assertEqual(req.written, 'done\n')
+
+    def test_text_log_line_range(self):
+        log = mock.Mock(LogFile)
+        log.getLineChunks.return_value = [(0, 'line 10\n')]
+        textlog = TextLog(log)
+        textlog.asText = True
+
+        req = FakeRequest(args={'start': ['10'], 'end': ['11']})
+        textlog.render_GET(req)
+        log.getLineChunks.assert_called_once_with(10, 11)
+        self.assertEqual(req.written, 'line 10\n')
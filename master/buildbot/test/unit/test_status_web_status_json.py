@@ -14,11 +14,13 @@
 # Copyright Buildbot Team Members
 
 import mock
+import zlib
 from buildbot.status.web import status_json
 from twisted.trial import unittest
 from buildbot.config import ProjectConfig
 from buildbot.status import master
 from buildbot.test.fake import fakemaster, fakedb
+from buildbot.test.fake.web import FakeRequest
 from buildbot.status.builder import BuilderStatus, PendingBuildsCache
 from buildbot.status.build import BuildStatus
 from buildbot.status.slave import SlaveStatus
@@ -30,6 +32,13 @@ from buildbot.status.buildrequest import BuildRequestStatus
 from buildbot.sourcestamp import SourceStamp
 from buildbot.process.properties import Properties
 
+def fakeBuildSummary(build, number):
+    summary = mock.Mock()
+    summary.getNumber.return_value = number
+    summary.getBuilder.return_value.deferToThread.side_effect = lambda n: defer.succeed(build)
+    return summary
+
+
 class PastBuildsJsonResource(unittest.TestCase):
     def setUp(self):
         # set-up mocked request object
@@ -42,8 +51,9 @@ class PastBuildsJsonResource(unittest.TestCase):
         build.asDict = mock.Mock(return_value="dummy")
 
         self.builder_status = mock.Mock()
-        self.builder_status.generateFinishedBuildsAsync = \
-            lambda branches=[], codebases={}, num_builds=None, results=None: defer.succeed([build])
+        self.builder_status.generateFinishedBuildSummariesAsync = \
+            lambda branches=[], codebases={}, num_builds=None, results=None: \
+            defer.succeed([fakeBuildSummary(build, 1)])
 
         # set-up the resource object that will be used
         # by the tests with our mocked objects
@@ -243,21 +253,15 @@ class TestPastBuildsJsonResource(unittest.TestCase):
     def test_getPastBuildsJsonResource(self):
         builder = mockBuilder(self.master, self.master_status, "builder-01", "Katana")
 
-        def mockFinishedBuilds(branches=[], codebases={},
-                               num_builds=None,
-                               max_buildnum=None,
-                               finished_before=None,
-                               results=None,
-                               max_search=2000,
-                               useCache=False):
-
-
-            finished_builds = []
+        def mockFinishedBuildSummaries(branches=[], codebases={},
+                                       num_builds=None,
+                                       results=None):
+            summaries = []
             for n in range(15):
-                finished_builds.append(fakeBuildStatus(self.master, builder, n))
-            return defer.succeed(finished_builds)
+                summaries.append(fakeBuildSummary(fakeBuildStatus(self.master, builder, n), n))
+            return defer.succeed(summaries)
 
-        builder.builder_status.generateFinishedBuildsAsync = mockFinishedBuilds
+        builder.builder_status.generateFinishedBuildSummariesAsync = mockFinishedBuildSummaries
 
         builds_json = status_json.PastBuildsJsonResource(self.master_status, 15, builder_status=builder.builder_status)
         builds_dict = yield builds_json.asDict(self.request)
@@ -501,7 +505,7 @@ class TestSinglePendingBuildsJsonResource(unittest.TestCase):
             brstatus.getBuildProperties = lambda: Properties()
             return brstatus
 
-        def getPendingBuildRequestStatuses(codebases={}):
+        def getPendingBuildRequestStatuses(codebases={}, prefetch=False):
             requests = [1, 2, 3]
             return [getBuildRequestStatus(id) for id in requests]
 
@@ -583,3 +587,260 @@ class TestAliveJsonResource(unittest.TestCase):
         '''
         alive_json = status_json.AliveJsonResource(None)
         self.assertEqual(alive_json.asDict(None), 1)
+
+
+class TestMetricsJsonResource(unittest.TestCase):
+    def test_buildCacheMetrics(self):
+        status = mock.Mock()
+        status.getMetrics.return_value = None
+        status.getBuildCacheMetrics.return_value = dict(max_weight=10, weight=4, builders={})
+
+        metrics_json = status_json.MetricsJsonResource(status)
+        self.assertEqual(metrics_json.asDict(None),
+                         {'buildCache': dict(max_weight=10, weight=4, builders={})})
+
+
+class TestJsonResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.status = mock.Mock()
+        self.resource = status_json.JsonResource(self.status)
+        self.resource.cacheEvents = (status_json.BUILDS,)
+        self.resource.asDict = mock.Mock(return_value={'number': 1})
+        self.cache = status_json.JsonResponseCache.forStatus(self.status)
+
+    def makeBuild(self, builderName='bldr', number=1):
+        build = mock.Mock()
+        build.getBuilder.return_value.getName.return_value = builderName
+        build.getNumber.return_value = number
+        return build
+
+    def render(self, args={}, headers={}, path='/json/builders/bldr'):
+        request = FakeRequest(args=dict(args))
+        request.path = path
+        request.getHeader.side_effect = headers.get
+        self.resource.render_GET(request)
+        return request
+
+    def test_forStatus(self):
+        self.assertIdentical(status_json.JsonResponseCache.forStatus(self.status), self.cache)
+        self.status.subscribe.assert_called_once_with(self.cache)
+
+    def test_etag(self):
+        request = self.render()
+        etag = status_json.JsonResponse(request.written).etag
+        request.setHeader.assert_any_call("ETag", etag)
+        request.setHeader.assert_any_call("Vary", "Accept-Encoding")
+
+        request = self.render(headers={"If-None-Match": etag})
+        request.setResponseCode.assert_called_with(304)
+        self.assertEqual((request.written, request.finished), ('', True))
+
+    def test_reused_until_event(self):
+        first = self.render(args={'as_text': ['1']})
+        self.assertEqual(self.render(args={'as_text': ['1']}).written, first.written)
+        self.assertEqual(self.resource.asDict.call_count, 1)
+
+        # other arguments are another response
+        self.render()
+        self.assertEqual(self.resource.asDict.call_count, 2)
+
+        # events the resource does not depend on keep the response
+        self.cache.stepFinished(self.makeBuild(), None, SUCCESS)
+        self.render()
+        self.assertEqual(self.resource.asDict.call_count, 2)
+
+        self.cache.buildFinished('bldr', self.makeBuild(), SUCCESS)
+        self.render()
+        self.assertEqual(self.resource.asDict.call_count, 3)
+
+    def test_steps_events(self):
+        self.resource.cacheEvents = (status_json.STEPS,)
+        build = self.makeBuild()
+        self.render()
+        # the responses which hold steps are rendered again as soon as a step
+        # starts, changes its text or its ETA, or finishes
+        self.assertEqual(self.cache.stepStarted(build, None),
+                         (self.cache, self.cache.ETA_UPDATE_INTERVAL))
+        for event in [lambda: self.cache.stepStarted(build, None),
+                      lambda: self.cache.stepTextChanged(build, None, ['compile']),
+                      lambda: self.cache.stepText2Changed(build, None, ['compile']),
+                      lambda: self.cache.stepETAUpdate(build, None, 10, []),
+                      lambda: self.cache.stepFinished(build, None, SUCCESS)]:
+            calls = self.resource.asDict.call_count
+            event()
+            self.render()
+            self.assertEqual(self.resource.asDict.call_count, calls + 1)
+
+    def test_scoped_events(self):
+        self.resource.cacheEvents = (status_json.BUILDS, status_json.STEPS)
+        self.resource.getCacheScopes = lambda: [('bldr', 1)]
+        self.cache.buildStarted('bldr', self.makeBuild())
+        self.render()
+
+        # the events of other builds and builders keep the response
+        self.cache.stepStarted(self.makeBuild(number=2), None)
+        self.cache.buildStarted('other', self.makeBuild('other', 1))
+        self.render()
+        self.assertEqual(self.resource.asDict.call_count, 1)
+
+        self.cache.stepStarted(self.makeBuild(), None)
+        self.render()
+        self.assertEqual(self.resource.asDict.call_count, 2)
+
+        # and the finished build has a response of its own
+        self.cache.buildFinished('bldr', self.makeBuild(), SUCCESS)
+        self.render()
+        self.assertEqual(self.resource.asDict.call_count, 3)
+        self.assertNotIn((status_json.STEPS, 'bldr', 1), self.cache.generations)
+
+        # builder resources depend on all of its builds
+        self.resource.getCacheScopes = lambda: [('bldr',)]
+        self.render()
+        self.cache.stepStarted(self.makeBuild(number=2), None)
+        self.render()
+        self.assertEqual(self.resource.asDict.call_count, 5)
+
+    def test_stale_responses_dropped(self):
+        self.render()
+        self.cache.buildFinished('bldr', self.makeBuild(), SUCCESS)
+        self.render()
+        self.render(path='/json/builders/other')
+        self.assertEqual(len(self.cache.responses), 2)
+        self.assertEqual(self.cache.size, 2 * len('{"number":1}'))
+
+    def test_bounded_by_size(self):
+        self.patch(self.cache, 'MAX_RESPONSES_SIZE', 2 * len('{"number":1}'))
+        for path in ['/json/builders/a', '/json/builders/b', '/json/builders/c']:
+            self.render(path=path)
+        self.assertEqual([key[0][0] for key in self.cache.responses],
+                         ['/json/builders/b', '/json/builders/c'])
+        self.assertEqual(sorted(path for path, args in self.cache.latest),
+                         ['/json/builders/b', '/json/builders/c'])
+
+    def test_isCacheable(self):
+        self.assertTrue(self.resource.isCacheable(FakeRequest(args={'as_text': ['1']})))
+        # selected children may depend on other events
+        self.assertFalse(self.resource.isCacheable(FakeRequest(args={'select': ['steps']})))
+        self.assertFalse(status_json.QueueJsonResource(self.status).isCacheable(FakeRequest()))
+
+    def test_concurrent_requests_share_rendering(self):
+        d = defer.Deferred()
+        self.resource.asDict.return_value = d
+        requests = [self.render(), self.render()]
+        self.assertFalse(requests[0].finished)
+        d.callback({'number': 1})
+
+        self.assertEqual([r.written for r in requests], ['{"number":1}'] * 2)
+        self.assertEqual(self.resource.asDict.call_count, 1)
+
+    def test_gzipped(self):
+        request = self.render(headers={"Accept-Encoding": "deflate, gzip;q=1.0"})
+        self.assertEqual(zlib.decompress(request.written, 16 + zlib.MAX_WBITS), '{"number":1}')
+        request.setHeader.assert_any_call("Content-Encoding", "gzip")
+        response = status_json.JsonResponse('{"number":1}')
+        request.setHeader.assert_any_call("ETag", response.gzipEtag)
+        self.assertNotEqual(response.gzipEtag, response.etag)
+
+
+class TestJsonItemsProducer(unittest.TestCase):
+
+    def setUp(self):
+        self.request = FakeRequest()
+        self.producer = status_json.JsonItemsProducer(self.request, iter([1, defer.succeed(2), 3]),
+                                                      encode=str)
+
+    def test_produce(self):
+        self.producer.produce("cb(", ");")
+        self.assertEqual(self.request.written, "cb([1,2,3]);")
+        self.assertTrue(self.request.finished)
+        self.request.registerProducer.assert_called_once_with(self.producer, True)
+        self.request.unregisterProducer.assert_called_once_with()
+
+    def test_paused(self):
+        self.producer.produce()
+        self.assertEqual(self.request.written, "[1,2,3]")
+
+        self.request = FakeRequest()
+        self.producer = status_json.JsonItemsProducer(self.request, iter([1, 2]), encode=str)
+        self.producer.pauseProducing()
+        self.producer.produce()
+        self.assertEqual(self.request.written, "[")
+
+        self.producer.resumeProducing()
+        self.assertEqual(self.request.written, "[1,2]")
+        self.assertTrue(self.request.finished)
+
+    def test_stopped(self):
+        self.producer.pauseProducing()
+        self.producer.produce()
+        self.producer.stopProducing()
+        self.assertEqual((self.request.written, self.request.finished), ("[", False))
+        self.request.unregisterProducer.assert_called_once_with()
+
+
+class TestStreamingJsonResource(unittest.TestCase):
+
+    def setUp(self):
+        self.builder_status = mock.Mock()
+        self.builds = [mock.Mock(), mock.Mock()]
+        self.loaded = {}
+        for number, build in enumerate(self.builds, 1):
+            build.asDict.return_value = {'number': number}
+            self.loaded[number] = defer.Deferred()
+        self.summaries = [mock.Mock(), mock.Mock()]
+        for number, summary in enumerate(self.summaries, 1):
+            summary.getNumber.return_value = number
+            summary.getBuilder.return_value.deferToThread.side_effect = self.loaded.get
+        self.builder_status.generateFinishedBuildSummariesAsync.return_value = defer.succeed(self.summaries)
+        self.resource = status_json.PastBuildsJsonResource(mock.Mock(), 2,
+                                                           builder_status=self.builder_status)
+
+    def render(self, args={}):
+        request = FakeRequest(args=dict(args))
+        request.getHeader.return_value = None
+        self.resource.render_GET(request)
+        return request
+
+    def load(self, *numbers):
+        for number in numbers:
+            self.loaded[number].callback(self.builds[number - 1])
+
+    def test_render_streamed(self):
+        request = self.render()
+        self.load(1, 2)
+        self.assertEqual(request.written, '[{"number":1},{"number":2}]')
+        self.assertTrue(request.finished)
+        request.setHeader.assert_any_call("content-type", "application/json")
+        request.registerProducer.assert_called_once_with(mock.ANY, True)
+
+    def test_render_filtered(self):
+        self.builds[0].asDict.return_value = {'number': 1, 'text': []}
+        request = self.render(args={'filter': ['1'], 'callback': ['cb']})
+        self.load(1, 2)
+        self.assertEqual(request.written, 'cb([{"number":1},{"number":2}]);')
+
+    def test_render_loads_one_build_per_item(self):
+        request = self.render()
+        deferToThread = self.summaries[1].getBuilder.return_value.deferToThread
+        self.assertFalse(deferToThread.called)
+        self.load(1)
+        self.assertEqual(request.written, '[{"number":1}')
+        deferToThread.assert_called_once_with(2)
+        self.load(2)
+        self.assertEqual(request.written, '[{"number":1},{"number":2}]')
+
+    def test_render_skips_missing_builds(self):
+        request = self.render()
+        self.loaded[1].callback(None)
+        self.load(2)
+        self.assertEqual(request.written, '[{"number":2}]')
+
+    @defer.inlineCallbacks
+    def test_asDict(self):
+        request = FakeRequest()
+        request.getHeader.return_value = None
+        d = self.resource.asDict(request)
+        self.load(1, 2)
+        builds = yield d
+        self.assertEqual(builds, [{'number': 1}, {'number': 2}])
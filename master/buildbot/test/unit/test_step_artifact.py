@@ -9,6 +9,7 @@ from buildbot.test.fake import fakemaster, fakedb
 class TestArtifactSteps(steps.BuildStepMixin, unittest.TestCase):
 
     def setUp(self):
+        self.patch(artifact, '_index', artifact.ArtifactIndex())
         return self.setUpBuildStep()
 
     def tearDown(self):
@@ -34,6 +35,7 @@ class TestArtifactSteps(steps.BuildStepMixin, unittest.TestCase):
         if brqs:
             breqs += brqs
 
+        self.build.slavebuilder.slave.slavename = "slave-01"
         self.build.slavebuilder.slave.slave_environ = {}
 
         if winslave:
@@ -188,3 +190,99 @@ class TestArtifactSteps(steps.BuildStepMixin, unittest.TestCase):
         self.expectOutcome(result=SUCCESS, status_text=["Downloaded 'B'."])
         return self.runStep()
 
+    def test_upload_artifact_deduplicated(self):
+        index = artifact.getArtifactIndex()
+        index.addUpload(('usr@srv.com', '/home/srv/web/dir', 'build', 'mydir', 'myartifact.py'),
+                        'build_0_16_12_2014_13_31_26_+0000/mydir')
+        self.setupStep(artifact.UploadArtifact(artifact="myartifact.py", artifactDirectory="mydir",
+                                   artifactServer='usr@srv.com', artifactServerDir='/home/srv/web/dir',
+                                   artifactServerURL="http://srv.com/dir"))
+        self.expectCommands(
+            ExpectShell(workdir='wkdir', usePTY='slave-config',
+                        command='for i in 1 2 3 4 5; do rsync -var --progress --partial '+
+                                '--link-dest=../../build_0_16_12_2014_13_31_26_+0000/mydir '+
+                                self.local +' '+ self.remote +
+                                '; if [ $? -eq 0 ]; then exit 0; else sleep 5; fi; done; exit -1')
+            + ExpectShell.log('stdio', stdout='')
+            + 0
+        )
+        self.expectOutcome(result=SUCCESS, status_text=['Artifact(s) uploaded.'])
+        d = self.runStep()
+        # the next upload is made against this one
+        d.addCallback(lambda _: self.assertEqual(
+            index.getPreviousUpload(('usr@srv.com', '/home/srv/web/dir', 'build', 'mydir',
+                                     'myartifact.py')),
+            'build_1_17_12_2014_13_31_26_+0000/mydir'))
+        return d
+
+    def test_getLinkDest(self):
+        self.assertEqual(artifact.getLinkDest('/srv', 'b_2/dir', 'b_1/dir', 'file.zip'),
+                         '../../b_1/dir')
+        self.assertEqual(artifact.getLinkDest('srv', 'b_2', 'b_1', 'my out/'),
+                         r'../../b_1/my\ out')
+
+    def test_download_artifact_cached(self):
+        fake_trigger = fakedb.BuildRequest(id=2, buildsetid=2, buildername="B", complete=1,
+                                           results=0, triggeredbybrid=1, startbrid=1)
+        self.setupStep(artifact.DownloadArtifact(artifactBuilderName="B", artifact="myartifact.py",
+                                     artifactDirectory="mydir",
+                                     artifactServer='usr@srv.com',
+                                     artifactServerDir='/home/srv/web/dir',
+                                     artifactCache='/cache/'), [fake_trigger])
+
+        self.expectCommands(
+            ExpectShell(workdir='wkdir', usePTY='slave-config',
+                        command='for i in 1 2 3 4 5; do rsync -var --progress --partial --delete '+
+                                self.remote_2 + ' \'/cache/slave-01_build_B_mydir_myartifact_py/\' && ' +
+                                'rsync -var --progress --partial ' +
+                                '\'/cache/slave-01_build_B_mydir_myartifact_py/myartifact.py\' ' + self.local +
+                                '; if [ $? -eq 0 ]; then exit 0; else sleep 5; fi; done; exit -1')
+            + ExpectShell.log('stdio', stdout='')
+            + 0
+        )
+        self.expectOutcome(result=SUCCESS, status_text=["Downloaded 'B'."])
+        return self.runStep()
+
+    def test_download_artifact_cached_concurrent_builds(self):
+        fake_trigger = fakedb.BuildRequest(id=2, buildsetid=2, buildername="B", complete=1,
+                                           results=0, triggeredbybrid=1, startbrid=1)
+        commands = []
+        for slavename, builddir in [("slave-01", "build"), ("slave-02", "build"),
+                                    ("slave-01", "other")]:
+            self.setupStep(artifact.DownloadArtifact(artifactBuilderName="B", artifact="myartifact.py",
+                                         artifactDirectory="mydir",
+                                         artifactServer='usr@srv.com',
+                                         artifactServerDir='/home/srv/web/dir',
+                                         artifactCache='/cache'), [fake_trigger])
+            self.build.slavebuilder.slave.slavename = slavename
+            self.build.builder.config.builddir = builddir
+            commands.append(self.step.getCachedDownloadCommand(self.remote_2))
+
+        # the builds which may run at the same time download to different
+        # places of the cache
+        self.assertIn("'/cache/slave-01_build_B_mydir_myartifact_py/'", commands[0])
+        self.assertIn("'/cache/slave-02_build_B_mydir_myartifact_py/'", commands[1])
+        self.assertIn("'/cache/slave-01_other_B_mydir_myartifact_py/'", commands[2])
+
+    def test_download_artifact_cached_Win(self):
+        fake_trigger = fakedb.BuildRequest(id=2, buildsetid=2, buildername="B", complete=1,
+                                           results=0, triggeredbybrid=1, startbrid=1)
+        self.setupStep(artifact.DownloadArtifact(artifactBuilderName="B", artifact="myartifact.py",
+                                     artifactDirectory="mydir",
+                                     artifactServer='usr@srv.com',
+                                     artifactServerDir='/home/srv/web/dir',
+                                     artifactCache='/cache'), [fake_trigger], winslave=True)
+
+        self.expectCommands(
+            ExpectShell(workdir='wkdir', usePTY='slave-config',
+                        command='powershell.exe -C for ($i=1; $i -le  5; $i++) '+
+                                '{ rsync -var --progress --partial --delete '+
+                                self.remote_2 + ' \'/cache/slave-01_build_B_mydir_myartifact_py/\'; if ($?) { ' +
+                                'rsync -var --progress --partial ' +
+                                '\'/cache/slave-01_build_B_mydir_myartifact_py/myartifact.py\' ' + self.local +
+                                ' } else { cmd /c exit 1 }; if ($?) { exit 0 } else { sleep 5} } exit -1')
+            + ExpectShell.log('stdio', stdout='')
+            + 0
+        )
+        self.expectOutcome(result=SUCCESS, status_text=["Downloaded 'B'."])
+        return self.runStep()
@@ -19,6 +19,7 @@ import tempfile, os
 import shutil
 import tarfile
 from twisted.trial import unittest
+from twisted.internet import defer
 import ast
 
 from mock import Mock
@@ -49,7 +50,7 @@ class TestFileUpload(unittest.TestCase):
         s = transfer.FileUpload(slavesrc=__file__, masterdest=self.destfile)
         s.build = Mock()
         s.build.getProperties.return_value = Properties()
-        s.build.getSlaveCommandVersion.return_value = 1
+        s.build.getSlaveCommandVersion.return_value = "2.16"
 
         s.step_status = Mock()
         s.buildslave = Mock()
@@ -144,6 +145,42 @@ class TestFileUpload(unittest.TestCase):
         s.step_status.addURL.assert_called_once_with(
             os.path.basename(self.destfile), "http://server/file")
 
+    def testWindow(self):
+        s = transfer.FileUpload(slavesrc=__file__, masterdest=self.destfile, window=8)
+        s.build = Mock()
+        s.build.getProperties.return_value = Properties()
+        s.build.getSlaveCommandVersion.return_value = "2.17"
+
+        s.step_status = Mock()
+        s.buildslave = Mock()
+        s.remote = Mock()
+        s.start()
+
+        kwargs = s.remote.method_calls[0][1][-1]
+        self.assertEqual(kwargs['window'], 8)
+        writer = kwargs['writer']
+        writer.remote_write('x' * 100)
+        writer.remote_write('x' * 100)
+        writer.remote_close()
+
+        s._reportThroughput()
+        s.step_status.setStatistic.assert_any_call('bytes_transferred', 200)
+
+    def testWindowOldSlave(self):
+        s = transfer.FileUpload(slavesrc=__file__, masterdest=self.destfile)
+        s.build = Mock()
+        s.build.getProperties.return_value = Properties()
+        s.build.getSlaveCommandVersion.return_value = "2.16"
+
+        s.step_status = Mock()
+        s.buildslave = Mock()
+        s.remote = Mock()
+        s.start()
+
+        kwargs = s.remote.method_calls[0][1][-1]
+        self.assertNotIn('window', kwargs)
+        kwargs['writer'].remote_close()
+
 class TestDirectoryUpload(steps.BuildStepMixin, unittest.TestCase):
     def setUp(self):
         self.destdir = os.path.abspath('destdir')
@@ -169,26 +206,102 @@ class TestDirectoryUpload(steps.BuildStepMixin, unittest.TestCase):
             archive.addfile(tarfile.TarInfo("test"), StringIO("Hello World!"))
             writer = command.args['writer']
             writer.remote_write(f.getvalue())
-            writer.remote_unpack()
+            return writer.remote_unpack()
 
         self.expectCommands(
             Expect('uploadDirectory', dict(
                 slavesrc="srcdir", workdir='wkdir',
-                blocksize=16384, compress=None, maxsize=None,
+                blocksize=16384, compress=None, maxsize=None, window=16,
                 writer=ExpectRemoteRef(transfer._DirectoryWriter)))
             + Expect.behavior(upload_behavior)
             + 0)
 
         self.expectOutcome(result=SUCCESS, status_text=["uploading", "srcdir"])
         d = self.runStep()
+        d.addCallback(lambda _:
+            self.assertTrue(os.path.exists(os.path.join(self.destdir, "test"))))
         return d
 
+class TestDirectoryWriter(unittest.TestCase):
+    def setUp(self):
+        self.destdir = os.path.abspath('destdir')
+        if os.path.exists(self.destdir):
+            shutil.rmtree(self.destdir)
+
+    def tearDown(self):
+        if os.path.exists(self.destdir):
+            shutil.rmtree(self.destdir)
+
+    def makeArchive(self, mode, files):
+        from cStringIO import StringIO
+        f = StringIO()
+        archive = tarfile.open(fileobj=f, mode=mode)
+        for name, data in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, StringIO(data))
+        archive.close()
+        return f.getvalue()
+
+    @defer.inlineCallbacks
+    def testStreamed(self):
+        files = [("a", "A" * 20000), ("sub/b", "B" * 3000)]
+        data = self.makeArchive('w|gz', files)
+        writer = transfer._DirectoryWriter(self.destdir, None, 'gz')
+
+        # every write is acknowledged once it was unpacked
+        for i in range(0, len(data), 100):
+            yield writer.remote_write(data[i:i + 100])
+        yield writer.remote_unpack()
+
+        for name, contents in files:
+            self.assertEqual(open(os.path.join(self.destdir, name)).read(), contents)
+        self.assertEqual(writer.transferred, len(data))
+
+    @defer.inlineCallbacks
+    def testMerged(self):
+        os.makedirs(os.path.join(self.destdir, "sub"))
+        open(os.path.join(self.destdir, "sub", "b"), "w").write("old")
+        open(os.path.join(self.destdir, "c"), "w").write("kept")
+        data = self.makeArchive('w|', [("a", "A"), ("sub/b", "B")])
+        writer = transfer._DirectoryWriter(self.destdir, None, None)
+
+        yield writer.remote_write(data)
+        yield writer.remote_unpack()
+
+        for name, contents in [("a", "A"), ("sub/b", "B"), ("c", "kept")]:
+            self.assertEqual(open(os.path.join(self.destdir, name)).read(), contents)
+        self.assertEqual([name for name in os.listdir(os.path.dirname(self.destdir))
+                          if name.startswith('.upload-')], [])
+
+    @defer.inlineCallbacks
+    def testCancelled(self):
+        data = self.makeArchive('w|', [("a", "A" * 20000), ("b", "B" * 20000)])
+        writer = transfer._DirectoryWriter(self.destdir, None, None)
+
+        # the first file is unpacked, but not moved into place
+        yield writer.remote_write(data[:len(data) / 2])
+        d = writer.remote_write(data[len(data) / 2:])
+        writer.cancel()
+        yield self.assertFailure(d, IOError)
+        self.assertFalse(os.path.exists(self.destdir))
+        self.assertEqual([name for name in os.listdir(os.path.dirname(self.destdir))
+                          if name.startswith('.upload-')], [])
+
+    @defer.inlineCallbacks
+    def testCorrupted(self):
+        writer = transfer._DirectoryWriter(self.destdir, None, 'gz')
+        yield writer.remote_write("not a gzip stream")
+        yield self.assertFailure(writer.remote_unpack(), tarfile.TarError)
+        # once unpacking failed, the writes fail too
+        yield self.assertFailure(writer.remote_write("more"), tarfile.TarError)
+
 class TestStringDownload(unittest.TestCase):
     def testBasic(self):
         s = transfer.StringDownload("Hello World", "hello.txt")
         s.build = Mock()
         s.build.getProperties.return_value = Properties()
-        s.build.getSlaveCommandVersion.return_value = 1
+        s.build.getSlaveCommandVersion.return_value = "2.16"
 
         s.step_status = Mock()
         s.buildslave = Mock()
@@ -215,7 +328,7 @@ class TestJSONStringDownload(unittest.TestCase):
         s = transfer.JSONStringDownload(msg, "hello.json")
         s.build = Mock()
         s.build.getProperties.return_value = Properties()
-        s.build.getSlaveCommandVersion.return_value = 1
+        s.build.getSlaveCommandVersion.return_value = "2.16"
 
         s.step_status = Mock()
         s.buildslave = Mock()
@@ -243,7 +356,7 @@ class TestJSONPropertiesDownload(unittest.TestCase):
         props = Properties()
         props.setProperty('key1', 'value1', 'test')
         s.build.getProperties.return_value = props
-        s.build.getSlaveCommandVersion.return_value = 1
+        s.build.getSlaveCommandVersion.return_value = "2.16"
         ss = Mock()
         ss.asDict.return_value = dict(revision="12345")
         s.build.getSourceStamp.return_value = ss
@@ -574,3 +574,75 @@ class AsyncLRUCacheTest(unittest.TestCase):
         self.assertEqual((yield self.lru.get('p')), short('p'))
         self.lru.put('p', set(['P2P2']))
         self.assertEqual((yield self.lru.get('p')), set(['P2P2']))
+
+
+class WeightedLRUCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.budget = lru.LRUBudget(10)
+        self.lru = lru.WeightedLRUCache(short, 3, weight_fn=lambda k, v: len(k),
+                                        budget=self.budget)
+        self.other = lru.WeightedLRUCache(long, 3, weight_fn=lambda k, v: len(k),
+                                          budget=self.budget)
+
+    def test_get(self):
+        self.assertEqual(self.lru.get('a'), short('a'))
+        self.lru.miss_fn = long
+        self.assertEqual(self.lru.get('a'), short('a'))
+        self.assertEqual((self.lru.hits, self.lru.misses), (1, 1))
+
+    def test_max_size(self):
+        for k in 'abcd':
+            self.lru.get(k)
+        self.assertEqual(self.lru.keys(), ['b', 'c', 'd'])
+        self.assertEqual((self.lru.evictions, self.lru.weight, self.budget.weight), (1, 3, 3))
+
+    def test_budget_evicts_across_caches(self):
+        self.lru.get('aaaa')
+        self.other.get('bbbb')
+        self.lru.get('aaaa')
+        self.other.get('cc')
+        self.other.get('dd')
+
+        # 'bbbb' was the least recently used entry of the two caches
+        self.assertEqual(self.lru.keys(), ['aaaa'])
+        self.assertEqual(self.other.keys(), ['cc', 'dd'])
+        self.assertEqual(self.budget.weight, 8)
+        self.assertEqual(self.other.get_metrics(),
+                         dict(hits=0, refhits=0, misses=3, evictions=1, size=2,
+                              max_size=3, weight=4))
+
+    def test_budget_keeps_last_entry(self):
+        self.lru.get('abcdefghijkl')
+        self.assertEqual(self.lru.keys(), ['abcdefghijkl'])
+        self.lru.get('a')
+        self.assertEqual(self.lru.keys(), ['a'])
+
+    def test_weakrefs(self):
+        val = self.lru.get('abcdefghijkl')
+        self.lru.get('a')
+        self.lru.miss_fn = long
+        self.assertEqual(self.lru.get('abcdefghijkl'), val)
+        self.assertEqual(self.lru.refhits, 1)
+
+    def test_set_max_weight(self):
+        for k in ('aaa', 'bbb', 'ccc'):
+            self.lru.get(k)
+        self.budget.set_max_weight(5)
+        self.assertEqual(self.lru.keys(), ['ccc'])
+        self.budget.set_max_weight(None)
+        self.lru.get('ddd')
+        self.assertEqual(self.lru.keys(), ['ccc', 'ddd'])
+
+    def test_set_budget(self):
+        self.lru.get('aaa')
+        budget = lru.LRUBudget(100)
+        self.lru.set_budget(budget)
+        self.assertEqual((self.budget.weight, budget.weight), (0, 3))
+
+    def test_put(self):
+        self.lru.get('p')
+        self.lru.put('p', set(['P2P2']))
+        self.assertEqual(self.lru.get('p'), set(['P2P2']))
+        self.assertEqual(self.budget.weight, 1)
+
@@ -1,15 +1,25 @@
+import os
+import time
 from twisted.internet import defer
 from buildbot.process import builder, factory
 from buildbot import config
 import mock
+import sqlalchemy as sa
 from buildbot.db import buildrequests, buildsets, sourcestamps, builds
 from buildbot.test.util import connector_component
 from buildbot.process import buildrequestdistributor
-from buildbot.process import cache
+from buildbot.process import cache, metrics
 from buildbot.test.fake import fakedb
 from buildbot.status.results import RESUME, BEGINNING
+from buildbot.util import json
 import cProfile, pstats
 
+try:
+    import resource
+    assert resource
+except ImportError:
+    resource = None
+
 
 class KatanaBuildRequestDistributorTestSetup(connector_component.ConnectorComponentMixin, object):
 
@@ -217,3 +227,109 @@ class KatanaBuildRequestDistributorTestSetup(connector_component.ConnectorCompon
                                                      revision=ss['revision']) for idx in xrange]
 
         self.lastbrid += len(xrange)
+
+
+def percentile(values, pct):
+    """
+    Return the C{pct} percentile of C{values}, using the nearest rank.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(round(pct / 100.0 * len(values) + 0.5)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def getRssKb():
+    if resource is None:
+        return None
+    return metrics._get_rss() * resource.getpagesize() / 1024
+
+
+class DistributorBenchmark(object):
+    """
+    Measures one run of the distributor's activity loop: how long each
+    iteration takes, the SELECT statements sent to the database and the
+    resident memory of the process, sampled after every iteration.
+    """
+
+    def __init__(self, brd, engine):
+        self.brd = brd
+        self.engine = engine
+        self.iterations = []
+        self.queries = 0
+        self.peakRssKb = getRssKb()
+        self.running = False
+        self._iterationStarted = None
+        # listeners cannot be removed in this version of sqlalchemy
+        sa.event.listen(self.engine, 'before_cursor_execute', self._countQuery)
+
+    def _countQuery(self, conn, cursor, statement, parameters, context, executemany):
+        if self.running:
+            self.queries += 1
+
+    def start(self):
+        self.running = True
+
+        # an iteration of the loop runs while it holds the activity lock
+        lock = self.brd.activity_lock
+        acquire, release = lock.acquire, lock.release
+
+        def timedAcquire():
+            d = acquire()
+
+            @d.addCallback
+            def started(res):
+                self._iterationStarted = time.time()
+                return res
+            return d
+
+        def timedRelease():
+            # the last time around, the loop releases the lock after it was
+            # marked inactive, without doing any work
+            if self.brd.active and self._iterationStarted is not None:
+                self.iterations.append(time.time() - self._iterationStarted)
+                self.peakRssKb = max(self.peakRssKb, getRssKb())
+            self._iterationStarted = None
+            return release()
+
+        lock.acquire = timedAcquire
+        lock.release = timedRelease
+        self.started = time.time()
+
+    def stop(self):
+        self.elapsed = time.time() - self.started
+        self.running = False
+        del self.brd.activity_lock.acquire
+        del self.brd.activity_lock.release
+
+    def getResults(self, builds, requests):
+        """
+        Summarize the run, given the number of C{builds} that were started or
+        resumed and the number of C{requests} they were dispatched with.
+        """
+        return dict(elapsed=self.elapsed,
+                    builds=builds,
+                    requests=requests,
+                    requests_per_second=requests / self.elapsed if self.elapsed else None,
+                    iterations=len(self.iterations),
+                    iteration_p50=percentile(self.iterations, 50),
+                    iteration_p99=percentile(self.iterations, 99),
+                    queries=self.queries,
+                    queries_per_build=float(self.queries) / builds if builds else None,
+                    peak_rss_kb=self.peakRssKb)
+
+
+def saveBenchmarkResults(filename, name, results):
+    """
+    Store the C{results} of the scenario C{name} in the JSON file
+    C{filename}, keeping the results of the other scenarios.
+    """
+    allResults = {}
+    if os.path.exists(filename):
+        with open(filename) as f:
+            allResults = json.load(f)
+    allResults[name] = results
+    with open(filename + ".tmp", "w") as f:
+        json.dump(allResults, f, indent=2, sort_keys=True)
+    os.rename(filename + ".tmp", filename)
@@ -19,6 +19,7 @@ from twisted.python import log
 from twisted.internet import defer
 from collections import deque
 from collections import defaultdict
+from collections import OrderedDict
 
 
 class LRUCache(object):
@@ -29,7 +30,7 @@ class LRUCache(object):
     """
 
     __slots__ = ('max_size max_queue miss_fn queue cache weakrefs '
-                 'refcount hits refhits misses'.split())
+                 'refcount hits refhits misses evictions'.split())
     sentinel = object()
     QUEUE_SIZE_FACTOR = 10
 
@@ -39,7 +40,7 @@ class LRUCache(object):
         self.queue = deque()
         self.cache = {}
         self.weakrefs = WeakValueDictionary()
-        self.hits = self.misses = self.refhits = 0
+        self.hits = self.misses = self.refhits = self.evictions = 0
         self.refcount = defaultdict(lambda : 0)
         self.miss_fn = miss_fn
 
@@ -70,6 +71,10 @@ class LRUCache(object):
     def keys(self):
         return self.cache.keys()
 
+    def __contains__(self, key):
+        # does not count as an access, so the entry is not refreshed
+        return key in self.cache or key in self.weakrefs
+
     def set_max_size(self, max_size):
         if self.max_size == max_size:
             return
@@ -161,6 +166,7 @@ class LRUCache(object):
                 refc = refcount[k] = refcount[k] - 1
             del cache[k]
             del refcount[k]
+            self.evictions += 1
 
 
 class AsyncLRUCache(LRUCache):
@@ -235,5 +241,161 @@ class AsyncLRUCache(LRUCache):
         if key in self.cache:
             del self.cache[key]
 
+class LRUBudget(object):
+    """
+    A limit on the total estimated cost of the entries of several
+    L{WeightedLRUCache} instances.  When the entries cost more than
+    C{max_weight}, the least-recently-used ones are evicted, whichever cache
+    they are in.  A C{max_weight} of None disables the limit.
+    """
+
+    def __init__(self, max_weight=None):
+        self.max_weight = max_weight
+        self.weight = 0
+        # (cache, key) -> weight, least recently used first
+        self.entries = OrderedDict()
+
+    def add(self, cache, key, weight):
+        self.entries[(cache, key)] = weight
+        self.weight += weight
+
+    def remove(self, cache, key):
+        self.weight -= self.entries.pop((cache, key))
+
+    def touch(self, cache, key):
+        self.entries[(cache, key)] = self.entries.pop((cache, key))
+
+    def set_max_weight(self, max_weight):
+        self.max_weight = max_weight
+        self.purge()
+
+    def purge(self):
+        if self.max_weight is None:
+            return
+
+        # the most recently used entry is kept, however large it is
+        entries = self.entries
+        while self.weight > self.max_weight and len(entries) > 1:
+            (cache, key), weight = entries.popitem(last=False)
+            self.weight -= weight
+            cache._evict(key)
+
+
+class WeightedLRUCache(object):
+    """
+    A least-recently-used cache with a maximum number of entries, whose
+    entries also count against an L{LRUBudget} shared with other caches.
+    C{weight_fn(key, value)} estimates the cost of an entry, in bytes.
+
+    Evicted values stay available through weak references for as long as
+    they are used elsewhere, as with L{LRUCache}.
+    """
+
+    __slots__ = ('max_size miss_fn weight_fn budget cache weakrefs weights '
+                 'weight hits refhits misses evictions'.split())
+
+    def __init__(self, miss_fn, max_size=50, weight_fn=None, budget=None):
+        self.max_size = max_size
+        self.miss_fn = miss_fn
+        self.weight_fn = weight_fn or (lambda key, value: 1)
+        self.budget = None
+        # key -> value, least recently used first
+        self.cache = OrderedDict()
+        self.weakrefs = WeakValueDictionary()
+        self.weights = {}
+        self.weight = 0
+        self.hits = self.misses = self.refhits = self.evictions = 0
+        if budget is not None:
+            self.set_budget(budget)
+
+    def get(self, key, **miss_fn_kwargs):
+        cache = self.cache
+        if key in cache:
+            self.hits += 1
+            cache[key] = cache.pop(key)
+            if self.budget is not None:
+                self.budget.touch(self, key)
+            return cache[key]
+
+        result = self.weakrefs.get(key)
+        if result is not None:
+            self.refhits += 1
+        else:
+            self.misses += 1
+            result = self.miss_fn(key, **miss_fn_kwargs)
+            if result is None:
+                return None
+            self.weakrefs[key] = result
+
+        self._add(key, result)
+        self._purge()
+        return result
+
+    def put(self, key, value):
+        if key in self.cache:
+            self._remove(key)
+            self._add(key, value)
+            self.weakrefs[key] = value
+            self._purge()
+        elif key in self.weakrefs:
+            self.weakrefs[key] = value
+
+    def keys(self):
+        return self.cache.keys()
+
+    def set_max_size(self, max_size):
+        if self.max_size == max_size:
+            return
+
+        self.max_size = max_size
+        self._purge()
+
+    def set_budget(self, budget):
+        """
+        Move the entries of this cache to C{budget}
+        """
+        if self.budget is not None:
+            for key in self.cache:
+                self.budget.remove(self, key)
+        self.budget = budget
+        if budget is not None:
+            for key in self.cache:
+                budget.add(self, key, self.weights[key])
+        self._purge()
+
+    def get_metrics(self):
+        return dict(hits=self.hits, refhits=self.refhits, misses=self.misses,
+                    evictions=self.evictions, size=len(self.cache),
+                    max_size=self.max_size, weight=self.weight)
+
+    def _add(self, key, value):
+        weight = self.weight_fn(key, value)
+        self.cache[key] = value
+        self.weights[key] = weight
+        self.weight += weight
+        if self.budget is not None:
+            self.budget.add(self, key, weight)
+
+    def _remove(self, key):
+        del self.cache[key]
+        self.weight -= self.weights.pop(key)
+        if self.budget is not None:
+            self.budget.remove(self, key)
+
+    def _evict(self, key):
+        # called by the budget, which has already forgotten the entry
+        del self.cache[key]
+        self.weight -= self.weights.pop(key)
+        self.evictions += 1
+
+    def _purge(self):
+        cache = self.cache
+        while len(cache) > self.max_size:
+            self._remove(next(iter(cache)))
+            self.evictions += 1
+        if self.budget is not None:
+            self.budget.purge()
+
+
 # for tests
 inv_failed = False
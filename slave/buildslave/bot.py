@@ -32,6 +32,16 @@ from buildslave import monkeypatches
 class UnknownCommand(pb.Error):
     pass
 
+def _updateSize(data):
+    # the bytes of output held by a status update
+    size = 0
+    for key, value in data.iteritems():
+        if key == 'log':
+            value = value[1]
+        if isinstance(value, basestring):
+            size += len(value)
+    return size
+
 class SlaveBuilder(pb.Referenceable, service.Service):
 
     """This is the local representation of a single Builder: it handles a
@@ -54,9 +64,20 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     # when the step is started
     remoteStep = None
 
+    # status updates are sent to the master in batches: an update waits at
+    # most UPDATE_BATCH_DELAY seconds for others to join it, and a batch is
+    # sent right away once it holds UPDATE_BATCH_SIZE bytes of output
+    UPDATE_BATCH_DELAY = 0.05
+    UPDATE_BATCH_SIZE = 64 * 1024
+
+    _reactor = reactor
+
     def __init__(self, name):
         #service.Service.__init__(self) # Service has no __init__ method
         self.setName(name)
+        self.pendingUpdates = []
+        self.pendingSize = 0
+        self.flushTimer = None
 
     def __repr__(self):
         return "<SlaveBuilder '%s' at %d>" % (self.name, id(self))
@@ -77,6 +98,7 @@ class SlaveBuilder(pb.Referenceable, service.Service):
             os.makedirs(self.basedir)
 
     def stopService(self):
+        self.flushUpdates()
         service.Service.stopService(self)
         if self.stopCommandOnShutdown:
             self.stopCommand()
@@ -103,6 +125,7 @@ class SlaveBuilder(pb.Referenceable, service.Service):
 
     def lostRemoteStep(self, remotestep):
         log.msg("lost remote step")
+        self.dropUpdates()
         self.remoteStep = None
         if self.stopCommandOnShutdown:
             self.stopCommand()
@@ -136,6 +159,8 @@ class SlaveBuilder(pb.Referenceable, service.Service):
         self.command = factory(self, stepId, args)
 
         log.msg(" startCommand:%s [id %s]" % (command,stepId))
+        # what is left of the previous command goes to its own step
+        self.flushUpdates()
         self.remoteStep = stepref
         self.remoteStep.notifyOnDisconnect(self.lostRemoteStep)
         d = self.command.doStart()
@@ -170,9 +195,9 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     def sendUpdate(self, data):
         """This sends the status update to the master-side
         L{buildbot.process.step.RemoteCommand} object, giving it a sequence
-        number in the process. It adds the update to a queue, and asks the
-        master to acknowledge the update so it can be removed from that
-        queue."""
+        number in the process. The update is added to the current batch,
+        which is sent by L{flushUpdates}, and the master is asked to
+        acknowledge it."""
 
         if not self.running:
             # .running comes from service.Service, and says whether the
@@ -183,12 +208,31 @@ class SlaveBuilder(pb.Referenceable, service.Service):
         # master still expects to receive. Provide it to avoid significant
         # interoperability issues between new slaves and old masters.
         if self.remoteStep:
-            update = [data, 0]
-            updates = [update]
+            self.pendingUpdates.append([data, 0])
+            self.pendingSize += _updateSize(data)
+            if self.pendingSize >= self.UPDATE_BATCH_SIZE:
+                self.flushUpdates()
+            elif self.flushTimer is None:
+                self.flushTimer = self._reactor.callLater(self.UPDATE_BATCH_DELAY,
+                                                          self.flushUpdates)
+
+    def flushUpdates(self):
+        """Send the pending status updates to the master in a single
+        message."""
+        updates = self.dropUpdates()
+        if updates and self.remoteStep:
             d = self.remoteStep.callRemote("update", updates)
             d.addCallback(self.ackUpdate)
             d.addErrback(self._ackFailed, "SlaveBuilder.sendUpdate")
 
+    def dropUpdates(self):
+        if self.flushTimer is not None and self.flushTimer.active():
+            self.flushTimer.cancel()
+        self.flushTimer = None
+        updates, self.pendingUpdates = self.pendingUpdates, []
+        self.pendingSize = 0
+        return updates
+
     def ackUpdate(self, acknum):
         self.activity() # update the "last activity" timer
 
@@ -215,8 +259,11 @@ class SlaveBuilder(pb.Referenceable, service.Service):
         self.command = None
         if not self.running:
             log.msg(" but we weren't running, quitting silently")
+            self.dropUpdates()
             return
         if self.remoteStep:
+            # the updates are delivered before the completion
+            self.flushUpdates()
             self.remoteStep.dontNotifyOnDisconnect(self.lostRemoteStep)
             d = self.remoteStep.callRemote("complete", failure)
             d.addCallback(self.ackComplete)
@@ -13,15 +13,78 @@
 #
 # Copyright Buildbot Team Members
 
-import os, tarfile, tempfile
+import os, tarfile, threading
+from collections import deque
 
-from twisted.python import log
-from twisted.internet import defer
+from twisted.python import log, failure
+from twisted.internet import defer, threads
 
 from buildslave.commands.base import Command
 
 class TransferCommand(Command):
 
+    # the number of blocks in flight; masters which do not send a 'window'
+    # argument expect each block to be acknowledged before the next one
+    window = 1
+
+    def _loop(self, fire_when_done):
+        """
+        Transfer the blocks, keeping up to C{self.window} of them in flight,
+        and fire C{fire_when_done} once they are all acknowledged.
+        C{self._nextBlock} starts the transfer of the next block and returns a
+        Deferred firing with True at the end of the transfer, or returns True
+        if there is nothing more to transfer.
+        """
+        self._inflight = 0
+        self._filling = False
+        self._done = False
+        self._failure = None
+        self._fire_when_done = fire_when_done
+        self._fill()
+
+    def _fill(self):
+        # blocks acknowledged synchronously come back here, so only the
+        # outermost call loops
+        if self._filling:
+            return
+        self._filling = True
+        try:
+            while (not self._done and self._failure is None
+                   and self._inflight < self.window):
+                try:
+                    d = self._nextBlock()
+                except:
+                    self._failure = failure.Failure()
+                    break
+                if not isinstance(d, defer.Deferred):
+                    self._done = bool(d)
+                    continue
+                self._inflight += 1
+                d.addCallbacks(self._blockDone, self._blockFailed)
+        finally:
+            self._filling = False
+
+        if self._inflight == 0 and (self._done or self._failure is not None):
+            fire_when_done, self._fire_when_done = self._fire_when_done, None
+            if fire_when_done is None:
+                return
+            if self._failure is not None:
+                fire_when_done.errback(self._failure)
+            else:
+                fire_when_done.callback(None)
+
+    def _blockDone(self, finished):
+        self._inflight -= 1
+        if finished:
+            self._done = True
+        self._fill()
+
+    def _blockFailed(self, why):
+        self._inflight -= 1
+        if self._failure is None:
+            self._failure = why
+        self._fill()
+
     def finished(self, res):
         if self.debug:
             log.msg('finished: stderr=%r, rc=%r' % (self.stderr, self.rc))
@@ -56,6 +119,7 @@ class SlaveFileUploadCommand(TransferCommand):
         - ['maxsize']:   max size (in bytes) of file to write
         - ['blocksize']: max size for each data block
         - ['keepstamp']: whether to preserve file modified and accessed times
+        - ['window']:    number of blocks to keep in flight
     """
     debug = False
 
@@ -66,6 +130,7 @@ class SlaveFileUploadCommand(TransferCommand):
         self.remaining = args['maxsize']
         self.blocksize = args['blocksize']
         self.keepstamp = args.get('keepstamp', False)
+        self.window = args.get('window', 1)
         self.stderr = None
         self.rc = 0
 
@@ -121,17 +186,8 @@ class SlaveFileUploadCommand(TransferCommand):
         d.addBoth(self.finished)
         return d
 
-    def _loop(self, fire_when_done):
-        d = defer.maybeDeferred(self._writeBlock)
-        def _done(finished):
-            if finished:
-                fire_when_done.callback(None)
-            else:
-                self._loop(fire_when_done)
-        def _err(why):
-            fire_when_done.errback(why)
-        d.addCallbacks(_done, _err)
-        return None
+    def _nextBlock(self):
+        return self._writeBlock()
 
     def _writeBlock(self):
         """Write a block of data to the remote writer"""
@@ -169,7 +225,112 @@ class SlaveFileUploadCommand(TransferCommand):
         return d
 
 
+class _TarStream(object):
+    """
+    File object which an archive is written to from a thread, and read from
+    in the reactor, in blocks of C{blocksize}.  The thread waits while
+    C{maxBlocks} blocks were not taken yet, so the archive is only produced
+    as fast as it is sent.
+    """
+
+    def __init__(self, blocksize, maxBlocks, _reactor):
+        self.blocksize = blocksize
+        self._reactor = _reactor
+        self.credits = threading.Semaphore(maxBlocks)
+        self.stopped = False
+        self.buffer = []
+        self.buffered = 0
+
+        self.blocks = deque()
+        self.waiters = deque()
+        self.finished = False
+        self.failure = None
+
+    # called from the thread writing the archive
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered < self.blocksize:
+            return
+        data = ''.join(self.buffer)
+        pos = 0
+        while len(data) - pos >= self.blocksize:
+            self._emit(data[pos:pos + self.blocksize])
+            pos += self.blocksize
+        self.buffer = [data[pos:]]
+        self.buffered = len(data) - pos
+
+    def close(self):
+        if self.buffered:
+            self._emit(''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+        self._reactor.callFromThread(self._deliver, None)
+
+    def _emit(self, block):
+        self.credits.acquire()
+        if self.stopped:
+            raise IOError("transfer stopped")
+        self._reactor.callFromThread(self._deliver, block)
+
+    # called in the reactor
+
+    def nextBlock(self):
+        """
+        Get the next block of the archive, or None at its end
+
+        @returns: string or None, via Deferred
+        """
+        if self.blocks:
+            self.credits.release()
+            return defer.succeed(self.blocks.popleft())
+        if self.failure is not None:
+            return defer.fail(self.failure)
+        if self.finished:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self.waiters.append(d)
+        return d
+
+    def fail(self, why):
+        self.failure = why
+        while self.waiters:
+            self.waiters.popleft().errback(why)
+
+    def stop(self):
+        """
+        Make the thread stop writing the archive
+        """
+        self.stopped = True
+        self.credits.release()
+
+    def _deliver(self, block):
+        if block is None:
+            self.finished = True
+            while self.waiters:
+                self.waiters.popleft().callback(None)
+        elif self.waiters:
+            self.credits.release()
+            self.waiters.popleft().callback(block)
+        else:
+            self.blocks.append(block)
+
+
 class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
+    """
+    Upload a directory from slave to build master, as a tar archive which is
+    written while it is sent
+    Arguments:
+
+        - ['workdir']:   base directory to use
+        - ['slavesrc']:  name of the slave-side directory to read from
+        - ['writer']:    RemoteReference to a transfer._DirectoryWriter object
+        - ['maxsize']:   max size (in bytes) of the archive to write
+        - ['blocksize']: max size for each data block
+        - ['compress']:  None, 'bz2' or 'gz'
+        - ['window']:    number of blocks to keep in flight
+    """
     debug = False
 
     def setup(self, args):
@@ -179,6 +340,7 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
         self.remaining = args['maxsize']
         self.blocksize = args['blocksize']
         self.compress = args['compress']
+        self.window = args.get('window', 1)
         self.stderr = None
         self.rc = 0
 
@@ -192,27 +354,26 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
         if self.debug:
             log.msg("path: %r" % self.path)
 
-        # Create temporary archive
-        fd, self.tarname = tempfile.mkstemp()
-        fileobj = os.fdopen(fd, 'w')
         if self.compress == 'bz2':
             mode='w|bz2'
         elif self.compress == 'gz':
             mode='w|gz'
         else:
-            mode = 'w'
-        archive = tarfile.open(name=self.tarname, mode=mode, fileobj=fileobj)
-        archive.add(self.path, '')
-        archive.close()
-        fileobj.close()
+            mode = 'w|'
 
-        # Transfer it
-        self.fp = open(self.tarname, 'rb')
+        # the archive is written in a thread, and sent as it is written
+        self.stream = _TarStream(self.blocksize, self.window + 1, self._reactor)
+        archived = threads.deferToThread(self._writeArchive, mode)
+        archived.addErrback(self.stream.fail)
 
         self.sendStatus({'header': "sending %s" % self.path})
 
         d = defer.Deferred()
         self._reactor.callLater(0, self._loop, d)
+        def _loop_err(f):
+            self.rc = 1
+            return f
+        d.addErrback(_loop_err)
         def unpack(res):
             d1 = self.writer.callRemote("unpack")
             def unpack_err(f):
@@ -225,9 +386,41 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
         d.addBoth(self.finished)
         return d
 
+    def _writeArchive(self, mode):
+        archive = tarfile.open(mode=mode, fileobj=self.stream)
+        archive.add(self.path, '')
+        archive.close()
+        self.stream.close()
+
+    def _nextBlock(self):
+        if self.interrupted:
+            return True
+        d = self.stream.nextBlock()
+        d.addCallback(self._sendBlock)
+        return d
+
+    def _sendBlock(self, data):
+        """Write a block of the archive to the remote writer"""
+        if data is None or self.interrupted:
+            return True
+
+        if self.remaining is not None:
+            if self.remaining <= 0:
+                if self.stderr is None:
+                    self.stderr = 'Maximum filesize reached, truncating file \'%s\'' \
+                                    % self.path
+                    self.rc = 1
+                return True
+            data = data[:self.remaining]
+            self.remaining = self.remaining - len(data)
+
+        d = self.writer.callRemote('write', data)
+        d.addCallback(lambda res: False)
+        return d
+
     def finished(self, res):
-        self.fp.close()
-        os.remove(self.tarname)
+        # let the thread go, if it is still writing the archive
+        self.stream.stop()
         return TransferCommand.finished(self, res)
 
 
@@ -242,6 +435,7 @@ class SlaveFileDownloadCommand(TransferCommand):
         - ['maxsize']:   max size (in bytes) of file to write
         - ['blocksize']: max size for each data block
         - ['mode']:      access mode for the new file
+        - ['window']:    number of blocks to keep in flight
     """
     debug = False
 
@@ -252,6 +446,14 @@ class SlaveFileDownloadCommand(TransferCommand):
         self.bytes_remaining = args['maxsize']
         self.blocksize = args['blocksize']
         self.mode = args['mode']
+        self.window = args.get('window', 1)
+        # the blocks read, by sequence number, until the blocks before them
+        # are written
+        self.nextRead = 0
+        self.nextWrite = 0
+        self.received = {}
+        self.eof = False
+        self.maxsizeReached = False
         self.stderr = None
         self.rc = 0
 
@@ -291,6 +493,13 @@ class SlaveFileDownloadCommand(TransferCommand):
 
         d = defer.Deferred()
         self._reactor.callLater(0, self._loop, d)
+        def _check_maxsize(res):
+            if self.maxsizeReached and not self.eof and self.stderr is None:
+                self.stderr = "Maximum filesize reached, truncating file '%s'" \
+                                % self.path
+                self.rc = 1
+            return res
+        d.addCallback(_check_maxsize)
         def _close(res):
             # close the file, but pass through any errors from _loop
             d1 = self.reader.callRemote('close')
@@ -301,22 +510,13 @@ class SlaveFileDownloadCommand(TransferCommand):
         d.addBoth(self.finished)
         return d
 
-    def _loop(self, fire_when_done):
-        d = defer.maybeDeferred(self._readBlock)
-        def _done(finished):
-            if finished:
-                fire_when_done.callback(None)
-            else:
-                self._loop(fire_when_done)
-        def _err(why):
-            fire_when_done.errback(why)
-        d.addCallbacks(_done, _err)
-        return None
+    def _nextBlock(self):
+        return self._readBlock()
 
     def _readBlock(self):
         """Read a block of data from the remote reader."""
 
-        if self.interrupted or self.fp is None:
+        if self.interrupted or self.fp is None or self.eof:
             if self.debug:
                 log.msg('SlaveFileDownloadCommand._readBlock(): end')
             return True
@@ -326,28 +526,35 @@ class SlaveFileDownloadCommand(TransferCommand):
             length = self.bytes_remaining
 
         if length <= 0:
-            if self.stderr is None:
-                self.stderr = "Maximum filesize reached, truncating file '%s'" \
-                                % self.path
-                self.rc = 1
+            # whether the file was truncated is known once the blocks in
+            # flight are read
+            self.maxsizeReached = True
             return True
         else:
+            if self.bytes_remaining is not None:
+                self.bytes_remaining = self.bytes_remaining - length
             d = self.reader.callRemote('read', length)
-            d.addCallback(self._writeData)
+            d.addCallback(self._receivedData, self.nextRead)
+            self.nextRead += 1
             return d
 
+    def _receivedData(self, data, seq):
+        # write the blocks in the order they were requested
+        self.received[seq] = data
+        while self.nextWrite in self.received:
+            self._writeData(self.received.pop(self.nextWrite))
+            self.nextWrite += 1
+        return self.eof
+
     def _writeData(self, data):
         if self.debug:
             log.msg('SlaveFileDownloadCommand._readBlock(): readlen=%d' %
                     len(data))
         if len(data) == 0:
-            return True
-
-        if self.bytes_remaining is not None:
-            self.bytes_remaining = self.bytes_remaining - len(data)
-            assert self.bytes_remaining >= 0
+            self.eof = True
+        if self.eof or self.fp is None:
+            return
         self.fp.write(data)
-        return False
 
     def finished(self, res):
         if self.fp is not None:
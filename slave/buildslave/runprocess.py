@@ -38,6 +38,12 @@ from buildslave.exceptions import AbandonChain
 if runtime.platformType == 'posix':
     from twisted.internet.process import Process
 
+if runtime.platform.supportsINotify():
+    from twisted.internet import inotify
+    from twisted.python import filepath
+else:
+    inotify = None
+
 def shell_quote(cmd_list):
     # attempt to quote cmd_list such that a shell will properly re-interpret
     # it.  The pipes module is only available on UNIX, and Windows "shell"
@@ -60,8 +66,104 @@ def shell_quote(cmd_list):
             return pipes.quote(e)
         return " ".join([ quote(e) for e in cmd_list ])
 
+class LogFileNotifier(object):
+    """
+    Tells the L{LogFileWatcher}s when their logfiles change, by watching the
+    directories which hold them with inotify.  A single notifier serves all
+    the watchers, and is closed once the last of them is removed.
+    """
+
+    instance = None
+
+    @classmethod
+    def add(cls, watcher):
+        """
+        Poll C{watcher} whenever its logfile changes.  Returns False if this
+        cannot be done with inotify, and the watcher has to poll by itself.
+        """
+        if inotify is None:
+            return False
+        try:
+            if cls.instance is None:
+                cls.instance = cls()
+            cls.instance._add(watcher)
+        except inotify.INotifyError:
+            # for instance, the directory of the logfile does not exist yet
+            log.msg("cannot watch %s with inotify, polling it" % watcher.logfile)
+            cls.remove(watcher)
+            return False
+        return True
+
+    @classmethod
+    def remove(cls, watcher):
+        if cls.instance is None:
+            return
+        cls.instance._remove(watcher)
+        if not cls.instance.watchers:
+            # this may run while the notifier reads its events, so it is
+            # closed once it is done with them
+            reactor.callLater(0, cls.instance.notifier.connectionLost, None)
+            cls.instance = None
+
+    def __init__(self):
+        self.notifier = inotify.INotify()
+        self.notifier.startReading()
+        # {directory: {filename: [watcher]}}
+        self.watchers = {}
+
+    def _add(self, watcher):
+        path = filepath.FilePath(os.path.abspath(watcher.logfile))
+        directory = path.parent()
+        if directory not in self.watchers:
+            self.notifier.watch(directory, callbacks=[self._notify],
+                                mask=inotify.IN_MODIFY | inotify.IN_CREATE |
+                                     inotify.IN_MOVED_TO | inotify.IN_DELETE |
+                                     inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF)
+            self.watchers[directory] = {}
+        self.watchers[directory].setdefault(path.basename(), []).append(watcher)
+
+    def _remove(self, watcher):
+        path = filepath.FilePath(os.path.abspath(watcher.logfile))
+        directory = path.parent()
+        files = self.watchers.get(directory, {})
+        if watcher in files.get(path.basename(), []):
+            files[path.basename()].remove(watcher)
+            if not files[path.basename()]:
+                del files[path.basename()]
+        if directory in self.watchers and not files:
+            self._ignore(directory)
+
+    def _ignore(self, directory):
+        del self.watchers[directory]
+        try:
+            self.notifier.ignore(directory)
+        except KeyError:
+            pass # the watch went away with the directory
+
+    def _notify(self, ignored, path, mask):
+        if mask & (inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF):
+            # the directory itself went away; its watchers poll from now on
+            if path in self.watchers:
+                if mask & inotify.IN_DELETE_SELF:
+                    # the notifier drops the watch of a deleted directory
+                    files = self.watchers.pop(path)
+                else:
+                    files = self.watchers[path]
+                    self._ignore(path)
+                for watchers in files.values():
+                    for watcher in watchers:
+                        watcher.startPolling()
+            return
+        for watcher in list(self.watchers.get(path.parent(), {}).get(path.basename(), [])):
+            watcher.poll()
+
+
 class LogFileWatcher:
     POLL_INTERVAL = 2
+    READ_SIZE = 64 * 1024
+
+    # use inotify, where available, rather than polling the logfile
+    useINotify = True
 
     def __init__(self, command, name, logfile, follow=False):
         self.command = command
@@ -79,10 +181,22 @@ class LogFileWatcher:
         # added since we started watching
         self.follow = follow
 
-        # every 2 seconds we check on the file again
-        self.poller = task.LoopingCall(self.poll)
+        # every 2 seconds we check on the file again, unless inotify tells us
+        # when it changes
+        self.poller = None
+        self.notified = False
 
     def start(self):
+        if self.useINotify and LogFileNotifier.add(self):
+            self.notified = True
+        else:
+            self.startPolling()
+
+    def startPolling(self):
+        if LogFileNotifier.instance is not None:
+            LogFileNotifier.remove(self)
+        self.notified = False
+        self.poller = task.LoopingCall(self.poll)
         self.poller.start(self.POLL_INTERVAL).addErrback(self._cleanupPoll)
 
     def _cleanupPoll(self, err):
@@ -90,9 +204,13 @@ class LogFileWatcher:
         self.poller = None
 
     def stop(self):
+        if self.notified:
+            LogFileNotifier.remove(self)
+            self.notified = False
         self.poll()
         if self.poller is not None:
             self.poller.stop()
+            self.poller = None
         if self.started:
             self.f.close()
 
@@ -113,7 +231,9 @@ class LogFileWatcher:
                 # in preparation for creating a new one.
                 self.old_logfile_stats = None
                 return # no file to work with
-            self.f = open(self.logfile, "rb")
+            # unbuffered, so each read goes straight into the string which is
+            # handed to the command
+            self.f = open(self.logfile, "rb", 0)
             # if we only want new lines, seek to
             # where we stat'd so we only find new
             # lines
@@ -122,10 +242,13 @@ class LogFileWatcher:
             self.started = True
         self.f.seek(self.f.tell(), 0)
         while True:
-            data = self.f.read(10000)
+            data = self.f.read(self.READ_SIZE)
             if not data:
                 return
             self.command.addLogfile(self.name, data)
+            if len(data) < self.READ_SIZE:
+                # nothing more for now
+                return
 
 
 if runtime.platformType == 'posix':
@@ -259,10 +259,10 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
         d.addCallback(lambda _ : st.wait_for_finish())
         def check(_):
             self.assertEqual(st.actions, [
-                         ['update', [[{'hdr': 'headers'}, 0]]],
-                         ['update', [[{'stdout': 'hello\n'}, 0]]],
-                         ['update', [[{'rc': 0}, 0]]],
-                         ['update', [[{'elapsed': 1}, 0]]],
+                         ['update', [[{'hdr': 'headers'}, 0],
+                                     [{'stdout': 'hello\n'}, 0],
+                                     [{'rc': 0}, 0],
+                                     [{'elapsed': 1}, 0]]],
                          ['complete', None],
                     ])
         d.addCallback(check)
@@ -304,9 +304,9 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
         d.addCallback(lambda _ : st.wait_for_finish())
         def check(_):
             self.assertEqual(st.actions, [
-                         ['update', [[{'hdr': 'headers'}, 0]]],
-                         ['update', [[{'hdr': 'killing'}, 0]]],
-                         ['update', [[{'rc': -1}, 0]]],
+                         ['update', [[{'hdr': 'headers'}, 0],
+                                     [{'hdr': 'killing'}, 0],
+                                     [{'rc': -1}, 0]]],
                          ['complete', None],
                     ])
         d.addCallback(check)
@@ -336,6 +336,33 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_sendUpdate_batched(self):
+        sb = self.sb.original
+        clock = sb._reactor = task.Clock()
+        st = FakeStep()
+        sb.remoteStep = FakeRemote(st)
+
+        sb.sendUpdate({'stdout': 'a'})
+        sb.sendUpdate({'stdout': 'b'})
+        self.assertEqual(st.actions, [])
+
+        clock.advance(sb.UPDATE_BATCH_DELAY)
+        self.assertEqual(st.actions, [['update', [[{'stdout': 'a'}, 0],
+                                                  [{'stdout': 'b'}, 0]]]])
+
+    def test_sendUpdate_batch_size(self):
+        sb = self.sb.original
+        clock = sb._reactor = task.Clock()
+        st = FakeStep()
+        sb.remoteStep = FakeRemote(st)
+
+        data = 'x' * (sb.UPDATE_BATCH_SIZE / 2)
+        sb.sendUpdate({'stdout': data})
+        sb.sendUpdate({'log': ('log', data)})
+        self.assertEqual(st.actions, [['update', [[{'stdout': data}, 0],
+                                                  [{'log': ('log', data)}, 0]]]])
+        self.assertEqual(clock.getDelayedCalls(), [])
+
 class TestBotFactory(unittest.TestCase):
 
     def setUp(self):
@@ -45,6 +45,10 @@ class FakeMasterMethods(object):
 
         self.unpack_fail = False
 
+        # the most writes or reads waiting at the same time
+        self.pending = 0
+        self.max_pending = 0
+
         self.written = False
         self.read = False
         self.data = ''
@@ -65,9 +69,7 @@ class FakeMasterMethods(object):
             self.data += data
 
         if self.delay_write:
-            d = defer.Deferred()
-            reactor.callLater(0.01, d.callback, None)
-            return d
+            return self._delay(None)
 
     def remote_read(self, length):
         if self.count_reads:
@@ -81,12 +83,20 @@ class FakeMasterMethods(object):
 
         slice, self.data = self.data[:length], self.data[length:]
         if self.delay_read:
-            d = defer.Deferred()
-            reactor.callLater(0.01, d.callback, slice)
-            return d
+            return self._delay(slice)
         else:
             return slice
 
+    def _delay(self, result):
+        self.pending += 1
+        self.max_pending = max(self.pending, self.max_pending)
+        d = defer.Deferred()
+        def fire():
+            self.pending -= 1
+            d.callback(result)
+        reactor.callLater(0.01, fire)
+        return d
+
     def remote_unpack(self):
         self.add_update('unpack')
         if self.unpack_fail:
@@ -247,6 +257,57 @@ class TestUploadFile(CommandTestMixin, unittest.TestCase):
         dl.addCallback(check)
         return dl
 
+    def test_window(self):
+        self.fakemaster.delay_write = True
+        self.fakemaster.keep_data = True
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=16,
+            keepstamp=False,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                    {'header': 'sending %s' % self.datafile},
+                    'write(s)', 'close',
+                    {'rc': 0}
+                ])
+            self.assertEqual(self.fakemaster.data, "this is some data\n" * 10)
+            self.assertEqual(self.fakemaster.max_pending, 4)
+        d.addCallback(check)
+        return d
+
+    def test_window_out_of_space(self):
+        self.fakemaster.write_out_of_space_at = 70
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=16,
+            keepstamp=False,
+            window=4,
+        ))
+
+        d = self.run_command()
+        self.assertFailure(d, RuntimeError)
+        def check(_):
+            self.assertUpdates([
+                    {'header': 'sending %s' % self.datafile},
+                    'write(s)', 'close',
+                    {'rc': 1}
+                ])
+        d.addCallback(check)
+        return d
+
     def test_timestamp(self):
         self.fakemaster.count_writes = True    # get actual byte counts
         timestamp = ( os.path.getatime(self.datafile),
@@ -294,17 +355,19 @@ class TestSlaveDirectoryUpload(CommandTestMixin, unittest.TestCase):
         if os.path.exists(self.datadir):
             shutil.rmtree(self.datadir)
 
-    def test_simple(self, compress=None):
+    def test_simple(self, compress=None, **kwargs):
         self.fakemaster.keep_data = True 
 
-        self.make_command(transfer.SlaveDirectoryUploadCommand, dict(
+        args = dict(
             workdir='workdir',
             slavesrc='data',
             writer=FakeRemote(self.fakemaster),
             maxsize=None,
             blocksize=512,
             compress=compress,
-        ))
+        )
+        args.update(kwargs)
+        self.make_command(transfer.SlaveDirectoryUploadCommand, args)
 
         d = self.run_command()
 
@@ -335,6 +398,33 @@ class TestSlaveDirectoryUpload(CommandTestMixin, unittest.TestCase):
     def test_simple_gz(self):
         return self.test_simple('gz')
 
+    # and with several small blocks in flight, while the archive is written
+    def test_window(self):
+        self.fakemaster.delay_write = True
+        d = self.test_simple('gz', blocksize=16, window=4)
+        d.addCallback(lambda _: self.assertEqual(self.fakemaster.max_pending, 4))
+        return d
+
+    def test_missing(self):
+        self.make_command(transfer.SlaveDirectoryUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data-nosuch',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=512,
+            compress=None,
+        ))
+
+        d = self.run_command()
+        self.assertFailure(d, OSError)
+        def check(_):
+            self.assertUpdates([
+                    {'header': 'sending %s' % (self.datadir + '-nosuch')},
+                    {'rc': 1}
+                ])
+        d.addCallback(check)
+        return d
+
     # except bz2 can't operate in stream mode on py24
     if sys.version_info[:2] <= (2,4):
         test_simple_bz2.skip = "bz2 stream decompression not supported on Python-2.4"
@@ -415,6 +505,60 @@ class TestDownloadFile(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_window(self):
+        self.fakemaster.delay_read = True
+        self.fakemaster.data = test_data = 'tenchars--' * 10
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=8,
+            mode=None,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                    'read(s)', 'close',
+                    {'rc': 0}
+                ])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile).read(), test_data)
+            self.assertEqual(self.fakemaster.max_pending, 4)
+        d.addCallback(check)
+        return d
+
+    def test_window_truncated(self):
+        self.fakemaster.data = test_data = 'tenchars--' * 10
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=50,
+            blocksize=8,
+            mode=None,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                    'read(s)', 'close',
+                    {'rc': 1,
+                     'stderr': "Maximum filesize reached, truncating file '%s'"
+                                % os.path.join(self.basedir, '.', 'data')}
+                ])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile).read(), test_data[:50])
+        d.addCallback(check)
+        return d
+
     def test_mkdir(self):
         self.fakemaster.data = test_data = 'hi'
 
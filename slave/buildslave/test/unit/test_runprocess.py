@@ -18,6 +18,7 @@ import re
 import os
 import time
 import signal
+import shutil
 
 from twisted.trial import unittest
 from twisted.internet import task, defer, reactor
@@ -721,3 +722,83 @@ class TestLogFileWatcher(BasedirMixin, unittest.TestCase):
         st = lf.statFile()
         self.assertEqual(st and st[2], 2, "statfile.log exists and size is correct")
         os.remove('statfile.log')
+
+    def test_poll_reads_new_data(self):
+        rp = self.makeRP()
+        added = []
+        rp.addLogfile = lambda name, data: added.append((name, data))
+        open('statfile.log', 'w').write('old')
+        lf = runprocess.LogFileWatcher(rp, 'test', 'statfile.log', False)
+        f = open('statfile.log', 'a')
+        f.write('x' * (lf.READ_SIZE + 10))
+        f.close()
+        lf.poll()
+        self.assertEqual([(name, len(data)) for name, data in added],
+                         [('test', lf.READ_SIZE), ('test', 13)])
+        lf.f.close()
+        os.remove('statfile.log')
+
+    def test_start_inotify(self):
+        if runprocess.inotify is None:
+            raise unittest.SkipTest("inotify is not available")
+        rp = self.makeRP()
+        logfile = os.path.abspath('statfile.log')
+        lf = runprocess.LogFileWatcher(rp, 'test', logfile, False)
+        d = defer.Deferred()
+        rp.addLogfile = lambda name, data: d.callback(data)
+
+        lf.start()
+        self.assertTrue(lf.notified)
+        self.assertIdentical(lf.poller, None)
+        open(logfile, 'w').write('hello')
+
+        @d.addCallback
+        def check(data):
+            self.assertEqual(data, 'hello')
+            lf.stop()
+            self.assertIdentical(runprocess.LogFileNotifier.instance, None)
+            os.remove(logfile)
+            # the notifier is closed on the next turn of the reactor
+            return task.deferLater(reactor, 0, lambda: None)
+        return d
+
+    @defer.inlineCallbacks
+    def test_start_inotify_deleted_directory(self):
+        if runprocess.inotify is None:
+            raise unittest.SkipTest("inotify is not available")
+        rp = self.makeRP()
+        logdir = os.path.abspath('logs')
+        os.mkdir(logdir)
+        logfile = os.path.join(logdir, 'statfile.log')
+        lf = runprocess.LogFileWatcher(rp, 'test', logfile, False)
+        lf.POLL_INTERVAL = 0.01
+        d = defer.Deferred()
+        rp.addLogfile = lambda name, data: d.callback(data)
+
+        lf.start()
+        self.assertTrue(lf.notified)
+        shutil.rmtree(logdir)
+        while lf.poller is None:
+            yield task.deferLater(reactor, 0.01, lambda: None)
+        self.assertFalse(lf.notified)
+        self.assertIdentical(runprocess.LogFileNotifier.instance, None)
+
+        # the watcher polls the logfile once its directory is back
+        os.mkdir(logdir)
+        open(logfile, 'w').write('hello')
+        data = yield d
+        self.assertEqual(data, 'hello')
+        lf.stop()
+        shutil.rmtree(logdir)
+
+    def test_start_inotify_missing_directory(self):
+        rp = self.makeRP()
+        logfile = os.path.abspath(os.path.join('missing', 'statfile.log'))
+        lf = runprocess.LogFileWatcher(rp, 'test', logfile, False)
+        lf.start()
+        # polls the logfile, which may show up with its directory later
+        self.assertFalse(lf.notified)
+        self.assertTrue(lf.poller.running)
+        lf.stop()
+        self.assertIdentical(runprocess.LogFileNotifier.instance, None)
+        return task.deferLater(reactor, 0, lambda: None)
@@ -7,7 +7,8 @@ define(function (require) {
         sock = null,
         realTimeFunctions = {},
         realtimeURLs = {},
-        realTimeLastUpdated = {};
+        realTimeLastUpdated = {},
+        realTimeDocuments = {};
 
     require('helpers');
     require('timeElements');
@@ -18,6 +19,7 @@ define(function (require) {
     var KRT_JSON_DATA = "krtJSONData";
     var KRT_URL_DROPPED = "krtURLDropped";
     var KRT_REGISTER_URL = "krtRegisterURL";
+    var KRT_JSON_PATCH = "krtJSONPatch";
 
     //Timeouts
     var iURLDroppedTimeout = 30000,
@@ -48,7 +50,8 @@ define(function (require) {
                         $.each(realtimeURLs, function (name, url) {
                             if (url !== undefined) {
                                 var data = {
-                                    url: url
+                                    url: url,
+                                    acceptPatch: true
                                 };
 
                                 if (json !== undefined) {
@@ -130,6 +133,9 @@ define(function (require) {
             if (data.cmd === KRT_JSON_DATA) {
                 realtimePages.updateRealTimeData(data.data, false);
             }
+            if (data.cmd === KRT_JSON_PATCH) {
+                realtimePages.patchRealTimeData(data.data);
+            }
             if (data.cmd === KRT_URL_DROPPED) {
                 console.log("URL Dropped by server will retry in {0} seconds... ({1})".format((iURLDroppedTimeout / 1000), data.data));
                 setTimeout(function () {
@@ -149,9 +155,46 @@ define(function (require) {
                 });
             } else {
                 var name = realtimePages.getRealtimeNameFromURL(json.url);
+                realTimeDocuments[name] = json.data;
                 realtimePages.updateSingleRealTimeData(name, json.data);
             }
         },
+        patchRealTimeData: function (json) {
+            var name = realtimePages.getRealtimeNameFromURL(json.url);
+            if (!realTimeDocuments.hasOwnProperty(name)) {
+                // the server always sends the whole document before patching it
+                return;
+            }
+            realTimeDocuments[name] = realtimePages.applyPatch(realTimeDocuments[name], json.patch);
+            realtimePages.updateSingleRealTimeData(name, realTimeDocuments[name]);
+        },
+        applyPatch: function (doc, patch) {
+            // applies the add, remove and replace operations of a JSON-patch
+            $.each(patch, function (i, operation) {
+                var keys = operation.path.split("/").slice(1).map(function (key) {
+                        return key.replace(/~1/g, "/").replace(/~0/g, "~");
+                    }),
+                    last = keys.pop(),
+                    parent = doc;
+
+                if (last === undefined) {
+                    doc = operation.value;
+                    return;
+                }
+
+                $.each(keys, function (j, key) {
+                    parent = parent[key];
+                });
+
+                if (operation.op === "remove") {
+                    delete parent[last];
+                } else {
+                    parent[last] = operation.value;
+                }
+            });
+
+            return doc;
+        },
         getRealtimeNameFromURL: function (url) {
             var name = "";
             $.each(realtimeURLs, function (n, u) {
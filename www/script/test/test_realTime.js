@@ -171,6 +171,18 @@ define(["jquery", "realtimePages", "rtGlobal"], function ($, rt, rtGlobal) {
             expect(sock.send).toHaveBeenCalled();
             expect(sock.send).toHaveBeenCalledWith(JSON.stringify({cmd: "test", data: testData}));
         });
+
+        it("applies a JSON patch", function () {
+            var doc = {builds: [{number: 1}, {number: 2}], "a/b": "old", removed: true},
+                patch = [{op: "replace", path: "/builds/1/number", value: 3},
+                         {op: "add", path: "/added", value: {x: 1}},
+                         {op: "replace", path: "/a~1b", value: "new"},
+                         {op: "remove", path: "/removed"}];
+
+            expect(rt.applyPatch(doc, patch)).toEqual({builds: [{number: 1}, {number: 3}], "a/b": "new",
+                                                       added: {x: 1}});
+            expect(rt.applyPatch(doc, [{op: "replace", path: "", value: [1]}])).toEqual([1]);
+        });
     });
 
     describe("The build load", function () {